@@ -3,7 +3,13 @@ from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from backend.business.market import MarketFacade
 from backend.business.authentication.authentication import Authentication
+from backend.business.authentication.password_hasher import PasswordHasher
 from backend.business.notifier.notifier import Notifier
+from backend.business.checkout import OutboxDispatcher, IdempotencyManager
+from backend.business.store import StoreFacade
+from backend.business.user import UserFacade
+from backend.business.purchase import PurchaseArchive
+from backend.business.ThirdPartyHandlers import DeliveryScheduler
 from flask_jwt_extended import get_jwt_identity, jwt_required, get_jwt
 from flask_socketio import SocketIO, join_room, leave_room, emit
 from flask_cors import CORS
@@ -14,7 +20,8 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy import create_engine
-from backend.database import db, clear_database
+from flask import g, jsonify
+from backend.database import db, clear_database, begin_unit_of_work, end_unit_of_work, in_unit_of_work
 
 # -------------logging configuration----------------
 import logging
@@ -97,11 +104,20 @@ def create_app(mode='development'):
             app.initialization_done = True
             authentication = Authentication()
             authentication.set_jwt(jwt, bcrypt)
+            PasswordHasher().start(app, bcrypt)
 
             notifier = Notifier()
             notifier.set_socketio_manager(socketio_manager)
 
             MarketFacade()
+            OutboxDispatcher().start(app)
+            StoreFacade().start_reservation_sweeper(app, app.config['RESERVATION_SWEEP_INTERVAL'])
+            IdempotencyManager().start_cleanup(app, app.config['IDEMPOTENCY_CLEANUP_INTERVAL'])
+            PurchaseArchive().start(app, app.config['PURCHASE_ARCHIVE_INTERVAL'])
+            DeliveryScheduler().start(app)
+            MarketFacade().start_completion_sweeper(app, app.config['PURCHASE_COMPLETION_SWEEP_INTERVAL'])
+            UserFacade().start_cart_flusher(app, app.config['CART_CACHE_FLUSH_INTERVAL'])
+            UserFacade().start_guest_collector(app, app.config['GUEST_GC_INTERVAL'])
             if mode != 'testing':
 
                 InitialState(app, db).init_system_from_file()
@@ -121,6 +137,35 @@ def create_app(mode='development'):
             app.register_blueprint(store_bp, url_prefix='/store')
             app.register_blueprint(third_party_bp, url_prefix='/third_party')
 
+            @app.before_request
+            def begin_request_unit_of_work():
+                if app.config.get('UNIT_OF_WORK', False):
+                    g.unit_of_work_token = begin_unit_of_work()
+
+            @app.after_request
+            def commit_request_unit_of_work(response):
+                if not in_unit_of_work():
+                    return response
+                try:
+                    if response.status_code < 400:
+                        db.session.commit()
+                    else:
+                        db.session.rollback()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to commit the unit of work of the request: {e}")
+                    response = jsonify({'message': str(e)})
+                    response.status_code = 400
+                return response
+
+            @app.teardown_request
+            def end_request_unit_of_work(exception=None):
+                token = g.pop('unit_of_work_token', None)
+                if token is not None:
+                    if exception is not None:
+                        db.session.rollback()
+                    end_unit_of_work(token)
+
             @jwt.token_in_blocklist_loader
             def check_if_token_in_blacklist(jwt_header, jwt_payload):
                 return authentication.check_if_token_in_blacklist(jwt_header, jwt_payload)
@@ -130,3 +175,4 @@ def create_app(mode='development'):
 def clean_data():
     MarketFacade().clean_data()
     Authentication().clean_data()
+    IdempotencyManager().clean_data()
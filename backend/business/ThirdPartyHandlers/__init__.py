@@ -1 +1,2 @@
 from .third_party_handlers import PaymentHandler, SupplyHandler
+from .delivery_scheduler import DeliveryScheduler, ScheduledDelivery
@@ -0,0 +1,249 @@
+# ----------------- imports -----------------#
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import heapq
+import threading
+
+from backend.database import db, commit, ensure_app_context
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_DELIVERY_BATCH_SIZE = 100  # arrivals handed to the arrival handler at a time
+DEFAULT_DELIVERY_POLL_INTERVAL = 60  # seconds, deliveries due within the interval are kept in memory
+DEFAULT_DELIVERY_RETRY_DELAY = 30  # seconds before a batch whose handler failed is fired again
+
+
+# -----------------ScheduledDelivery Class-----------------#
+class ScheduledDelivery(db.Model):
+    # a delivery that has not arrived yet, the row is the source of truth so pending deliveries survive a restart
+    __tablename__ = 'scheduled_deliveries'
+
+    _purchase_id = db.Column(db.Integer, primary_key=True)
+    _due_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, purchase_id: int, due_at: datetime):
+        self._purchase_id = purchase_id
+        self._due_at = due_at
+
+
+# -----------------DeliveryScheduler Class-----------------#
+class DeliveryScheduler:
+    # singleton
+    # a single worker fires the arrivals of all the deliveries. The deliveries that are due within the poll interval
+    # are kept in a min-heap, the rest are only in the scheduled_deliveries table and are loaded by the worker as they
+    # get close, so memory does not grow with the number of pending orders
+    __instance = None
+    __lock = threading.Lock()
+
+    def __new__(cls):
+        if DeliveryScheduler.__instance is None:
+            DeliveryScheduler.__instance = super(DeliveryScheduler, cls).__new__(cls)
+        return DeliveryScheduler.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            self.__condition = threading.Condition()
+            self.__heap: List[Tuple[datetime, int]] = []
+            self.__queued: Set[int] = set()
+            self.__loaded_until: datetime = datetime.min
+            # arrival callbacks of single orders, used when no arrival handler is set
+            self.__callbacks: Dict[int, Callable[[int], None]] = {}
+            self.__on_arrivals: Optional[Callable[[List[int]], None]] = None
+            self.__worker: Optional[threading.Thread] = None
+            logger.info('[DeliveryScheduler] successfully created delivery scheduler')
+
+    @staticmethod
+    def __config(name: str, default):
+        from flask import current_app
+        return current_app.config.get(name, default)
+
+    def set_on_arrivals(self, on_arrivals: Callable[[List[int]], None]) -> None:
+        """
+        * Parameters: on_arrivals - called with the ids of the purchases whose delivery arrived
+        * This function sets the handler the arrivals are fired to in batches
+        * Returns: none
+        """
+        self.__on_arrivals = on_arrivals
+
+    def __push(self, purchase_id: int, due_at: datetime) -> None:
+        # the caller holds the condition
+        if purchase_id in self.__queued:
+            return
+        self.__queued.add(purchase_id)
+        heapq.heappush(self.__heap, (due_at, purchase_id))
+        self.__condition.notify()
+
+    def schedule(self, purchase_id: int, due_at: datetime, on_arrival: Optional[Callable[[int], None]] = None) -> None:
+        """
+        * Parameters: purchase_id, due_at, on_arrival(default=None) - used if no arrival handler is set
+        * This function schedules the arrival of the delivery of a purchase, it is saved with the current transaction
+        * Returns: none
+        """
+        with ensure_app_context():
+            db.session.merge(ScheduledDelivery(purchase_id, due_at))
+            commit()
+        with self.__condition:
+            if on_arrival is not None:
+                self.__callbacks[purchase_id] = on_arrival
+            if due_at <= self.__loaded_until:
+                self.__push(purchase_id, due_at)
+        logger.info(f'[DeliveryScheduler] scheduled the arrival of purchase {purchase_id} at {due_at}')
+
+    def cancel(self, purchase_id: int) -> None:
+        """
+        * Parameters: purchase_id
+        * This function cancels the arrival of the delivery of a purchase
+        * Returns: none
+        """
+        with ensure_app_context():
+            db.session.query(ScheduledDelivery).filter(ScheduledDelivery._purchase_id == purchase_id).delete()
+            commit()
+        with self.__condition:
+            self.__callbacks.pop(purchase_id, None)
+        logger.info(f'[DeliveryScheduler] cancelled the arrival of purchase {purchase_id}')
+
+    def discard(self, purchase_ids: List[int]) -> None:
+        """
+        * Parameters: purchase_ids
+        * This function removes the scheduled arrivals of purchases that were completed without them
+        * Returns: none
+        """
+        if not purchase_ids:
+            return
+        db.session.query(ScheduledDelivery).filter(ScheduledDelivery._purchase_id.in_(purchase_ids)) \
+            .delete(synchronize_session=False)
+        commit()
+        with self.__condition:
+            for purchase_id in purchase_ids:
+                self.__callbacks.pop(purchase_id, None)
+
+    def load_due(self) -> int:
+        """
+        * Parameters: none
+        * This function loads the deliveries that are due within the poll interval from the table into the heap
+        * Returns: the number of deliveries that were loaded
+        """
+        loaded_until = datetime.now() + timedelta(seconds=self.__config('DELIVERY_POLL_INTERVAL',
+                                                                        DEFAULT_DELIVERY_POLL_INTERVAL))
+        rows = (db.session.query(ScheduledDelivery._purchase_id, ScheduledDelivery._due_at)
+                .filter(ScheduledDelivery._due_at <= loaded_until)
+                .order_by(ScheduledDelivery._due_at)
+                .all())
+        with self.__condition:
+            loaded = len(self.__queued)
+            for purchase_id, due_at in rows:
+                self.__push(purchase_id, due_at)
+            self.__loaded_until = loaded_until
+            return len(self.__queued) - loaded
+
+    def __take_due(self, batch_size: int) -> List[int]:
+        # the caller holds the condition
+        now = datetime.now()
+        purchase_ids = []
+        while self.__heap and self.__heap[0][0] <= now and len(purchase_ids) < batch_size:
+            _, purchase_id = heapq.heappop(self.__heap)
+            self.__queued.discard(purchase_id)
+            purchase_ids.append(purchase_id)
+        return purchase_ids
+
+    def fire_due(self) -> int:
+        """
+        * Parameters: none
+        * This function fires the arrivals of the deliveries in the heap that are due, in batches of
+          DELIVERY_BATCH_SIZE, a batch whose handler fails is fired again after DELIVERY_RETRY_DELAY
+        * Returns: the number of arrivals that were fired
+        """
+        batch_size = self.__config('DELIVERY_BATCH_SIZE', DEFAULT_DELIVERY_BATCH_SIZE)
+        fired = 0
+        while True:
+            with self.__condition:
+                purchase_ids = self.__take_due(batch_size)
+            if not purchase_ids:
+                return fired
+            try:
+                fired += self.__fire(purchase_ids)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f'[DeliveryScheduler] firing the arrivals of purchases {purchase_ids} failed: {e}')
+                retry_at = datetime.now() + timedelta(seconds=self.__config('DELIVERY_RETRY_DELAY',
+                                                                           DEFAULT_DELIVERY_RETRY_DELAY))
+                with self.__condition:
+                    for purchase_id in purchase_ids:
+                        self.__push(purchase_id, retry_at)
+                return fired
+
+    def __fire(self, purchase_ids: List[int]) -> int:
+        # a purchase whose checkout was rolled back or whose delivery was cancelled has no row
+        pending = {purchase_id for purchase_id, in
+                   db.session.query(ScheduledDelivery._purchase_id)
+                   .filter(ScheduledDelivery._purchase_id.in_(purchase_ids))}
+        purchase_ids = [purchase_id for purchase_id in purchase_ids if purchase_id in pending]
+        if not purchase_ids:
+            return 0
+        if self.__on_arrivals is not None:
+            self.__on_arrivals(purchase_ids)
+        else:
+            for purchase_id in purchase_ids:
+                on_arrival = self.__callbacks.get(purchase_id)
+                if on_arrival is not None:
+                    on_arrival(purchase_id)
+        db.session.query(ScheduledDelivery).filter(ScheduledDelivery._purchase_id.in_(purchase_ids)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        with self.__condition:
+            for purchase_id in purchase_ids:
+                self.__callbacks.pop(purchase_id, None)
+        logger.info(f'[DeliveryScheduler] {len(purchase_ids)} deliveries arrived')
+        return len(purchase_ids)
+
+    def __next_wake_up(self) -> float:
+        # the caller holds the condition
+        timeout = (self.__loaded_until - datetime.now()).total_seconds()
+        if self.__heap:
+            timeout = min(timeout, (self.__heap[0][0] - datetime.now()).total_seconds())
+        return max(timeout, 0)
+
+    def start(self, app) -> None:
+        """
+        * Parameters: app
+        * This function loads the pending deliveries and starts the worker that fires their arrivals
+        * Returns: none
+        """
+        with DeliveryScheduler.__lock:
+            if self.__worker is not None:
+                return
+            with app.app_context():
+                loaded = self.load_due()
+            logger.info(f'[DeliveryScheduler] loaded {loaded} pending deliveries')
+
+            def run():
+                while True:
+                    with self.__condition:
+                        timeout = self.__next_wake_up()
+                        if timeout > 0:
+                            self.__condition.wait(timeout)
+                    try:
+                        with app.app_context():
+                            if datetime.now() >= self.__loaded_until:
+                                self.load_due()
+                            self.fire_due()
+                    except Exception as e:
+                        logger.error(f'[DeliveryScheduler] delivery worker failed: {e}')
+
+            self.__worker = threading.Thread(target=run, name='delivery-scheduler', daemon=True)
+            self.__worker.start()
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        db.session.query(ScheduledDelivery).delete()
+        commit()
+        with self.__condition:
+            self.__heap = []
+            self.__queued = set()
+            self.__callbacks = {}
@@ -1,11 +1,10 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Tuple, Callable, List
 from datetime import datetime, timedelta
-import time
-import threading
 from backend.error_types import *
 import requests
-from backend.database import db
+from backend.database import db, commit
+from .delivery_scheduler import DeliveryScheduler
 from sqlalchemy import Column, Integer, JSON
 from typing import ClassVar
 from sqlalchemy.ext.declarative import declarative_base
@@ -138,7 +137,7 @@ class PaymentHandler(db.Model):
 
     def reset(self) -> None:
         self.payment_config = {"bogo": {}, "external payment": {}}
-        db.session.commit()
+        commit()
 
     def _resolve_payment_strategy(self, payment_details: dict):
         method = payment_details.get("payment method")
@@ -209,7 +208,7 @@ class SupplyAdapter(ABC):
     def order(self, package_details: Dict, on_arrival: Callable[[int], None]) -> int:
         """
             * order is an abstract method that should be implemented by concrete supply strategies.
-            * order should wait for the supply to arrive and call the on_arrival callback.
+            * order should schedule the arrival of the supply, the on_arrival callback is called when it arrives.
         """
         pass
 
@@ -222,21 +221,13 @@ class SupplyAdapter(ABC):
         pass
 
 
-def do_task(pur_id: int, sleep_time: int, on_arrival: Callable[[int], None]):
-    time.sleep(sleep_time)
-    on_arrival(pur_id)
-
-
 class BogoSupply(SupplyAdapter):
     def order(self, package_details: Dict, on_arrival: Callable[[int], None]) -> int:
         """
             * For testing purposes, BogoSupply always returns True.
         """
-        arrival_time = package_details.get("arrival time")
-        sleep_time = (arrival_time - datetime.now()).total_seconds()
-        pur_id = package_details.get("purchase id")
-        thread = threading.Thread(target=do_task, args=(pur_id, sleep_time, on_arrival))
-        thread.start()
+        DeliveryScheduler().schedule(package_details.get("purchase id"), package_details.get("arrival time"),
+                                     on_arrival)
         return 1
 
     def cancel_order(self, order_id: int) -> int:
@@ -272,11 +263,8 @@ class ExternalSupply(SupplyAdapter):
         if not 10000 <= response.json() <= 100000:
             raise ThirdPartyHandlerError("Failed to process supply", ThirdPartyHandlerErrorTypes.external_supply_failed)
         order_id = response.json()
-        arrival_time = package_details.get("arrival time")
-        sleep_time = (arrival_time - datetime.now()).total_seconds()
-        pur_id = package_details.get("purchase id")
-        thread = threading.Thread(target=do_task, args=(pur_id, sleep_time, on_arrival))
-        thread.start()
+        DeliveryScheduler().schedule(package_details.get("purchase id"), package_details.get("arrival time"),
+                                     on_arrival)
         return order_id
 
 
@@ -331,7 +319,7 @@ class SupplyHandler(db.Model):
 
     def reset(self) -> None:
         self.supply_config = {"bogo": {}, "external supply": {}}
-        db.session.commit()
+        commit()
 
     def _validate_supply_method(self, method_name: str, address: dict) -> bool:
         logger.info(f"Validating supply method {method_name} for address {address}")
@@ -384,6 +372,8 @@ class SupplyHandler(db.Model):
         return order_id
 
     def process_supply_cancel(self, package_details: Dict, order_id: int) -> int:
+        if package_details.get("purchase id") is not None:
+            DeliveryScheduler().cancel(package_details.get("purchase id"))
         return (self._resolve_supply_strategy(package_details)
                 .cancel_order(order_id))
 
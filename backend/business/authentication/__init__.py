@@ -1 +1,2 @@
-from .authentication import Authentication
\ No newline at end of file
+from .authentication import Authentication
+from .password_hasher import PasswordHasher
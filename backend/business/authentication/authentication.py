@@ -5,6 +5,7 @@ from backend.error_types import *
 import logging
 from backend.database import db
 from flask import current_app
+from .password_hasher import PasswordHasher
 
 logger = logging.getLogger('myapp')
 
@@ -40,6 +41,7 @@ class Authentication:
             self.jwt = None
             self.bcrypt = None
             self.load_blacklist_from_db()  # Load the blacklist from the database
+            self.user_facade.set_on_guests_collected(self.forget_guests)
 
     def clean_data(self):
         """
@@ -57,6 +59,10 @@ class Authentication:
             self.logged_in.clear()
             self.guests.clear()
 
+    def forget_guests(self, user_ids):
+        # the guests were removed by the guest collector after their tokens expired
+        self.guests.difference_update(user_ids)
+
     def set_jwt(self, jwt, bcrypt):
         self.jwt = jwt
         self.bcrypt = bcrypt
@@ -73,10 +79,21 @@ class Authentication:
         return token
 
     def hash_password(self, password):
-        return self.bcrypt.generate_password_hash(password).decode('utf-8')
+        return PasswordHasher().hash(password)
 
     def verify_password(self, password, hashed_password):
-        return self.bcrypt.check_password_hash(hashed_password, password)
+        return PasswordHasher().verify(password, hashed_password)
+
+    def rehash_password(self, user_id, password, hashed_password):
+        # the work factor of the environment changed since the password was hashed
+        if not PasswordHasher().needs_rehash(hashed_password):
+            return
+        try:
+            self.user_facade.set_password(user_id, self.hash_password(password))
+            logger.info(f'password of user {user_id} was rehashed')
+        except UserError as e:
+            # the hasher is saturated, the password is rehashed on a later login
+            logger.info(f'password of user {user_id} was not rehashed - {e}')
 
     def register_user(self, user_id, user_credentials):
         if ('password' not in user_credentials
@@ -110,6 +127,7 @@ class Authentication:
         elif user_id in self.logged_in:
             raise UserError("User is already logged in", UserErrorTypes.user_logged_in)
         else:
+            self.rehash_password(user_id, password, hashed_password)
             token = self.generate_token(user_id)
             notification = self.user_facade.get_notifications(user_id)
             self.logged_in.add(user_id)
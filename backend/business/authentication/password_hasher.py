@@ -0,0 +1,184 @@
+# ----------------- imports -----------------#
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+import queue
+import threading
+import time
+
+from backend.error_types import *
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_BCRYPT_LOG_ROUNDS = 12
+DEFAULT_PASSWORD_HASH_WORKERS = 2
+DEFAULT_PASSWORD_HASH_QUEUE_SIZE = 64
+DEFAULT_PASSWORD_HASH_TIMEOUT = 10  # seconds a request waits for its hash once it was queued
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # seconds, the upper bounds of the latency histogram
+
+
+# -----------------PasswordHasher Class-----------------#
+class PasswordHasher:
+    # singleton
+    # runs the bcrypt hashing of the registrations and the verification of the logins on a pool of worker threads. A
+    # login storm waits in a bounded queue instead of taking every request thread, and a login that finds the queue
+    # full is rejected immediately
+    __instance = None
+    __lock = threading.Lock()
+
+    def __new__(cls):
+        if PasswordHasher.__instance is None:
+            PasswordHasher.__instance = super(PasswordHasher, cls).__new__(cls)
+        return PasswordHasher.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            self.__bcrypt = None
+            self.__rounds = DEFAULT_BCRYPT_LOG_ROUNDS
+            self.__timeout = DEFAULT_PASSWORD_HASH_TIMEOUT
+            self.__queue: Optional[queue.Queue] = None
+            self.__workers: List[threading.Thread] = []
+            self.__metrics_lock = threading.Lock()
+            self.__metrics = self.__new_metrics()
+            logger.info('[PasswordHasher] successfully created password hasher')
+
+    @staticmethod
+    def __new_metrics() -> Dict:
+        return {'rejected': 0, 'timed_out': 0, 'max_queue_depth': 0,
+                'operations': {operation: {'count': 0, 'total_seconds': 0.0, 'total_wait_seconds': 0.0,
+                                           'max_seconds': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+                               for operation in ('verify', 'hash')}}
+
+    def start(self, app, bcrypt) -> None:
+        """
+        * Parameters: app, bcrypt - the Flask-Bcrypt extension
+        * This function sets the work factor of the environment (BCRYPT_LOG_ROUNDS) and starts the workers, once
+        * Returns: none
+        """
+        with PasswordHasher.__lock:
+            self.__bcrypt = bcrypt
+            self.__rounds = app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_BCRYPT_LOG_ROUNDS)
+            self.__timeout = app.config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_PASSWORD_HASH_TIMEOUT)
+            if self.__queue is not None:
+                return
+            workers = app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_PASSWORD_HASH_WORKERS)
+            self.__queue = queue.Queue(maxsize=app.config.get('PASSWORD_HASH_QUEUE_SIZE',
+                                                              DEFAULT_PASSWORD_HASH_QUEUE_SIZE))
+            for i in range(workers):
+                worker = threading.Thread(target=self.__work, name=f'password-hasher-{i}', daemon=True)
+                worker.start()
+                self.__workers.append(worker)
+            logger.info(f'[PasswordHasher] started password hasher with {workers} workers')
+
+    def __work(self) -> None:
+        while True:
+            operation, work, future, queued_at = self.__queue.get()
+            # a request that timed out cancelled its job
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            try:
+                future.set_result(work())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.__observe(operation, started - queued_at, time.monotonic() - queued_at)
+
+    def __observe(self, operation: str, wait_seconds: float, seconds: float) -> None:
+        with self.__metrics_lock:
+            metrics = self.__metrics['operations'][operation]
+            metrics['count'] += 1
+            metrics['total_seconds'] += seconds
+            metrics['total_wait_seconds'] += wait_seconds
+            metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            metrics['buckets'][bucket] += 1
+
+    def __submit(self, operation: str, work: Callable[[], object]):
+        if self.__queue is None:
+            # not started, the caller hashes on its own thread
+            return work()
+        future = Future()
+        try:
+            self.__queue.put_nowait((operation, work, future, time.monotonic()))
+        except queue.Full:
+            with self.__metrics_lock:
+                self.__metrics['rejected'] += 1
+            logger.warning(f'[PasswordHasher] rejected a {operation}, the queue is full')
+            raise UserError("Too many logins, try again later", UserErrorTypes.too_many_logins)
+        with self.__metrics_lock:
+            self.__metrics['max_queue_depth'] = max(self.__metrics['max_queue_depth'], self.__queue.qsize())
+        try:
+            return future.result(timeout=self.__timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self.__metrics_lock:
+                self.__metrics['timed_out'] += 1
+            logger.warning(f'[PasswordHasher] a {operation} timed out in the queue')
+            raise UserError("Too many logins, try again later", UserErrorTypes.too_many_logins)
+
+    def hash(self, password: str) -> str:
+        """
+        * Parameters: password
+        * This function hashes the password with the work factor of the environment
+        * Returns: the hash
+        """
+        bcrypt, rounds = self.__bcrypt, self.__rounds
+        return self.__submit('hash', lambda: bcrypt.generate_password_hash(password, rounds).decode('utf-8'))
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        """
+        * Parameters: password, hashed_password
+        * This function checks the password against its hash
+        * Returns: whether the password matches
+        """
+        bcrypt = self.__bcrypt
+        return self.__submit('verify', lambda: bcrypt.check_password_hash(hashed_password, password))
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """
+        * Parameters: hashed_password
+        * This function checks if the hash was made with another work factor than the one of the environment
+        * Returns: bool
+        """
+        # a bcrypt hash is $<version>$<work factor>$<salt and hash>
+        try:
+            return int(hashed_password.split('$')[2]) != self.__rounds
+        except (IndexError, ValueError):
+            return False
+
+    def get_metrics(self) -> Dict:
+        """
+        * Parameters: none
+        * This function returns the queue depth, the rejections and the latency (queue wait included) of every
+          operation since the process started
+        * Returns: a dict
+        """
+        with self.__metrics_lock:
+            operations = {}
+            for operation, metrics in self.__metrics['operations'].items():
+                count = metrics['count']
+                operations[operation] = {
+                    'count': count,
+                    'avg_seconds': metrics['total_seconds'] / count if count else None,
+                    'avg_wait_seconds': metrics['total_wait_seconds'] / count if count else None,
+                    'max_seconds': metrics['max_seconds'],
+                    'buckets': {str(bound): metrics['buckets'][i] for i, bound in enumerate(LATENCY_BUCKETS)}
+                    | {'inf': metrics['buckets'][-1]}}
+            return {'workers': len(self.__workers),
+                    'queue_depth': self.__queue.qsize() if self.__queue is not None else 0,
+                    'queue_size': self.__queue.maxsize if self.__queue is not None else 0,
+                    'max_queue_depth': self.__metrics['max_queue_depth'],
+                    'rejected': self.__metrics['rejected'],
+                    'timed_out': self.__metrics['timed_out'],
+                    'operations': operations}
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        with self.__metrics_lock:
+            self.__metrics = self.__new_metrics()
@@ -0,0 +1,4 @@
+from .checkout import CheckoutJobManager, CheckoutJobStatus
+from .outbox import OutboxDispatcher, OutboxStatus
+from .idempotency import IdempotencyManager, IdempotencyStatus
+from .quote import PriceQuoteManager
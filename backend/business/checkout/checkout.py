@@ -0,0 +1,233 @@
+# ----------------- imports -----------------#
+from datetime import datetime
+from typing import Callable, Optional
+
+from backend.error_types import *
+from backend.database import db
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+
+# ---------------------CheckoutJobStatus Enum---------------------#
+class CheckoutJobStatus(Enum):
+    # Enum for the status of an asynchronous checkout job
+    pending = 1
+    processing = 2
+    completed = 3
+    failed = 4
+
+
+# -----------------CheckoutJob Class-----------------#
+class CheckoutJob(db.Model):
+    # a checkout whose payment, supply and notification stages are processed in the background
+    __tablename__ = 'checkout_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    _user_id = db.Column(db.Integer, nullable=False)
+    _purchase_id = db.Column(db.Integer, nullable=False)
+    _status = db.Column(db.Enum(CheckoutJobStatus), nullable=False)
+    _message = db.Column(db.String, nullable=True)
+    _payment_id = db.Column(db.Integer, nullable=True)
+    _payment_attempted_at = db.Column(db.DateTime, nullable=True)
+    _created_at = db.Column(db.DateTime, nullable=False)
+    _updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, user_id: int, purchase_id: int):
+        self._user_id = user_id
+        self._purchase_id = purchase_id
+        self._status = CheckoutJobStatus.pending
+        self._message = None
+        self._payment_id = None
+        self._payment_attempted_at = None
+        self._created_at = datetime.now()
+        self._updated_at = self._created_at
+
+    # ---------------------------------Getters and Setters---------------------------------#
+    @property
+    def job_id(self):
+        return self.id
+
+    @property
+    def user_id(self):
+        return self._user_id
+
+    @property
+    def purchase_id(self):
+        return self._purchase_id
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def message(self):
+        return self._message
+
+    @property
+    def payment_id(self):
+        return self._payment_id
+
+    @property
+    def payment_attempted(self):
+        return self._payment_attempted_at is not None
+
+    def attempt_payment(self) -> None:
+        self._payment_attempted_at = datetime.now()
+        self._updated_at = self._payment_attempted_at
+
+    def set_payment(self, payment_id: Optional[int]) -> None:
+        # without a payment id the provider was not charged and the attempt is forgotten
+        self._payment_id = payment_id
+        if payment_id is None:
+            self._payment_attempted_at = None
+        self._updated_at = datetime.now()
+
+    def update_status(self, status: CheckoutJobStatus, message: Optional[str] = None) -> None:
+        self._status = status
+        self._message = message
+        self._updated_at = datetime.now()
+
+    def get_checkout_job_dto(self) -> dict:
+        return {
+            "job_id": self.id,
+            "user_id": self._user_id,
+            "purchase_id": self._purchase_id,
+            "status": self._status.name,
+            "message": self._message,
+            "created_at": self._created_at.isoformat(),
+            "updated_at": self._updated_at.isoformat()
+        }
+
+
+# -----------------CheckoutJobManager Class-----------------#
+class CheckoutJobManager:
+    # singleton
+    __instance = None
+
+    def __new__(cls):
+        if CheckoutJobManager.__instance is None:
+            CheckoutJobManager.__instance = super(CheckoutJobManager, cls).__new__(cls)
+        return CheckoutJobManager.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            self.__on_status_change: Optional[Callable[[dict], None]] = None
+            logger.info('[CheckoutJobManager] successfully created checkout job manager')
+
+    def set_status_listener(self, on_status_change: Callable[[dict], None]) -> None:
+        """
+        * Parameters: on_status_change
+        * This function sets the callback that is called with the job dto whenever a job finishes
+        * Returns: none
+        """
+        self.__on_status_change = on_status_change
+
+    def create_job(self, user_id: int, purchase_id: int) -> int:
+        """
+        * Parameters: user_id, purchase_id
+        * This function creates a pending checkout job for an already reserved purchase,
+          the job is committed together with the outbox message that processes it
+        * Returns: the id of the job
+        """
+        job = CheckoutJob(user_id, purchase_id)
+        db.session.add(job)
+        db.session.flush()
+        logger.info(f'[CheckoutJobManager] created checkout job {job.job_id} for purchase {purchase_id}')
+        return job.job_id
+
+    def is_finished(self, job_id: int) -> bool:
+        """
+        * Parameters: job_id
+        * This function checks whether the job already completed or failed
+        * Returns: True if the job is finished
+        """
+        job = self.__get_job_by_id(job_id)
+        return job.status in (CheckoutJobStatus.completed, CheckoutJobStatus.failed)
+
+    def mark_processing(self, job_id: int) -> None:
+        """
+        * Parameters: job_id
+        * This function marks the job as processing
+        * Returns: none
+        """
+        job = self.__get_job_by_id(job_id)
+        if job.status == CheckoutJobStatus.pending:
+            job.update_status(CheckoutJobStatus.processing)
+            db.session.commit()
+
+    def begin_payment(self, job_id: int) -> bool:
+        """
+        * Parameters: job_id
+        * This function records, before the payment provider is called, that the payment of the job is sent
+        * Returns: False if an earlier attempt was already sent and its outcome is unknown, the job must not pay again
+        """
+        job = self.__get_job_by_id(job_id)
+        if job.payment_attempted:
+            return False
+        job.attempt_payment()
+        db.session.commit()
+        return True
+
+    def record_payment(self, job_id: int, payment_id: Optional[int]) -> None:
+        """
+        * Parameters: job_id, payment_id - None if the provider was not charged
+        * This function records the outcome of the payment attempt of the job
+        * Returns: none
+        """
+        job = self.__get_job_by_id(job_id)
+        job.set_payment(payment_id)
+        db.session.commit()
+
+    def get_payment_id(self, job_id: int) -> Optional[int]:
+        """
+        * Parameters: job_id
+        * This function returns the id of the payment of the job
+        * Returns: the payment id, or None if the job did not pay yet
+        """
+        return self.__get_job_by_id(job_id).payment_id
+
+    def finish_job(self, job_id: int, status: CheckoutJobStatus, message: Optional[str] = None) -> None:
+        """
+        * Parameters: job_id, status, message
+        * This function marks the job as completed or failed and publishes its new status
+        * Returns: none
+        """
+        job = self.__get_job_by_id(job_id)
+        job.update_status(status, message)
+        db.session.commit()
+        logger.info(f'[CheckoutJobManager] checkout job {job_id} {status.name}')
+        if self.__on_status_change is not None:
+            try:
+                self.__on_status_change(job.get_checkout_job_dto())
+            except Exception as e:
+                logger.error(f'[CheckoutJobManager] failed to publish status of checkout job {job_id}: {e}')
+
+    def __get_job_by_id(self, job_id: int) -> CheckoutJob:
+        job = db.session.query(CheckoutJob).filter_by(id=job_id).first()
+        if job is None:
+            raise PurchaseError('Checkout job not found', PurchaseErrorTypes.checkout_job_not_found)
+        return job
+
+    def get_job(self, user_id: int, job_id: int) -> dict:
+        """
+        * Parameters: user_id, job_id
+        * This function returns the status of a checkout job of the user
+        * Returns: the job as a dictionary
+        """
+        job = self.__get_job_by_id(job_id)
+        if job.user_id != user_id:
+            raise PurchaseError('Checkout job does not belong to the user', PurchaseErrorTypes.checkout_job_not_of_user)
+        return job.get_checkout_job_dto()
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        from backend.app_factory import get_app
+        with get_app().app_context():
+            db.session.query(CheckoutJob).delete()
+            db.session.commit()
@@ -0,0 +1,304 @@
+# ----------------- imports -----------------#
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from backend.error_types import *
+from backend.database import db, commit_boundary
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_IDEMPOTENCY_TTL = 24 * 60 * 60  # seconds a result is replayed for
+DEFAULT_IDEMPOTENCY_WAIT_TIMEOUT = 30  # seconds a duplicate waits for the first request
+DEFAULT_IDEMPOTENCY_IN_FLIGHT_TIMEOUT = 120  # seconds after which an unfinished request is considered abandoned
+DEFAULT_IDEMPOTENCY_CLEANUP_INTERVAL = 60 * 60  # seconds
+IDEMPOTENCY_POLL_INTERVAL = 0.1  # seconds, used when the first request runs in another process
+
+
+# ---------------------IdempotencyStatus Enum---------------------#
+class IdempotencyStatus(Enum):
+    # Enum for the status of a request that was sent with an idempotency key
+    in_progress = 1
+    completed = 2
+
+
+# -----------------IdempotencyRecord Class-----------------#
+class IdempotencyRecord(db.Model):
+    # the result of a request that was sent with an idempotency key
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    _user_id = db.Column(db.Integer, nullable=False)
+    _endpoint = db.Column(db.String(50), nullable=False)
+    _key = db.Column(db.String(200), nullable=False)
+    _request_hash = db.Column(db.String(64), nullable=False)
+    _status = db.Column(db.Enum(IdempotencyStatus), nullable=False)
+    _response = db.Column(db.JSON, nullable=True)
+    _status_code = db.Column(db.Integer, nullable=True)
+    _updated_at = db.Column(db.DateTime, nullable=False)
+    _expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('_user_id', '_endpoint', '_key', name='uq_idempotency_keys_user_endpoint_key'),
+                      db.Index('ix_idempotency_keys_expires_at', '_expires_at'))
+
+    def __init__(self, user_id: int, endpoint: str, key: str, request_hash: str, expires_at: datetime):
+        self._user_id = user_id
+        self._endpoint = endpoint
+        self._key = key
+        self._request_hash = request_hash
+        self._status = IdempotencyStatus.in_progress
+        self._response = None
+        self._status_code = None
+        self._updated_at = datetime.now()
+        self._expires_at = expires_at
+
+    # ---------------------------------Getters and Setters---------------------------------#
+    @property
+    def user_id(self):
+        return self._user_id
+
+    @property
+    def endpoint(self):
+        return self._endpoint
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def request_hash(self):
+        return self._request_hash
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def status_code(self):
+        return self._status_code
+
+    @property
+    def updated_at(self):
+        return self._updated_at
+
+    @property
+    def expires_at(self):
+        return self._expires_at
+
+    def complete(self, response: dict, status_code: int, expires_at: datetime) -> None:
+        self._status = IdempotencyStatus.completed
+        self._response = response
+        self._status_code = status_code
+        self._updated_at = datetime.now()
+        self._expires_at = expires_at
+
+
+# -----------------IdempotencyManager Class-----------------#
+class IdempotencyManager:
+    # singleton
+    __instance = None
+    __lock = threading.Lock()
+
+    def __new__(cls):
+        if IdempotencyManager.__instance is None:
+            IdempotencyManager.__instance = super(IdempotencyManager, cls).__new__(cls)
+        return IdempotencyManager.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            # (user_id, endpoint, key) -> event that is set when the request that owns the key finishes
+            self.__in_flight: Dict[Tuple[int, str, str], threading.Event] = {}
+            self.__in_flight_lock = threading.Lock()
+            self.__cleaner: Optional[threading.Thread] = None
+            logger.info('[IdempotencyManager] successfully created idempotency manager')
+
+    @staticmethod
+    def __config(name: str, default):
+        from flask import current_app
+        return current_app.config.get(name, default)
+
+    @staticmethod
+    def request_hash(request_data: dict) -> str:
+        return hashlib.sha256(json.dumps(request_data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def __get_record(self, user_id: int, endpoint: str, key: str) -> Optional[IdempotencyRecord]:
+        return (db.session.query(IdempotencyRecord)
+                .filter_by(_user_id=user_id, _endpoint=endpoint, _key=key)
+                .first())
+
+    def __try_insert(self, user_id: int, endpoint: str, key: str, request_hash: str) -> bool:
+        ttl = self.__config('IDEMPOTENCY_TTL', DEFAULT_IDEMPOTENCY_TTL)
+        try:
+            # the savepoint keeps the rest of the session when another request inserted the key first
+            with db.session.begin_nested():
+                db.session.add(IdempotencyRecord(user_id, endpoint, key, request_hash,
+                                                 datetime.now() + timedelta(seconds=ttl)))
+        except IntegrityError:
+            return False
+        commit_boundary()
+        with self.__in_flight_lock:
+            self.__in_flight[(user_id, endpoint, key)] = threading.Event()
+        return True
+
+    def __take_over(self, record: IdempotencyRecord, request_hash: str) -> bool:
+        ttl = self.__config('IDEMPOTENCY_TTL', DEFAULT_IDEMPOTENCY_TTL)
+        now = datetime.now()
+        updated = (db.session.query(IdempotencyRecord)
+                   .filter(IdempotencyRecord.id == record.id,
+                           IdempotencyRecord._status == IdempotencyStatus.in_progress,
+                           IdempotencyRecord._updated_at == record.updated_at)
+                   .update({IdempotencyRecord._request_hash: request_hash,
+                            IdempotencyRecord._updated_at: now,
+                            IdempotencyRecord._expires_at: now + timedelta(seconds=ttl)}))
+        commit_boundary()
+        if updated:
+            with self.__in_flight_lock:
+                self.__in_flight[(record.user_id, record.endpoint, record.key)] = threading.Event()
+        return updated > 0
+
+    def begin(self, user_id: int, endpoint: str, key: str, request_data: dict) -> Optional[Tuple[dict, int]]:
+        """
+        * Parameters: user_id, endpoint, key, request_data
+        * This function claims the idempotency key of the user for the endpoint. If the key was already used the
+          stored result is returned, if the request that owns the key is still running this function waits for
+          its result
+        * Returns: None if the caller owns the key and has to run the request and call complete or release,
+          otherwise the stored (response, status code)
+        """
+        request_hash = self.request_hash(request_data)
+        in_flight_timeout = self.__config('IDEMPOTENCY_IN_FLIGHT_TIMEOUT', DEFAULT_IDEMPOTENCY_IN_FLIGHT_TIMEOUT)
+        deadline = time.monotonic() + self.__config('IDEMPOTENCY_WAIT_TIMEOUT', DEFAULT_IDEMPOTENCY_WAIT_TIMEOUT)
+        while True:
+            record = self.__get_record(user_id, endpoint, key)
+            now = datetime.now()
+            if record is None:
+                if self.__try_insert(user_id, endpoint, key, request_hash):
+                    logger.info(f'[IdempotencyManager] user {user_id} claimed key {key} of {endpoint}')
+                    return None
+                continue
+            if record.expires_at < now:
+                db.session.delete(record)
+                commit_boundary()
+                continue
+            if record.request_hash != request_hash:
+                raise PurchaseError('Idempotency key was already used for a different request',
+                                    PurchaseErrorTypes.idempotency_key_reused)
+            if record.status == IdempotencyStatus.completed:
+                logger.info(f'[IdempotencyManager] replaying the result of key {key} of {endpoint} for user {user_id}')
+                return record.response, record.status_code
+            if record.updated_at + timedelta(seconds=in_flight_timeout) < now:
+                # the request that owned the key never finished
+                if self.__take_over(record, request_hash):
+                    logger.warning(f'[IdempotencyManager] took over abandoned key {key} of {endpoint}')
+                    return None
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PurchaseError('A request with this idempotency key is still in progress',
+                                    PurchaseErrorTypes.idempotency_request_in_progress)
+            with self.__in_flight_lock:
+                event = self.__in_flight.get((user_id, endpoint, key))
+            # the event only exists when the first request runs in this process, otherwise poll the table
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(IDEMPOTENCY_POLL_INTERVAL, remaining))
+            db.session.expire_all()
+
+    def complete(self, user_id: int, endpoint: str, key: str, response: dict, status_code: int) -> None:
+        """
+        * Parameters: user_id, endpoint, key, response, status_code
+        * This function stores the result of the request that owns the key and wakes up its duplicates. The result
+          of a successful request is committed together with the changes of the request, the changes of a failed
+          request are rolled back before its result is stored
+        * Returns: none
+        """
+        try:
+            if status_code >= 400:
+                db.session.rollback()
+            record = self.__get_record(user_id, endpoint, key)
+            if record is not None:
+                ttl = self.__config('IDEMPOTENCY_TTL', DEFAULT_IDEMPOTENCY_TTL)
+                record.complete(response, status_code, datetime.now() + timedelta(seconds=ttl))
+                commit_boundary()
+        finally:
+            self.__finish(user_id, endpoint, key)
+
+    def release(self, user_id: int, endpoint: str, key: str) -> None:
+        """
+        * Parameters: user_id, endpoint, key
+        * This function gives up the key of a request that did not produce a result, so it can be retried
+        * Returns: none
+        """
+        try:
+            db.session.rollback()
+            (db.session.query(IdempotencyRecord)
+             .filter_by(_user_id=user_id, _endpoint=endpoint, _key=key, _status=IdempotencyStatus.in_progress)
+             .delete())
+            commit_boundary()
+        finally:
+            self.__finish(user_id, endpoint, key)
+
+    def __finish(self, user_id: int, endpoint: str, key: str) -> None:
+        with self.__in_flight_lock:
+            event = self.__in_flight.pop((user_id, endpoint, key), None)
+        if event is not None:
+            event.set()
+
+    def clean_expired(self) -> int:
+        """
+        * Parameters: none
+        * This function deletes the keys whose time to live passed
+        * Returns: the number of deleted keys
+        """
+        deleted = (db.session.query(IdempotencyRecord)
+                   .filter(IdempotencyRecord._expires_at < datetime.now())
+                   .delete())
+        commit_boundary()
+        return deleted
+
+    def start_cleanup(self, app, interval_seconds: float) -> None:
+        """
+        * Parameters: app, interval_seconds
+        * This function starts a background thread that deletes expired keys every interval_seconds
+        * Returns: none
+        """
+        with IdempotencyManager.__lock:
+            if self.__cleaner is not None:
+                return
+
+            def clean():
+                while True:
+                    time.sleep(interval_seconds)
+                    try:
+                        with app.app_context():
+                            deleted = self.clean_expired()
+                        if deleted:
+                            logger.info(f'[IdempotencyManager] deleted {deleted} expired idempotency keys')
+                    except Exception as e:
+                        logger.error(f'[IdempotencyManager] idempotency key cleanup failed: {e}')
+
+            self.__cleaner = threading.Thread(target=clean, name='idempotency-cleanup', daemon=True)
+            self.__cleaner.start()
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        db.session.query(IdempotencyRecord).delete()
+        commit_boundary()
+        with self.__in_flight_lock:
+            self.__in_flight.clear()
@@ -0,0 +1,379 @@
+# ----------------- imports -----------------#
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+import base64
+import hashlib
+import json
+import threading
+import uuid
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from backend.error_types import *
+from backend.database import db
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_OUTBOX_WORKERS = 4
+DEFAULT_OUTBOX_MAX_ATTEMPTS = 5
+DEFAULT_OUTBOX_RETRY_BACKOFF = 2  # seconds, doubled on every attempt
+DEFAULT_OUTBOX_POLL_INTERVAL = 1  # seconds
+DEFAULT_OUTBOX_BATCH_SIZE = 100
+DEFAULT_OUTBOX_LEASE = 300  # seconds a claimed message belongs to the process that claimed it
+
+# (action, payload, key) - a message that a handler wants to enqueue after it succeeded
+FollowUp = Tuple[str, dict, Optional[str]]
+OutboxHandler = Callable[[dict], Optional[List[FollowUp]]]
+OutboxGiveUpHandler = Callable[[dict, str], Optional[List[FollowUp]]]
+
+
+# ---------------------OutboxStatus Enum---------------------#
+class OutboxStatus(Enum):
+    # Enum for the status of an outbox message
+    pending = 1
+    processing = 2
+    done = 3
+    failed = 4
+
+
+# -----------------OutboxMessage Class-----------------#
+class OutboxMessage(db.Model):
+    # a side effect (third party call, notification, compensation) that has to be executed at least once
+    __tablename__ = 'outbox_messages'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    _key = db.Column(db.String(200), nullable=False, unique=True)
+    _action = db.Column(db.String(50), nullable=False)
+    _payload = db.Column(db.JSON, nullable=False)
+    _status = db.Column(db.Enum(OutboxStatus), nullable=False)
+    _attempts = db.Column(db.Integer, nullable=False, default=0)
+    _next_attempt_at = db.Column(db.DateTime, nullable=False)
+    _last_error = db.Column(db.String, nullable=True)
+    _claimed_at = db.Column(db.DateTime, nullable=True)
+    _created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_outbox_messages_status_next_attempt', '_status', '_next_attempt_at'),)
+
+    def __init__(self, key: str, action: str, payload: dict):
+        self._key = key
+        self._action = action
+        self._payload = payload
+        self._status = OutboxStatus.pending
+        self._attempts = 0
+        self._created_at = datetime.now()
+        self._next_attempt_at = self._created_at
+        self._last_error = None
+        self._claimed_at = None
+
+    # ---------------------------------Getters and Setters---------------------------------#
+    @property
+    def message_id(self):
+        return self.id
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def action(self):
+        return self._action
+
+    @property
+    def payload(self):
+        return self._payload
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def attempts(self):
+        return self._attempts
+
+    @property
+    def last_error(self):
+        return self._last_error
+
+    def redact(self, fields: Tuple[str, ...]) -> None:
+        # a new dict, the JSON column does not track changes inside the payload
+        if any(field in self._payload for field in fields):
+            self._payload = {field: value for field, value in self._payload.items() if field not in fields}
+
+    def mark_done(self, redacted_fields: Tuple[str, ...] = ()) -> None:
+        self._status = OutboxStatus.done
+        self._last_error = None
+        self._claimed_at = None
+        self.redact(redacted_fields)
+
+    def mark_retry(self, error: str, next_attempt_at: datetime) -> None:
+        self._attempts += 1
+        self._status = OutboxStatus.pending
+        self._last_error = error
+        self._next_attempt_at = next_attempt_at
+        self._claimed_at = None
+
+    def mark_failed(self, error: str, redacted_fields: Tuple[str, ...] = ()) -> None:
+        self._attempts += 1
+        self._status = OutboxStatus.failed
+        self._last_error = error
+        self._claimed_at = None
+        self.redact(redacted_fields)
+
+
+# -----------------OutboxDispatcher Class-----------------#
+class OutboxDispatcher:
+    # singleton
+    __instance = None
+    __lock = threading.Lock()
+
+    def __new__(cls):
+        if OutboxDispatcher.__instance is None:
+            OutboxDispatcher.__instance = super(OutboxDispatcher, cls).__new__(cls)
+        return OutboxDispatcher.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            self.__handlers: Dict[str, Tuple[OutboxHandler, Optional[OutboxGiveUpHandler], Tuple[str, ...]]] = {}
+            self.__app = None
+            self.__executor: Optional[ThreadPoolExecutor] = None
+            self.__poller: Optional[threading.Thread] = None
+            self.__wakeup = threading.Event()
+            self.__max_attempts = DEFAULT_OUTBOX_MAX_ATTEMPTS
+            self.__retry_backoff = DEFAULT_OUTBOX_RETRY_BACKOFF
+            self.__poll_interval = DEFAULT_OUTBOX_POLL_INTERVAL
+            self.__batch_size = DEFAULT_OUTBOX_BATCH_SIZE
+            self.__lease = DEFAULT_OUTBOX_LEASE
+            logger.info('[OutboxDispatcher] successfully created outbox dispatcher')
+
+    def register_handler(self, action: str, handler: OutboxHandler,
+                         on_give_up: Optional[OutboxGiveUpHandler] = None,
+                         sensitive_fields: Tuple[str, ...] = ()) -> None:
+        """
+        * Parameters: action, handler, on_give_up, sensitive_fields
+        * This function registers the handler that executes messages of the given action.
+          handler(payload) returns follow up messages that are enqueued in the same commit that marks the message done,
+          on_give_up(payload, error) is called once the message ran out of attempts,
+          the sensitive fields are stored encrypted, the handlers get them decrypted, and they are removed from the
+          stored payload once the message is done or failed
+        * Returns: none
+        """
+        self.__handlers[action] = (handler, on_give_up, tuple(sensitive_fields))
+
+    def enqueue(self, action: str, payload: dict, key: Optional[str] = None) -> None:
+        """
+        * Parameters: action, payload, key
+        * This function adds a message to the outbox in the current transaction, it is dispatched once the caller
+          commits. A message whose key already exists is ignored, so enqueueing is idempotent
+        * Returns: none
+        """
+        if action not in self.__handlers:
+            raise PurchaseError(f'No outbox handler for action {action}', PurchaseErrorTypes.outbox_action_not_supported)
+        if key is None:
+            key = f'{action}:{uuid.uuid4().hex}'
+        elif db.session.query(OutboxMessage.id).filter_by(_key=key).first() is not None:
+            logger.info(f'[OutboxDispatcher] message {key} is already in the outbox')
+            return
+        sensitive_fields = self.__handlers[action][2]
+        if any(field in payload for field in sensitive_fields):
+            cipher = self.__cipher()
+            payload = {field: cipher.encrypt(json.dumps(value).encode()).decode() if field in sensitive_fields else value
+                       for field, value in payload.items()}
+        db.session.add(OutboxMessage(key, action, payload))
+        logger.info(f'[OutboxDispatcher] enqueued message {key}')
+
+    @staticmethod
+    def __cipher() -> Fernet:
+        # every server that dispatches the outbox needs the same key, the process secret key only works for messages
+        # that are dispatched by the process that enqueued them
+        from flask import current_app
+        secret = current_app.config.get('OUTBOX_ENCRYPTION_KEY') or current_app.config.get('SECRET_KEY', '')
+        return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+
+    def __decrypt(self, payload: dict, sensitive_fields: Tuple[str, ...]) -> dict:
+        if not any(field in payload for field in sensitive_fields):
+            return payload
+        cipher = self.__cipher()
+        return {field: json.loads(cipher.decrypt(value.encode())) if field in sensitive_fields else value
+                for field, value in payload.items()}
+
+    def start(self, app=None) -> None:
+        """
+        * Parameters: app
+        * This function starts the dispatcher, messages whose lease expired while they were in process (the process
+          that claimed them stopped) are returned to the queue so crashed checkouts converge
+        * Returns: none
+        """
+        with OutboxDispatcher.__lock:
+            if self.__poller is not None:
+                return
+            if app is None:
+                from backend.app_factory import get_app
+                app = get_app()
+            self.__app = app
+            self.__max_attempts = app.config.get('OUTBOX_MAX_ATTEMPTS', DEFAULT_OUTBOX_MAX_ATTEMPTS)
+            self.__retry_backoff = app.config.get('OUTBOX_RETRY_BACKOFF', DEFAULT_OUTBOX_RETRY_BACKOFF)
+            self.__poll_interval = app.config.get('OUTBOX_POLL_INTERVAL', DEFAULT_OUTBOX_POLL_INTERVAL)
+            self.__batch_size = app.config.get('OUTBOX_BATCH_SIZE', DEFAULT_OUTBOX_BATCH_SIZE)
+            self.__lease = app.config.get('OUTBOX_LEASE', DEFAULT_OUTBOX_LEASE)
+            workers = app.config.get('CHECKOUT_WORKERS', DEFAULT_OUTBOX_WORKERS)
+            if not app.config.get('OUTBOX_ENCRYPTION_KEY'):
+                logger.warning('[OutboxDispatcher] OUTBOX_ENCRYPTION_KEY is not set, messages with sensitive fields '
+                               'can only be dispatched by the process that enqueued them')
+            with app.app_context():
+                self.reclaim_expired()
+                db.session.commit()
+            self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
+            self.__poller = threading.Thread(target=self.__poll, name='outbox-poller', daemon=True)
+            self.__poller.start()
+            logger.info(f'[OutboxDispatcher] started outbox dispatcher with {workers} workers')
+
+    def wake(self) -> None:
+        """
+        * Parameters: none
+        * This function makes the dispatcher look for due messages immediately instead of waiting for the next poll
+        * Returns: none
+        """
+        if self.__poller is None:
+            self.start()
+        self.__wakeup.set()
+
+    def __poll(self) -> None:
+        while True:
+            self.__wakeup.wait(self.__poll_interval)
+            self.__wakeup.clear()
+            try:
+                with self.__app.app_context():
+                    self.dispatch_due()
+            except Exception as e:
+                logger.error(f'[OutboxDispatcher] failed to dispatch outbox messages: {e}')
+
+    def reclaim_expired(self) -> int:
+        """
+        * Parameters: none
+        * This function returns the messages whose lease expired to the queue. A message that is still in its lease
+          may be running in another process and is left alone
+        * Returns: the number of reclaimed messages
+        """
+        expired = datetime.now() - timedelta(seconds=self.__lease)
+        reclaimed = (db.session.query(OutboxMessage)
+                     .filter(OutboxMessage._status == OutboxStatus.processing,
+                             db.or_(OutboxMessage._claimed_at.is_(None), OutboxMessage._claimed_at <= expired))
+                     .update({OutboxMessage._status: OutboxStatus.pending, OutboxMessage._claimed_at: None},
+                             synchronize_session=False))
+        if reclaimed:
+            logger.info(f'[OutboxDispatcher] reclaimed {reclaimed} messages whose lease expired')
+        return reclaimed
+
+    def dispatch_due(self) -> int:
+        """
+        * Parameters: none
+        * This function reclaims the expired messages, claims the messages that are due and hands them to the worker
+          pool
+        * Returns: the number of claimed messages
+        """
+        self.reclaim_expired()
+        due = (db.session.query(OutboxMessage.id)
+               .filter(OutboxMessage._status == OutboxStatus.pending,
+                       OutboxMessage._next_attempt_at <= datetime.now())
+               .order_by(OutboxMessage.id)
+               .limit(self.__batch_size)
+               .all())
+        claimed = []
+        for (message_id,) in due:
+            # claiming with a conditional update keeps a message from running twice
+            updated = (db.session.query(OutboxMessage)
+                       .filter(OutboxMessage.id == message_id, OutboxMessage._status == OutboxStatus.pending)
+                       .update({OutboxMessage._status: OutboxStatus.processing,
+                                OutboxMessage._claimed_at: datetime.now()}))
+            if updated:
+                claimed.append(message_id)
+        db.session.commit()
+        for message_id in claimed:
+            self.__executor.submit(self.__run_message, message_id)
+        return len(claimed)
+
+    def __run_message(self, message_id: int) -> None:
+        with self.__app.app_context():
+            message = db.session.query(OutboxMessage).filter_by(id=message_id).first()
+            if message is None or message.status != OutboxStatus.processing:
+                return
+            handler, on_give_up, sensitive_fields = self.__handlers.get(message.action, (None, None, ()))
+            try:
+                payload = self.__decrypt(dict(message.payload), sensitive_fields)
+            except (InvalidToken, AttributeError, ValueError) as e:
+                # another key encrypted the message, retrying will not help
+                payload = {field: value for field, value in message.payload.items() if field not in sensitive_fields}
+                if self.__give_up(message_id, on_give_up, sensitive_fields, payload,
+                                  f'The sensitive fields of the message can not be decrypted: {e!r}'):
+                    self.__wakeup.set()
+                return
+            try:
+                if handler is None:
+                    raise PurchaseError(f'No outbox handler for action {message.action}',
+                                        PurchaseErrorTypes.outbox_action_not_supported)
+                follow_ups = handler(payload) or []
+                for action, follow_up_payload, key in follow_ups:
+                    self.enqueue(action, follow_up_payload, key)
+                message.mark_done(sensitive_fields)
+                db.session.commit()
+                logger.info(f'[OutboxDispatcher] message {message.key} done')
+            except Exception as e:
+                db.session.rollback()
+                message = db.session.query(OutboxMessage).filter_by(id=message_id).first()
+                follow_ups = []
+                if message.attempts + 1 < self.__max_attempts:
+                    delay = self.__retry_backoff * (2 ** message.attempts)
+                    message.mark_retry(str(e), datetime.now() + timedelta(seconds=delay))
+                    logger.warning(f'[OutboxDispatcher] message {message.key} failed, retrying in {delay}s: {e}')
+                    db.session.commit()
+                else:
+                    follow_ups = self.__give_up(message_id, on_give_up, sensitive_fields, payload, str(e))
+            if follow_ups:
+                self.__wakeup.set()
+
+    def __give_up(self, message_id: int, on_give_up: Optional[OutboxGiveUpHandler], sensitive_fields: Tuple[str, ...],
+                  payload: dict, error: str) -> List[FollowUp]:
+        # the message is marked failed even if its give up handler fails, otherwise it stays in process forever
+        message = db.session.query(OutboxMessage).filter_by(id=message_id).first()
+        message.mark_failed(error, sensitive_fields)
+        logger.error(f'[OutboxDispatcher] message {message.key} failed permanently: {error}')
+        follow_ups = []
+        try:
+            if on_give_up is not None:
+                follow_ups = on_give_up(payload, error) or []
+            for action, follow_up_payload, key in follow_ups:
+                self.enqueue(action, follow_up_payload, key)
+            db.session.commit()
+            return follow_ups
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'[OutboxDispatcher] give up handler of message {message_id} failed: {e}')
+            message = db.session.query(OutboxMessage).filter_by(id=message_id).first()
+            message.mark_failed(f'{error}; give up handler failed: {e}', sensitive_fields)
+            db.session.commit()
+            return []
+
+    def get_messages(self, status: Optional[OutboxStatus] = None) -> List[OutboxMessage]:
+        """
+        * Parameters: status
+        * This function returns the outbox messages, optionally only the ones with the given status
+        * Returns: a list of outbox messages
+        """
+        query = db.session.query(OutboxMessage)
+        if status is not None:
+            query = query.filter(OutboxMessage._status == status)
+        return query.order_by(OutboxMessage.id).all()
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        from backend.app_factory import get_app
+        with get_app().app_context():
+            db.session.query(OutboxMessage).delete()
+            db.session.commit()
@@ -0,0 +1,142 @@
+# ----------------- imports -----------------#
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import base64
+import hashlib
+import hmac
+import json
+
+from backend.business.DTOs import PurchaseProductDTO, UserInformationForConstraintDTO
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_PRICE_QUOTE_TTL = 5 * 60  # seconds a quote can be used at checkout
+
+
+# -----------------PriceQuoteManager Class-----------------#
+class PriceQuoteManager:
+    # singleton
+    # a quote is a signed token that holds the pricing of a cart. It is bound to the user, the cart contents, the
+    # user information the discounts were calculated with and the catalog, discount and policy versions of the stores,
+    # so checkout can use its prices as long as none of them changed
+    __instance = None
+
+    def __new__(cls):
+        if PriceQuoteManager.__instance is None:
+            PriceQuoteManager.__instance = super(PriceQuoteManager, cls).__new__(cls)
+        return PriceQuoteManager.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            logger.info('[PriceQuoteManager] successfully created price quote manager')
+
+    @staticmethod
+    def __config(name: str, default):
+        from flask import current_app
+        return current_app.config.get(name, default)
+
+    def __sign(self, payload: bytes) -> str:
+        secret = self.__config('PRICE_QUOTE_SECRET_KEY', None) or self.__config('SECRET_KEY', '')
+        return hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def __encode(payload: bytes) -> str:
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    @staticmethod
+    def __decode(data: str) -> bytes:
+        return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+    @staticmethod
+    def __hash(value) -> str:
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+    def cart_hash(self, cart: Dict[int, Dict[int, int]]) -> str:
+        return self.__hash({str(store_id): {str(product_id): amount for product_id, amount in products.items()}
+                            for store_id, products in cart.items()})
+
+    def user_info_hash(self, user_id: int, user_info: Optional[UserInformationForConstraintDTO]) -> str:
+        if user_info is None:
+            return self.__hash({'user_id': user_id})
+        return self.__hash(user_info.get())
+
+    @staticmethod
+    def __versions(versions: Dict[int, Tuple[int, int, int]], category_version: int) -> Dict[str, List[int]]:
+        result = {str(store_id): list(store_versions) for store_id, store_versions in versions.items()}
+        result['categories'] = [category_version]
+        return result
+
+    def issue(self, user_id: int, user_info: Optional[UserInformationForConstraintDTO],
+              cart: Dict[int, Dict[int, int]], versions: Dict[int, Tuple[int, int, int]], category_version: int,
+              total_price: float, total_price_after_discounts: float,
+              purchase_shopping_cart: Dict[int, Tuple[List[PurchaseProductDTO], float, float]],
+              valid_until: Optional[datetime] = None) -> Tuple[str, datetime]:
+        """
+        * Parameters: user_id, user_info, cart, versions (store_id -> (catalog, discount, policy version)),
+          category_version, total_price, total_price_after_discounts, purchase_shopping_cart,
+          valid_until(default=None) - e.g. the next time a discount of the stores starts or ends
+        * This function creates a signed quote of the pricing of the cart
+        * Returns: the quote token and the time it expires
+        """
+        expires_at = datetime.now() + timedelta(seconds=self.__config('PRICE_QUOTE_TTL', DEFAULT_PRICE_QUOTE_TTL))
+        if valid_until is not None and valid_until < expires_at:
+            expires_at = valid_until
+        payload = {
+            'user_id': user_id,
+            'user_info': self.user_info_hash(user_id, user_info),
+            'cart': self.cart_hash(cart),
+            'versions': self.__versions(versions, category_version),
+            'expires_at': expires_at.timestamp(),
+            'total_price': total_price,
+            'total_price_after_discounts': total_price_after_discounts,
+            'purchase_shopping_cart': {
+                str(store_id): {'products': [product.get() for product in products],
+                                'price': price, 'price_after_discounts': price_after_discounts}
+                for store_id, (products, price, price_after_discounts) in purchase_shopping_cart.items()}
+        }
+        data = json.dumps(payload, sort_keys=True).encode()
+        return f'{self.__encode(data)}.{self.__sign(data)}', expires_at
+
+    def redeem(self, quote: str, user_id: int, user_info: Optional[UserInformationForConstraintDTO],
+               cart: Dict[int, Dict[int, int]], versions: Dict[int, Tuple[int, int, int]], category_version: int) \
+            -> Optional[Tuple[float, float, Dict[int, Tuple[List[PurchaseProductDTO], float, float]]]]:
+        """
+        * Parameters: quote, user_id, user_info, cart, versions (store_id -> (catalog, discount, policy version)),
+          category_version
+        * This function checks that the quote is authentic and still describes the cart
+        * Returns: (total price, total price after discounts, purchase shopping cart) of the quote, or None if the
+          cart has to be priced again
+        """
+        try:
+            encoded, signature = quote.split('.')
+            data = self.__decode(encoded)
+        except Exception:
+            logger.warning(f'[PriceQuoteManager] malformed quote of user {user_id}')
+            return None
+        if not hmac.compare_digest(signature, self.__sign(data)):
+            logger.warning(f'[PriceQuoteManager] quote of user {user_id} has an invalid signature')
+            return None
+        payload = json.loads(data)
+        if payload['expires_at'] < datetime.now().timestamp():
+            reason = 'expired'
+        elif payload['user_id'] != user_id or payload['user_info'] != self.user_info_hash(user_id, user_info):
+            reason = 'was made for other user information'
+        elif payload['cart'] != self.cart_hash(cart):
+            reason = 'was made for another cart'
+        elif payload['versions'] != self.__versions(versions, category_version):
+            reason = 'is outdated'
+        else:
+            purchase_shopping_cart = {
+                int(store_id): ([PurchaseProductDTO(product['product_id'], product['name'], product['description'],
+                                                    product['price'], product['amount'])
+                                 for product in basket['products']],
+                                basket['price'], basket['price_after_discounts'])
+                for store_id, basket in payload['purchase_shopping_cart'].items()}
+            logger.info(f'[PriceQuoteManager] using the quote of user {user_id}')
+            return payload['total_price'], payload['total_price_after_discounts'], purchase_shopping_cart
+        logger.info(f'[PriceQuoteManager] quote of user {user_id} {reason}, the cart is priced again')
+        return None
@@ -0,0 +1,128 @@
+# ----------------- imports -----------------#
+from typing import Callable, Dict, List
+import threading
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from backend.database import db, commit
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_ID_BLOCK_SIZE = 1
+HOT_ID_BLOCK_SIZE = 50  # ids reserved at a time for the counters that are allocated on every request
+
+
+# -----------------IdSequence Class-----------------#
+class IdSequence(db.Model):
+    # the next id of a counter that was not reserved by any process yet
+    __tablename__ = 'id_sequences'
+
+    _name = db.Column('name', db.String(100), primary_key=True)
+    _next_value = db.Column('next_value', db.Integer, nullable=False)
+
+    def __init__(self, name: str, next_value: int):
+        self._name = name
+        self._next_value = next_value
+
+
+def first_free_id(column, *filters) -> int:
+    """
+    * Parameters: column - an id column, filters
+    * This function is used as the initial value of a counter whose ids are already used by rows
+    * Returns: the id after the largest id in the column, 0 if there are no rows
+    """
+    last = db.session.query(func.max(column)).filter(*filters).scalar()
+    return 0 if last is None else last + 1
+
+
+# -----------------IdAllocator Class-----------------#
+class IdAllocator:
+    # singleton
+    # allocates the ids of the counters of all the processes from the id_sequences table. A process reserves a block of
+    # ids of a counter with one locked update and hands them out from memory (hi-lo), so a hot counter only goes to
+    # the database once per block
+    __instance = None
+
+    def __new__(cls):
+        if IdAllocator.__instance is None:
+            IdAllocator.__instance = super(IdAllocator, cls).__new__(cls)
+        return IdAllocator.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            self.__lock = threading.Lock()
+            # counter name -> [next id, end of the reserved block]
+            self.__blocks: Dict[str, List[int]] = {}
+            logger.info('[IdAllocator] successfully created id allocator')
+
+    @staticmethod
+    def __reserve_on(connection, name: str, block_size: int, initial: Callable[[], int]) -> int:
+        table = IdSequence.__table__
+        query = select(table.c.next_value).where(table.c.name == name).with_for_update()
+        next_value = connection.execute(query).scalar()
+        if next_value is None:
+            next_value = initial()
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(name=name, next_value=next_value + block_size))
+                return next_value
+            except IntegrityError:
+                # another process created the counter first
+                next_value = connection.execute(query).scalar()
+        connection.execute(table.update().where(table.c.name == name).values(next_value=next_value + block_size))
+        return next_value
+
+    def __reserve(self, name: str, block_size: int, initial: Callable[[], int]) -> List[int]:
+        # returns [the first id of the block, the end of the block]
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # sqlite has a single writer, a second connection would wait for the transaction of the request itself, so
+            # the id is reserved in it. A rolled back block would be handed out again, so it is one id
+            db.session.flush()
+            writing = db.session.connection().connection.dbapi_connection.in_transaction
+            first = self.__reserve_on(db.session, name, 1, initial)
+            if not writing:
+                # the request did not write yet, it must not hold the lock of the counter until it ends
+                commit()
+            return [first, first + 1]
+        # the block is committed on its own, a rollback of the request must not hand out its ids again
+        with db.session.get_bind().begin() as connection:
+            first = self.__reserve_on(connection, name, block_size, initial)
+            return [first, first + block_size]
+
+    def allocate(self, name: str, initial: Callable[[], int] = lambda: 0,
+                 block_size: int = DEFAULT_ID_BLOCK_SIZE) -> int:
+        """
+        * Parameters: name - of the counter, initial(default=0) - returns the first id of a counter that does not
+          exist yet, block_size(default=1) - the number of ids reserved at a time
+        * This function allocates the next id of the counter
+        * Returns: the id
+        """
+        with self.__lock:
+            block = self.__blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                block = self.__blocks[name] = self.__reserve(name, block_size, initial)
+            block[0] += 1
+            return block[0] - 1
+
+    def reset(self, name: str, prefix: bool = False) -> None:
+        """
+        * Parameters: name, prefix(default=False) - reset all the counters whose name starts with name
+        * This function removes the counter, it starts again from its initial value
+        * Returns: none
+        """
+        with self.__lock:
+            query = db.session.query(IdSequence)
+            if prefix:
+                query = query.filter(IdSequence._name.startswith(name))
+                for counter in [counter for counter in self.__blocks if counter.startswith(name)]:
+                    del self.__blocks[counter]
+            else:
+                query = query.filter(IdSequence._name == name)
+                self.__blocks.pop(name, None)
+            query.delete(synchronize_session=False)
+            commit()
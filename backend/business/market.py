@@ -1,18 +1,23 @@
 from .user import UserFacade
 from .authentication.authentication import Authentication
+from .authentication.password_hasher import PasswordHasher
 from .roles import RolesFacade
 from .DTOs import AddressDTO, BidPurchaseDTO, NotificationDTO, PurchaseDTO, PurchaseProductDTO, StoreDTO, ProductDTO, \
     UserDTO, \
     PurchaseUserDTO, UserInformationForConstraintDTO, RoleNominationDTO, NominationDTO, CategoryDTO
 from .store import StoreFacade
-from .purchase import PurchaseFacade
-from .ThirdPartyHandlers import PaymentHandler, SupplyHandler
+from .purchase import PurchaseFacade, SalesStats
+from .purchase.purchase import PurchaseStatus
+from .ThirdPartyHandlers import PaymentHandler, SupplyHandler, DeliveryScheduler
 from .notifier import Notifier
-from typing import List, Dict, Tuple, Optional
-from datetime import date, datetime
+from .checkout import CheckoutJobManager, CheckoutJobStatus, OutboxDispatcher, PriceQuoteManager
+from typing import Iterator, List, Dict, Tuple, Optional
+from datetime import date, datetime, timedelta
 import threading
+import time
+from flask import current_app
 from backend.error_types import *
-from backend.database import db
+from backend.database import db, commit, commit_boundary, begin_unit_of_work, end_unit_of_work
 
 import logging
 
@@ -20,6 +25,9 @@ logging.basicConfig(level=logging.INFO, filename='app.log', filemode='w',
                     format='%(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Market logger")
 
+DEFAULT_RESERVATION_TTL = 600  # seconds
+DEFAULT_BATCH_CHECKOUT_MAX_ENTRIES = 500
+
 
 class MarketFacade:
     # singleton
@@ -43,6 +51,13 @@ class MarketFacade:
             self.addresses = []
             self.auth_facade = Authentication()
             self.notifier = Notifier()
+            self.checkout_jobs = CheckoutJobManager()
+            self.checkout_jobs.set_status_listener(self.__on_checkout_job_finished)
+            self.outbox = OutboxDispatcher()
+            self.__register_outbox_handlers()
+            self.price_quotes = PriceQuoteManager()
+            self.delivery_scheduler = DeliveryScheduler()
+            self.delivery_scheduler.set_on_arrivals(self.on_arrivals_lambda)
 
             # create the admin?
             self.create_admin()
@@ -66,7 +81,7 @@ class MarketFacade:
         self.user_facade.register_user(man_id, "admin@admin.com", "admin", hashed_password,
                                        2000, 1, 1, "123456789")
         self.roles_facade.add_admin(man_id)
-        db.session.commit()
+        commit()
         logger.info(f"Admin was created")
 
     def clean_data(self):
@@ -78,6 +93,9 @@ class MarketFacade:
         self.roles_facade.clean_data()
         self.purchase_facade.clean_data()
         self.notifier.clean_data()
+        self.checkout_jobs.clean_data()
+        self.outbox.clean_data()
+        self.delivery_scheduler.clean_data()
         PaymentHandler().reset()
         SupplyHandler().reset()
 
@@ -237,15 +255,210 @@ class MarketFacade:
         if self.store_facade.check_product_availability(store_id, product_id, amount):
             self.user_facade.add_product_to_basket(user_id, store_id, product_id, amount)
             logger.info(f"User {user_id} has added {amount} of product {product_id} to the basket")
+            if self.__reserve_on_add_to_basket():
+                self.__reserve_basket_product(user_id, store_id, product_id)
         else:
             raise StoreError("Product is not available", StoreErrorTypes.product_not_available)
 
     def remove_product_from_basket(self, user_id: int, store_id: int, product_id: int, amount: int):
         self.user_facade.remove_product_from_basket(user_id, store_id, product_id, amount)
         logger.info(f"User {user_id} has removed {amount} of product {product_id} from the basket")
+        if self.__reserve_on_add_to_basket():
+            self.__reserve_basket_product(user_id, store_id, product_id)
+
+    def __reserve_basket_product(self, user_id: int, store_id: int, product_id: int):
+        amount_in_basket = self.user_facade.get_shopping_cart(user_id).get(store_id, {}).get(product_id, 0)
+        try:
+            self.store_facade.reserve_products(user_id, {store_id: {product_id: amount_in_basket}},
+                                               self.__reservation_ttl())
+        except StoreError as e:
+            # the basket is kept, the products will be reserved again when the checkout starts
+            logger.warning(f"Could not reserve product {product_id} of store {store_id} for user {user_id}: {e}")
+
+    @staticmethod
+    def __reservation_ttl() -> int:
+        return current_app.config.get('RESERVATION_TTL', DEFAULT_RESERVATION_TTL)
+
+    @staticmethod
+    def __reserve_on_add_to_basket() -> bool:
+        return current_app.config.get('RESERVE_ON_ADD_TO_BASKET', False)
+
+    def checkout(self, user_id: int, payment_details: Dict, supply_details: Dict, address: Dict,
+                 quote: Optional[str] = None) -> int:
+        pur_id, cart, total_price_after_discounts, delivery_date = self.__reserve_checkout(user_id, payment_details,
+                                                                                           supply_details, address,
+                                                                                           quote)
+        self.__finalize_checkout(user_id, pur_id, cart, total_price_after_discounts, delivery_date, payment_details,
+                                 supply_details)
+        logger.info(f"User {user_id} has checked out")
+        return pur_id
+
+    def checkout_async(self, user_id: int, payment_details: Dict, supply_details: Dict, address: Dict,
+                       quote: Optional[str] = None) -> int:
+        """
+        * Parameters: user_id, payment_details, supply_details, address, quote(default=None)
+        * This function validates the cart, creates the purchase and removes the products from the stores,
+          the payment, supply and notification stages are processed through the outbox
+        * Returns: the id of the checkout job, its outcome is available through get_checkout_status
+        """
+        pur_id, cart, total_price_after_discounts, delivery_date = self.__reserve_checkout(user_id, payment_details,
+                                                                                           supply_details, address,
+                                                                                           quote)
+        job_id = self.checkout_jobs.create_job(user_id, pur_id)
+        payload = {'job_id': job_id, 'user_id': user_id, 'purchase_id': pur_id,
+                   'cart': {str(store_id): {str(product_id): amount for product_id, amount in products.items()}
+                            for store_id, products in cart.items()},
+                   'total_price': total_price_after_discounts, 'delivery_date': delivery_date.isoformat(),
+                   'payment_method': payment_details.get("payment method"), 'payment_details': payment_details,
+                   'supply_details': supply_details}
+        self.outbox.enqueue('checkout_payment', payload, f'checkout_payment:{job_id}')
+        commit_boundary()
+        self.outbox.wake()
+        logger.info(f"User {user_id} has started checkout job {job_id}")
+        return job_id
+
+    def get_checkout_status(self, user_id: int, job_id: int) -> dict:
+        return self.checkout_jobs.get_job(user_id, job_id)
+
+    def batch_checkout(self, actor_id: int, entries: List[Dict]) -> List[Dict]:
+        """
+        * Parameters: actor_id, entries - every entry has user_id, payment_details, supply_details, address and
+          optionally cart (store_id -> product_id -> amount), when the cart is missing the basket of the user is used.
+          Entries of users other than the actor are allowed for system managers only
+        * This function checks out many carts at once. The carts are priced with shared store, discount and policy
+          loads and reserved in one transaction per group of stores, then every entry is paid, supplied and committed
+          on its own. A failing entry does not abort the others
+        * Returns: a result for every entry with its purchase id or the error message
+        """
+        max_entries = current_app.config.get('BATCH_CHECKOUT_MAX_ENTRIES', DEFAULT_BATCH_CHECKOUT_MAX_ENTRIES)
+        if len(entries) > max_entries:
+            raise PurchaseError(f"A batch checkout can have at most {max_entries} entries",
+                                PurchaseErrorTypes.batch_checkout_too_large)
+
+        errors: Dict[int, Exception] = {}
+        prepared: Dict[int, Tuple[Dict[int, Dict[int, int]], UserInformationForConstraintDTO, bool]] = {}
+        actor_is_system_manager = self.roles_facade.is_system_manager(actor_id)
+        batch_users = set()
+        for index, entry in enumerate(entries):
+            try:
+                user_id = entry['user_id']
+                if user_id != actor_id and not actor_is_system_manager:
+                    raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
+                if user_id in batch_users:
+                    raise PurchaseError("User already has an entry in the batch",
+                                        PurchaseErrorTypes.duplicate_user_in_batch)
+                batch_users.add(user_id)
+                prepared[index] = self.__prepare_batch_entry(entry)
+            except Exception as e:
+                errors[index] = e
+
+        # price all the carts with one load of their stores, discounts and policies
+        indexes = list(prepared.keys())
+        prices = self.store_facade.price_carts([(prepared[index][1], prepared[index][0]) for index in indexes])
+        priced: Dict[int, Tuple[float, float, Dict[int, Tuple[List[PurchaseProductDTO], float, float]]]] = {}
+        for index, price in zip(indexes, prices):
+            if isinstance(price, Exception):
+                errors[index] = price
+            else:
+                priced[index] = price
+
+        # reserve the products, one transaction per group of stores
+        indexes = list(priced.keys())
+        reserved = self.store_facade.reserve_products_batch(
+            [(entries[index]['user_id'], prepared[index][0]) for index in indexes], self.__reservation_ttl())
+        for index, error in zip(indexes, reserved):
+            if error is not None:
+                errors[index] = error
+                priced.pop(index)
+
+        results = []
+        for index, entry in enumerate(entries):
+            result = {'index': index, 'user_id': entry.get('user_id') if isinstance(entry, dict) else None}
+            if index in priced:
+                try:
+                    cart, _, from_basket = prepared[index]
+                    result['purchase_id'] = self.__complete_batch_entry(entry, cart, from_basket, priced[index])
+                except Exception as e:
+                    errors[index] = e
+            result['success'] = index not in errors
+            if index in errors:
+                result['message'] = str(errors[index])
+            results.append(result)
+        logger.info(f"Batch checkout of {len(entries)} entries, {len(entries) - len(errors)} succeeded")
+        return results
+
+    def __prepare_batch_entry(self, entry: Dict) \
+            -> Tuple[Dict[int, Dict[int, int]], UserInformationForConstraintDTO, bool]:
+        user_id = entry['user_id']
+        if self.user_facade.suspended(user_id):
+            raise UserError("User is suspended", UserErrorTypes.user_suspended)
+        cart = entry.get('cart')
+        from_basket = cart is None
+        if from_basket:
+            cart = self.user_facade.get_shopping_cart(user_id)
+        cart = {store_id: {product_id: amount for product_id, amount in products.items() if amount > 0}
+                for store_id, products in cart.items()}
+        cart = {store_id: products for store_id, products in cart.items() if products}
+        if not cart:
+            raise StoreError("Cart is empty", StoreErrorTypes.cart_is_empty)
+        user_info = self.__checkout_user_info(user_id, entry['address'])
+        supply_details = entry['supply_details']
+        if "supply method" not in supply_details:
+            raise ThirdPartyHandlerError("Supply method not specified",
+                                         ThirdPartyHandlerErrorTypes.support_not_specified)
+        if supply_details.get("supply method") not in SupplyHandler().supply_config:
+            raise ThirdPartyHandlerError("Invalid supply method", ThirdPartyHandlerErrorTypes.invalid_supply_method)
+        if "payment method" not in entry['payment_details']:
+            raise ThirdPartyHandlerError("Payment method not specified",
+                                         ThirdPartyHandlerErrorTypes.payment_not_specified)
+        return cart, user_info, from_basket
+
+    def __complete_batch_entry(self, entry: Dict, cart: Dict[int, Dict[int, int]], from_basket: bool,
+                               price: Tuple[float, float, Dict[int, Tuple[List[PurchaseProductDTO], float, float]]]) \
+            -> int:
+        user_id = entry['user_id']
+        supply_details = dict(entry['supply_details'])
+        total_price, total_price_after_discounts, purchase_shopping_cart = price
+        purchase_accepted = False
+        basket_cleared = False
+        pur_id = -1
+        try:
+            pur_id = self.purchase_facade.create_immediate_purchase(user_id, total_price, total_price_after_discounts,
+                                                                    purchase_shopping_cart)
+            package_details = {'stores': cart.keys(), "supply method": supply_details["supply method"]}
+            delivery_date = SupplyHandler().get_delivery_time(package_details, entry['address'])
+            self.purchase_facade.accept_purchase(pur_id, delivery_date)
+            purchase_accepted = True
+            if from_basket:
+                self.user_facade.clear_basket(user_id)
+                basket_cleared = True
+        except Exception as e:
+            db.session.rollback()
+            if purchase_accepted:
+                self.purchase_facade.cancel_accepted_purchase(pur_id)
+            if basket_cleared:
+                self.user_facade.restore_basket(user_id, cart)
+            self.store_facade.release_reservations(user_id, cart)
+            commit_boundary()
+            raise e
+        commit_boundary()
+        self.__finalize_checkout(user_id, pur_id, cart, total_price_after_discounts, delivery_date,
+                                 entry['payment_details'], supply_details, restore_basket=from_basket)
+        return pur_id
+
+    def __on_checkout_job_finished(self, checkout_job: dict) -> None:
+        self.notifier.notify_checkout_status(checkout_job['user_id'], checkout_job)
 
-    def checkout(self, user_id: int, payment_details: Dict, supply_details: Dict, address: Dict) -> int:
-        products_removed = False
+    def __reserve_checkout(self, user_id: int, payment_details: Dict, supply_details: Dict, address: Dict,
+                           quote: Optional[str] = None) -> Tuple[int, Dict[int, Dict[int, int]], float, datetime]:
+        """
+        * Parameters: user_id, payment_details, supply_details, address, quote(default=None)
+        * This function runs the synchronous stage of the checkout: validation, pricing, creating and accepting the
+          purchase, removing the products from the stores and clearing the basket. The prices of a quote that still
+          matches the cart are used instead of pricing it again
+        * Returns: the purchase id, the cart, the total price after discounts and the delivery date
+        """
+        products_reserved = False
         purchase_accepted = False
         basket_cleared = False
         cart: Dict[int, Dict[int, int]] = {}  # store_id -> product_id -> amount
@@ -260,42 +473,35 @@ class MarketFacade:
             if not cart:
                 raise StoreError("Cart is empty", StoreErrorTypes.cart_is_empty)
 
-            user_dto = self.user_facade.get_userDTO(user_id)
-            birthdate = None
-            if user_dto.day is not None and user_dto.month is not None and user_dto.year is not None:
-                birthdate = date(user_dto.year, user_dto.month, user_dto.day)
-            user_purchase_dto = PurchaseUserDTO(user_dto.user_id, birthdate)
-
-            if 'address' not in address or 'city' not in address or 'state' not in address or 'country' not in address or 'zip_code' not in address:
-                raise ThirdPartyHandlerError("Address information is missing",
-                                             ThirdPartyHandlerErrorTypes.missing_address)
-            address_of_user_for_discount: AddressDTO = AddressDTO(address['address'],
-                                                                  address['city'], address['state'],
-                                                                  address['country'], address['zip_code'])
-
-            user_info_for_constraint_dto = UserInformationForConstraintDTO(user_id, user_purchase_dto.birthdate,
-                                                                           address_of_user_for_discount)
+            # reserve the products before any pricing work, so buyers that lose the race fail fast
+            self.store_facade.reserve_products(user_id, cart, self.__reservation_ttl())
+            products_reserved = True
+
+            user_info_for_constraint_dto = self.__checkout_user_info(user_id, address)
             # calculate the total price
             if not self.store_facade.validate_purchase_policies(cart, user_info_for_constraint_dto):
                 raise StoreError("Purchase policies are not met", StoreErrorTypes.policy_not_satisfied)
 
-            total_price = self.store_facade.get_total_price_before_discount(cart)
+            quoted = None
+            if quote is not None:
+                quoted = self.price_quotes.redeem(quote, user_id, user_info_for_constraint_dto, cart,
+                                                  self.store_facade.get_pricing_versions(list(cart.keys())),
+                                                  self.store_facade.category_version)
+            if quoted is not None:
+                total_price, total_price_after_discounts, purchase_shopping_cart = quoted
+            else:
+                total_price = self.store_facade.get_total_price_before_discount(cart)
 
-            total_price_after_discounts = self.store_facade.get_total_price_after_discount(cart,
-                                                                                           user_info_for_constraint_dto)
+                total_price_after_discounts = self.store_facade.get_total_price_after_discount(
+                    cart, user_info_for_constraint_dto)
 
-            # purchase facade immediate
-            purchase_shopping_cart: Dict[int, Tuple[List[PurchaseProductDTO], float, float]] = (
-                self.store_facade.get_purchase_shopping_cart(user_info_for_constraint_dto, cart))
+                # purchase facade immediate
+                purchase_shopping_cart: Dict[int, Tuple[List[PurchaseProductDTO], float, float]] = (
+                    self.store_facade.get_purchase_shopping_cart(user_info_for_constraint_dto, cart))
 
             pur_id = self.purchase_facade.create_immediate_purchase(user_id, total_price, total_price_after_discounts,
                                                                     purchase_shopping_cart)
 
-            # remove the products from the store
-            self.store_facade.check_and_remove_shopping_cart(cart)
-
-            products_removed = True
-
             # find the delivery date
             if "supply method" not in supply_details:
                 raise ThirdPartyHandlerError("Supply method not specified",
@@ -319,6 +525,32 @@ class MarketFacade:
                 raise ThirdPartyHandlerError("Payment method not specified",
                                              ThirdPartyHandlerErrorTypes.payment_not_specified)
 
+            # the accepted purchase is committed before the third parties are called
+            commit_boundary()
+            return pur_id, cart, total_price_after_discounts, delivery_date
+        except Exception as e:
+            db.session.rollback()
+            # WHEN EVERYTHING IN DB WORKS, SIMPLY ROLLBACK
+            if purchase_accepted:
+                self.purchase_facade.cancel_accepted_purchase(pur_id)
+            if basket_cleared:
+                self.user_facade.restore_basket(user_id, cart)
+            if products_reserved:
+                self.store_facade.release_reservations(user_id, cart)
+            commit_boundary()
+            raise e
+
+    def __finalize_checkout(self, user_id: int, pur_id: int, cart: Dict[int, Dict[int, int]],
+                            total_price_after_discounts: float, delivery_date: datetime, payment_details: Dict,
+                            supply_details: Dict, restore_basket: bool = True) -> None:
+        """
+        * Parameters: user_id, pur_id, cart, total_price_after_discounts, delivery_date, payment_details,
+          supply_details, restore_basket
+        * This function runs the payment, supply and notification stage of a reserved checkout,
+          on failure the purchase is cancelled and, if restore_basket is set, the basket is restored
+        * Returns: none
+        """
+        try:
             payment_id = PaymentHandler().process_payment(total_price_after_discounts, payment_details)
 
             if payment_id == -1:
@@ -339,28 +571,273 @@ class MarketFacade:
             for store_id in cart.keys():
                 self.notifier.notify_new_purchase(store_id, pur_id)
 
-            logger.info(f"User {user_id} has checked out")
-            return pur_id
+            self.store_facade.commit_reservations(user_id, cart, pur_id)
+            commit_boundary()
         except Exception as e:
             db.session.rollback()
             # WHEN EVERYTHING IN DB WORKS, SIMPLY ROLLBACK
-            if purchase_accepted:
-                self.purchase_facade.cancel_accepted_purchase(pur_id)
-            if basket_cleared:
-                self.user_facade.restore_basket(user_id, cart)
-            # check if payment_id is defined
+            # the third party cancellations are committed to the outbox together with the purchase cancellation
             if "payment_id" in locals() and payment_id != -1:
-                PaymentHandler().process_payment_cancel(payment_details, payment_id)
+                self.__enqueue_payment_cancel(payment_details, payment_id)
             if "supply_id" in locals() and supply_id != -1:
-                SupplyHandler().process_supply_cancel(supply_details, supply_id)
+                self.__enqueue_supply_cancel(supply_details, supply_id)
+            self.purchase_facade.cancel_accepted_purchase(pur_id)
+            if restore_basket:
+                self.user_facade.restore_basket(user_id, cart)
+            self.store_facade.release_reservations(user_id, cart)
+            commit_boundary()
+            self.outbox.wake()
             raise e
 
+    def __checkout_user_info(self, user_id: int, address: Dict) -> UserInformationForConstraintDTO:
+        user_dto = self.user_facade.get_userDTO(user_id)
+        birthdate = None
+        if user_dto.day is not None and user_dto.month is not None and user_dto.year is not None:
+            birthdate = date(user_dto.year, user_dto.month, user_dto.day)
+        user_purchase_dto = PurchaseUserDTO(user_dto.user_id, birthdate)
+
+        if 'address' not in address or 'city' not in address or 'state' not in address or 'country' not in address or 'zip_code' not in address:
+            raise ThirdPartyHandlerError("Address information is missing",
+                                         ThirdPartyHandlerErrorTypes.missing_address)
+        address_of_user_for_discount: AddressDTO = AddressDTO(address['address'],
+                                                              address['city'], address['state'],
+                                                              address['country'], address['zip_code'])
+
+        return UserInformationForConstraintDTO(user_id, user_purchase_dto.birthdate, address_of_user_for_discount)
+
+    # -------------Outbox related methods-------------------#
+    def __register_outbox_handlers(self) -> None:
+        # the card details are stored encrypted and only while the payment stage is pending
+        self.outbox.register_handler('checkout_payment', self.__outbox_checkout_payment,
+                                     self.__outbox_checkout_payment_given_up, sensitive_fields=('payment_details',))
+        self.outbox.register_handler('checkout_supply', self.__outbox_checkout_supply,
+                                     self.__outbox_checkout_supply_given_up)
+        self.outbox.register_handler('checkout_complete', self.__outbox_checkout_complete)
+        self.outbox.register_handler('checkout_compensate', self.__outbox_checkout_compensate)
+        self.outbox.register_handler('notify_new_purchase', self.__outbox_notify_new_purchase)
+        self.outbox.register_handler('payment_cancel', self.__outbox_payment_cancel)
+        self.outbox.register_handler('supply_cancel', self.__outbox_supply_cancel)
+
+    def __enqueue_payment_cancel(self, payment_details: Dict, payment_id: int) -> None:
+        # a cancellation needs the payment method only, the card details are not persisted
+        self.outbox.enqueue('payment_cancel', {'payment_method': payment_details.get("payment method"),
+                                               'payment_id': payment_id})
+
+    def __enqueue_supply_cancel(self, supply_details: Dict, supply_id: int) -> None:
+        supply_details = dict(supply_details)
+        if isinstance(supply_details.get("arrival time"), datetime):
+            supply_details["arrival time"] = supply_details["arrival time"].isoformat()
+        self.outbox.enqueue('supply_cancel', {'supply_details': supply_details, 'supply_id': supply_id})
+
+    @staticmethod
+    def __is_retryable_third_party_error(error: ThirdPartyHandlerError) -> bool:
+        # a failed handshake means the external service could not be reached, any other error is final
+        return error.third_party_handler_error_type == ThirdPartyHandlerErrorTypes.handshake_failed
+
+    @staticmethod
+    def __stage_payload(payload: Dict, **fields) -> Dict:
+        # the stages after the payment keep only the payment method, which is enough to cancel the payment
+        return {key: value for key, value in payload.items() if key != 'payment_details'} | fields
+
+    def __checkout_compensation(self, payload: Dict, reason: str) -> Tuple[str, Dict, str]:
+        return ('checkout_compensate', self.__stage_payload(payload, reason=reason),
+                f"checkout_compensate:{payload['job_id']}")
+
+    @staticmethod
+    def __payment_cancellation(payload: Dict, payment_id: int) -> Tuple[str, Dict, str]:
+        return ('payment_cancel', {'payment_method': payload['payment_method'], 'payment_id': payment_id},
+                f"payment_cancel:{payload['job_id']}")
+
+    def __outbox_checkout_payment(self, payload: Dict) -> List[Tuple[str, Dict, str]]:
+        job_id = payload['job_id']
+        if self.checkout_jobs.is_finished(job_id):
+            return []
+        self.checkout_jobs.mark_processing(job_id)
+        try:
+            # the job may outlive the reservation time to live, the stock is kept while the job is alive
+            self.store_facade.extend_reservations(payload['user_id'], self.__payload_cart(payload),
+                                                  self.__reservation_ttl())
+        except StoreError as e:
+            return self.__outbox_checkout_payment_given_up(payload, str(e))
+        # a payment that was recorded by an earlier attempt of this message is not sent again
+        payment_id = self.checkout_jobs.get_payment_id(job_id)
+        if payment_id is None:
+            if not self.checkout_jobs.begin_payment(job_id):
+                # an earlier attempt reached the provider and stopped before recording the outcome, paying again
+                # could charge the user twice
+                logger.error(f"Checkout job {job_id} was interrupted during its payment, the outcome is unknown")
+                return [self.__checkout_compensation(payload, "Payment outcome unknown")]
+            try:
+                payment_id = PaymentHandler().process_payment(payload['total_price'],
+                                                              dict(payload['payment_details']))
+            except ThirdPartyHandlerError as e:
+                if self.__is_retryable_third_party_error(e):
+                    # the handshake failed before the payment was sent
+                    self.checkout_jobs.record_payment(job_id, None)
+                    raise e
+                return [self.__checkout_compensation(payload, str(e))]
+            self.checkout_jobs.record_payment(job_id, payment_id)
+        if payment_id == -1:
+            return [self.__checkout_compensation(payload, "Payment failed")]
+        return [('checkout_supply', self.__stage_payload(payload, payment_id=payment_id), f'checkout_supply:{job_id}')]
+
+    def __outbox_checkout_payment_given_up(self, payload: Dict, error: str) -> List[Tuple[str, Dict, str]]:
+        follow_ups = [self.__checkout_compensation(payload, error)]
+        payment_id = self.checkout_jobs.get_payment_id(payload['job_id'])
+        if payment_id is not None and payment_id != -1:
+            follow_ups.insert(0, self.__payment_cancellation(self.__stage_payload(payload), payment_id))
+        return follow_ups
+
+    def __outbox_checkout_supply(self, payload: Dict) -> List[Tuple[str, Dict, Optional[str]]]:
+        job_id = payload['job_id']
+        pur_id = payload['purchase_id']
+        if self.checkout_jobs.is_finished(job_id):
+            return []
+        try:
+            self.store_facade.extend_reservations(payload['user_id'], self.__payload_cart(payload),
+                                                  self.__reservation_ttl())
+        except StoreError as e:
+            return self.__outbox_checkout_supply_given_up(payload, str(e))
+        supply_details = dict(payload['supply_details'])
+        supply_details["arrival time"] = datetime.fromisoformat(payload['delivery_date'])
+        supply_details["purchase id"] = pur_id
+        on_arrival = lambda purchase_id: self.on_arrival_lambda(purchase_id)
+        try:
+            supply_id = SupplyHandler().process_supply(supply_details, payload['user_id'], on_arrival)
+        except ThirdPartyHandlerError as e:
+            if self.__is_retryable_third_party_error(e):
+                raise e
+            return self.__outbox_checkout_supply_given_up(payload, str(e))
+        if supply_id == -1:
+            return self.__outbox_checkout_supply_given_up(payload, "Supply failed")
+        follow_ups = [('notify_new_purchase', {'store_id': int(store_id), 'purchase_id': pur_id},
+                       f'notify_new_purchase:{pur_id}:{store_id}') for store_id in payload['cart']]
+        follow_ups.append(('checkout_complete', payload | {'supply_id': supply_id}, f'checkout_complete:{job_id}'))
+        return follow_ups
+
+    def __outbox_checkout_supply_given_up(self, payload: Dict, error: str) -> List[Tuple[str, Dict, Optional[str]]]:
+        return [self.__payment_cancellation(payload, payload['payment_id']),
+                self.__checkout_compensation(payload, error)]
+
+    @staticmethod
+    def __payload_cart(payload: Dict) -> Dict[int, Dict[int, int]]:
+        return {int(store_id): {int(product_id): amount for product_id, amount in products.items()}
+                for store_id, products in payload['cart'].items()}
+
+    def __outbox_checkout_complete(self, payload: Dict) -> List[Tuple[str, Dict, str]]:
+        job_id = payload['job_id']
+        if not self.checkout_jobs.is_finished(job_id):
+            try:
+                self.store_facade.commit_reservations(payload['user_id'], self.__payload_cart(payload),
+                                                      payload['purchase_id'])
+            except StoreError as e:
+                # the stock of the purchase was returned to the store, the purchase can not be delivered
+                db.session.rollback()
+                logger.error(f"Checkout job {job_id} lost its reservations: {e}")
+                supply_details = dict(payload['supply_details'])
+                supply_details["arrival time"] = payload['delivery_date']
+                supply_details["purchase id"] = payload['purchase_id']
+                return [self.__payment_cancellation(payload, payload['payment_id']),
+                        ('supply_cancel', {'supply_details': supply_details, 'supply_id': payload['supply_id']},
+                         f'supply_cancel:{job_id}'),
+                        self.__checkout_compensation(payload, str(e))]
+            self.checkout_jobs.finish_job(job_id, CheckoutJobStatus.completed)
+        logger.info(f"User {payload['user_id']} has checked out")
+        return []
+
+    def __outbox_checkout_compensate(self, payload: Dict) -> None:
+        if self.checkout_jobs.is_finished(payload['job_id']):
+            return
+        try:
+            self.purchase_facade.cancel_accepted_purchase(payload['purchase_id'])
+        except PurchaseError as e:
+            logger.warning(f"Purchase {payload['purchase_id']} was already cancelled: {e}")
+        cart = self.__payload_cart(payload)
+        self.user_facade.restore_basket(payload['user_id'], cart)
+        self.store_facade.release_reservations(payload['user_id'], cart)
+        self.checkout_jobs.finish_job(payload['job_id'], CheckoutJobStatus.failed, payload['reason'])
+
+    def __outbox_notify_new_purchase(self, payload: Dict) -> None:
+        try:
+            self.notifier.notify_new_purchase(payload['store_id'], payload['purchase_id'])
+        except StoreError as e:
+            # a store without listeners has no one to notify, retrying will not help
+            logger.warning(f"Could not notify store {payload['store_id']} on purchase {payload['purchase_id']}: {e}")
+
+    def __outbox_payment_cancel(self, payload: Dict) -> None:
+        PaymentHandler().process_payment_cancel({"payment method": payload['payment_method']}, payload['payment_id'])
+
+    def __outbox_supply_cancel(self, payload: Dict) -> None:
+        supply_details = dict(payload['supply_details'])
+        supply_details["arrival time"] = datetime.fromisoformat(supply_details["arrival time"])
+        SupplyHandler().process_supply_cancel(supply_details, payload['supply_id'])
+
     def on_arrival_lambda(self, purchase_id: int):
 
         from backend.app_factory import get_app
         with get_app().app_context():
             self.purchase_facade.complete_purchase(purchase_id)
 
+    def on_arrivals_lambda(self, purchase_ids: List[int]):
+        # called by the delivery scheduler inside an app context, the purchases are completed in one transaction that
+        # the scheduler commits together with the removal of their deliveries
+        token = begin_unit_of_work()
+        try:
+            for purchase_id in purchase_ids:
+                try:
+                    with db.session.begin_nested():
+                        self.purchase_facade.complete_purchase(purchase_id)
+                except PurchaseError as e:
+                    logger.warning(f"[MarketFacade] delivery of purchase {purchase_id} arrived but the purchase "
+                                   f"could not be completed: {e}")
+        finally:
+            end_unit_of_work(token)
+
+    def complete_delivered_purchases(self) -> int:
+        """
+        * Parameters: none
+        * This function completes all the accepted purchases whose delivery date has passed, in batches of
+          PURCHASE_COMPLETION_BATCH_SIZE, and sends the owners of every store one notification per batch
+        * Returns: the number of purchases that were completed
+        """
+        batch_size = current_app.config.get('PURCHASE_COMPLETION_BATCH_SIZE', 1000)
+        total = 0
+        while True:
+            completed = self.purchase_facade.complete_delivered_purchases(batch_size=batch_size)
+            purchase_ids = {purchase_id for store_purchases in completed.values() for purchase_id in store_purchases}
+            self.delivery_scheduler.discard(list(purchase_ids))
+            for store_id, store_purchases in completed.items():
+                try:
+                    self.notifier.notify_purchases_completed(store_id, store_purchases)
+                except StoreError as e:
+                    logger.warning(f"[MarketFacade] could not notify store {store_id} of delivered purchases: {e}")
+            total += len(purchase_ids)
+            if len(purchase_ids) < batch_size:
+                return total
+
+    def start_completion_sweeper(self, app, interval_seconds: float) -> None:
+        """
+        * Parameters: app, interval_seconds
+        * This function starts a background thread that completes the delivered purchases every interval_seconds
+        * Returns: none
+        """
+        if getattr(self, '_completion_sweeper', None) is not None:
+            return
+
+        def sweep():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    with app.app_context():
+                        completed = self.complete_delivered_purchases()
+                    if completed:
+                        logger.info(f"[MarketFacade] completion sweeper completed {completed} delivered purchases")
+                except Exception as e:
+                    logger.error(f"[MarketFacade] completion sweeper failed: {e}")
+
+        self._completion_sweeper = threading.Thread(target=sweep, name='completion-sweeper', daemon=True)
+        self._completion_sweeper.start()
+
     def get_stores(self, page: int, limit: int) -> Dict[int, StoreDTO]:
         return self.store_facade.get_stores(page, limit)
 
@@ -370,42 +847,62 @@ class MarketFacade:
         return self.store_facade.get_all_stores()
 
     def nominate_store_owner(self, store_id: int, owner_id: int, new_owner_username):
+        self.nominate_store_owners(store_id, owner_id, [new_owner_username])
+
+    def nominate_store_owners(self, store_id: int, owner_id: int, new_owner_usernames: List[str]) -> Dict[str, int]:
+        """
+        * Parameters: store_id, owner_id, new_owner_usernames
+        * This function nominates the users to be owners of the store. The usernames are resolved at once, so an
+          unknown username fails before anyone is nominated
+        * Returns: username -> nomination id
+        """
         if self.user_facade.suspended(owner_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
 
-        # get user_id of new_owner_username
-        new_owner_id = self.user_facade.get_user_id_from_username(new_owner_username)
-
-        # nominate the new owner
-        nomination_id = self.roles_facade.nominate_owner(store_id, owner_id, new_owner_id)
+        nominations: Dict[str, int] = {}
+        for username, new_owner_id in self.user_facade.get_user_ids_from_usernames(new_owner_usernames).items():
+            # nominate the new owner
+            nomination_id = self.roles_facade.nominate_owner(store_id, owner_id, new_owner_id)
 
-        # send notification to the new owner
-        notification = NotificationDTO(-1, f"You have been nominated to be the owner of store"
-                                           f" {store_id}. nomination id: {nomination_id} ",
-                                       datetime.now())
+            # send notification to the new owner
+            notification = NotificationDTO(-1, f"You have been nominated to be the owner of store"
+                                               f" {store_id}. nomination id: {nomination_id} ",
+                                           datetime.now())
 
-        self.notifier.notify_general_message(new_owner_id, notification.get_message())
+            self.notifier.notify_general_message(new_owner_id, notification.get_message())
+            nominations[username] = nomination_id
 
-        logger.info(f"User {owner_id} has nominated user {new_owner_id} to be the owner of store {store_id}")
+            logger.info(f"User {owner_id} has nominated user {new_owner_id} to be the owner of store {store_id}")
+        return nominations
 
     def nominate_store_manager(self, store_id: int, owner_id: int, new_manager_username):
+        self.nominate_store_managers(store_id, owner_id, [new_manager_username])
+
+    def nominate_store_managers(self, store_id: int, owner_id: int,
+                                new_manager_usernames: List[str]) -> Dict[str, int]:
+        """
+        * Parameters: store_id, owner_id, new_manager_usernames
+        * This function nominates the users to be managers of the store. The usernames are resolved at once, so an
+          unknown username fails before anyone is nominated
+        * Returns: username -> nomination id
+        """
         if self.user_facade.suspended(owner_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
 
-        # get user_id of new_manager_username
-        new_manager_id = self.user_facade.get_user_id_from_username(new_manager_username)
-
-        # nominate the new manager
-        nomination_id = self.roles_facade.nominate_manager(store_id, owner_id, new_manager_id)
+        nominations: Dict[str, int] = {}
+        for username, new_manager_id in self.user_facade.get_user_ids_from_usernames(new_manager_usernames).items():
+            # nominate the new manager
+            nomination_id = self.roles_facade.nominate_manager(store_id, owner_id, new_manager_id)
 
-        # send notification to the new manager
-        notification = NotificationDTO(-1, f"You have been nominated to be the manager of store"
-                                           f" {store_id}. nomination id: {nomination_id} ",
-                                       datetime.now())
-        self.notifier.notify_general_message(new_manager_id, notification.get_message())
-        # logger.info("\n\naaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n\naaaaaaaaaaaaaaaaaaaaaaaa\n\naaaaaaaaaaaaaaaaaaaaaaaa\n\n")
+            # send notification to the new manager
+            notification = NotificationDTO(-1, f"You have been nominated to be the manager of store"
+                                               f" {store_id}. nomination id: {nomination_id} ",
+                                           datetime.now())
+            self.notifier.notify_general_message(new_manager_id, notification.get_message())
+            nominations[username] = nomination_id
 
-        logger.info(f"User {owner_id} has nominated user {new_manager_id} to be the manager of store {store_id}")
+            logger.info(f"User {owner_id} has nominated user {new_manager_id} to be the manager of store {store_id}")
+        return nominations
 
     def accept_nomination(self, user_id: int, nomination_id: int, accept: bool):
         if accept:
@@ -520,7 +1017,7 @@ class MarketFacade:
         try:
             PaymentHandler().add_payment_method(method_name, payment_config)
             logger.info(f"User {user_id} has added payment method {method_name}")
-            db.session.commit()
+            commit()
         except Exception as e:
             db.session.rollback()
             raise e
@@ -534,7 +1031,7 @@ class MarketFacade:
         try:
             PaymentHandler().edit_payment_method(method_name, editing_data)
             logger.info(f"User {user_id} has edited payment method {method_name}")
-            db.session.commit()
+            commit()
         except Exception as e:
             db.session.rollback()
             raise e
@@ -548,7 +1045,7 @@ class MarketFacade:
         try:
             PaymentHandler().remove_payment_method(method_name)
             logger.info(f"User {user_id} has removed payment method {method_name}")
-            db.session.commit()
+            commit()
         except Exception as e:
             db.session.rollback()
             raise e
@@ -562,7 +1059,7 @@ class MarketFacade:
         try:
             SupplyHandler().add_supply_method(method_name, supply_config)
             logger.info(f"User {user_id} has added supply method {method_name}")
-            db.session.commit()
+            commit()
         except Exception as e:
             db.session.rollback()
             raise e
@@ -576,7 +1073,7 @@ class MarketFacade:
         try:
             SupplyHandler().edit_supply_method(method_name, editing_data)
             logger.info(f"User {user_id} has edited supply method {method_name}")
-            db.session.commit()
+            commit()
         except Exception as e:
             db.session.rollback()
             raise e
@@ -590,7 +1087,7 @@ class MarketFacade:
         try:
             SupplyHandler().remove_supply_method(method_name)
             logger.info(f"User {user_id} has removed supply method {method_name}")
-            db.session.commit()
+            commit()
         except Exception as e:
             db.session.rollback()
             raise e
@@ -903,7 +1400,7 @@ class MarketFacade:
                 raise UserError("User does not have the necessary permissions to add a product to the store", UserErrorTypes.user_does_not_have_necessary_permissions)
             logger.info(f"User {user_id} has permissions to add a product to store {store_id}")
             res =  self.store_facade.add_product_to_store(store_id, product_name, description, price, weight, tags, amount)
-            db.session.commit()
+            commit()
             return res
         except Exception as e:
             db.session.rollback()
@@ -921,7 +1418,7 @@ class MarketFacade:
             raise UserError("User does not have the necessary permissions to remove a product from the store",
                             UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.remove_product_from_store(store_id, product_id)
-        db.session.commit()
+        commit()
 
     def add_product_amount(self, user_id: int, store_id: int, product_id: int, amount: int):
         """
@@ -935,7 +1432,7 @@ class MarketFacade:
             raise UserError("User does not have the necessary permissions to add an amount of a product to the store",
                             UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.add_product_amount(store_id, product_id, amount)
-        db.session.commit()
+        commit()
 
     def remove_product_amount(self, user_id: int, store_id: int, product_id: int, amount: int):
         """
@@ -949,7 +1446,7 @@ class MarketFacade:
             raise UserError("User does not have the necessary permissions to remove an amount of a product from the "
                             "store", UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.remove_product_amount(store_id, product_id, amount)
-        db.session.commit()
+        commit()
 
     # -------------Store related methods-------------------#
     def add_store(self, founder_id: int, address: str, city: str, state: str, country: str, zip_code: str,
@@ -969,7 +1466,7 @@ class MarketFacade:
         address_of_store: AddressDTO = AddressDTO(address, city, state, country, zip_code)
         store_id = self.store_facade.add_store(address_of_store, store_name, founder_id)
         self.roles_facade.add_store(store_id, founder_id)
-        db.session.commit()
+        commit()
         # Notifier().sign_listener(founder_id, store_id) -- already happened inside roles.add_store()
 
         return store_id
@@ -984,7 +1481,7 @@ class MarketFacade:
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
         self.store_facade.close_store(store_id, user_id)
         self.notifier.notify_update_store_status(store_id, True)
-        db.session.commit()
+        commit()
 
     def open_store(self, user_id: int, store_id: int):
         """
@@ -996,7 +1493,7 @@ class MarketFacade:
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
         self.store_facade.open_store(store_id, user_id)
         self.notifier.notify_update_store_status(store_id, False)
-        db.session.commit()
+        commit()
 
     def get_employees_info(self, user_id: int, store_id: int) -> Dict[int, str]:
         """
@@ -1023,7 +1520,7 @@ class MarketFacade:
             raise UserError("User does not have the necessary permissions to add a tag to a product in the store",
                             UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.add_tag_to_product(store_id, product_id, tag)
-        db.session.commit()
+        commit()
 
     def remove_tag_from_product(self, user_id: int, store_id: int, product_id: int, tag: str):
         """
@@ -1037,7 +1534,7 @@ class MarketFacade:
             raise UserError("User does not have the necessary permissions to remove a tag to a product in the store",
                             UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.remove_tag_from_product(store_id, product_id, tag)
-        db.session.commit()
+        commit()
 
     # -------------Product related methods-------------------#
     def change_product_price(self, user_id: int, store_id: int, product_id: int, new_price: float):
@@ -1053,7 +1550,7 @@ class MarketFacade:
                 "User does not have the necessary permissions to change the price of a product in the store",
                 UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.change_price_of_product(store_id, product_id, new_price)
-        db.session.commit()
+        commit()
 
     def change_product_description(self, user_id: int, store_id: int, product_id: int, description: str):
         """
@@ -1068,7 +1565,7 @@ class MarketFacade:
                 "User does not have the necessary permissions to change the price of a product in the store",
                 UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.change_description_of_product(store_id, product_id, description)
-        db.session.commit()
+        commit()
 
     def change_product_weight(self, user_id: int, store_id: int, product_id: int, weight: float):
         """
@@ -1081,7 +1578,7 @@ class MarketFacade:
                 "User does not have the necessary permissions to change the price of a product in the store",
                 UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.change_weight_of_product(store_id, product_id, weight)
-        db.session.commit()
+        commit()
 
     # -------------Category related methods-------------------#
     def add_category(self, user_id: int, category_name: str) -> int:
@@ -1178,21 +1675,7 @@ class MarketFacade:
 
             cart: Dict[int, Dict[int, int]] = {bid.store_id: {bid.product_id: 1}}
 
-            user_dto = self.user_facade.get_userDTO(user_id)
-            birthdate = None
-            if user_dto.day is not None and user_dto.month is not None and user_dto.year is not None:
-                birthdate = date(user_dto.year, user_dto.month, user_dto.day)
-            user_purchase_dto = PurchaseUserDTO(user_dto.user_id, birthdate)
-
-            if 'address' not in address or 'city' not in address or 'state' not in address or 'country' not in address or 'zip_code' not in address:
-                raise ThirdPartyHandlerError("Address information is missing",
-                                             ThirdPartyHandlerErrorTypes.missing_address)
-            address_of_user_for_discount: AddressDTO = AddressDTO(address['address'],
-                                                                  address['city'], address['state'],
-                                                                  address['country'], address['zip_code'])
-
-            user_info_for_constraint_dto = UserInformationForConstraintDTO(user_id, user_purchase_dto.birthdate,
-                                                                           address_of_user_for_discount)
+            user_info_for_constraint_dto = self.__checkout_user_info(user_id, address)
             # calculate the total price
             if not self.store_facade.validate_purchase_policies(cart, user_info_for_constraint_dto):
                 raise StoreError("Purchase policies are not met", StoreErrorTypes.policy_not_satisfied)
@@ -1252,6 +1735,7 @@ class MarketFacade:
             # notify the store owners
             for store_id in cart.keys():
                 self.notifier.notify_new_purchase(store_id, bid_id)
+            commit_boundary()
 
             logger.info(f"User {user_id} has checked out")
             return bid_id
@@ -1261,13 +1745,15 @@ class MarketFacade:
                     for product_id in products:
                         amount = products[product_id]
                         self.add_product_amount(user_id, store_id, product_id, amount)
-            if purchase_accepted:
-                self.purchase_facade.cancel_accepted_purchase(bid_id)
             # check if payment_id is defined
             if "payment_id" in locals() and payment_id != -1:
-                PaymentHandler().process_payment_cancel(payment_details, payment_id)
+                self.__enqueue_payment_cancel(payment_details, payment_id)
             if "supply_id" in locals() and supply_id != -1:
-                SupplyHandler().process_supply_cancel(supply_details, supply_id)
+                self.__enqueue_supply_cancel(supply_details, supply_id)
+            if purchase_accepted:
+                self.purchase_facade.cancel_accepted_purchase(bid_id)
+            commit_boundary()
+            self.outbox.wake()
             raise e
     
     def user_bid_offer(self, user_id: int, proposed_price: float, store_id: int, product_id: int) -> int:
@@ -1278,8 +1764,9 @@ class MarketFacade:
         """
         if self.user_facade.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
-        pur_id = self.purchase_facade.create_bid_purchase(user_id, proposed_price, store_id, product_id)
         users_to_notify = self.roles_facade.get_bid_owners_managers(store_id)
+        pur_id = self.purchase_facade.create_bid_purchase(user_id, proposed_price, store_id, product_id,
+                                                          len(users_to_notify))
         self.notifier.notify_new_bid(store_id, user_id, users_to_notify, pur_id)
         logger.info(f"User {user_id} has created a bid purchase with id {pur_id}")
         return pur_id
@@ -1423,21 +1910,27 @@ class MarketFacade:
             raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
         return self.purchase_facade.get_bid_purchases_of_user(user_id)
         
-    def view_user_bids(self, user_id:int) -> dict:
+    def view_user_bids(self, user_id: int, status: Optional[str] = None, cursor: Optional[int] = None,
+                       limit: Optional[int] = None) -> dict:
         """
-        Parameters: userId
-        This function views the bids of a user
-        Returns a list of bids
+        Parameters: userId, status (name of a purchase status), cursor - the next_cursor of the previous page,
+        limit - page size
+        This function views a page of the bids of a user, newest first
+        Returns a dict with the bids and the next_cursor (None on the last page)
         """
         if self.user_facade.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
-        return self.purchase_facade.view_user_bids(user_id)
-    
-    def show_store_bids(self, user_id: int, store_id: int) -> dict:
+        bids, next_cursor = self.purchase_facade.list_bids(user_id=user_id, status=self.__purchase_status(status),
+                                                           cursor=cursor, limit=limit)
+        return {'bids': bids, 'next_cursor': next_cursor}
+
+    def show_store_bids(self, user_id: int, store_id: int, status: Optional[str] = None, cursor: Optional[int] = None,
+                        limit: Optional[int] = None) -> dict:
         """
-        Parameters: userId, storeId
-        This function shows the bids of a store
-        Returns a list of bids
+        Parameters: userId, storeId, status (name of a purchase status), cursor - the next_cursor of the previous
+        page, limit - page size
+        This function shows a page of the bids of a store, newest first
+        Returns a dict with the bids and the next_cursor (None on the last page)
         """
         if self.user_facade.suspended(user_id):
             logger.info(f"User {user_id} is suspended")
@@ -1445,20 +1938,26 @@ class MarketFacade:
         if not self.roles_facade.has_get_bid_permission(store_id, user_id):
             logger.info(f'User {user_id} does not have the necessary permissions to get the bids of the store')
             raise UserError("User does not have the necessary permissions to get the bids of the store", UserErrorTypes.user_does_not_have_necessary_permissions)
-        return self.purchase_facade.get_bid_purchases_of_store(store_id)
-    
-    def view_all_bids_of_system(self, user_id: int) -> dict:
+        bids, next_cursor = self.purchase_facade.list_bids(store_id=store_id, status=self.__purchase_status(status),
+                                                           cursor=cursor, limit=limit)
+        return {'bids': bids, 'next_cursor': next_cursor}
+
+    def view_all_bids_of_system(self, user_id: int, status: Optional[str] = None, cursor: Optional[int] = None,
+                                limit: Optional[int] = None) -> dict:
         """
-        Parameters: userId
-        This function views all the bids of the system
-        Returns a list of bids
+        Parameters: userId, status (name of a purchase status), cursor - the next_cursor of the previous page,
+        limit - page size
+        This function views a page of all the bids of the system, newest first
+        Returns a dict with the bids and the next_cursor (None on the last page)
         """
         if self.user_facade.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
         if not self.roles_facade.is_system_manager(user_id):
             raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
-        return self.purchase_facade.view_all_bids_of_system()
-    
+        bids, next_cursor = self.purchase_facade.list_bids(status=self.__purchase_status(status), cursor=cursor,
+                                                           limit=limit)
+        return {'bids': bids, 'next_cursor': next_cursor}
+
     def has_store_worker_accepted_bid(self, user_id:int, store_id:int, bid_id:int) -> int:
         """
         Parameters: userId, storeId, bidId
@@ -1526,29 +2025,100 @@ class MarketFacade:
         else:
             logger.info(f"User {user_id} has failed to create a lottery purchase")'''
 
-    def view_purchases_of_user(self, user_id: int, requested_id: int, store_id: Optional[int] = None) -> List[
-        PurchaseDTO]:
-        """
-        * Parameters: user_id
-        * This function returns the purchases of a user
-        * Returns a string
+    @staticmethod
+    def __purchase_status(status: Optional[str]) -> Optional[PurchaseStatus]:
+        if status is None:
+            return None
+        if status not in PurchaseStatus.__members__:
+            raise PurchaseError("Purchase status is invalid", PurchaseErrorTypes.invalid_purchase_status)
+        return PurchaseStatus[status]
+
+    def view_purchases_of_user(self, user_id: int, requested_id: int, store_id: Optional[int] = None,
+                               start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                               status: Optional[str] = None, cursor: Optional[str] = None,
+                               limit: Optional[int] = None, summary: bool = False) -> Dict:
+        """
+        * Parameters: user_id, requested_id, store_id, start_date (inclusive), end_date (exclusive), status (name of a
+          purchase status), cursor - the next_cursor of the previous page, limit - page size, summary
+        * This function returns a page of the purchases of a user, newest first, or only their totals if summary is
+          True
+        * Returns a dict with the purchases and the next_cursor (None on the last page), or the summary
         """
         if not self.roles_facade.is_system_manager(user_id) and (user_id != requested_id):
             raise UserError("User is not a system manager so can't view history of other users",
                             UserErrorTypes.user_not_system_manager)
-        return self.purchase_facade.get_purchases_of_user(requested_id, store_id)
-
-    def view_purchases_of_store(self, user_id: int, store_id: int) -> List[PurchaseDTO]:
-        """
-        * Parameters: userId, store_id
-        * This function returns the purchases of a store
-        * Returns a string
+        purchase_status = self.__purchase_status(status)
+        if summary:
+            return self.purchase_facade.get_purchase_summary_of_user(requested_id, store_id, start_date, end_date,
+                                                                    purchase_status)
+        purchases, next_cursor = self.purchase_facade.get_purchase_history_of_user(requested_id, store_id, start_date,
+                                                                                   end_date, purchase_status, cursor,
+                                                                                   limit)
+        return {'purchases': purchases, 'next_cursor': next_cursor}
+
+    def view_purchases_of_store(self, user_id: int, store_id: int, start_date: Optional[datetime] = None,
+                                end_date: Optional[datetime] = None, status: Optional[str] = None,
+                                cursor: Optional[str] = None, limit: Optional[int] = None,
+                                summary: bool = False) -> Dict:
+        """
+        * Parameters: userId, store_id, start_date (inclusive), end_date (exclusive), status (name of a purchase
+          status), cursor - the next_cursor of the previous page, limit - page size, summary
+        * This function returns a page of the purchases of a store, newest first, or only their totals if summary is
+          True
+        * Returns a dict with the purchases and the next_cursor (None on the last page), or the summary
         """
         if not self.roles_facade.is_owner(store_id, user_id) and not self.roles_facade.is_manager(store_id,
                                                                                                   user_id) and not self.roles_facade.is_system_manager(
             user_id):
             raise UserError("User is not a store owner or manager", UserErrorTypes.user_not_a_manager_or_owner)
-        return self.purchase_facade.get_purchases_of_store(store_id)
+        purchase_status = self.__purchase_status(status)
+        if summary:
+            return self.purchase_facade.get_purchase_summary_of_store(store_id, start_date, end_date, purchase_status)
+        purchases, next_cursor = self.purchase_facade.get_purchase_history_of_store(store_id, start_date, end_date,
+                                                                                    purchase_status, cursor, limit)
+        return {'purchases': purchases, 'next_cursor': next_cursor}
+
+    def export_purchases_of_store(self, user_id: int, store_id: int, start_date: Optional[datetime] = None,
+                                  end_date: Optional[datetime] = None, status: Optional[str] = None) -> Iterator[Dict]:
+        """
+        * Parameters: userId, store_id, start_date (inclusive), end_date (exclusive), status (name of a purchase
+          status)
+        * This function checks the permissions of the user and returns the purchases of a store for an export
+        * Returns an iterator that streams the purchased products of the store, oldest first
+        """
+        if not self.roles_facade.is_owner(store_id, user_id) and not self.roles_facade.is_manager(store_id, user_id) \
+                and not self.roles_facade.is_system_manager(user_id):
+            raise UserError("User is not a store owner or manager", UserErrorTypes.user_not_a_manager_or_owner)
+        return self.purchase_facade.iter_purchase_lines_of_store(store_id, start_date, end_date,
+                                                                 self.__purchase_status(status))
+
+    def get_sales_stats(self, user_id: int, store_id: int, start_date: Optional[date] = None,
+                        end_date: Optional[date] = None) -> Dict:
+        """
+        * Parameters: user_id, store_id, start_date (default=SALES_STATS_DEFAULT_DAYS before end_date),
+          end_date (default=today), both inclusive
+        * This function returns the daily sales, the product sales and the totals of a store in the range, read from
+          the sales rollups
+        * Returns a dict
+        """
+        if not self.roles_facade.is_owner(store_id, user_id) and not self.roles_facade.is_manager(store_id, user_id) \
+                and not self.roles_facade.is_system_manager(user_id):
+            raise UserError("User is not a store owner or manager", UserErrorTypes.user_not_a_manager_or_owner)
+        end_date = end_date or date.today()
+        start_date = start_date or end_date - timedelta(days=current_app.config.get('SALES_STATS_DEFAULT_DAYS', 30) - 1)
+        if start_date > end_date or (end_date - start_date).days >= current_app.config.get('SALES_STATS_MAX_DAYS', 366):
+            raise PurchaseError("Date range is invalid", PurchaseErrorTypes.invalid_date_range)
+        return SalesStats().get_store_stats(store_id, start_date, end_date)
+
+    def rebuild_sales_stats(self, user_id: int, store_id: Optional[int] = None) -> int:
+        """
+        * Parameters: user_id, store_id(default=None - all the stores)
+        * This function recalculates the sales rollups from the purchase history
+        * Returns the number of sub purchases that were counted
+        """
+        if not self.roles_facade.is_system_manager(user_id):
+            raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
+        return SalesStats().rebuild(store_id)
 
     def get_payment_methods(self, user_id: int) -> List[str]:
         """
@@ -1920,7 +2490,7 @@ class MarketFacade:
         if not self.roles_facade.has_add_product_permission(store_id, user_id):
             raise UserError("User does not have the necessary permissions to add a product to the store", UserErrorTypes.user_does_not_have_necessary_permissions)
         self.store_facade.edit_product_in_store(store_id, product_id, product_name, description, price, weight, tags, amount)
-        db.session.commit()
+        commit()
 
     def get_store_role(self, user_id: int, store_id: int) -> str:
         logger.info(f"Getting role of user {user_id} in store {store_id}")
@@ -1937,31 +2507,81 @@ class MarketFacade:
     def is_store_closed(self, store_id: int) -> bool:
         return self.store_facade.is_store_closed(store_id)
 
-    def get_user_employees(self, user_id: int, store_id: int):
-        employees = self.roles_facade.get_user_employees(user_id, store_id)
+    def get_user_employees(self, user_id: int, store_id: int, cursor: Optional[int] = None,
+                           limit: Optional[int] = None, is_owner: Optional[bool] = None,
+                           username: Optional[str] = None) -> dict:
+        """
+        * Parameters: user_id, store_id, cursor - the next_cursor of the previous page, limit - page size, is_owner -
+          only the owners (True) or the managers (False), username - a prefix of the usernames
+        * This function returns a page of the employees the user nominated in the store, ordered by user id. The
+          users of the page are loaded with one query
+        * Returns a dict with the employees and the next_cursor (None on the last page)
+        """
+        limit = self.user_facade.page_size(limit)
+        employees = sorted((employee for employee in self.roles_facade.get_user_employees(user_id, store_id)
+                            if (is_owner is None or employee.is_owner == is_owner)
+                            and (cursor is None or employee.user_id > cursor)),
+                           key=lambda employee: employee.user_id)
+        if not username:
+            employees = employees[:limit + 1]
+        users = self.user_facade.get_users_by_ids(employee.user_id for employee in employees)
         for employee in employees:
-            user_dto = self.user_facade.get_userDTO(employee.user_id)
-            employee.username = user_dto.username
-        return employees
-
-    def get_unemployed_users(self, store_id) -> List[UserDTO]:
+            user = users.get(employee.user_id)
+            employee.username = user.get_username() if user is not None else None
+        if username:
+            employees = [employee for employee in employees
+                         if employee.username is not None and employee.username.startswith(username)][:limit + 1]
+        next_cursor = employees[limit - 1].user_id if len(employees) > limit else None
+        return {'employees': employees[:limit], 'next_cursor': next_cursor}
+
+    def get_unemployed_users(self, store_id, cursor: Optional[int] = None, limit: Optional[int] = None,
+                             username: Optional[str] = None) -> dict:
+        """
+        * Parameters: store_id, cursor - the next_cursor of the previous page, limit - page size, username - a
+          prefix of the usernames
+        * This function returns a page of the members that have no role in the store, ordered by user id
+        * Returns a dict with the members and the next_cursor (None on the last page)
+        """
         employed = self.roles_facade.get_employed_users(store_id)
-        all_users = self.user_facade.get_all_members()
-        unemployed = []
-        for user in all_users:
-            if user.user_id not in employed:
-                unemployed.append(user)
+        members, next_cursor = self.user_facade.get_members_page(cursor, limit, username, excluded_ids=employed)
+        return {'members': members, 'next_cursor': next_cursor}
 
-        return unemployed
-
-    def get_all_members(self, user_id) -> List[UserDTO]:
+    def get_all_members(self, user_id, cursor: Optional[int] = None, limit: Optional[int] = None,
+                        username: Optional[str] = None, suspended: Optional[bool] = None) -> dict:
+        """
+        * Parameters: user_id, cursor - the next_cursor of the previous page, limit - page size, username - a
+          prefix of the usernames, suspended - only the suspended (True) or not suspended (False) members
+        * This function returns a page of the members, ordered by user id
+        * Returns a dict with the members and the next_cursor (None on the last page)
+        """
         if not self.roles_facade.is_system_manager(user_id):
             raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
-        return self.user_facade.get_all_members()
+        members, next_cursor = self.user_facade.get_members_page(cursor, limit, username, suspended)
+        return {'members': members, 'next_cursor': next_cursor}
 
     def is_suspended(self, user_id: int) -> bool:
         return self.user_facade.suspended(user_id)
 
+    def get_guest_gc_metrics(self, user_id: int) -> Dict:
+        """
+        * Parameters: user_id
+        * This function returns the metrics of the guest collector
+        * Returns a dict
+        """
+        if not self.roles_facade.is_system_manager(user_id):
+            raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
+        return self.user_facade.get_guest_gc_metrics()
+
+    def get_password_hash_metrics(self, user_id: int) -> Dict:
+        """
+        * Parameters: user_id
+        * This function returns the metrics of the password hasher of the logins
+        * Returns a dict
+        """
+        if not self.roles_facade.is_system_manager(user_id):
+            raise UserError("User is not a system manager", UserErrorTypes.user_not_system_manager)
+        return PasswordHasher().get_metrics()
+
     def get_product_categories(self, user_id: int, store_id: int, product_id: int) -> Dict[int, CategoryDTO]:
         if not self.roles_facade.has_add_product_permission(store_id, user_id):
             raise UserError("User does not have the necessary permissions to get the product categories",
@@ -1971,3 +2591,26 @@ class MarketFacade:
     def get_total_price_after_discount(self, user_id: int):
         cart = self.user_facade.get_shopping_cart(user_id)
         return self.store_facade.get_total_price_after_discount(cart, None)
+
+    def get_price_quote(self, user_id: int, address: Optional[Dict] = None) -> Dict:
+        """
+        * Parameters: user_id, address(default=None)
+        * This function prices the cart of the user and signs the result, checkout reuses the prices of the quote if
+          it gets the same cart and address while the products, discounts and policies of the stores did not change.
+          Discounts that depend on the user are calculated only if the address is given
+        * Returns: the total price, the total price after discounts, the quote and the time it expires
+        """
+        cart = self.user_facade.get_shopping_cart(user_id)
+        user_info = self.__checkout_user_info(user_id, address) if address is not None else None
+        price = self.store_facade.price_carts([(user_info, cart)], check_policies=False)[0]
+        if isinstance(price, Exception):
+            raise price
+        total_price, total_price_after_discounts, purchase_shopping_cart = price
+        store_ids = list(cart.keys())
+        quote, expires_at = self.price_quotes.issue(user_id, user_info, cart,
+                                                    self.store_facade.get_pricing_versions(store_ids),
+                                                    self.store_facade.category_version, total_price,
+                                                    total_price_after_discounts, purchase_shopping_cart,
+                                                    self.store_facade.get_next_discount_change(store_ids))
+        return {'total_price': total_price, 'total_price_after_discounts': total_price_after_discounts,
+                'quote': quote, 'expires_at': expires_at.isoformat()}
@@ -8,12 +8,12 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask import jsonify
 from backend.business.authentication.authentication import Authentication
 from backend.error_types import *
-from flask import current_app
 # from backend.business.roles.roles import RolesFacade
 
 # Database related imports
 from sqlalchemy.exc import SQLAlchemyError
-from backend.database import db
+from backend.database import db, commit, ensure_app_context
+from backend.business.id_allocator import HOT_ID_BLOCK_SIZE, IdAllocator
 
 # -------------logging configuration----------------
 import logging
@@ -28,7 +28,6 @@ class Notifier:
     # singleton
 
     __instance = None
-    __create_lock = Lock()
     __sign_lock = Lock()
     __store_lock: Dict[int, Lock] = {} #TODO #load_store_locks?
 
@@ -44,7 +43,6 @@ class Notifier:
             self._user_facade: UserFacade = UserFacade()  # Singleton
             self._authentication: Authentication = Authentication()  # Singleton
             #self._listeners: Dict = {} # Would it restart the listeners every time the server restarts?
-            self._notification_id = 0
             self.socketio_manager = None
 
     @property
@@ -59,7 +57,7 @@ class Notifier:
     def _listeners(self, listeners):
         #delete all listeners
         db.session.query(Listeners).delete()
-        db.session.commit()
+        commit()
 
         for store_id in listeners.keys():
             for listener in listeners[store_id]:
@@ -72,7 +70,7 @@ class Notifier:
         """
         self._user_facade.clean_data()
         self._listeners.clear()
-        self._notification_id = 0
+        IdAllocator().reset('notifications')
 
     def set_socketio_manager(self, socketio_manager):
         self.socketio_manager = socketio_manager
@@ -85,9 +83,7 @@ class Notifier:
         logger.info(f"sent message to user {user_id}")
 
     def _generate_notification_id(self) -> int:
-        with self.__create_lock:
-            self._notification_id += 1
-            return self._notification_id
+        return IdAllocator().allocate('notifications', lambda: 1, HOT_ID_BLOCK_SIZE)
 
     def _notify_delayed(self, user_id: int, message: str) -> None:
         """
@@ -126,9 +122,7 @@ class Notifier:
         * Parameters: store_id: int, message: str
         * This function sends a message to multiple users.
         """
-        from backend.app_factory import get_app
-        app = get_app()
-        with app.app_context():
+        with ensure_app_context():
             all_listeners = db.session.query(Listeners).filter_by(store_id=store_id).all()
             if len(all_listeners) == 0:
                 raise StoreError(f"No listenerss for the store with ID: {store_id}", StoreErrorTypes.no_listeners_for_store)
@@ -162,10 +156,18 @@ class Notifier:
         msg = "New purchase in store: " + str(store_id) + "\n purchase ID: " + str(purchase_id)  # + "With the info:"
         self._notify_multiple(store_id, msg)
 
+    # Notify on delivered purchases --- for store owner
+    def notify_purchases_completed(self, store_id: int, purchase_ids: List[int]) -> None:
+        """
+        * Parameters: store_id: int, purchase_ids: List[int]
+        * This function notifies the store owner(s) of the purchases of the store that were delivered, in one message.
+        """
+        msg = (f"{len(purchase_ids)} purchases of store: {store_id} were delivered"
+               f"\n purchase IDs: {', '.join(str(purchase_id) for purchase_id in purchase_ids)}")
+        self._notify_multiple(store_id, msg)
+
     def _notify_multiple_bid(self, store_id: int, message: str, send_to = list[int], send_by = None) -> None:
-        from backend.app_factory import get_app
-        app = get_app()
-        with app.app_context():
+        with ensure_app_context():
             all_listeners = db.session.query(Listeners).filter_by(store_id=store_id).all()
             if len(all_listeners) == 0:
                 raise StoreError(f"No listenerss for the store with ID: {store_id}", StoreErrorTypes.no_listeners_for_store)
@@ -182,6 +184,22 @@ class Notifier:
                         else:
                             self._notify_delayed(listener, message)
 
+    # Notify on a finished asynchronous checkout --- for the buyer
+    def notify_checkout_status(self, user_id: int, checkout_job: dict) -> None:
+        """
+        * Parameters: user_id: int, checkout_job: dict
+        * This function notifies the buyer that an asynchronous checkout job has finished.
+        * Online users receive a 'checkout_status' event, offline users a delayed notification.
+        """
+        msg = f"Checkout job {checkout_job['job_id']} has {checkout_job['status']}"
+        if checkout_job['message']:
+            msg += ": " + checkout_job['message']
+        if self._authentication.is_logged_in(user_id) and self.socketio_manager is not None:
+            self.socketio_manager.emit('checkout_status', checkout_job, room=user_id)
+            logger.info(f"sent checkout status of job {checkout_job['job_id']} to user {user_id}")
+        else:
+            self._notify_delayed(user_id, msg)
+
     # Notify on a new bid  --- for store owner
     def notify_new_bid(self, store_id: int, user_id: int, users_to_notify: list[int], bid_id: int) -> None:
         """
@@ -292,12 +310,12 @@ class Notifier:
         * It would alert him to the events that are relevant to the store (new purchase, store update, removed
         management position)
         """
-        with current_app.app_context():
+        with ensure_app_context():
             store = db.session.query(Listeners).filter_by(store_id=store_id).all()
             if len(store) == 0:
                 new_listener = Listeners(store_id, str(user_id))
                 db.session.add(new_listener)
-                db.session.commit()
+                commit()
                 self.__store_lock[store_id] = Lock()
             else:
                 db.session.query(Listeners).filter_by(store_id=store_id).first().add_listener_to_store(user_id)
@@ -318,7 +336,7 @@ class Notifier:
         * Parameters: user_id: int, store_id: int
         * This function removes a user (manager or owner) from the store listeners.
         """
-        with current_app.app_context():
+        with ensure_app_context():
             with self.__store_lock[store_id]:
                 store = db.session.query(Listeners).filter_by(store_id=store_id).all()
                 if len(store) == 0:
@@ -349,7 +367,7 @@ class Listeners(db.Model):
             raise UserError(f"User is already a listener for the store with ID: {self.store_id}", UserErrorTypes.user_already_listener_for_store)
         
         self.listeners += ',' + str(listener)
-        db.session.commit()
+        commit()
         logger.info("[Listeners] added listener: " + str(listener) + " to store_id: " + str(self.store_id))
 
     def remove_listener_from_store(self, listener: int) -> None:
@@ -359,7 +377,7 @@ class Listeners(db.Model):
         self.listeners = ','.join([str(x) for x in curr_listeners if x != str(listener)])
         if self.listeners == '':
             db.session.query(Listeners).filter_by(store_id=self.store_id).delete()
-        db.session.commit()
+        commit()
         logger.info("[Listeners] removed listener: " + str(listener) + " from store_id: " + str(self.store_id))
 
     @property
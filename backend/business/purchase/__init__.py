@@ -1 +1,3 @@
 from .purchase import PurchaseFacade
+from .sales_stats import SalesStats
+from .archive import PurchaseArchive
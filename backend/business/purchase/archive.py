@@ -0,0 +1,379 @@
+# ----------------- imports -----------------#
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Tuple
+import gzip
+import json
+import os
+import threading
+import time
+
+from sqlalchemy.orm import selectinload
+
+from backend.business.DTOs import PurchaseProductDTO
+from backend.error_types import *
+from backend.database import db, commit
+from .purchase import ImmediatePurchase, ImmediateSubPurchase, Purchase, PurchaseProduct, PurchaseStatus
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_PURCHASE_ARCHIVE_HORIZON_DAYS = 365
+DEFAULT_PURCHASE_ARCHIVE_BATCH_SIZE = 1000  # purchases moved to the archive in one transaction
+DEFAULT_PURCHASE_ARCHIVE_MANIFEST_TTL = 60  # seconds the list of partitions is cached
+ARCHIVE_CACHED_PARTITIONS = 8  # decoded partition files kept in memory
+ARCHIVE_FORMAT_VERSION = 1
+SUB_PURCHASE_COLUMNS = ['purchase_id', 'store_id', 'user_id', 'date', 'status', 'total_price',
+                        'total_price_after_discounts', 'products_end']
+PRODUCT_COLUMNS = ['product_id', 'name', 'description', 'price', 'amount']
+
+
+# -----------------PurchaseArchivePartition Class-----------------#
+class PurchaseArchivePartition(db.Model):
+    # a month of archived purchases, the purchases themselves are kept in a compressed columnar file in the archive
+    # directory and this row tells the read path which months it has to open
+    __tablename__ = 'purchase_archive_partitions'
+
+    _month = db.Column(db.String(7), primary_key=True)
+    _rows = db.Column(db.Integer, nullable=False)
+    _first_date = db.Column(db.DateTime, nullable=False)
+    _last_date = db.Column(db.DateTime, nullable=False)
+    _archived_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, month: str):
+        self._month = month
+        self._rows = 0
+        self._archived_at = datetime.now()
+
+
+# -----------------ArchivedSubPurchase Class-----------------#
+class ArchivedSubPurchase:
+    # a sub purchase read from the archive, it has the attributes of ImmediateSubPurchase that the history uses
+    def __init__(self, purchase_id: int, store_id: int, user_id: int, date_of_purchase: datetime,
+                 total_price: float, total_price_after_discounts: float, status: PurchaseStatus,
+                 products: List[PurchaseProductDTO]):
+        self.purchase_id: int = purchase_id
+        self.store_id: int = store_id
+        self.user_id: int = user_id
+        self.date_of_purchase: datetime = date_of_purchase
+        self.total_price: float = total_price
+        self.total_price_after_discounts: float = total_price_after_discounts
+        self.status: PurchaseStatus = status
+        self.products: List[PurchaseProductDTO] = products
+
+    def key(self) -> Tuple[datetime, int, int]:
+        # the order of the history is newest first, with the store id breaking ties inside a purchase
+        return self.date_of_purchase, self.purchase_id, -self.store_id
+
+
+# -----------------PurchaseArchive Class-----------------#
+class PurchaseArchive:
+    # singleton
+    # moves the completed purchases that are older than the archive horizon out of the purchase tables into one
+    # gzip compressed columnar file per month, so the tables only hold the recent purchases. The archived purchases
+    # are still part of the purchase history, the read path only opens the files of the months it needs.
+    # Every process runs an archiver, so the directory has to be shared by all of them and a month is rewritten only
+    # while its partition row is locked
+    __instance = None
+    __lock = threading.Lock()
+
+    def __new__(cls):
+        if PurchaseArchive.__instance is None:
+            PurchaseArchive.__instance = super(PurchaseArchive, cls).__new__(cls)
+        return PurchaseArchive.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            self.__partitions: Optional[List[Tuple[str, datetime, datetime]]] = None
+            self.__partitions_loaded_at: float = 0
+            self.__cache: OrderedDict = OrderedDict()
+            self.__archiver: Optional[threading.Thread] = None
+            logger.info('[PurchaseArchive] successfully created purchase archive')
+
+    @staticmethod
+    def __config(name: str, default):
+        from flask import current_app
+        return current_app.config.get(name, default)
+
+    def __directory(self) -> str:
+        directory = self.__config('PURCHASE_ARCHIVE_DIR', None)
+        if not directory or not os.path.isabs(directory):
+            raise PurchaseError('The purchase archive directory has to be an absolute path shared by every server',
+                                PurchaseErrorTypes.archive_directory_invalid)
+        return directory
+
+    def __path(self, month: str) -> str:
+        return os.path.join(self.__directory(), f'purchases-{month}.json.gz')
+
+    # ---------------------------------partition files---------------------------------#
+    @staticmethod
+    def __encode(sub_purchases: List[ArchivedSubPurchase]) -> Dict[str, list]:
+        columns: Dict[str, list] = {name: [] for name in SUB_PURCHASE_COLUMNS + PRODUCT_COLUMNS}
+        for sub_purchase in sub_purchases:
+            columns['purchase_id'].append(sub_purchase.purchase_id)
+            columns['store_id'].append(sub_purchase.store_id)
+            columns['user_id'].append(sub_purchase.user_id)
+            columns['date'].append(sub_purchase.date_of_purchase.isoformat())
+            columns['status'].append(sub_purchase.status.name)
+            columns['total_price'].append(sub_purchase.total_price)
+            columns['total_price_after_discounts'].append(sub_purchase.total_price_after_discounts)
+            for product in sorted(sub_purchase.products, key=lambda p: p.product_id):
+                columns['product_id'].append(product.product_id)
+                columns['name'].append(product.name)
+                columns['description'].append(product.description)
+                columns['price'].append(product.price)
+                columns['amount'].append(product.amount)
+            columns['products_end'].append(len(columns['product_id']))
+        return columns
+
+    @staticmethod
+    def __decode_row(columns: Dict[str, list], index: int) -> ArchivedSubPurchase:
+        start = columns['products_end'][index - 1] if index > 0 else 0
+        products = [PurchaseProductDTO(columns['product_id'][i], columns['name'][i], columns['description'][i],
+                                       columns['price'][i], columns['amount'][i])
+                    for i in range(start, columns['products_end'][index])]
+        return ArchivedSubPurchase(columns['purchase_id'][index], columns['store_id'][index],
+                                   columns['user_id'][index], columns['dates'][index], columns['total_price'][index],
+                                   columns['total_price_after_discounts'][index],
+                                   PurchaseStatus[columns['status'][index]], products)
+
+    def __read(self, month: str) -> Dict[str, list]:
+        path = self.__path(month)
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            # the purchases of the month were deleted from the tables, without the file they are lost
+            logger.error(f'[PurchaseArchive] archive file of {month} is missing')
+            raise PurchaseError(f'The archive file of {month} is missing', PurchaseErrorTypes.archive_file_missing)
+        cached = self.__cache.get(path)
+        if cached is not None and cached[0] == modified:
+            self.__cache.move_to_end(path)
+            return cached[1]
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            columns = json.load(file)['columns']
+        # the dates are compared by every filter, they are parsed once per file
+        columns['dates'] = [datetime.fromisoformat(value) for value in columns['date']]
+        self.__cache[path] = (modified, columns)
+        while len(self.__cache) > ARCHIVE_CACHED_PARTITIONS:
+            self.__cache.popitem(last=False)
+        return columns
+
+    def __write(self, month: str, sub_purchases: List[ArchivedSubPurchase]) -> None:
+        os.makedirs(self.__directory(), exist_ok=True)
+        path = self.__path(month)
+        temporary_path = f'{path}.tmp'
+        with gzip.open(temporary_path, 'wt', encoding='utf-8') as file:
+            json.dump({'version': ARCHIVE_FORMAT_VERSION, 'columns': self.__encode(sub_purchases)}, file)
+        os.replace(temporary_path, path)
+        self.__cache.pop(path, None)
+
+    # ---------------------------------manifest---------------------------------#
+    def __get_partitions(self) -> List[Tuple[str, datetime, datetime]]:
+        # the list of partitions is small and cached, so reading the recent history costs no extra query
+        ttl = self.__config('PURCHASE_ARCHIVE_MANIFEST_TTL', DEFAULT_PURCHASE_ARCHIVE_MANIFEST_TTL)
+        if self.__partitions is None or time.monotonic() - self.__partitions_loaded_at > ttl:
+            self.__partitions = [(partition._month, partition._first_date, partition._last_date)
+                                 for partition in db.session.query(PurchaseArchivePartition)
+                                 .order_by(PurchaseArchivePartition._month.desc())]
+            self.__partitions_loaded_at = time.monotonic()
+        return self.__partitions
+
+    # ---------------------------------read path---------------------------------#
+    def iter_sub_purchases(self, user_id: Optional[int] = None, store_id: Optional[int] = None,
+                           start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                           status: Optional[PurchaseStatus] = None,
+                           before: Optional[Tuple[datetime, int, int]] = None,
+                           newer_than: Optional[datetime] = None,
+                           oldest_first: bool = False) -> Iterator[ArchivedSubPurchase]:
+        """
+        * Parameters: user_id, store_id, start_date (inclusive), end_date (exclusive), status, before - a history
+          cursor (date, purchase_id, store_id), only the sub purchases after it are read, newer_than - only the sub
+          purchases from this date on are needed, oldest_first(default=False)
+        * This function reads the archived sub purchases that match the filters, newest first
+        * Note: the files are opened lazily one month at a time, and only the months that can hold a match
+        * Returns: iterator of ArchivedSubPurchase
+        """
+        partitions = [(month, first_date, last_date) for month, first_date, last_date in self.__get_partitions()
+                      if (start_date is None or last_date >= start_date)
+                      and (end_date is None or first_date < end_date)
+                      and (before is None or first_date <= before[0])
+                      and (newer_than is None or last_date >= newer_than)]
+        if oldest_first:
+            partitions.reverse()
+        for month, _, _ in partitions:
+            columns = self.__read(month)
+            indexes = range(len(columns['purchase_id']))
+            if oldest_first:
+                indexes = reversed(indexes)
+            for index in indexes:
+                if user_id is not None and columns['user_id'][index] != user_id:
+                    continue
+                if store_id is not None and columns['store_id'][index] != store_id:
+                    continue
+                date_of_purchase = columns['dates'][index]
+                if start_date is not None and date_of_purchase < start_date:
+                    continue
+                if end_date is not None and date_of_purchase >= end_date:
+                    continue
+                if newer_than is not None and date_of_purchase < newer_than:
+                    continue
+                if status is not None and columns['status'][index] != status.name:
+                    continue
+                if before is not None and (date_of_purchase, columns['purchase_id'][index],
+                                           -columns['store_id'][index]) >= (before[0], before[1], -before[2]):
+                    continue
+                yield self.__decode_row(columns, index)
+
+    # ---------------------------------archiver---------------------------------#
+    def __candidates(self, cutoff: datetime, batch_size: int) -> List[int]:
+        # found through the index on (_status, _date_of_purchase), the purchases another archiver took are skipped
+        return [purchase_id for purchase_id, in
+                db.session.query(Purchase.id)
+                .filter(Purchase._status == PurchaseStatus.completed, Purchase._date_of_purchase < cutoff,
+                        Purchase.type == ImmediatePurchase.__mapper_args__['polymorphic_identity'])
+                .order_by(Purchase._date_of_purchase, Purchase.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)]
+
+    @staticmethod
+    def __lock_partition(month: str, first_date: datetime, last_date: datetime) -> PurchaseArchivePartition:
+        # the row lock serializes the archivers of all the processes on the month, its file is read and rewritten only
+        # while the lock is held. A new month is inserted right away, a concurrent insert of the same month waits for
+        # this transaction and then fails before it wrote anything
+        partition = (db.session.query(PurchaseArchivePartition)
+                     .filter(PurchaseArchivePartition._month == month)
+                     .with_for_update()
+                     .first())
+        if partition is None:
+            partition = PurchaseArchivePartition(month)
+            partition._first_date = first_date
+            partition._last_date = last_date
+            db.session.add(partition)
+        partition._archived_at = datetime.now()
+        db.session.flush()
+        return partition
+
+    @staticmethod
+    def __month(sub_purchase: ArchivedSubPurchase) -> str:
+        return sub_purchase.date_of_purchase.strftime('%Y-%m')
+
+    def __archive_batch(self, purchase_ids: List[int]) -> None:
+        rows = (db.session.query(ImmediateSubPurchase, Purchase._user_id)
+                .join(Purchase, Purchase.id == ImmediateSubPurchase.purchase_id)
+                .filter(ImmediateSubPurchase.purchase_id.in_(purchase_ids))
+                .options(selectinload(ImmediateSubPurchase._products))
+                .all())
+        archived = [ArchivedSubPurchase(sub_purchase.purchase_id, sub_purchase.store_id, user_id,
+                                        sub_purchase.date_of_purchase, sub_purchase.total_price,
+                                        sub_purchase.total_price_after_discounts, sub_purchase.status,
+                                        [product.get_dto() for product in sub_purchase.products])
+                    for sub_purchase, user_id in rows]
+        # the months are locked in order, so two archivers never wait for each other
+        archived.sort(key=self.__month)
+        for month, new_rows in groupby(archived, key=self.__month):
+            # a month is rewritten with its old and new rows, rows of an archive run that failed before deleting them
+            # from the tables are written once
+            merged = {(sub_purchase.purchase_id, sub_purchase.store_id): sub_purchase for sub_purchase in new_rows}
+            dates = [sub_purchase.date_of_purchase for sub_purchase in merged.values()]
+            partition = self.__lock_partition(month, min(dates), max(dates))
+            # a partition without rows was only just inserted and has no file yet
+            if partition._rows:
+                old_columns = self.__read(month)
+                for index in range(len(old_columns['purchase_id'])):
+                    old_row = self.__decode_row(old_columns, index)
+                    merged.setdefault((old_row.purchase_id, old_row.store_id), old_row)
+            month_rows = sorted(merged.values(), key=ArchivedSubPurchase.key, reverse=True)
+            self.__write(month, month_rows)
+            partition._rows = len(month_rows)
+            partition._first_date = month_rows[-1].date_of_purchase
+            partition._last_date = month_rows[0].date_of_purchase
+
+        # the files are written before the rows are deleted, so a failure never loses a purchase
+        for sub_purchase, _ in rows:
+            for product in sub_purchase.products:
+                db.session.expunge(product)
+            db.session.expunge(sub_purchase)
+        db.session.query(PurchaseProduct).filter(PurchaseProduct.purchase_id.in_(purchase_ids)) \
+            .delete(synchronize_session=False)
+        db.session.query(ImmediateSubPurchase).filter(ImmediateSubPurchase.purchase_id.in_(purchase_ids)) \
+            .delete(synchronize_session=False)
+        db.session.execute(ImmediatePurchase.__table__.delete()
+                           .where(ImmediatePurchase.__table__.c.id.in_(purchase_ids)))
+        db.session.execute(Purchase.__table__.delete().where(Purchase.__table__.c.id.in_(purchase_ids)))
+        db.session.commit()
+
+    def archive(self, before: Optional[datetime] = None) -> int:
+        """
+        * Parameters: before(default=PURCHASE_ARCHIVE_HORIZON_DAYS ago)
+        * This function moves the completed immediate purchases made before the date to the archive,
+          PURCHASE_ARCHIVE_BATCH_SIZE purchases at a time
+        * Returns: the number of purchases that were archived
+        """
+        if before is None:
+            before = datetime.now() - timedelta(days=self.__config('PURCHASE_ARCHIVE_HORIZON_DAYS',
+                                                                   DEFAULT_PURCHASE_ARCHIVE_HORIZON_DAYS))
+        batch_size = self.__config('PURCHASE_ARCHIVE_BATCH_SIZE', DEFAULT_PURCHASE_ARCHIVE_BATCH_SIZE)
+        archived = 0
+        with PurchaseArchive.__lock:
+            try:
+                while True:
+                    purchase_ids = self.__candidates(before, batch_size)
+                    if not purchase_ids:
+                        break
+                    self.__archive_batch(purchase_ids)
+                    archived += len(purchase_ids)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                self.__partitions = None
+        if archived:
+            logger.info(f'[PurchaseArchive] archived {archived} purchases made before {before}')
+        return archived
+
+    def start(self, app, interval_seconds: float) -> None:
+        """
+        * Parameters: app, interval_seconds
+        * This function starts a background thread that archives the old purchases every interval_seconds,
+          the archiver is not started without an archive directory
+        * Returns: none
+        """
+        with PurchaseArchive.__lock:
+            if self.__archiver is not None:
+                return
+            if not app.config.get('PURCHASE_ARCHIVE_DIR'):
+                logger.warning('[PurchaseArchive] PURCHASE_ARCHIVE_DIR is not set, purchases are not archived')
+                return
+            with app.app_context():
+                self.__directory()
+
+            def run():
+                while True:
+                    time.sleep(interval_seconds)
+                    try:
+                        with app.app_context():
+                            self.archive()
+                    except Exception as e:
+                        logger.error(f'[PurchaseArchive] archiving purchases failed: {e}')
+
+            self.__archiver = threading.Thread(target=run, name='purchase-archiver', daemon=True)
+            self.__archiver.start()
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        db.session.query(PurchaseArchivePartition).delete()
+        commit()
+        directory = self.__config('PURCHASE_ARCHIVE_DIR', None)
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith('purchases-'):
+                    os.remove(os.path.join(directory, name))
+        self.__cache.clear()
+        self.__partitions = []
+        self.__partitions_loaded_at = time.monotonic()
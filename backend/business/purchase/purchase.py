@@ -1,18 +1,31 @@
 # ----------------- imports -----------------#
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import List, Tuple, Optional, Dict
+from typing import Iterator, List, Tuple, Optional, Dict
 
 from backend.business.DTOs import BidPurchaseDTO, PurchaseProductDTO, PurchaseDTO
 import threading
 from backend.error_types import *
-from backend.database import db
+from backend.database import db, commit
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import selectinload
+from itertools import chain, islice
+import base64
+import heapq
+import json
 
 # -------------logging configuration----------------
 import logging
 
 logger = logging.getLogger('myapp')
 
+DEFAULT_PURCHASE_HISTORY_PAGE_SIZE = 100
+DEFAULT_PURCHASE_HISTORY_MAX_PAGE_SIZE = 1000
+PURCHASE_EXPORT_BATCH_SIZE = 1000  # rows fetched from the cursor at a time
+DEFAULT_PURCHASE_COMPLETION_BATCH_SIZE = 1000  # delivered purchases completed by one sweep statement
+PURCHASE_EXPORT_FIELDS = ['purchase_id', 'user_id', 'date', 'status', 'total_price', 'total_price_after_discounts',
+                          'product_id', 'name', 'description', 'price', 'amount']
+
 # -----------------Rating class-----------------#
 '''class Rating(ABC):
     def __init__(self, rating_id: int, rating: float, purchase_id: int, user_id: int, description: str,
@@ -113,6 +126,16 @@ class Purchase(db.Model):
         'polymorphic_on': 'type'
     }
 
+    # the purchase history of a user is read newest first, the bids of a user are filtered by their status, the
+    # archiver finds the old completed purchases by their status and date and the completion sweeper finds the
+    # accepted purchases by their delivery date
+    __table_args__ = (
+        db.Index('ix_purchases_user_id_date', '_user_id', '_date_of_purchase', 'id'),
+        db.Index('ix_purchases_user_id_status', '_user_id', '_status'),
+        db.Index('ix_purchases_status_date', '_status', '_date_of_purchase'),
+        db.Index('ix_purchases_status_delivery_date', '_status', '_delivery_date'),
+    )
+
     #__table_args__ = {'extend_existing': True}
 
     def __init__(self, user_id: int, date_of_purchase: Optional[datetime],
@@ -188,6 +211,7 @@ class ImmediateSubPurchase(db.Model):
     __table_args__ = (
         db.PrimaryKeyConstraint('purchase_id', 'store_id'),
         db.UniqueConstraint('purchase_id', 'store_id', name='uq_purchase_store'),
+        db.Index('ix_immediate_sub_purchases_store_id_date', 'store_id', '_date_of_purchase', 'purchase_id'),
     )
 
     #__table_args__ = {'extend_existing': True}
@@ -325,19 +349,31 @@ class BidPurchase(Purchase):
     _product_id = db.Column(db.Integer)
     _store_id = db.Column(db.Integer)
     _is_offer_to_store = db.Column(db.Boolean)
-    _list_of_store_owners_managers_that_accepted_offer_demo = db.Column(db.String)
+    # the approvals are kept in the bid_approvals table, _approvals counts them and _required_approvals is the number
+    # of store owners/managers with bid permissions the last time the quorum was checked
+    _approvals = db.Column(db.Integer, nullable=False, default=0)
+    _required_approvals = db.Column(db.Integer, nullable=False, default=0)
     _user_who_rejected_id = db.Column(db.Integer)
+    _approval_rows = db.relationship('BidApproval', cascade='all, delete-orphan', lazy=True,
+                                     order_by='BidApproval._approved_at')
     #_product = db.relationship('PurchaseProduct', backref='bid_purchase', lazy=True)
 
     __mapper_args__ = {
         'polymorphic_identity': 'bid_purchase',
     }
 
+    # the status is a column of the purchases table, so the bids of a store are found by the store id and the status
+    # is checked on the joined rows
+    __table_args__ = (
+        db.Index('ix_bid_purchases_store_id', '_store_id'),
+    )
+
     #__table_args__ = {'extend_existing': True}
 
     _bid_lock = threading.Lock()
 
-    def __init__(self, user_id: int, proposed_price: float, store_id: int, product_id: int):
+    def __init__(self, user_id: int, proposed_price: float, store_id: int, product_id: int,
+                 required_approvals: int = 0):
         super().__init__(user_id, None, -1, -1, PurchaseStatus.onGoing)
         if proposed_price < 0:
             raise PurchaseError("Proposed price is invalid", PurchaseErrorTypes.invalid_proposed_price)
@@ -345,7 +381,8 @@ class BidPurchase(Purchase):
         self._product_id: int = product_id
         self._store_id: int = store_id
         self._is_offer_to_store: bool = True
-        self._list_of_store_owners_managers_that_accepted_offer_demo: str = ""
+        self._approvals: int = 0
+        self._required_approvals: int = required_approvals
         self._user_who_rejected_id: int = -1
         #self._product: PurchaseProductDTO = PurchaseProductDTO(product_id, "", "", -1, -1) #temporary placeholder 
         logger.info('[BidPurchase] successfully created bid purchase object with purchase id: %s',
@@ -373,10 +410,8 @@ class BidPurchase(Purchase):
         return self._is_offer_to_store
 
     @property
-    def _list_of_store_owners_managers_that_accepted_offer(self):
-        if self._list_of_store_owners_managers_that_accepted_offer_demo == "":
-            return []
-        return [int(x) for x in self._list_of_store_owners_managers_that_accepted_offer_demo.split(",")]
+    def _list_of_store_owners_managers_that_accepted_offer(self) -> List[int]:
+        return [row.worker_id for row in self._approval_rows]
 
     @property
     def list_of_store_owners_managers_that_accepted_offer(self) -> List[int]:
@@ -384,20 +419,28 @@ class BidPurchase(Purchase):
 
     @_list_of_store_owners_managers_that_accepted_offer.setter
     def _list_of_store_owners_managers_that_accepted_offer(self, store_worker_ids: List[int]) -> None:
-        if len(store_worker_ids) == 0:
-            self._list_of_store_owners_managers_that_accepted_offer_demo = ""
-        else:
-            self._list_of_store_owners_managers_that_accepted_offer_demo = ','.join([str(x) for x in store_worker_ids])
+        self._approval_rows = [BidApproval(self.id, store_worker_id) for store_worker_id in store_worker_ids]
+        self._approvals = len(store_worker_ids)
 
     @list_of_store_owners_managers_that_accepted_offer.setter
     def list_of_store_owners_managers_that_accepted_offer(self, store_worker_ids: List[int]) -> None:
         self._list_of_store_owners_managers_that_accepted_offer = store_worker_ids
 
     def add_to_list_of_store_owners_managers_that_accepted_offer(self, store_worker_id: int) -> None:
-        if len(self._list_of_store_owners_managers_that_accepted_offer_demo) == 0:
-            self._list_of_store_owners_managers_that_accepted_offer_demo += str(store_worker_id)
-        else:
-            self._list_of_store_owners_managers_that_accepted_offer_demo += "," + str(store_worker_id)
+        self._approval_rows.append(BidApproval(self.id, store_worker_id))
+        self._approvals += 1
+
+    @property
+    def approvals(self) -> int:
+        return self._approvals
+
+    @property
+    def required_approvals(self) -> int:
+        return self._required_approvals
+
+    @property
+    def fully_approved(self) -> bool:
+        return self._required_approvals > 0 and self._approvals >= self._required_approvals
 
     @property
     def user_who_rejected_id(self):
@@ -474,13 +517,17 @@ class BidPurchase(Purchase):
                     self.id)
                 raise PurchaseError("Offer is not to store", PurchaseErrorTypes.offer_not_to_store)
 
-            for store_worker_id in set(store_workers_ids):
-                if store_worker_id not in self._list_of_store_owners_managers_that_accepted_offer:
-                    logger.info(
-                        "[BidPurchase] store could not accept offer of bid purchase with purchase id: %s, since not"
-                        " all store owners/managers accepted the offer",
-                        self.id)
-                    return False
+            # the counter answers most checks without reading the approvals, they are only read once there are
+            # enough of them, to make sure they were given by the current store owners/managers
+            store_workers_ids = set(store_workers_ids)
+            self._required_approvals = len(store_workers_ids)
+            if self._approvals < self._required_approvals or \
+                    not store_workers_ids.issubset(self._list_of_store_owners_managers_that_accepted_offer):
+                logger.info(
+                    "[BidPurchase] store could not accept offer of bid purchase with purchase id: %s, since not"
+                    " all store owners/managers accepted the offer",
+                    self.id)
+                return False
             self._status = PurchaseStatus.approved
             logger.info("[BidPurchase] store accepted offer of bid purchase with purchase id: %s", self.id)
             return True
@@ -517,8 +564,7 @@ class BidPurchase(Purchase):
             if proposed_price < 0:
                 raise PurchaseError("Proposed price is invalid", PurchaseErrorTypes.invalid_proposed_price)
 
-            self._list_of_store_owners_managers_that_accepted_offer = []
-            self.add_to_list_of_store_owners_managers_that_accepted_offer(user_who_counter_offer)
+            self._list_of_store_owners_managers_that_accepted_offer = [user_who_counter_offer]
             self._proposed_price = proposed_price
             self._is_offer_to_store = False
 
@@ -690,6 +736,21 @@ class BidPurchase(Purchase):
         
 
 
+class BidApproval(db.Model):
+    # an approval of a bid by a store owner/manager, the primary key makes checking a single approval one lookup and
+    # prevents approving the same offer twice
+    __tablename__ = 'bid_approvals'
+
+    bid_id = db.Column(db.Integer, db.ForeignKey('bid_purchases.id'), primary_key=True)
+    worker_id = db.Column(db.Integer, primary_key=True)
+    _approved_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, bid_id: Optional[int], worker_id: int):
+        self.bid_id = bid_id
+        self.worker_id = worker_id
+        self._approved_at = datetime.now()
+
+
 class PurchaseProduct(db.Model):
     __tablename__ = 'purchase_products'
 
@@ -1112,6 +1173,10 @@ class PurchaseFacade:
             # self._ratings = []
             self._purchases_id_counter_lock = threading.Lock()
             # self._rating_id_counter = 0
+            from .sales_stats import SalesStats
+            from .archive import PurchaseArchive
+            self.__sales_stats = SalesStats()
+            self.__archive = PurchaseArchive()
             logger.info('[PurchaseFacade] successfully created purchase facade object')
 
     # -----------------Immediate Purchase Class related methods-----------------#
@@ -1146,7 +1211,7 @@ class PurchaseFacade:
             pur = create_immediate_purchase(user_id, total_price, shopping_cart, total_price_after_discounts)
 
             # no need to add because already added in the static function create_immediate_purchase
-            db.session.commit()
+            commit()
             return pur.id
 
     """def __get_new_purchase_id(self) -> int:
@@ -1168,75 +1233,264 @@ class PurchaseFacade:
                 #db.session.rollback()
                 raise e"""
 
+    @staticmethod
+    def __to_purchase_dto(sub_purchase: ImmediateSubPurchase, user_id: Optional[int] = None) -> PurchaseDTO:
+        # the products of archived sub purchases are already dtos
+        conv_prod = [prod if isinstance(prod, PurchaseProductDTO) else prod.get_dto() for prod in sub_purchase.products]
+        return PurchaseDTO(sub_purchase.purchase_id, sub_purchase.store_id, sub_purchase.date_of_purchase,
+                           sub_purchase.total_price, sub_purchase.total_price_after_discounts,
+                           sub_purchase.status.value, conv_prod, user_id)
+
+    @staticmethod
+    def __encode_cursor(date_of_purchase: datetime, purchase_id: int, store_id: int) -> str:
+        data = json.dumps([date_of_purchase.isoformat(), purchase_id, store_id]).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    @staticmethod
+    def __decode_cursor(cursor: str) -> Tuple[datetime, int, int]:
+        try:
+            date_of_purchase, purchase_id, store_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            return datetime.fromisoformat(date_of_purchase), int(purchase_id), int(store_id)
+        except Exception:
+            raise PurchaseError("Purchase history cursor is invalid", PurchaseErrorTypes.invalid_history_cursor)
+
+    @staticmethod
+    def __page_size(limit: Optional[int]) -> int:
+        from flask import current_app
+        if limit is None:
+            return current_app.config.get('PURCHASE_HISTORY_PAGE_SIZE', DEFAULT_PURCHASE_HISTORY_PAGE_SIZE)
+        if limit <= 0 or limit > current_app.config.get('PURCHASE_HISTORY_MAX_PAGE_SIZE',
+                                                        DEFAULT_PURCHASE_HISTORY_MAX_PAGE_SIZE):
+            raise PurchaseError("Page size is invalid", PurchaseErrorTypes.invalid_page_size)
+        return limit
+
+    @staticmethod
+    def __user_history_query(user_id: int, store_id: Optional[int]):
+        # the purchases of the user are found through the index on (_user_id, _date_of_purchase, id)
+        query = (db.session.query(ImmediateSubPurchase, Purchase._user_id)
+                 .join(Purchase, Purchase.id == ImmediateSubPurchase.purchase_id)
+                 .filter(Purchase._user_id == user_id))
+        if store_id is not None:
+            query = query.filter(ImmediateSubPurchase.store_id == store_id)
+        return query, Purchase._date_of_purchase, Purchase.id
+
+    @staticmethod
+    def __store_history_query(store_id: int):
+        # the sub purchases of the store are found through the index on (store_id, _date_of_purchase, purchase_id)
+        query = (db.session.query(ImmediateSubPurchase, Purchase._user_id)
+                 .join(Purchase, Purchase.id == ImmediateSubPurchase.purchase_id)
+                 .filter(ImmediateSubPurchase.store_id == store_id))
+        return query, ImmediateSubPurchase._date_of_purchase, ImmediateSubPurchase.purchase_id
+
+    @staticmethod
+    def __filter_history(query, date_column, start_date: Optional[datetime], end_date: Optional[datetime],
+                         status: Optional[PurchaseStatus]):
+        if start_date is not None and end_date is not None and start_date >= end_date:
+            raise PurchaseError("Start date must be before end date", PurchaseErrorTypes.invalid_date_range)
+        if start_date is not None:
+            query = query.filter(date_column >= start_date)
+        if end_date is not None:
+            query = query.filter(date_column < end_date)
+        if status is not None:
+            query = query.filter(ImmediateSubPurchase._status == status)
+        return query
+
+    def __history_page(self, query, date_column, id_column, cursor: Optional[str], limit: Optional[int],
+                       with_user_id: bool, archive_filters: Dict) -> Tuple[List[PurchaseDTO], Optional[str]]:
+        # newest first; a purchase has a sub purchase for each store, so the store id breaks ties inside a purchase
+        before = None
+        if cursor is not None:
+            before = self.__decode_cursor(cursor)
+            date_of_purchase, purchase_id, store_id = before
+            query = query.filter(or_(date_column < date_of_purchase,
+                                     and_(date_column == date_of_purchase, id_column < purchase_id),
+                                     and_(date_column == date_of_purchase, id_column == purchase_id,
+                                          ImmediateSubPurchase.store_id > store_id)))
+        query = (query.options(selectinload(ImmediateSubPurchase._products))
+                 .order_by(date_column.desc(), id_column.desc(), ImmediateSubPurchase.store_id))
+        if limit is not None:
+            query = query.limit(limit + 1)
+        rows = [(sub_purchase, user_id) for sub_purchase, user_id in query.all()]
+        # the archived purchases are older than the archive horizon, when the page is filled by recent purchases only
+        # the archived months that reach its oldest purchase are read, usually none
+        newer_than = rows[-1][0].date_of_purchase if limit is not None and len(rows) > limit else None
+        archived = self.__archive.iter_sub_purchases(before=before, newer_than=newer_than, **archive_filters)
+        if limit is not None:
+            archived = islice(archived, limit + 1)
+        archived_rows = [(sub_purchase, sub_purchase.user_id) for sub_purchase in archived]
+        if archived_rows:
+            rows = sorted(rows + archived_rows, reverse=True,
+                          key=lambda row: (row[0].date_of_purchase, row[0].purchase_id, -row[0].store_id))
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = self.__encode_cursor(last.date_of_purchase, last.purchase_id, last.store_id)
+        return [self.__to_purchase_dto(sub_purchase, user_id if with_user_id else None)
+                for sub_purchase, user_id in rows], next_cursor
+
+    def __history_summary(self, query, archive_filters: Dict) -> Dict[str, float]:
+        count, total_price, total_price_after_discounts = query.with_entities(
+            func.count(ImmediateSubPurchase.purchase_id),
+            func.coalesce(func.sum(ImmediateSubPurchase._total_price), 0),
+            func.coalesce(func.sum(ImmediateSubPurchase._total_price_after_discounts), 0)).one()
+        summary = {'purchases': count, 'total_price': float(total_price),
+                   'total_price_after_discounts': float(total_price_after_discounts)}
+        for sub_purchase in self.__archive.iter_sub_purchases(**archive_filters):
+            summary['purchases'] += 1
+            summary['total_price'] += sub_purchase.total_price
+            summary['total_price_after_discounts'] += sub_purchase.total_price_after_discounts
+        return summary
+
     def get_purchases_of_user(self, user_id: int, store_id: Optional[int] = None) -> List[PurchaseDTO]:
         """
-        * Parameters: userId
-        * This function is responsible for returning the purchases of the user
+        * Parameters: userId, storeId(default=None)
+        * This function is responsible for returning the purchases of the user, newest first
+        * Note: only the purchases of the user are read, using the index on purchases._user_id, and the products of
+          the sub purchases are loaded in one additional query
         * Returns: list of Purchase objects
         """
-        purchases: List[PurchaseDTO] = []
-        for purchase in db.session.query(ImmediatePurchase).all():
-            if purchase.user_id == user_id:
-                if isinstance(purchase, ImmediatePurchase):
-                    for sub_purchase in purchase.immediate_sub_purchases:
-                        if store_id is None or sub_purchase.store_id == store_id:
-                            conv_prod = [prod.get_dto() for prod in sub_purchase.products]
-                            purchases.append(PurchaseDTO(sub_purchase.purchase_id, sub_purchase.store_id,
-                                                         sub_purchase.date_of_purchase, sub_purchase.total_price,
-                                                         sub_purchase.total_price_after_discounts,
-                                                         sub_purchase.status.value, conv_prod))
-                    # if another type of purchase
-       # for purchase in db.session.query(BidPurchase).all():
-        #    if purchase.user_id == user_id:
-        #        if isinstance(purchase, BidPurchase):
-        #            if store_id is None or purchase.store_id == store_id:
-        #                if purchase.status == PurchaseStatus.completed:
-        #                    conv_prod = [prod.get_dto() for prod in purchase.product] 
-        #                    purchases.append(PurchaseDTO(purchase.id, purchase.store_id, purchase.date_of_purchase,
-        #                                                purchase.proposed_price, purchase.proposed_price,
-        #                                                purchase.status.value, conv_prod))
-        return purchases
+        query, date_column, id_column = self.__user_history_query(user_id, store_id)
+        return self.__history_page(query, date_column, id_column, None, None, False,
+                                   {'user_id': user_id, 'store_id': store_id})[0]
 
     def get_purchases_of_store(self, store_id: int) -> List[PurchaseDTO]:
         """
         * Parameters: storeId
-        * This function is responsible for returning the purchases of the store
+        * This function is responsible for returning the purchases of the store, newest first
+        * Note: only the sub purchases of the store are read, using the index on immediate_sub_purchases.store_id,
+          and their products are loaded in one additional query
         * Returns: list of Purchase objects
         """
-        purchases: List[PurchaseDTO] = []
-        for purchase in db.session.query(ImmediatePurchase).all():
-            if isinstance(purchase, ImmediatePurchase):
-                for sub_purchase in purchase.immediate_sub_purchases:
-                    if sub_purchase.store_id == store_id:
-                        conv_prod = [prod.get_dto() for prod in sub_purchase.products]
-                        purchases.append(PurchaseDTO(sub_purchase.purchase_id, sub_purchase.store_id,
-                                                     sub_purchase.date_of_purchase, sub_purchase.total_price,
-                                                     sub_purchase.total_price_after_discounts,
-                                                     sub_purchase.status.value, conv_prod, purchase.user_id))
-        
-        #for purchase in db.session.query(BidPurchase).all():
-        #    if isinstance(purchase, BidPurchase):
-        #        if purchase.store_id == store_id:
-        #            if purchase.status == PurchaseStatus.completed:
-        #                conv_prod = [prod.get_dto() for prod in purchase.product] 
-        #                purchases.append(PurchaseDTO(purchase.id, purchase.store_id, purchase.date_of_purchase,
-        #                                            purchase.proposed_price, purchase.proposed_price,
-        #                                            purchase.status.value, conv_prod))
-        return purchases
+        query, date_column, id_column = self.__store_history_query(store_id)
+        return self.__history_page(query, date_column, id_column, None, None, True, {'store_id': store_id})[0]
+
+    def get_purchase_history_of_user(self, user_id: int, store_id: Optional[int] = None,
+                                     start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                                     status: Optional[PurchaseStatus] = None, cursor: Optional[str] = None,
+                                     limit: Optional[int] = None) -> Tuple[List[PurchaseDTO], Optional[str]]:
+        """
+        * Parameters: userId, storeId, start_date (inclusive), end_date (exclusive), status, cursor - the next_cursor
+          of the previous page, limit - page size (default=PURCHASE_HISTORY_PAGE_SIZE)
+        * This function is responsible for returning a page of the purchases of the user, newest first
+        * Returns: the purchases of the page and the cursor of the next page (None if this is the last page)
+        """
+        query, date_column, id_column = self.__user_history_query(user_id, store_id)
+        query = self.__filter_history(query, date_column, start_date, end_date, status)
+        return self.__history_page(query, date_column, id_column, cursor, self.__page_size(limit), False,
+                                   {'user_id': user_id, 'store_id': store_id, 'start_date': start_date,
+                                    'end_date': end_date, 'status': status})
+
+    def get_purchase_history_of_store(self, store_id: int, start_date: Optional[datetime] = None,
+                                      end_date: Optional[datetime] = None, status: Optional[PurchaseStatus] = None,
+                                      cursor: Optional[str] = None, limit: Optional[int] = None) \
+            -> Tuple[List[PurchaseDTO], Optional[str]]:
+        """
+        * Parameters: storeId, start_date (inclusive), end_date (exclusive), status, cursor - the next_cursor of the
+          previous page, limit - page size (default=PURCHASE_HISTORY_PAGE_SIZE)
+        * This function is responsible for returning a page of the purchases of the store, newest first
+        * Returns: the purchases of the page and the cursor of the next page (None if this is the last page)
+        """
+        query, date_column, id_column = self.__store_history_query(store_id)
+        query = self.__filter_history(query, date_column, start_date, end_date, status)
+        return self.__history_page(query, date_column, id_column, cursor, self.__page_size(limit), True,
+                                   {'store_id': store_id, 'start_date': start_date, 'end_date': end_date,
+                                    'status': status})
+
+    def get_purchase_summary_of_user(self, user_id: int, store_id: Optional[int] = None,
+                                     start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                                     status: Optional[PurchaseStatus] = None) -> Dict[str, float]:
+        """
+        * Parameters: userId, storeId, start_date (inclusive), end_date (exclusive), status
+        * This function is responsible for summing up the purchases of the user without loading them
+        * Returns: the number of purchases and their total prices before and after discounts
+        """
+        query, date_column, _ = self.__user_history_query(user_id, store_id)
+        return self.__history_summary(self.__filter_history(query, date_column, start_date, end_date, status),
+                                      {'user_id': user_id, 'store_id': store_id, 'start_date': start_date,
+                                       'end_date': end_date, 'status': status})
+
+    def get_purchase_summary_of_store(self, store_id: int, start_date: Optional[datetime] = None,
+                                      end_date: Optional[datetime] = None,
+                                      status: Optional[PurchaseStatus] = None) -> Dict[str, float]:
+        """
+        * Parameters: storeId, start_date (inclusive), end_date (exclusive), status
+        * This function is responsible for summing up the purchases of the store without loading them
+        * Returns: the number of purchases and their total prices before and after discounts
+        """
+        query, date_column, _ = self.__store_history_query(store_id)
+        return self.__history_summary(self.__filter_history(query, date_column, start_date, end_date, status),
+                                      {'store_id': store_id, 'start_date': start_date, 'end_date': end_date,
+                                       'status': status})
+
+    def iter_purchase_lines_of_store(self, store_id: int, start_date: Optional[datetime] = None,
+                                     end_date: Optional[datetime] = None,
+                                     status: Optional[PurchaseStatus] = None) -> Iterator[Dict]:
+        """
+        * Parameters: storeId, start_date (inclusive), end_date (exclusive), status
+        * This function is responsible for reading the purchases of the store for an export, oldest first
+        * Note: the rows are streamed from a server side cursor PURCHASE_EXPORT_BATCH_SIZE at a time and are not kept
+          in the session, so the memory used does not depend on the size of the history. The archived purchases are
+          read one month at a time
+        * Returns: iterator of dicts with the PURCHASE_EXPORT_FIELDS, one for each product of each purchase
+        """
+        query = (db.session.query(ImmediateSubPurchase.purchase_id, Purchase._user_id,
+                                  ImmediateSubPurchase._date_of_purchase, ImmediateSubPurchase._status,
+                                  ImmediateSubPurchase._total_price, ImmediateSubPurchase._total_price_after_discounts,
+                                  PurchaseProduct.product_id, PurchaseProduct._name, PurchaseProduct._description,
+                                  PurchaseProduct._price, PurchaseProduct._amount)
+                 .join(Purchase, Purchase.id == ImmediateSubPurchase.purchase_id)
+                 .join(PurchaseProduct, and_(PurchaseProduct.purchase_id == ImmediateSubPurchase.purchase_id,
+                                             PurchaseProduct.store_id == ImmediateSubPurchase.store_id))
+                 .filter(ImmediateSubPurchase.store_id == store_id))
+        query = self.__filter_history(query, ImmediateSubPurchase._date_of_purchase, start_date, end_date, status)
+        query = query.order_by(ImmediateSubPurchase._date_of_purchase, ImmediateSubPurchase.purchase_id,
+                               PurchaseProduct.product_id)
+        archived = self.__archive.iter_sub_purchases(store_id=store_id, start_date=start_date, end_date=end_date,
+                                                     status=status, oldest_first=True)
+        # the arguments are checked here, the rows are only read while the caller iterates, the archived purchases
+        # are merged in by date
+        return heapq.merge(self.__archived_purchase_lines(archived), self.__stream_purchase_lines(query),
+                           key=lambda line: (line['date'] or '', line['purchase_id']))
+
+    @staticmethod
+    def __purchase_line(purchase_id: int, user_id: int, date_of_purchase: Optional[datetime],
+                        purchase_status: PurchaseStatus, total_price: float, total_price_after_discounts: float,
+                        product_id: int, name: str, description: str, price: float, amount: int) -> Dict:
+        return {'purchase_id': purchase_id, 'user_id': user_id,
+                'date': date_of_purchase.isoformat() if date_of_purchase else None,
+                'status': purchase_status.name, 'total_price': total_price,
+                'total_price_after_discounts': total_price_after_discounts, 'product_id': product_id,
+                'name': name, 'description': description, 'price': price, 'amount': amount}
+
+    def __stream_purchase_lines(self, query) -> Iterator[Dict]:
+        for row in query.yield_per(PURCHASE_EXPORT_BATCH_SIZE):
+            yield self.__purchase_line(*row)
+
+    def __archived_purchase_lines(self, sub_purchases) -> Iterator[Dict]:
+        for sub_purchase in sub_purchases:
+            for product in sub_purchase.products:
+                yield self.__purchase_line(sub_purchase.purchase_id, sub_purchase.user_id,
+                                           sub_purchase.date_of_purchase, sub_purchase.status,
+                                           sub_purchase.total_price, sub_purchase.total_price_after_discounts,
+                                           product.product_id, product.name, product.description, product.price,
+                                           product.amount)
 
     # -----------------BidPurchase class related methods-----------------#
-    def create_bid_purchase(self, user_id: int, proposed_price: float, store_id: int, product_id: int) -> int:
+    def create_bid_purchase(self, user_id: int, proposed_price: float, store_id: int, product_id: int,
+                            required_approvals: int = 0) -> int:
         """
-        Parameters: userId, proposedPrice, storeId, productId
+        Parameters: userId, proposedPrice, storeId, productId, requiredApprovals(default=0) - the number of store
+        owners/managers that have to accept the offer
         This function is responsible for creating a bid purchase
         Returns: none
         """
         with self._purchases_id_counter_lock:
             if proposed_price < 0:
                 raise PurchaseError("Proposed price is invalid", PurchaseErrorTypes.invalid_proposed_price)
-            pur = BidPurchase(user_id, proposed_price, store_id, product_id)
+            pur = BidPurchase(user_id, proposed_price, store_id, product_id, required_approvals)
             db.session.add(pur)
-            db.session.commit()
+            commit()
 
             return pur.id
         
@@ -1269,7 +1523,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
 
     def store_reject_offer(self, purchase_id: int, store_worker_id: int) -> int:
         """
@@ -1284,7 +1538,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
         return ret
 
     def store_accept_offer(self, purchase_id: int, store_workers_ids: List[int]) -> bool:
@@ -1299,7 +1553,7 @@ class PurchaseFacade:
             ret = purchase.store_accept_offer(store_workers_ids)
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
-        db.session.commit()
+        commit()
         return ret
 
     def store_counter_offer(self, purchase_id: int, user_who_counter_offer: int, proposed_price: float) -> None:
@@ -1315,7 +1569,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
 
     def user_accept_counter_offer(self, purchase_id: int, user_id: int) -> None:
         """
@@ -1332,7 +1586,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
 
     def user_reject_counter_offer(self, purchase_id: int, user_id: int) -> None:
         """
@@ -1347,7 +1601,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
 
     def cancel_bid(self, purchase_id: int, user_id: int) -> None:
         """
@@ -1362,7 +1616,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
 
 
 
@@ -1379,7 +1633,7 @@ class PurchaseFacade:
         else:
             raise PurchaseError("Purchase is not a bid purchase", PurchaseErrorTypes.purchase_not_bid_purchase)
 
-        db.session.commit()
+        commit()
 
     def is_bid_approved(self, purchase_id: int) -> bool:
         """
@@ -1401,25 +1655,57 @@ class PurchaseFacade:
         Returns: list of BidPurchase objects
         """
         purchases: List[BidPurchaseDTO] = []
-        for purchase in db.session.query(BidPurchase).all():
-            if isinstance(purchase, BidPurchase):
-                if purchase.user_id == user_id:
-                    purchases.append(BidPurchaseDTO(purchase.purchase_id, purchase.user_id, purchase.proposed_price, purchase.store_id, purchase.product_id, purchase.date_of_purchase, purchase.delivery_date, purchase.is_offer_to_store, purchase.total_price, purchase.status.value, purchase.list_of_store_owners_managers_that_accepted_offer, purchase.user_who_rejected_id))
+        for purchase in db.session.query(BidPurchase).filter(BidPurchase._user_id == user_id).order_by(BidPurchase.id):
+            purchases.append(BidPurchaseDTO(purchase.purchase_id, purchase.user_id, purchase.proposed_price, purchase.store_id, purchase.product_id, purchase.date_of_purchase, purchase.delivery_date, purchase.is_offer_to_store, purchase.total_price, purchase.status.value, purchase.list_of_store_owners_managers_that_accepted_offer, purchase.user_who_rejected_id))
         return purchases
-    
+
+    @staticmethod
+    def __bids_query(user_id: Optional[int], store_id: Optional[int], status: Optional[PurchaseStatus]):
+        # only the columns the bid listings show are read, the bids are found through the indexes on
+        # (_user_id, _status) and (_store_id)
+        query = db.session.query(BidPurchase.id, BidPurchase._user_id, BidPurchase._store_id, BidPurchase._product_id,
+                                 BidPurchase._proposed_price, BidPurchase._is_offer_to_store, BidPurchase._status,
+                                 BidPurchase._user_who_rejected_id)
+        if user_id is not None:
+            query = query.filter(BidPurchase._user_id == user_id)
+        if store_id is not None:
+            query = query.filter(BidPurchase._store_id == store_id)
+        if status is not None:
+            query = query.filter(BidPurchase._status == status)
+        return query
+
+    @staticmethod
+    def __bid_listing(row) -> dict:
+        bid_id, user_id, store_id, product_id, proposed_price, is_offer_to_store, status, user_who_rejected_id = row
+        return {"bid_id": bid_id, "user_id": user_id, "store_id": store_id, "product_id": product_id,
+                "proposed_price": proposed_price, "is_offer_to_store": is_offer_to_store, "status": status.name,
+                "user_who_rejected_id": user_who_rejected_id}
+
+    def list_bids(self, user_id: Optional[int] = None, store_id: Optional[int] = None,
+                  status: Optional[PurchaseStatus] = None, cursor: Optional[int] = None,
+                  limit: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        """
+        Parameters: userId, storeId, status - filters (default=None - no filter), cursor - the next_cursor of the
+        previous page, limit - page size (default=PURCHASE_HISTORY_PAGE_SIZE)
+        This function is responsible for returning a page of bids, newest first
+        Returns: the listings of the bids of the page and the cursor of the next page (None if this is the last page)
+        """
+        limit = self.__page_size(limit)
+        query = self.__bids_query(user_id, store_id, status)
+        if cursor is not None:
+            query = query.filter(BidPurchase.id < cursor)
+        rows = query.order_by(BidPurchase.id.desc()).limit(limit + 1).all()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [self.__bid_listing(row) for row in rows[:limit]], next_cursor
+
     def view_user_bids(self, user_id) -> List[dict]:
         """
         Parameters: userId
         This function is responsible for returning the bid purchases of the user
         Returns: list of BidPurchase objects
         """
-        purchases: List[dict] = []
-        for purchase in db.session.query(BidPurchase).all():
-            if isinstance(purchase, BidPurchase):
-                if purchase.user_id == user_id:
-                    purchases.append(purchase.get_bid_purchase_dto())
-        return purchases
-        
+        return [self.__bid_listing(row) for row in
+                self.__bids_query(user_id, None, None).order_by(BidPurchase.id.desc())]
 
     def get_bid_purchases_of_store(self, store_id: int) -> List[dict]:
         """
@@ -1427,28 +1713,18 @@ class PurchaseFacade:
         This function is responsible for returning the bid purchases of the store
         Returns: list of BidPurchase objects
         """
-        purchases: List[dict] = []
-        for purchase in db.session.query(BidPurchase).all():
-            logger.info(f'[PurchaseFacade] purchase: {purchase}')
-            if isinstance(purchase, BidPurchase):
-                logger.info(f'[PurchaseFacade] found that purchase is bid, the store id stored is: {purchase.store_id}')
-                if purchase.store_id == store_id:
-                    purchases.append(purchase.get_bid_purchase_dto())
-        return purchases
-    
+        return [self.__bid_listing(row) for row in
+                self.__bids_query(None, store_id, None).order_by(BidPurchase.id.desc())]
+
     def view_all_bids_of_system(self) -> List[dict]:
         """
         Parameters: none
         This function is responsible for returning the bid purchases of the system
         Returns: list of BidPurchase objects
         """
-        purchases: List[dict] = []
-        for purchase in db.session.query(BidPurchase).all():
-            if isinstance(purchase, BidPurchase):
-                purchases.append(purchase.get_bid_purchase_dto())
-        return purchases
-    
-    
+        return [self.__bid_listing(row) for row in
+                self.__bids_query(None, None, None).order_by(BidPurchase.id.desc())]
+
     def get_bid_purchase_by_id(self, purchase_id: int) -> BidPurchaseDTO:
         """
         Parameters: purchaseId
@@ -1490,8 +1766,10 @@ class PurchaseFacade:
         purchase.accept()
         if isinstance(purchase, ImmediatePurchase) or isinstance(purchase, BidPurchase):
             purchase.delivery_date = delivery_date
+        if isinstance(purchase, ImmediatePurchase):
+            self.__sales_stats.record_accepted(purchase)
 
-        db.session.commit()
+        commit()
 
     def reject_purchase(self, purchase_id: int) -> None:
         """
@@ -1509,7 +1787,7 @@ class PurchaseFacade:
         ImmediatePurchase.query.filter_by(purchase_id=purchase_id).delete()
         BidPurchase.query.filter_by(purchase_id=purchase_id).delete()
         db.session.delete(purchase)
-        db.session.commit()
+        commit()
         # del self._purchases[purchase_id]
 
     def cancel_accepted_purchase(self, purchase_id: int) -> None:
@@ -1523,12 +1801,16 @@ class PurchaseFacade:
         purchase = self.__get_purchase_by_id(purchase_id)
         if purchase.status != PurchaseStatus.accepted:
             raise PurchaseError("Purchase is not accepted", PurchaseErrorTypes.purchase_not_accepted)
+        if isinstance(purchase, ImmediatePurchase):
+            self.__sales_stats.record_cancelled(purchase)
+            # the sub purchases are deleted in bulk, the collection that was loaded for the rollups must not be flushed
+            db.session.expire(purchase, ['_immediate_sub_purchases'])
         PurchaseProduct.query.filter_by(purchase_id=purchase_id).delete()
         ImmediateSubPurchase.query.filter_by(purchase_id=purchase_id).delete()
         ImmediatePurchase.query.filter_by(purchase_id=purchase_id).delete()
         BidPurchase.query.filter_by(purchase_id=purchase_id).delete()
         db.session.delete(purchase)
-        db.session.commit()
+        commit()
         # del self._purchases[purchase_id]
 
     def complete_purchase(self, purchase_id: int):
@@ -1540,7 +1822,53 @@ class PurchaseFacade:
         logger.info('[PurchaseFacade] attempting to complete purchase with purchase id: %s', purchase_id)
         purchase = self.__get_purchase_by_id(purchase_id)
         purchase.complete()
-        db.session.commit()
+        if isinstance(purchase, ImmediatePurchase):
+            self.__sales_stats.record_completed(purchase)
+        commit()
+
+    def complete_delivered_purchases(self, now: Optional[datetime] = None,
+                                     batch_size: int = DEFAULT_PURCHASE_COMPLETION_BATCH_SIZE) -> Dict[int, List[int]]:
+        """
+        * Parameters: now(default=None - the current time), batch_size
+        * This function completes up to batch_size accepted purchases whose delivery date has passed, the purchases
+          and their sub purchases are updated by one statement each instead of being loaded one by one
+        * Returns: the ids of the completed purchases of every store
+        """
+        now = now or datetime.now()
+        purchase_ids = [purchase_id for purchase_id, in
+                        db.session.query(Purchase.id)
+                        .filter(Purchase._status == PurchaseStatus.accepted, Purchase._delivery_date <= now)
+                        .order_by(Purchase._delivery_date)
+                        .limit(batch_size)
+                        .with_for_update(skip_locked=True)]
+        if not purchase_ids:
+            return {}
+        sub_purchases = (db.session.query(ImmediateSubPurchase.purchase_id, ImmediateSubPurchase.store_id,
+                                          ImmediateSubPurchase._date_of_purchase)
+                         .filter(ImmediateSubPurchase.purchase_id.in_(purchase_ids),
+                                 ImmediateSubPurchase._status == PurchaseStatus.accepted)
+                         .all())
+        bids = (db.session.query(BidPurchase.id, BidPurchase._store_id)
+                .filter(BidPurchase.id.in_(purchase_ids))
+                .all())
+
+        (db.session.query(Purchase)
+         .filter(Purchase.id.in_(purchase_ids), Purchase._status == PurchaseStatus.accepted)
+         .update({Purchase._status: PurchaseStatus.completed}, synchronize_session=False))
+        (db.session.query(ImmediateSubPurchase)
+         .filter(ImmediateSubPurchase.purchase_id.in_(purchase_ids),
+                 ImmediateSubPurchase._status == PurchaseStatus.accepted)
+         .update({ImmediateSubPurchase._status: PurchaseStatus.completed}, synchronize_session=False))
+        self.__sales_stats.record_completed_sub_purchases([(store_id, date_of_purchase.date())
+                                                           for _, store_id, date_of_purchase in sub_purchases])
+        commit()
+
+        completed: Dict[int, List[int]] = {}
+        for purchase_id, store_id in chain(((purchase_id, store_id) for purchase_id, store_id, _ in sub_purchases),
+                                           bids):
+            completed.setdefault(store_id, []).append(purchase_id)
+        logger.info(f'[PurchaseFacade] completed {len(purchase_ids)} delivered purchases')
+        return completed
 
     def check_if_purchase_completed(self, purchase_id: int) -> bool:
         """
@@ -1568,13 +1896,16 @@ class PurchaseFacade:
 
         from backend.app_factory import get_app
         with get_app().app_context():
+            self.__sales_stats.clean_data()
+            self.__archive.clean_data()
             db.session.query(PurchaseProduct).delete()
             db.session.query(ImmediateSubPurchase).delete()
             db.session.query(ImmediatePurchase).delete()
+            db.session.query(BidApproval).delete()
             db.session.query(BidPurchase).delete()
             db.session.query(Purchase).delete()
             # db.session.query(Counter).filter_by(name=PURCHASE_ID_COUNTER_NAME).update({"value": 0})
-            db.session.commit()
+            commit()
 
     '''def create_bid_purchase(self, user_id: int, proposed_price: float, product_id: int, product_spec_id: int,
                             store_id: int,
@@ -0,0 +1,237 @@
+# ----------------- imports -----------------#
+from datetime import date, timedelta
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from backend.database import db, commit
+from .purchase import ImmediatePurchase, ImmediateSubPurchase, PurchaseStatus
+from .archive import PurchaseArchive
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+REBUILD_BATCH_SIZE = 500
+
+
+# -----------------StoreDailySales Class-----------------#
+class StoreDailySales(db.Model):
+    # the accepted sub purchases of a store in a day, purchases are counted on the day they were made
+    __tablename__ = 'store_daily_sales'
+
+    _store_id = db.Column(db.Integer, primary_key=True)
+    _day = db.Column(db.Date, primary_key=True)
+    _purchases = db.Column(db.Integer, nullable=False, default=0)
+    _completed_purchases = db.Column(db.Integer, nullable=False, default=0)
+    _units = db.Column(db.Integer, nullable=False, default=0)
+    _revenue = db.Column(db.Float, nullable=False, default=0)
+    _revenue_before_discounts = db.Column(db.Float, nullable=False, default=0)
+
+    def __init__(self, store_id: int, day: date):
+        self._store_id = store_id
+        self._day = day
+        self._purchases = 0
+        self._completed_purchases = 0
+        self._units = 0
+        self._revenue = 0.0
+        self._revenue_before_discounts = 0.0
+
+    def get(self) -> dict:
+        return {'date': self._day.isoformat(), 'purchases': self._purchases,
+                'completed_purchases': self._completed_purchases, 'units': self._units, 'revenue': self._revenue,
+                'revenue_before_discounts': self._revenue_before_discounts,
+                'average_basket_value': self._revenue / self._purchases if self._purchases else 0.0}
+
+
+# -----------------StoreProductDailySales Class-----------------#
+class StoreProductDailySales(db.Model):
+    # the units of a product sold by a store in a day, revenue is before the discounts of the basket
+    __tablename__ = 'store_product_daily_sales'
+
+    _store_id = db.Column(db.Integer, primary_key=True)
+    _day = db.Column(db.Date, primary_key=True)
+    _product_id = db.Column(db.Integer, primary_key=True)
+    _units = db.Column(db.Integer, nullable=False, default=0)
+    _revenue = db.Column(db.Float, nullable=False, default=0)
+
+    def __init__(self, store_id: int, day: date, product_id: int):
+        self._store_id = store_id
+        self._day = day
+        self._product_id = product_id
+        self._units = 0
+        self._revenue = 0.0
+
+
+# -----------------SalesStats Class-----------------#
+class SalesStats:
+    # singleton
+    # keeps the daily rollups of the sales of the stores, they are updated together with the purchase they count and
+    # can be rebuilt from the purchase history
+    __instance = None
+
+    def __new__(cls):
+        if SalesStats.__instance is None:
+            SalesStats.__instance = super(SalesStats, cls).__new__(cls)
+        return SalesStats.__instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            self._initialized = True
+            logger.info('[SalesStats] successfully created sales stats')
+
+    @staticmethod
+    def __add(model, key: Tuple, increments: Dict) -> None:
+        # adds the increments to the row of the key, the row is created on the first sale of its day
+        primary_key = list(model.__table__.primary_key.columns)
+        filters = [column == value for column, value in zip(primary_key, key)]
+        values = {getattr(model, name): getattr(model, name) + value for name, value in increments.items()}
+        if db.session.query(model).filter(*filters).update(values):
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(model(*key))
+        except IntegrityError:
+            # another purchase created the row first
+            pass
+        db.session.query(model).filter(*filters).update(values)
+
+    def __add_sub_purchase(self, sub_purchase: ImmediateSubPurchase, sign: int) -> None:
+        day = sub_purchase.date_of_purchase.date()
+        units = 0
+        for product in sub_purchase.products:
+            units += product.amount
+            self.__add(StoreProductDailySales, (sub_purchase.store_id, day, product.product_id),
+                       {'_units': sign * product.amount, '_revenue': sign * product.price * product.amount})
+        self.__add(StoreDailySales, (sub_purchase.store_id, day),
+                   {'_purchases': sign, '_units': sign * units,
+                    '_revenue': sign * sub_purchase.total_price_after_discounts,
+                    '_revenue_before_discounts': sign * sub_purchase.total_price})
+
+    def record_accepted(self, purchase: ImmediatePurchase) -> None:
+        """
+        * Parameters: purchase
+        * This function counts the sub purchases of an accepted purchase in the rollups of their stores
+        * Returns: none
+        """
+        for sub_purchase in purchase.immediate_sub_purchases:
+            self.__add_sub_purchase(sub_purchase, 1)
+
+    def record_cancelled(self, purchase: ImmediatePurchase) -> None:
+        """
+        * Parameters: purchase
+        * This function removes the sub purchases of a cancelled accepted purchase from the rollups of their stores
+        * Returns: none
+        """
+        for sub_purchase in purchase.immediate_sub_purchases:
+            self.__add_sub_purchase(sub_purchase, -1)
+
+    def record_completed(self, purchase: ImmediatePurchase) -> None:
+        """
+        * Parameters: purchase
+        * This function counts the sub purchases of a completed purchase as completed
+        * Returns: none
+        """
+        for sub_purchase in purchase.immediate_sub_purchases:
+            self.__add(StoreDailySales, (sub_purchase.store_id, sub_purchase.date_of_purchase.date()),
+                       {'_completed_purchases': 1})
+
+    def record_completed_sub_purchases(self, sub_purchases: List[Tuple[int, date]]) -> None:
+        """
+        * Parameters: sub_purchases - (store_id, day of purchase) of every completed sub purchase
+        * This function counts sub purchases that were completed in bulk as completed, with one update per store and
+          day
+        * Returns: none
+        """
+        for key, completed in Counter(sub_purchases).items():
+            self.__add(StoreDailySales, key, {'_completed_purchases': completed})
+
+    def get_store_stats(self, store_id: int, start_date: date, end_date: date) -> Dict:
+        """
+        * Parameters: store_id, start_date, end_date (both inclusive)
+        * This function reads the sales of the store in the range from the rollups
+        * Returns: the sales of every day of the range, the units and revenue of every product sold in the range and
+          the totals of the range
+        """
+        rows = {row._day: row for row in
+                db.session.query(StoreDailySales)
+                .filter(StoreDailySales._store_id == store_id,
+                        StoreDailySales._day >= start_date, StoreDailySales._day <= end_date)}
+        days: List[dict] = []
+        day = start_date
+        while day <= end_date:
+            days.append((rows.get(day) or StoreDailySales(store_id, day)).get())
+            day += timedelta(days=1)
+        products = (db.session.query(StoreProductDailySales._product_id,
+                                     func.sum(StoreProductDailySales._units),
+                                     func.sum(StoreProductDailySales._revenue))
+                    .filter(StoreProductDailySales._store_id == store_id,
+                            StoreProductDailySales._day >= start_date, StoreProductDailySales._day <= end_date)
+                    .group_by(StoreProductDailySales._product_id)
+                    .all())
+        purchases = sum(day['purchases'] for day in days)
+        revenue = sum(day['revenue'] for day in days)
+        totals = {'purchases': purchases, 'completed_purchases': sum(day['completed_purchases'] for day in days),
+                  'units': sum(day['units'] for day in days), 'revenue': revenue,
+                  'revenue_before_discounts': sum(day['revenue_before_discounts'] for day in days),
+                  'average_basket_value': revenue / purchases if purchases else 0.0}
+        return {'days': days,
+                'products': sorted(({'product_id': product_id, 'units': int(units), 'revenue': float(revenue)}
+                                    for product_id, units, revenue in products if units),
+                                   key=lambda product: (-product['units'], product['product_id'])),
+                'totals': totals}
+
+    def rebuild(self, store_id: Optional[int] = None) -> int:
+        """
+        * Parameters: store_id(default=None - all the stores)
+        * This function recalculates the rollups from the accepted and completed sub purchases, including the archived
+          ones
+        * Returns: the number of sub purchases that were counted
+        """
+        store_rows: Dict[Tuple[int, date], StoreDailySales] = {}
+        product_rows: Dict[Tuple[int, date, int], StoreProductDailySales] = {}
+        query = (db.session.query(ImmediateSubPurchase)
+                 .filter(ImmediateSubPurchase._status.in_([PurchaseStatus.accepted, PurchaseStatus.completed]))
+                 .options(selectinload(ImmediateSubPurchase._products)))
+        if store_id is not None:
+            query = query.filter(ImmediateSubPurchase.store_id == store_id)
+        counted = 0
+        for sub_purchase in chain(query.yield_per(REBUILD_BATCH_SIZE),
+                                  PurchaseArchive().iter_sub_purchases(store_id=store_id)):
+            day = sub_purchase.date_of_purchase.date()
+            row = store_rows.setdefault((sub_purchase.store_id, day), StoreDailySales(sub_purchase.store_id, day))
+            row._purchases += 1
+            row._completed_purchases += 1 if sub_purchase.status == PurchaseStatus.completed else 0
+            row._revenue += sub_purchase.total_price_after_discounts
+            row._revenue_before_discounts += sub_purchase.total_price
+            for product in sub_purchase.products:
+                row._units += product.amount
+                product_row = product_rows.setdefault((sub_purchase.store_id, day, product.product_id),
+                                                      StoreProductDailySales(sub_purchase.store_id, day,
+                                                                             product.product_id))
+                product_row._units += product.amount
+                product_row._revenue += product.price * product.amount
+            counted += 1
+
+        for model in (StoreDailySales, StoreProductDailySales):
+            query = db.session.query(model)
+            if store_id is not None:
+                query = query.filter(model._store_id == store_id)
+            query.delete()
+        db.session.add_all(list(store_rows.values()) + list(product_rows.values()))
+        commit()
+        logger.info(f'[SalesStats] rebuilt the sales rollups from {counted} sub purchases')
+        return counted
+
+    def clean_data(self):
+        """
+        For testing purposes only
+        """
+        db.session.query(StoreProductDailySales).delete()
+        db.session.query(StoreDailySales).delete()
+        commit()
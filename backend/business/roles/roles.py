@@ -3,7 +3,8 @@ from typing import Dict, List, Optional
 from threading import Lock
 from backend.business.notifier.notifier import Notifier
 from backend.error_types import *
-from backend.database import db
+from backend.database import db, commit, ensure_app_context
+from sqlalchemy import and_
 from sqlalchemy.ext.declarative import declared_attr
 from backend.business.DTOs import RoleNominationDTO, UserDTO
 import sqlalchemy.exc
@@ -344,11 +345,10 @@ class RolesFacade:
             db.session.query(StoreRole).delete()
             db.session.query(Nomination).delete()
             db.session.query(SystemManagerModel).delete()
-            db.session.commit()
+            commit()
 
     def add_store(self, store_id: int, owner_id: int) -> None:
-        from flask import current_app as app
-        with app.app_context():
+        with ensure_app_context():
             if db.session.query(TreeNode).filter_by(store_id=store_id, is_root=True).first():
                 raise RoleError("Store already exists", RoleErrorTypes.store_already_exists)
 
@@ -357,12 +357,12 @@ class RolesFacade:
 
             # Add the root node to the session and commit
             db.session.add(root_node)
-            db.session.commit()
+            commit()
 
             # Add store owner role and commit to database
             store_owner = StoreOwner(store_id=store_id, user_id=owner_id)
             db.session.add(store_owner)
-            db.session.commit()
+            commit()
 
             # Initialize store lock
             self.__stores_locks[store_id] = Lock()
@@ -379,10 +379,10 @@ class RolesFacade:
 
         # Remove from database
         db.session.query(TreeNode).filter(TreeNode.store_id == store_id).delete()
-        db.session.commit()
+        commit()
 
         db.session.query(StoreRole).filter(StoreRole.store_id == store_id).delete()
-        db.session.commit()
+        commit()
 
         self.__stores_locks.pop(store_id, None)
 
@@ -396,7 +396,7 @@ class RolesFacade:
 
             # Save to database
             db.session.add(nomination)
-            db.session.commit()
+            commit()
 
             return nomination.nomination_id
 
@@ -411,7 +411,7 @@ class RolesFacade:
 
             # Save to database
             db.session.add(nomination)
-            db.session.commit()
+            commit()
 
             return nomination.nomination_id
 
@@ -450,20 +450,20 @@ class RolesFacade:
                                     RoleErrorTypes.nominee_already_exists_in_store)
                 role = StoreManager(store_id=nomination.store_id, user_id=nominee_id)
                 db.session.add(role.permissions)
-                db.session.commit()
+                commit()
             db.session.add(role)
-            db.session.commit()
+            commit()
 
             # Add the user to the store tree
             treeNode = TreeNode(data=nominee_id, store_id=nomination.store_id, parent_id=nomination.nominator_id)
             db.session.add(treeNode)
-            db.session.commit()
+            commit()
 
             self.__notifier.sign_listener(nominee_id, nomination.store_id)
 
             # Delete all nominations of the nominee in the store
             db.session.query(Nomination).filter_by(store_id=nomination.store_id, nominee_id=nominee_id).delete()
-            db.session.commit()
+            commit()
             logger.info(f"User {nominee_id} accepted the nomination {nomination_id} in store {nomination.store_id}")
 
     def decline_nomination(self, nomination_id: int, nominee_id) -> None:
@@ -474,7 +474,7 @@ class RolesFacade:
             raise RoleError("Nominee id does not match the nomination", RoleErrorTypes.nominee_id_error)
 
         db.session.query(Nomination).filter_by(nomination_id=nomination_id).delete()
-        db.session.commit()
+        commit()
 
         logger.info(f"User {nominee_id} declined the nomination {nomination_id} in store {nomination.store_id}")
 
@@ -499,7 +499,7 @@ class RolesFacade:
             permissions_model.set_permissions(add_product, change_purchase_policy, change_purchase_types,
                                               change_discount_policy, change_discount_types, add_manager, get_bid)
 
-            db.session.commit()
+            commit()
 
     def remove_role(self, store_id: int, actor_id: int, removed_id: int) -> None:
         with self.__stores_locks[store_id]:
@@ -522,7 +522,7 @@ class RolesFacade:
                 self.__notifier.unsign_listener(user_id, store_id)
                 db.session.query(StoreRole).filter_by(store_id=store_id, user_id=user_id).delete()
                 db.session.query(Permissions).filter_by(store_id=store_id, user_id=user_id).delete()
-            db.session.commit()
+            commit()
 
     def get_employees_info(self, store_id: int, actor_id: int) -> Dict[int, str]:
         if not db.session.query(StoreRole).filter_by(store_id=store_id).first():
@@ -539,6 +539,9 @@ class RolesFacade:
     def is_system_manager(self, user_id: int) -> bool:
         return db.session.query(SystemManagerModel).filter_by(user_id=user_id).first() is not None
 
+    def get_system_managers(self) -> List[int]:
+        return self.__load_system_managers_from_db()
+
     def add_system_manager(self, actor: int, user_id: int) -> None:
         with self.__system_managers_lock:
             res = db.session.query(SystemManagerModel).filter_by(is_admin=True).first() is not None
@@ -548,7 +551,7 @@ class RolesFacade:
                 return
             system_manager_model = SystemManagerModel(user_id=user_id, is_admin=False)
             db.session.add(system_manager_model)
-            db.session.commit()
+            commit()
 
     def remove_system_manager(self, actor: int, user_id: int) -> None:
         with self.__system_managers_lock:
@@ -559,7 +562,7 @@ class RolesFacade:
             if not self.is_system_manager(user_id):
                 raise RoleError("User is not a system manager", RoleErrorTypes.user_not_system_manager)
             db.session.query(SystemManagerModel).filter_by(user_id=user_id).delete()
-            db.session.commit()
+            commit()
 
     def add_admin(self, user_id: int) -> None:
         if self.__load_system_admin_from_db() != -1:
@@ -750,19 +753,18 @@ class RolesFacade:
             return [role.user_id for role in roles]
 
     def get_bid_owners_managers(self, store_id: int) -> List[int]:
-        if not db.session.query(StoreRole).filter_by(store_id=store_id).first():
+        # the owners and the managers with the get_bid permission, the roles are read together with their permissions
+        # in a single query so no lock is needed
+        roles = (db.session.query(StoreRole.user_id, StoreRole.type, Permissions.get_bid)
+                 .outerjoin(Permissions, and_(Permissions.store_id == StoreRole.store_id,
+                                              Permissions.user_id == StoreRole.user_id))
+                 .filter(StoreRole.store_id == store_id)
+                 .all())
+        if not roles:
             raise StoreError("Store does not exist", StoreErrorTypes.store_not_found)
-        with self.__stores_locks[store_id]:
-            owners_managers = []
-            roles = db.session.query(StoreRole).filter_by(store_id=store_id).all()
-            for role in roles:
-                if isinstance(role, StoreOwner):
-                    owners_managers.append(int(role.user_id))
-                elif isinstance(role, StoreManager):
-                    per = db.session.query(Permissions).filter_by(store_id=store_id, user_id=role.user_id).one_or_none()
-                    if per.get_bid:
-                        owners_managers.append(int(role.user_id))
-            return owners_managers
+        return [int(user_id) for user_id, role_type, get_bid in roles
+                if role_type == StoreOwner.__mapper_args__['polymorphic_identity']
+                or (role_type == StoreManager.__mapper_args__['polymorphic_identity'] and get_bid)]
 
     def get_role(self, store_id: int, user_id: int) -> StoreRole:
         return db.session.query(StoreRole).filter_by(store_id=store_id, user_id=user_id).one_or_none()
@@ -784,7 +786,7 @@ class RolesFacade:
         tree = Tree.from_db(store_id)
         removed_nodes = tree.remove_node(user_id)
         db.session.query(TreeNode).filter(TreeNode.store_id == store_id, TreeNode.data == user_id).delete()
-        db.session.commit()
+        commit()
         return removed_nodes
 
     def is_admin_created(self):
@@ -8,7 +8,7 @@ from typing import Optional, Tuple, Dict
 from backend.business.DTOs import BasketInformationForConstraintDTO
 from backend.business.store.constraints import *
 from backend.error_types import *
-from backend.database import db
+from backend.database import db, commit
 import re
 
 
@@ -355,7 +355,7 @@ class PurchasePolicy(db.Model):
             self._predicate = None
         else:
             self._predicate = predicate.get_constraint_string()
-        db.session.commit()
+        commit()
 
     @abstractmethod
     def get_policy_info_as_dict(self) -> dict:
@@ -6,7 +6,7 @@ from typing import Dict, Optional, Tuple
 from backend.business.DTOs import BasketInformationForConstraintDTO, CategoryDTO
 from backend.business.store.constraints import *
 from backend.error_types import *
-from backend.database import db
+from backend.database import db, commit
 import re
 
 
@@ -383,12 +383,12 @@ class Discount(db.Model):
             raise DiscountAndConstraintsError("Invalid percentage", DiscountAndConstraintsErrorTypes.invalid_percentage)
         logger.info("[Discount] Discount percentage changed to: " + str(new_percentage))
         self._percentage = new_percentage
-        db.session.commit()        
+        commit()        
 
 
     def change_discount_description(self, new_description: str) -> None:
         self._discount_description = new_description
-        db.session.commit()
+        commit()
 
     def is_simple_discount(self) -> bool:
         if self._predicate is None:
@@ -397,7 +397,7 @@ class Discount(db.Model):
     
     def change_predicate(self, new_predicate: Constraint) -> None:
         self._predicate = new_predicate.get_constraint_string()
-        db.session.commit()
+        commit()
 
 
 
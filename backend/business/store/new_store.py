@@ -1,15 +1,18 @@
 # ---------- Imports ------------#
-from typing import Dict, Tuple, Set
+from typing import Dict, Tuple, Set, Union
 
 from .constraints import *
 from .discount import *
 from .PurchasePolicy import *
-from datetime import datetime
+from .reservation import StockReservation, ReservationStatus
+from datetime import datetime, timedelta
 from backend.business.DTOs import ProductDTO, ProductForConstraintDTO, StoreDTO, PurchaseProductDTO, UserInformationForConstraintDTO, CategoryDTO
 from backend.error_types import *
-from backend.database import db
+from backend.database import db, commit, commit_boundary, ensure_app_context
+from backend.business.id_allocator import IdAllocator, first_free_id
 
 import threading
+import time
 # -------------logging configuration----------------
 import logging
 logging.basicConfig(level=logging.INFO, filename='app.log', filemode='w',
@@ -613,15 +616,17 @@ class Store(db.Model):
     _store_name = db.Column(db.String(100))
     _store_founder_id = db.Column(db.Integer)
     _is_active = db.Column(db.Boolean)
-    _product_id_counter = db.Column(db.Integer)
     _founded_date = db.Column(db.DateTime)
     #_policy_id_counter = db.Column(db.Integer)
+    # incremented whenever something that the price of a basket depends on changes, price quotes are bound to them
+    _catalog_version = db.Column(db.Integer, nullable=False, default=0)
+    _discount_version = db.Column(db.Integer, nullable=False, default=0)
+    _policy_version = db.Column(db.Integer, nullable=False, default=0)
 
     _address = db.relationship('StoreAddress', uselist=False, backref='store')
     _store_products = db.relationship('Product', backref='store', lazy=True)
 
     checkout_locks = {}
-    _product_id_locks = {}
 
 
     def __init__(self, store_name: str, store_founder_id: int):
@@ -629,11 +634,12 @@ class Store(db.Model):
         self._store_name = store_name
         self._store_founder_id = store_founder_id
         self._is_active = True
-        self._product_id_counter = 0  # product Id
-        self._product_id_lock = threading.Lock() # lock for product id
         #self._purchase_policy: Dict[int, PurchasePolicy] = {} # purchase policy
         self._founded_date = datetime.now()
         #self._policy_id_counter = 0  # purchase policy Id
+        self._catalog_version = 0
+        self._discount_version = 0
+        self._policy_version = 0
 
     # ---------------------getters and setters---------------------#
 
@@ -672,6 +678,36 @@ class Store(db.Model):
     def purchase_policy(self) -> List[int]:
         res = db.session.query(PurchasePolicy).filter(PurchasePolicy.store_id == self.store_id).all()
         return list(set([policy.policy_id for policy in res]))
+
+    @property
+    def catalog_version(self) -> int:
+        return self._catalog_version
+
+    @property
+    def discount_version(self) -> int:
+        return self._discount_version
+
+    @property
+    def policy_version(self) -> int:
+        return self._policy_version
+
+    @property
+    def pricing_versions(self) -> Tuple[int, int, int]:
+        return self._catalog_version, self._discount_version, self._policy_version
+
+    def __increment_version(self, column) -> None:
+        # an atomic update, so concurrent changes of the same store never end up with the same version
+        (db.session.query(Store).filter(Store.store_id == self.store_id)
+         .update({column: column + 1}, synchronize_session='fetch'))
+
+    def increment_catalog_version(self) -> None:
+        self.__increment_version(Store._catalog_version)
+
+    def increment_discount_version(self) -> None:
+        self.__increment_version(Store._discount_version)
+
+    def increment_policy_version(self) -> None:
+        self.__increment_version(Store._policy_version)
     # ---------------------methods--------------------------------
     def close_store(self, user_id: int) -> None:
         """
@@ -718,17 +754,6 @@ class Store(db.Model):
         if self.store_id in self.checkout_locks:
             self.checkout_locks[self.store_id].release()
 
-    def __acquire_product_id_lock(self) -> None:
-        if self.store_id not in self._product_id_locks:
-            self._product_id_locks[self.store_id] = threading.Lock()
-
-        self._product_id_locks[self.store_id].acquire()
-
-    def __release_product_id_lock(self) -> None:
-        if self.store_id in self._product_id_locks:
-            self._product_id_locks[self.store_id].release()
-
-
     # We assume that the marketFacade verified that the user attempting to add the product is a store Owner
     def add_product(self, name: str, description: str, price: float, tags: List[str], weight: float, amount: int = 0) -> int:
         """
@@ -736,13 +761,13 @@ class Store(db.Model):
         * This function adds a product to the store
         * Returns: none
         """
-        self.__acquire_product_id_lock()
-        product = Product(self.store_id, self._product_id_counter, name, description, price, weight, amount)
+        product_id = IdAllocator().allocate(f'store_products:{self.store_id}',
+                                            lambda: first_free_id(Product.product_id, Product.store_id == self.store_id))
+        product = Product(self.store_id, product_id, name, description, price, weight, amount)
         for tag in tags:
             product.add_tag(tag)
         db.session.add(product)
-        self._product_id_counter += 1
-        self.__release_product_id_lock()
+        self.increment_catalog_version()
         logger.info('[Store] successfully added product to store with id: ' + str(self.store_id))
         return product.product_id
 
@@ -755,8 +780,9 @@ class Store(db.Model):
         """
         try:
             self.acquire_products_lock([product_id])
-            db.session.query(Product).filter(Product.product_id == product_id).delete()
+            db.session.query(Product).filter(Product.store_id == self.store_id, Product.product_id == product_id).delete()
             Product.product_locks[product_id].release()
+            self.increment_catalog_version()
             logger.info('Successfully removed product from store with id: {self.__store_id}')
         except KeyError:
             raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
@@ -768,7 +794,7 @@ class Store(db.Model):
         * Returns: the product with the given ID
         """
         try:
-            return db.session.query(Product).filter(Product.product_id == product_id).one()
+            return db.session.query(Product).filter(Product.store_id == self.store_id, Product.product_id == product_id).one()
         except Exception:
             raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
 
@@ -806,7 +832,7 @@ class Store(db.Model):
             #self._policy_id_counter += 1
         
         elif category_id is None and product_id is not None:
-            if db.session.query(Product).filter(Product.product_id == product_id).count() == 0:
+            if db.session.query(Product).filter(Product.store_id == self.store_id, Product.product_id == product_id).count() == 0:
                 logger.warning('[Store] Product is not found in the store with id: {self.__store_id}')
                 raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
             product_policy_to_add = ProductSpecificPurchasePolicy(self.store_id, policy_name, product_id)
@@ -824,7 +850,8 @@ class Store(db.Model):
             raise StoreError('Something unexpected happened when adding the purchase policy to the store with id: {self.__store_id}', StoreErrorTypes.unexpected_error)
 
         # db.session.add(self._purchase_policy[policy_id])
-        db.session.commit()
+        self.increment_policy_version()
+        commit()
 
         logger.info('[Store] successfully added purchase policy to store with id: {self.__store_id}')
         return policy_id
@@ -856,7 +883,8 @@ class Store(db.Model):
         self.__get_purchase_policy_by_id(policy_id) # check for existance
         
         db.session.query(PurchasePolicy).filter(PurchasePolicy.policy_id == policy_id).delete()
-        db.session.commit()
+        self.increment_policy_version()
+        commit()
 
         logger.info('[Store] successfully removed purchase policy from store with id: {self.__store_id}')
         
@@ -926,7 +954,8 @@ class Store(db.Model):
         db.session.query(PurchasePolicy).filter(PurchasePolicy.policy_id == policy_id_right).delete()
 
         db.session.add(new_policy)
-        db.session.commit()
+        self.increment_policy_version()
+        commit()
 
         logger.info('[Store] successfully created composite purchase policy in store with id: {self.__store_id}')
         return new_policy_id
@@ -941,11 +970,14 @@ class Store(db.Model):
         #     raise StoreError('Purchase policy is not found', StoreErrorTypes.policy_not_found)
         pol = self.__get_purchase_policy_by_id(policy_id)
         pol.set_predicate(predicate)
+        self.increment_policy_version()
+        commit()
         #self._purchase_policy[policy_id].set_predicate(predicate)
 
-    def check_purchase_policies_of_store(self, basket: BasketInformationForConstraintDTO) -> bool:
+    def check_purchase_policies_of_store(self, basket: BasketInformationForConstraintDTO,
+                                         policies: Optional[List[PurchasePolicy]] = None) -> bool:
         """
-        * Parameters: basket
+        * Parameters: basket, policies(default=None) - the policies of the store if they were already loaded
         * This function checks if the purchase policy is satisfied
         * Returns: true if the purchase policy is satisfied
         """
@@ -954,7 +986,9 @@ class Store(db.Model):
         if basket.store_id != self.store_id:
             raise PurchaseError('Basket is not from the same store', PurchaseErrorTypes.basket_not_for_store)
 
-        for policy in db.session.query(PurchasePolicy).filter(PurchasePolicy.store_id == self.store_id).all():
+        if policies is None:
+            policies = db.session.query(PurchasePolicy).filter(PurchasePolicy.store_id == self.store_id).all()
+        for policy in policies:
             if not policy.check_constraint(basket):
                 return False
         return True
@@ -1065,6 +1099,8 @@ class Store(db.Model):
         
         if product is not None:
             product.change_description(new_description)
+            self.increment_catalog_version()
+            commit()
             logger.info('Successfully changed description of product with id: {product_id}')
         else:
             raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
@@ -1082,6 +1118,8 @@ class Store(db.Model):
         
         if product is not None:
             product.change_price(new_price)
+            self.increment_catalog_version()
+            commit()
             logger.info('Successfully changed price of product with id: {product_id} to {new_price}')
         else:
             raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
@@ -1175,6 +1213,8 @@ class Store(db.Model):
         """
         product = self.get_product_by_id(product_id)
         product.change_weight(new_weight)
+        self.increment_catalog_version()
+        commit()
 
     
     def edit_product(self, product_id: int, name: str, description: str, price: float, tags: List[str], weight: float, amount: Optional[int]=None) -> None:
@@ -1191,6 +1231,8 @@ class Store(db.Model):
         product.change_tags(tags)
         if amount is not None:
             product.change_amount(amount)
+        self.increment_catalog_version()
+        commit()
         logger.info('[Store] successfully edited product in store with id: ' + str(self.store_id))
 # ---------------------end of classes---------------------#
 
@@ -1198,12 +1240,11 @@ def create_store(address: AddressDTO, store_name: str, store_founder_id: int) ->
     if store_name is None or store_name == '':
         raise StoreError('Store name is not a valid string', StoreErrorTypes.invalid_store_name)
     st = Store(store_name, store_founder_id)
-    from backend.app_factory import get_app
-    with get_app().app_context():
+    with ensure_app_context():
         db.session.add(st)
         db.session.flush()
         st.set_new_address(address)
-        db.session.commit()
+        commit()
         db.session.refresh(st)
     logger.info('[Store] successfully created store with id: ' + str(st.store_id))
     return st
@@ -1278,10 +1319,10 @@ class StoreFacade:
         if not hasattr(self, '_initialized'):
             self._initialized = True
             self.__categories: Dict[int, Category] = {}  # category_id: Category
-            self.__category_id_counter = 0  # Counter for category IDs
-            self.__category_id_lock = threading.Lock() # lock for category id
             self.__store_id_lock = threading.Lock() # lock for store id
             self.__tags: Set[str] = set() # all existing product tags for fast access
+            # the categories are kept in memory, so their changes are versioned here and not in the stores
+            self.__category_version = 0
             logger.info('successfully created storeFacade')
 
     def clean_data(self):
@@ -1289,7 +1330,8 @@ class StoreFacade:
         For testing purposes only
         """
         self.__categories = {}
-        self.__category_id_counter = 0
+        IdAllocator().reset('categories')
+        IdAllocator().reset('store_products:', prefix=True)
         self.__tags = {
                        'alcoholic', 'tobacco', 'food', 'utilities',
                         'clothing', 'electronics', 'furniture', 'toys', 'books',
@@ -1303,6 +1345,10 @@ class StoreFacade:
     def categories(self) -> List[int]:
         return list(self.__categories.keys())
 
+    @property
+    def category_version(self) -> int:
+        return self.__category_version
+
     @property
     def stores(self) -> List[int]:
         res = db.session.query(Store).all()
@@ -1351,10 +1397,8 @@ class StoreFacade:
         * Returns: none
         """
         if category_name is not None or category_name != '':
-            with self.__category_id_lock:
-                category = Category(self.__category_id_counter, category_name)
-                self.__categories[self.__category_id_counter] = category
-                self.__category_id_counter += 1
+            category = Category(IdAllocator().allocate('categories'), category_name)
+            self.__categories[category.category_id] = category
             logger.info(f'[StoreFacade] successfully added category: {category_name}')
             return category.category_id
         else:
@@ -1384,6 +1428,7 @@ class StoreFacade:
         if parent_category is not None:
             parent_category.remove_sub_category(category_to_remove)
         self.__categories.pop(category_id)
+        self.__category_version += 1
         logger.info(f'Successfully removed category with id: {category_id}')
 
     def assign_sub_category_to_category(self, sub_category_id: int, category_id: int) -> None:
@@ -1399,6 +1444,7 @@ class StoreFacade:
         sub_category = self.get_category_by_id(sub_category_id)
         category = self.get_category_by_id(category_id)
         category.add_sub_category(sub_category)
+        self.__category_version += 1
 
     def delete_sub_category_from_category(self, category_id: int, sub_category_id: int) -> None:
         """
@@ -1415,6 +1461,7 @@ class StoreFacade:
         category = self.get_category_by_id(category_id)
         sub_category = self.get_category_by_id(sub_category_id)
         category.remove_sub_category(sub_category)
+        self.__category_version += 1
 
     def assign_product_to_category(self, category_id: int, store_id: int, product_id: int) -> None:
         """
@@ -1424,6 +1471,7 @@ class StoreFacade:
         """
         category = self.get_category_by_id(category_id)
         category.add_product_to_category(store_id, product_id)
+        self.__category_version += 1
 
     def remove_product_from_category(self, category_id: int, store_id: int, product_id: int) -> None:
         """
@@ -1435,6 +1483,7 @@ class StoreFacade:
         """
         category = self.get_category_by_id(category_id)
         category.remove_product_from_category(store_id, product_id)
+        self.__category_version += 1
 
     def add_product_to_store(self, store_id: int, product_name: str, description: str, price: float, weight: float,
                              tags: Optional[List[str]]=[], amount: Optional[int] = 0) -> int:
@@ -1687,7 +1736,8 @@ class StoreFacade:
             db.session.flush()
             id = new_store_discount.discount_id
         
-        db.session.commit()
+        self.__get_store_by_id(store_id).increment_discount_version()
+        commit()
         return id
     
 
@@ -1741,7 +1791,8 @@ class StoreFacade:
             db.session.flush()
             id = new_xor_discount.discount_id
 
-        db.session.commit()
+        self.__get_store_by_id(store_id).increment_discount_version()
+        commit()
         return id
 
 
@@ -1800,7 +1851,8 @@ class StoreFacade:
             db.session.flush()
             id = new_additive_discount.discount_id
 
-        db.session.commit()
+        self.__get_store_by_id(store_id).increment_discount_version()
+        commit()
         return id
     
     def assign_predicate_helper(self, predicate_properties: Tuple) -> Optional[Constraint]:
@@ -2037,6 +2089,8 @@ class StoreFacade:
             raise DiscountAndConstraintsError('No valid predicate found',DiscountAndConstraintsErrorTypes.no_predicate_found)
         
         discount.change_predicate(predicate)
+        self.__get_store_by_id(discount.store_id).increment_discount_version()
+        commit()
 
     # we assume that the marketFacade verified that the user has necessary permissions to remove a discount
     def remove_discount(self, discount_id: int) -> None:
@@ -2049,11 +2103,12 @@ class StoreFacade:
         discount = db.session.query(Discount).filter(Discount.discount_id == discount_id).first()
         if discount is not None:
             logger.info('[StoreFacade] successfully removed discount')
+            self.__get_store_by_id(discount.store_id).increment_discount_version()
             db.session.delete(discount)
         else:
             logger.error('[StoreFacade] discount is not found')
             raise DiscountAndConstraintsError('Discount is not found',DiscountAndConstraintsErrorTypes.discount_not_found)
-        db.session.commit()
+        commit()
 
 
     def change_discount_percentage(self, discount_id: int, new_percentage: float) -> None:
@@ -2073,6 +2128,8 @@ class StoreFacade:
             raise DiscountAndConstraintsError('Percentage is negative',DiscountAndConstraintsErrorTypes.invalid_percentage)
         
         discount.change_discount_percentage(new_percentage)
+        self.__get_store_by_id(discount.store_id).increment_discount_version()
+        commit()
 
     def change_discount_description(self, discount_id: int, new_description: str) -> None:
         """
@@ -2203,6 +2260,10 @@ class StoreFacade:
             logger.info(f'[StoreFacade] discount {discount_id} not applied on store {store_id}!')
             return 0.0
     
+    def __get_discounts_of_store(self, store_id: int) -> List[Discount]:
+        # store_id is a plain property of the discount, the query has to use the mapped column
+        return db.session.query(Discount).filter(Discount._store_id == store_id).order_by(Discount.discount_id).all()
+
     def get_total_price_before_discount(self, shopping_cart: Dict[int, Dict[int, int]]) -> float:
         """
         * Parameters: shoppingCart
@@ -2234,7 +2295,7 @@ class StoreFacade:
         total_price = 0.0
         for store_id, products in shopping_cart.items():
             price_before_discount = self.get_total_basket_price_before_discount(store_id, products)
-            discounts = db.session.query(Discount).filter(Discount.store_id == store_id).all()
+            discounts = self.__get_discounts_of_store(store_id)
             for discount in discounts:
                 price_before_discount = price_before_discount - self.apply_discount(discount.discount_id, store_id, price_before_discount, products, user_info)
             total_price += price_before_discount
@@ -2407,32 +2468,372 @@ class StoreFacade:
             self.__release_store_locks(list(shopping_cart.keys()))
             raise e
 
+    # --------------------methods for stock reservations---------------------------#
+
+    def __get_active_reservation(self, user_id: int, store_id: int, product_id: int) -> Optional[StockReservation]:
+        return (db.session.query(StockReservation)
+                .filter(StockReservation._user_id == user_id, StockReservation._store_id == store_id,
+                        StockReservation._product_id == product_id,
+                        StockReservation._status == ReservationStatus.active)
+                .first())
+
+    def reserve_products(self, user_id: int, shopping_cart: Dict[int, Dict[int, int]], ttl_seconds: int) -> None:
+        """
+        * Parameters: user_id, shoppingCart, ttl_seconds
+        * This function sets the amounts the user holds of the products in the shopping cart to the given amounts,
+          the difference is taken from (or returned to) the store stock. Either all products are reserved or none
+        * Returns: none
+        """
+        store_ids = list(shopping_cart.keys())
+        self.__acquire_store_locks(store_ids)
+        try:
+            expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+            changes: List[Tuple[Store, int, int, Optional[StockReservation]]] = []
+            for store_id, products in shopping_cart.items():
+                store = self.__get_store_by_id(store_id)
+                if not store.is_active:
+                    raise StoreError('Store is not active', StoreErrorTypes.store_not_active)
+                for product_id, amount in products.items():
+                    reservation = self.__get_active_reservation(user_id, store_id, product_id)
+                    reserved = reservation.amount if reservation is not None else 0
+                    if amount > reserved and not store.has_amount_of_product(product_id, amount - reserved):
+                        raise StoreError('Store does not have the given amount of the product', StoreErrorTypes.product_not_available)
+                    changes.append((store, product_id, amount, reservation))
+
+            for store, product_id, amount, reservation in changes:
+                reserved = reservation.amount if reservation is not None else 0
+                if amount > reserved:
+                    store.remove_product_amount(product_id, amount - reserved)
+                elif amount < reserved:
+                    store.restock_product(product_id, reserved - amount)
+                if reservation is None:
+                    if amount > 0:
+                        db.session.add(StockReservation(user_id, store.store_id, product_id, amount, expires_at))
+                elif amount == 0:
+                    reservation.release()
+                else:
+                    reservation.change_amount(amount, expires_at)
+            commit_boundary()
+            logger.info(f'[StoreFacade] successfully reserved products for user {user_id}')
+        except Exception as e:
+            db.session.rollback()
+            raise e
+        finally:
+            self.__release_store_locks(store_ids)
+
+    def reserve_products_batch(self, requests: List[Tuple[int, Dict[int, Dict[int, int]]]], ttl_seconds: int) \
+            -> List[Optional[Exception]]:
+        """
+        * Parameters: requests, ttl_seconds
+        * This function reserves the shopping carts of many users, every user may appear once. The carts are grouped
+          by the stores they buy from, every group is checked against the stock under a single acquisition of the
+          store locks and written in one transaction. A cart that can not be reserved does not affect its group
+        * Returns: for every request None if its products were reserved, otherwise the error
+        """
+        results: List[Optional[Exception]] = [None] * len(requests)
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for index, (_, shopping_cart) in enumerate(requests):
+            groups.setdefault(tuple(sorted(shopping_cart.keys())), []).append(index)
+        expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+
+        for store_ids, indexes in groups.items():
+            try:
+                self.__acquire_store_locks(list(store_ids))
+            except Exception as e:
+                for index in indexes:
+                    results[index] = e
+                continue
+            try:
+                stores = {store.store_id: store
+                          for store in db.session.query(Store).filter(Store.store_id.in_(store_ids)).all()}
+                products = {(product.store_id, product.product_id): product
+                            for product in db.session.query(Product).filter(Product.store_id.in_(store_ids)).all()}
+                user_ids = [requests[index][0] for index in indexes]
+                reservations = {(reservation.user_id, reservation.store_id, reservation.product_id): reservation
+                                for reservation in db.session.query(StockReservation)
+                                .filter(StockReservation._user_id.in_(user_ids),
+                                        StockReservation._store_id.in_(store_ids),
+                                        StockReservation._status == ReservationStatus.active)
+                                .all()}
+                available = {key: product.amount for key, product in products.items()}
+
+                for index in indexes:
+                    user_id, shopping_cart = requests[index]
+                    needed: Dict[Tuple[int, int], int] = {}
+                    try:
+                        for store_id, basket in shopping_cart.items():
+                            if not stores[store_id].is_active:
+                                raise StoreError('Store is not active', StoreErrorTypes.store_not_active)
+                            for product_id, amount in basket.items():
+                                if (store_id, product_id) not in products:
+                                    raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
+                                reservation = reservations.get((user_id, store_id, product_id))
+                                reserved = reservation.amount if reservation is not None else 0
+                                needed[(store_id, product_id)] = amount - reserved
+                        if any(need > available[key] for key, need in needed.items()):
+                            raise StoreError('Store does not have the given amount of the product', StoreErrorTypes.product_not_available)
+                    except StoreError as e:
+                        results[index] = e
+                        continue
+
+                    for (store_id, product_id), need in needed.items():
+                        available[(store_id, product_id)] -= need
+                        product = products[(store_id, product_id)]
+                        if need > 0:
+                            product.remove_amount(need)
+                        elif need < 0:
+                            product.restock(-need)
+                        amount = shopping_cart[store_id][product_id]
+                        reservation = reservations.get((user_id, store_id, product_id))
+                        if reservation is None:
+                            if amount > 0:
+                                db.session.add(StockReservation(user_id, store_id, product_id, amount, expires_at))
+                        elif amount == 0:
+                            reservation.release()
+                        else:
+                            reservation.change_amount(amount, expires_at)
+                commit_boundary()
+                logger.info(f'[StoreFacade] successfully reserved {len(indexes)} carts of stores {list(store_ids)}')
+            except Exception as e:
+                db.session.rollback()
+                for index in indexes:
+                    if results[index] is None:
+                        results[index] = e
+            finally:
+                self.__release_store_locks(list(store_ids))
+        return results
+
+    def __get_reservations_of_cart(self, user_id: int, shopping_cart: Dict[int, Dict[int, int]]) \
+            -> List[StockReservation]:
+        # the rows are locked, so the reservation sweeper can not return them while they are being used
+        reservations: List[StockReservation] = []
+        for store_id, products in shopping_cart.items():
+            for product_id, amount in products.items():
+                reservation = (db.session.query(StockReservation)
+                               .filter(StockReservation._user_id == user_id, StockReservation._store_id == store_id,
+                                       StockReservation._product_id == product_id,
+                                       StockReservation._status == ReservationStatus.active)
+                               .with_for_update()
+                               .first())
+                if reservation is None or reservation.amount < amount:
+                    raise StoreError(f'The reservation of product {product_id} in store {store_id} is no longer held',
+                                     StoreErrorTypes.reservation_expired)
+                reservations.append(reservation)
+        return reservations
+
+    def extend_reservations(self, user_id: int, shopping_cart: Dict[int, Dict[int, int]], ttl_seconds: int) -> None:
+        """
+        * Parameters: user_id, shoppingCart, ttl_seconds
+        * This function keeps the reservations of the products in the shopping cart for at least ttl_seconds more
+        * Raises: StoreError(reservation_expired) if a product of the cart is no longer reserved for the user
+        * Returns: none
+        """
+        try:
+            expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+            for reservation in self.__get_reservations_of_cart(user_id, shopping_cart):
+                reservation.extend(expires_at)
+            commit_boundary()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+
+    def commit_reservations(self, user_id: int, shopping_cart: Dict[int, Dict[int, int]], purchase_id: int) -> None:
+        """
+        * Parameters: user_id, shoppingCart, purchase_id
+        * This function marks the reservations of the products in the shopping cart as sold in the given purchase
+        * Raises: StoreError(reservation_expired) if a product of the cart is no longer reserved for the user, the
+          stock of such a product may already be sold to someone else
+        * Returns: none
+        """
+        for reservation in self.__get_reservations_of_cart(user_id, shopping_cart):
+            reservation.commit(purchase_id)
+        db.session.flush()
+        logger.info(f'[StoreFacade] committed reservations of user {user_id} to purchase {purchase_id}')
+
+    def release_reservations(self, user_id: int, shopping_cart: Optional[Dict[int, Dict[int, int]]] = None) -> None:
+        """
+        * Parameters: user_id, shoppingCart(default=None)
+        * This function returns the reserved amounts of the user to the store stock, if a shopping cart is given only
+          the reservations of its products are released
+        * Returns: none
+        """
+        reservations = (db.session.query(StockReservation)
+                        .filter(StockReservation._user_id == user_id,
+                                StockReservation._status == ReservationStatus.active)
+                        .all())
+        if shopping_cart is not None:
+            reservations = [reservation for reservation in reservations
+                            if reservation.product_id in shopping_cart.get(reservation.store_id, {})]
+        self.__return_reservations(reservations, expired=False)
+
+    def release_expired_reservations(self) -> int:
+        """
+        * Parameters: none
+        * This function returns the amounts of all the reservations whose time to live passed to the store stock
+        * Returns: the number of released reservations
+        """
+        reservations = (db.session.query(StockReservation)
+                        .filter(StockReservation._status == ReservationStatus.active,
+                                StockReservation._expires_at < datetime.now())
+                        .all())
+        self.__return_reservations(reservations, expired=True)
+        return len(reservations)
+
+    def __return_reservations(self, reservations: List[StockReservation], expired: bool) -> None:
+        if not reservations:
+            return
+        store_ids = list({reservation.store_id for reservation in reservations})
+        self.__acquire_store_locks(store_ids)
+        try:
+            now = datetime.now()
+            for reservation in reservations:
+                db.session.refresh(reservation, with_for_update=True)
+                # the reservation may have been committed or extended while we were waiting for the lock
+                if reservation.status != ReservationStatus.active or (expired and reservation.expires_at >= now):
+                    continue
+                store = self.__get_store_by_id(reservation.store_id)
+                store.restock_product(reservation.product_id, reservation.amount)
+                reservation.release(expired)
+            commit_boundary()
+            logger.info(f'[StoreFacade] released {len(reservations)} reservations')
+        except Exception as e:
+            db.session.rollback()
+            raise e
+        finally:
+            self.__release_store_locks(store_ids)
+
+    def start_reservation_sweeper(self, app, interval_seconds: float) -> None:
+        """
+        * Parameters: app, interval_seconds
+        * This function starts a background thread that releases expired reservations every interval_seconds
+        * Returns: none
+        """
+        if getattr(self, '_reservation_sweeper', None) is not None:
+            return
+
+        def sweep():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    with app.app_context():
+                        released = self.release_expired_reservations()
+                    if released:
+                        logger.info(f'[StoreFacade] reservation sweeper released {released} expired reservations')
+                except Exception as e:
+                    logger.error(f'[StoreFacade] reservation sweeper failed: {e}')
+
+        self._reservation_sweeper = threading.Thread(target=sweep, name='reservation-sweeper', daemon=True)
+        self._reservation_sweeper.start()
+
     def get_purchase_shopping_cart(self, user_info: UserInformationForConstraintDTO, shopping_cart: Dict[int, Dict[int, int]]) \
             -> Dict[int, Tuple[List[PurchaseProductDTO], float, float]]:
+        pricing = self.__load_pricing(list(shopping_cart.keys()))
         purchase_shopping_cart: Dict[int, Tuple[List[PurchaseProductDTO], float, float]] = {}
 
         for store_id, products in shopping_cart.items():
-            purchase_products: List[PurchaseProductDTO] = []
-            store = self.__get_store_by_id(store_id)
-
-            for product_id in products:
-                product = store.get_product_by_id(product_id)
-                amount = products[product_id]
-                name = product.product_name
-                description = product.description
-                price = product.price
-                purchase_products.append(PurchaseProductDTO(product_id, name, description, price, amount))
-
-            basket_price_before_discount = store.get_total_price_of_basket_before_discount(products)
-            temp_price = basket_price_before_discount
-            for discount in db.session.query(Discount).filter(Discount.store_id == store_id).all():
-                temp_price = temp_price - self.apply_discount(discount.discount_id, store_id, temp_price, products, user_info)
-            basket_price_after_discount = temp_price
-            purchase_shopping_cart[store_id] = (purchase_products,
-                                                basket_price_before_discount,
-                                                basket_price_after_discount)
+            purchase_shopping_cart[store_id] = self.__price_basket(store_id, products, user_info, False, pricing)
         return purchase_shopping_cart
 
+    def __load_pricing(self, store_ids: List[int]) \
+            -> Dict[int, Tuple[Store, Dict[int, Product], List[Discount], List[PurchasePolicy]]]:
+        # the stores, products, discounts and policies of all the stores are loaded with one query each
+        pricing: Dict[int, Tuple[Store, Dict[int, Product], List[Discount], List[PurchasePolicy]]] = {
+            store.store_id: (store, {}, [], [])
+            for store in db.session.query(Store).filter(Store.store_id.in_(store_ids)).all()}
+        for product in db.session.query(Product).filter(Product.store_id.in_(store_ids)).all():
+            pricing[product.store_id][1][product.product_id] = product
+        # store_id is a plain property of the discount, the query has to use the mapped column
+        for discount in (db.session.query(Discount).filter(Discount._store_id.in_(store_ids))
+                         .order_by(Discount.discount_id).all()):
+            pricing[discount.store_id][2].append(discount)
+        for policy in db.session.query(PurchasePolicy).filter(PurchasePolicy.store_id.in_(store_ids)).all():
+            pricing[policy.store_id][3].append(policy)
+        return pricing
+
+    def __price_basket(self, store_id: int, basket: Dict[int, int], user_info: UserInformationForConstraintDTO,
+                       check_policies: bool,
+                       pricing: Dict[int, Tuple[Store, Dict[int, Product], List[Discount], List[PurchasePolicy]]]) \
+            -> Tuple[List[PurchaseProductDTO], float, float]:
+        # the single checkout and the batch pricing share this method, so a cart gets the same price on both
+        if store_id not in pricing:
+            raise StoreError('Store not found', StoreErrorTypes.store_not_found)
+        store, products, discounts, policies = pricing[store_id]
+        purchase_products: List[PurchaseProductDTO] = []
+        constraint_products: List[ProductForConstraintDTO] = []
+        basket_price_before_discount = 0.0
+        for product_id, amount in basket.items():
+            product = products.get(product_id)
+            if product is None:
+                raise StoreError('Product is not found', StoreErrorTypes.product_not_found)
+            basket_price_before_discount += product.price * amount
+            purchase_products.append(PurchaseProductDTO(product_id, product.product_name, product.description,
+                                                        product.price, amount))
+            constraint_products.append(ProductForConstraintDTO(product_id, store_id, product.price, product.weight,
+                                                               amount))
+        categories = [self.get_category_as_dto_for_discount(category, basket)
+                      for category in self.__categories.values()]
+
+        basket_info = BasketInformationForConstraintDTO(store_id, constraint_products, basket_price_before_discount,
+                                                        datetime.now(), user_info, categories)
+        if check_policies and not store.check_purchase_policies_of_store(basket_info, policies):
+            raise StoreError("Purchase policies are not met", StoreErrorTypes.policy_not_satisfied)
+
+        basket_price_after_discount = basket_price_before_discount
+        for discount in discounts:
+            basket_info = BasketInformationForConstraintDTO(store_id, constraint_products,
+                                                            basket_price_after_discount, basket_info.time_of_purchase,
+                                                            user_info, categories)
+            basket_price_after_discount -= discount.calculate_discount(basket_info)
+        return purchase_products, basket_price_before_discount, basket_price_after_discount
+
+    def price_carts(self, carts: List[Tuple[UserInformationForConstraintDTO, Dict[int, Dict[int, int]]]],
+                    check_policies: bool = True) \
+            -> List[Union[Tuple[float, float, Dict[int, Tuple[List[PurchaseProductDTO], float, float]]], Exception]]:
+        """
+        * Parameters: carts, check_policies(default=True)
+        * This function validates the purchase policies of many shopping carts (unless check_policies is false) and
+          prices them with the same per store pricing as the single checkout. The stores, products, discounts and
+          policies of all the carts are loaded once
+        * Returns: for every cart either (total price, total price after discounts, purchase shopping cart)
+          or the error that failed it
+        """
+        pricing = self.__load_pricing(list({store_id for _, shopping_cart in carts for store_id in shopping_cart}))
+        results: List[Union[Tuple[float, float, Dict[int, Tuple[List[PurchaseProductDTO], float, float]]], Exception]] = []
+        for user_info, shopping_cart in carts:
+            try:
+                purchase_shopping_cart: Dict[int, Tuple[List[PurchaseProductDTO], float, float]] = {}
+                for store_id, basket in shopping_cart.items():
+                    purchase_shopping_cart[store_id] = self.__price_basket(store_id, basket, user_info,
+                                                                           check_policies, pricing)
+                results.append((sum(price for _, price, _ in purchase_shopping_cart.values()),
+                                sum(price for _, _, price in purchase_shopping_cart.values()),
+                                purchase_shopping_cart))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def get_pricing_versions(self, store_ids: List[int]) -> Dict[int, Tuple[int, int, int]]:
+        """
+        * Parameters: store_ids
+        * This function gets the catalog, discount and policy versions of the stores in one query
+        * Returns: store_id -> (catalog version, discount version, policy version)
+        """
+        if not store_ids:
+            return {}
+        stores = db.session.query(Store).filter(Store.store_id.in_(store_ids)).all()
+        return {store.store_id: store.pricing_versions for store in stores}
+
+    def get_next_discount_change(self, store_ids: List[int]) -> Optional[datetime]:
+        """
+        * Parameters: store_ids
+        * This function finds the next time a discount of one of the stores starts or ends
+        * Returns: the time of the next change, or None if no discount changes in the future
+        """
+        now = datetime.now()
+        changes = [date for store_id in store_ids for discount in self.__get_discounts_of_store(store_id)
+                   for date in (discount.starting_date, discount.ending_date) if date is not None and date > now]
+        return min(changes) if changes else None
+
     # --------------------methods for market facade used by users team---------------------------#
 
     def check_product_availability(self, store_id: int, product_id: int, amount: int) -> bool:
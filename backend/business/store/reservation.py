@@ -0,0 +1,99 @@
+# ---------- Imports ------------#
+from datetime import datetime
+from typing import Optional
+
+from backend.error_types import *
+from backend.database import db
+
+# -------------logging configuration----------------
+import logging
+logger = logging.getLogger("New Store Logger")
+
+
+# ---------------------reservationStatus Enum---------------------#
+class ReservationStatus(Enum):
+    # Enum for the status of a stock reservation
+    active = 1
+    committed = 2
+    released = 3
+    expired = 4
+
+
+# ---------------------stockReservation class---------------------#
+class StockReservation(db.Model):
+    # amount of a product that was taken out of the store stock for a user until the purchase is done
+    __tablename__ = 'stock_reservations'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    _user_id = db.Column(db.Integer, nullable=False)
+    _store_id = db.Column(db.Integer, nullable=False)
+    _product_id = db.Column(db.Integer, nullable=False)
+    _amount = db.Column(db.Integer, nullable=False)
+    _status = db.Column(db.Enum(ReservationStatus), nullable=False)
+    _expires_at = db.Column(db.DateTime, nullable=False)
+    _purchase_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_stock_reservations_user_status', '_user_id', '_status'),
+        db.Index('ix_stock_reservations_status_expires', '_status', '_expires_at'),
+    )
+
+    def __init__(self, user_id: int, store_id: int, product_id: int, amount: int, expires_at: datetime):
+        if amount <= 0:
+            raise StoreError('Amount is not a valid integer', StoreErrorTypes.invalid_amount)
+        self._user_id = user_id
+        self._store_id = store_id
+        self._product_id = product_id
+        self._amount = amount
+        self._status = ReservationStatus.active
+        self._expires_at = expires_at
+        self._purchase_id = None
+        logger.info(f'[StockReservation] reserved {amount} of product {product_id} in store {store_id} for user {user_id}')
+
+    # ---------------------getters and setters---------------------
+    @property
+    def reservation_id(self) -> int:
+        return self.id
+
+    @property
+    def user_id(self) -> int:
+        return self._user_id
+
+    @property
+    def store_id(self) -> int:
+        return self._store_id
+
+    @property
+    def product_id(self) -> int:
+        return self._product_id
+
+    @property
+    def amount(self) -> int:
+        return self._amount
+
+    @property
+    def status(self) -> ReservationStatus:
+        return self._status
+
+    @property
+    def expires_at(self) -> datetime:
+        return self._expires_at
+
+    @property
+    def purchase_id(self) -> Optional[int]:
+        return self._purchase_id
+
+    # ---------------------methods---------------------
+    def change_amount(self, amount: int, expires_at: datetime) -> None:
+        self._amount = amount
+        self._expires_at = expires_at
+
+    def extend(self, expires_at: datetime) -> None:
+        self._expires_at = max(self._expires_at, expires_at)
+
+    def commit(self, purchase_id: Optional[int]) -> None:
+        self._status = ReservationStatus.committed
+        self._purchase_id = purchase_id
+
+    def release(self, expired: bool = False) -> None:
+        self._status = ReservationStatus.expired if expired else ReservationStatus.released
@@ -0,0 +1,224 @@
+# ----------------- imports -----------------#
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import json
+import threading
+
+# -------------logging configuration----------------
+import logging
+
+logger = logging.getLogger('myapp')
+
+DEFAULT_CART_CACHE_MAX_CARTS = 10000  # carts kept by the in-process backend, only flushed carts are evicted
+DEFAULT_CART_CACHE_REDIS_PREFIX = 'tradecenter:cart:'
+
+Cart = Dict[int, Dict[int, int]]
+
+
+def copy_cart(cart: Cart) -> Cart:
+    return {store_id: dict(products) for store_id, products in cart.items()}
+
+
+# -----------------CartCacheBackend Class-----------------#
+class CartCacheBackend(ABC):
+    # the carts of the users with a version, a cart is dirty while it has changes that were not written to the
+    # database. Changes are compare-and-set on the version so concurrent changes of a cart are not lost
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Tuple[Cart, int]]:
+        """
+        * Parameters: user_id
+        * Returns: (a copy of the cart, its version), or None if the cart is not cached
+        """
+        pass
+
+    @abstractmethod
+    def put(self, user_id: int, cart: Cart, version: Optional[int], dirty: bool) -> bool:
+        """
+        * Parameters: user_id, cart, version - the version the cart was read at, None if it was read from the
+          database, dirty
+        * This function saves the cart if it did not change since it was read
+        * Returns: whether the cart was saved
+        """
+        pass
+
+    @abstractmethod
+    def mark_clean(self, user_id: int, version: int) -> None:
+        """
+        * Parameters: user_id, version
+        * This function marks the cart as written to the database, if it did not change since the version was written
+        * Returns: none
+        """
+        pass
+
+    @abstractmethod
+    def dirty_users(self) -> List[int]:
+        pass
+
+    @abstractmethod
+    def delete(self, user_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+# -----------------MemoryCartCacheBackend Class-----------------#
+class MemoryCartCacheBackend(CartCacheBackend):
+    # the carts of a single process, used by the tests and by a deployment with one worker
+
+    def __init__(self, max_carts: int = DEFAULT_CART_CACHE_MAX_CARTS):
+        self.__lock = threading.Lock()
+        self.__carts: 'OrderedDict[int, Tuple[Cart, int]]' = OrderedDict()
+        self.__dirty: set = set()
+        self.__max_carts = max_carts
+
+    def get(self, user_id: int) -> Optional[Tuple[Cart, int]]:
+        with self.__lock:
+            if user_id not in self.__carts:
+                return None
+            self.__carts.move_to_end(user_id)
+            cart, version = self.__carts[user_id]
+            return copy_cart(cart), version
+
+    def put(self, user_id: int, cart: Cart, version: Optional[int], dirty: bool) -> bool:
+        with self.__lock:
+            current = self.__carts.get(user_id)
+            if version is None:
+                if current is not None:
+                    return False
+                new_version = 0
+            else:
+                if current is None or current[1] != version:
+                    return False
+                new_version = version + 1
+            self.__carts[user_id] = (copy_cart(cart), new_version)
+            self.__carts.move_to_end(user_id)
+            if dirty:
+                self.__dirty.add(user_id)
+            self.__evict()
+            return True
+
+    def __evict(self) -> None:
+        # the caller holds the lock
+        for user_id in list(self.__carts):
+            if len(self.__carts) <= self.__max_carts:
+                return
+            if user_id not in self.__dirty:
+                del self.__carts[user_id]
+
+    def mark_clean(self, user_id: int, version: int) -> None:
+        with self.__lock:
+            current = self.__carts.get(user_id)
+            if current is not None and current[1] == version:
+                self.__dirty.discard(user_id)
+
+    def dirty_users(self) -> List[int]:
+        with self.__lock:
+            return list(self.__dirty)
+
+    def delete(self, user_id: int) -> None:
+        with self.__lock:
+            self.__carts.pop(user_id, None)
+            self.__dirty.discard(user_id)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__carts.clear()
+            self.__dirty.clear()
+
+
+# -----------------RedisCartCacheBackend Class-----------------#
+class RedisCartCacheBackend(CartCacheBackend):
+    # the carts of all the workers, kept in redis. The redis package is only needed when this backend is configured
+
+    def __init__(self, url: str, prefix: str = DEFAULT_CART_CACHE_REDIS_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError('CART_CACHE_BACKEND=redis requires the redis package')
+        self.__redis = redis.Redis.from_url(url)
+        self.__watch_error = redis.WatchError
+        self.__prefix = prefix
+        self.__dirty_key = f'{prefix}dirty'
+
+    def __key(self, user_id: int) -> str:
+        return f'{self.__prefix}{user_id}'
+
+    @staticmethod
+    def __decode(value) -> Tuple[Cart, int]:
+        data = json.loads(value)
+        return ({int(store_id): {int(product_id): amount for product_id, amount in products.items()}
+                 for store_id, products in data['cart'].items()}, data['version'])
+
+    def get(self, user_id: int) -> Optional[Tuple[Cart, int]]:
+        value = self.__redis.get(self.__key(user_id))
+        return None if value is None else self.__decode(value)
+
+    def put(self, user_id: int, cart: Cart, version: Optional[int], dirty: bool) -> bool:
+        key = self.__key(user_id)
+        with self.__redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if version is None:
+                    if current is not None:
+                        return False
+                    new_version = 0
+                else:
+                    if current is None or self.__decode(current)[1] != version:
+                        return False
+                    new_version = version + 1
+                pipe.multi()
+                pipe.set(key, json.dumps({'cart': cart, 'version': new_version}))
+                if dirty:
+                    pipe.sadd(self.__dirty_key, user_id)
+                pipe.execute()
+                return True
+            except self.__watch_error:
+                return False
+
+    def mark_clean(self, user_id: int, version: int) -> None:
+        key = self.__key(user_id)
+        with self.__redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if current is None or self.__decode(current)[1] != version:
+                    return
+                pipe.multi()
+                pipe.srem(self.__dirty_key, user_id)
+                pipe.execute()
+            except self.__watch_error:
+                # the cart changed while it was written, it stays dirty
+                pass
+
+    def dirty_users(self) -> List[int]:
+        return [int(user_id) for user_id in self.__redis.smembers(self.__dirty_key)]
+
+    def delete(self, user_id: int) -> None:
+        with self.__redis.pipeline() as pipe:
+            pipe.delete(self.__key(user_id))
+            pipe.srem(self.__dirty_key, user_id)
+            pipe.execute()
+
+    def clear(self) -> None:
+        keys = list(self.__redis.scan_iter(f'{self.__prefix}*'))
+        if keys:
+            self.__redis.delete(*keys)
+
+
+def create_cart_cache_backend(config) -> CartCacheBackend:
+    """
+    * Parameters: config - the configuration of the app
+    * This function creates the cart cache backend of CART_CACHE_BACKEND ('memory' or 'redis')
+    * Returns: the backend
+    """
+    backend = config.get('CART_CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryCartCacheBackend(config.get('CART_CACHE_MAX_CARTS', DEFAULT_CART_CACHE_MAX_CARTS))
+    if backend == 'redis':
+        return RedisCartCacheBackend(config['CART_CACHE_REDIS_URL'])
+    raise ValueError(f'Unknown cart cache backend {backend}')
@@ -1,16 +1,20 @@
 from . import c
-from typing import List, Dict, Optional, Set, Tuple
-from datetime import datetime
+from typing import Iterable, List, Dict, Optional, Set, Tuple
+from datetime import datetime, timedelta
 from abc import ABC, abstractmethod
+import heapq
 import threading
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
 from backend.error_types import *
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Table, and_, not_, or_
 from sqlalchemy import create_engine
-from sqlalchemy.orm import relationship, backref, sessionmaker
-import json
-from ...database import db
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, backref, sessionmaker, contains_eager, joinedload
+from ...database import db, commit, in_unit_of_work
+from .cart_cache import Cart, CartCacheBackend, create_cart_cache_backend
+from ..id_allocator import HOT_ID_BLOCK_SIZE, IdAllocator, first_free_id
 
 import logging
 
@@ -25,66 +29,102 @@ logger = logging.getLogger("User Logger")
 from backend.business.DTOs import NotificationDTO, UserDTO, PurchaseUserDTO
 from .. import NotificationDTO
 
+DEFAULT_GUEST_TTL = 25 * 60 * 60  # seconds, longer than the one day token of a guest
+DEFAULT_GUEST_GC_BATCH_SIZE = 500
+DEFAULT_SUSPENSION_INDEX_REFRESH_INTERVAL = 30  # seconds, picks up the suspensions changed by other processes
+DEFAULT_MEMBER_LISTING_PAGE_SIZE = 100
+DEFAULT_MEMBER_LISTING_MAX_PAGE_SIZE = 1000
+DEFAULT_USERNAME_CACHE_MAX_ENTRIES = 10000
 
-class ShoppingBasket(db.Model):
-    __tablename__ = 'shopping_baskets'
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    store_id = db.Column(db.Integer, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    products = db.Column(db.String(1000), nullable=False)  # JSON string to store product quantities
 
-    user = db.relationship("User", back_populates="baskets")
+class BasketProduct(db.Model):
+    # a product in the basket of a user in a store, the cart of a user is read with one query on the primary key
+    __tablename__ = 'basket_products'
+    user_id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, user_id: int, store_id: int, product_id: int, quantity: int) -> None:
+        self.user_id = user_id
+        self.store_id = store_id
+        self.product_id = product_id
+        self.quantity = quantity
+
+
+def _insert(table):
+    # both dialects the app runs on support INSERT ... ON CONFLICT
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
 
-    # cart = db.relationship("ShoppingCart", back_populates='baskets')
+class ShoppingBasket:
+    # the products of a user in a store, every change is a single statement on the rows of the basket so concurrent
+    # changes to the same basket do not overwrite each other
 
     def __init__(self, store_id: int, user_id: int) -> None:
         self.store_id = store_id
         self.user_id = user_id
-        self.products = json.dumps({})  # Store products as a JSON string
 
-    def add_product(self, product_id: int, quantity: int) -> None:
+    def __rows(self):
+        return db.session.query(BasketProduct).filter(BasketProduct.user_id == self.user_id,
+                                                      BasketProduct.store_id == self.store_id)
+
+    def __add(self, product_id: int, quantity: int) -> None:
         if quantity < 0:
             raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
-        products = self.get_dto()
-        products[product_id] = products.get(product_id, 0) + quantity
-        self.products = json.dumps(products)
+        statement = _insert(BasketProduct.__table__).values(user_id=self.user_id, store_id=self.store_id,
+                                                            product_id=product_id, quantity=quantity)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'store_id', 'product_id'],
+            set_={'quantity': BasketProduct.__table__.c.quantity + quantity}))
+
+    def add_product(self, product_id: int, quantity: int) -> None:
+        self.__add(product_id, quantity)
 
-        db.session.commit()
+        commit()
 
     def get_dto(self) -> Dict[int, int]:
-        dict = json.loads(self.products)
-        ans = {}
-        for key in dict:
-            ans[int(key)] = int(dict[key])
-        return ans
+        return {product_id: quantity for product_id, quantity in
+                self.__rows().with_entities(BasketProduct.product_id, BasketProduct.quantity)}
 
-    def remove_product(self, product_id: int, quantity: int):
+    def __subtract(self, product_id: int, quantity: int) -> None:
         if quantity < 0:
             raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
-        products = self.get_dto()
-        if product_id not in products:
+        product = self.__rows().filter(BasketProduct.product_id == product_id)
+        if product.filter(BasketProduct.quantity >= quantity) \
+                .update({BasketProduct.quantity: BasketProduct.quantity - quantity}, synchronize_session=False):
+            return
+        if product.count() == 0:
             raise StoreError("Product not found", StoreErrorTypes.product_not_found)
-        if products[product_id] < quantity:
-            raise StoreError("Not enough quantity", StoreErrorTypes.product_not_available)
-        products[product_id] -= quantity
-        if products[product_id] == 0:
-            del products[product_id]
-        self.products = json.dumps(products)
+        raise StoreError("Not enough quantity", StoreErrorTypes.product_not_available)
 
-        db.session.commit()
+    def remove_product(self, product_id: int, quantity: int):
+        self.__subtract(product_id, quantity)
+        self.__rows().filter(BasketProduct.product_id == product_id, BasketProduct.quantity == 0) \
+            .delete(synchronize_session=False)
+
+        commit()
 
     def subtract_product(self, product_id: int, quantity: int):
-        if quantity < 0:
-            raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
-        products = self.get_dto()
-        if product_id not in products:
-            raise StoreError("Product not found", StoreErrorTypes.product_not_found)
-        if products[product_id] < quantity:
-            raise StoreError("Not enough quantity", StoreErrorTypes.product_not_available)
-        products[product_id] -= quantity
-        self.products = json.dumps(products)
+        self.__subtract(product_id, quantity)
+
+        commit()
+
+    def exists(self) -> bool:
+        return db.session.query(self.__rows().exists()).scalar()
 
-        db.session.commit()
+    def apply_changes(self, changes: Dict[int, int]) -> None:
+        # product id -> the change of its quantity, the products that reach zero are removed. The caller commits
+        for product_id, change in changes.items():
+            if change > 0:
+                self.__add(product_id, change)
+            elif change < 0:
+                self.__subtract(product_id, -change)
+        self.__rows().filter(BasketProduct.quantity <= 0).delete(synchronize_session=False)
 
 
 class ShoppingCart():
@@ -111,7 +151,7 @@ class ShoppingCart():
             db.session.add(basket)
         basket.add_product(product_id, quantity)
 
-        db.session.commit()
+        commit()
 
     def get_dto(self) -> Dict[int, Dict[int, int]]:
         return {basket.store_id: basket.get_dto() for basket in self.baskets}
@@ -124,7 +164,7 @@ class ShoppingCart():
             raise StoreError("Store not found", StoreErrorTypes.store_not_found)
         basket.remove_product(product_id, quantity)
 
-        db.session.commit()
+        commit()
 
     def subtract_product_from_cart(self, store_id: int, product_id: int, quantity: int) -> None:
         if quantity < 0:
@@ -134,7 +174,7 @@ class ShoppingCart():
             raise StoreError("Store not found", StoreErrorTypes.store_not_found)
         basket.subtract_product(product_id, quantity)
 
-        db.session.commit()
+        commit()
 
 
 class Notification(db.Model):
@@ -157,11 +197,11 @@ class Member(db.Model):
     __tablename__ = 'members'
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), nullable=False)
-    username = db.Column(db.String(50), nullable=False)
+    username = db.Column(db.String(50), nullable=False, unique=True, index=True)
     password = db.Column(db.String(200), nullable=False)
     birthdate = db.Column(db.DateTime, nullable=False)
     phone = db.Column(db.String(20), nullable=False)
-    is_suspended = db.Column(db.Boolean, default=False)
+    is_suspended = db.Column(db.Boolean, default=False, index=True)
     suspended_until = db.Column(db.DateTime, nullable=True)
     notifications = db.relationship('Notification', back_populates='member')
 
@@ -177,7 +217,7 @@ class Member(db.Model):
     def set_suspense(self, value: bool, suspended_until: Optional[datetime]):
         self.is_suspended = value
         self.suspended_until = suspended_until
-        db.session.commit()
+        commit()
 
     def get_password(self):
         return self.password
@@ -187,11 +227,11 @@ class Member(db.Model):
 
     def add_notification(self, notification: Notification):
         self.notifications.append(notification)
-        db.session.commit()
+        commit()
 
     def clear_notifications(self):
         self.notifications.clear()
-        db.session.commit()
+        commit()
 
 
 class User(db.Model):
@@ -200,7 +240,8 @@ class User(db.Model):
     currency = db.Column(db.String(10), nullable=False)
     member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=True)
     member = db.relationship("Member", backref=backref("user", uselist=False))
-    baskets = db.relationship("ShoppingBasket", back_populates='user')
+    # the time after which a guest can not be used anymore and is collected, None for a member
+    guest_expires_at = db.Column(db.DateTime, nullable=True, index=True)
 
     def __init__(self, user_id: int, currency: str = 'USD') -> None:
         if currency not in c.currencies:
@@ -225,7 +266,7 @@ class User(db.Model):
             self.member.add_notification(notification)
 
         db.session.add(notification)
-        db.session.commit()
+        commit()
 
     def get_notifications(self) -> List[Notification]:
         if self.is_member():
@@ -240,60 +281,62 @@ class User(db.Model):
         if quantity < 0:
             raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
         # self.shopping_cart.add_product_to_basket(store_id, product_id, quantity)
-        basket = next((b for b in self.baskets if b.store_id == store_id), None)
-        if not basket:
-            basket = ShoppingBasket(store_id, self.id)
-            self.baskets.append(basket)
-            db.session.add(basket)
-        basket.add_product(product_id, quantity)
-
-        db.session.commit()
+        ShoppingBasket(store_id, self.id).add_product(product_id, quantity)
 
     def get_shopping_cart(self) -> Dict[int, Dict[int, int]]:
         # return self.shopping_cart.get_dto()
-        return {basket.store_id: basket.get_dto() for basket in self.baskets}
+        cart: Dict[int, Dict[int, int]] = {}
+        for store_id, product_id, quantity in (db.session.query(BasketProduct.store_id, BasketProduct.product_id,
+                                                                BasketProduct.quantity)
+                                               .filter(BasketProduct.user_id == self.id)
+                                               .order_by(BasketProduct.store_id, BasketProduct.product_id)):
+            cart.setdefault(store_id, {})[product_id] = quantity
+        return cart
 
     def register(self, email: str, username: str, password: str, year: int, month: int, day: int, phone: str) -> None:
         if email == "" or username == "" or password == "":
             raise UserError("Empty fields", UserErrorTypes.empty_fields)
         if self.is_member():
             raise UserError("User is already registered", UserErrorTypes.user_already_registered)
-        self.member_id = db.session.query(Member).count()
-        self.member = Member(self.member_id, email, username, password, str(year), str(month), str(day), phone)
-        db.session.add(self.member)
-        db.session.commit()
+        member = Member(IdAllocator().allocate('members', lambda: first_free_id(Member.id)), email, username, password,
+                        str(year), str(month), str(day), phone)
+        try:
+            # the unique index on the username rejects a registration that raced with another one
+            with db.session.begin_nested():
+                db.session.add(member)
+        except IntegrityError:
+            raise UserError("Username already exists", UserErrorTypes.username_already_exists)
+        self.member_id = member.id
+        self.member = member
+        self.guest_expires_at = None
+        commit()
 
     def remove_product_from_basket(self, store_id: int, product_id: int, quantity: int):
         if quantity < 0:
             raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
         # self.shopping_cart.remove_product_from_basket(store_id, product_id, quantity)
-        basket = next((b for b in self.baskets if b.store_id == store_id), None)
-        if not basket:
+        basket = ShoppingBasket(store_id, self.id)
+        if not basket.exists():
             raise StoreError("Store not found", StoreErrorTypes.store_not_found)
         basket.remove_product(product_id, quantity)
 
-        db.session.commit()
-
     def subtract_product_from_cart(self, store_id: int, product_id: int, quantity: int):
         if quantity < 0:
             raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
         # self.shopping_cart.subtract_product_from_cart(store_id, product_id, quantity)
-        basket = next((b for b in self.baskets if b.store_id == store_id), None)
-        if not basket:
+        basket = ShoppingBasket(store_id, self.id)
+        if not basket.exists():
             raise StoreError("Store not found", StoreErrorTypes.store_not_found)
         basket.subtract_product(product_id, quantity)
 
-        db.session.commit()
-
     def clear_basket(self):
-        for basket in db.session.query(ShoppingBasket).filter_by(user_id=self.id).all():
-            db.session.delete(basket)
+        db.session.query(BasketProduct).filter(BasketProduct.user_id == self.id).delete(synchronize_session=False)
         # cart = db.session.query(ShoppingCart).filter_by(user_id=self.id).first()
         # db.session.delete(cart)
 
         # self.cart = ShoppingCart(self.id)
         # db.session.add(self.cart)
-        db.session.commit()
+        commit()
 
     def get_password(self):
         if self.is_member():
@@ -302,7 +345,9 @@ class User(db.Model):
 
     def is_suspended(self):
         if self.is_member():
-            return self.member.is_suspended
+            # a temporary suspension is lifted when it ends
+            until = self.member.suspended_until
+            return bool(self.member.is_suspended) and (until is None or until > datetime.now())
         return False
 
     def change_suspend(self, value: bool, suspended_until: Optional[datetime]):
@@ -329,16 +374,14 @@ class User(db.Model):
             for product_id, quantity in products.items():
                 self.add_product_to_basket(store_id, product_id, quantity)
 
-        db.session.commit()
+        commit()
 
 
 class UserFacade:
     # singleton
-    __create_lock = threading.Lock()
     __register_lock = threading.Lock()
     __notification_lock = threading.Lock()
     # __suspend_lock = threading.Lock()
-    __id_serializer: int = 0
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -349,25 +392,94 @@ class UserFacade:
     def __init__(self):
         if not hasattr(self, '_initialized'):
             self._initialized = True
-            self.__id_serializer = db.session.query(User).count()
+            self.__cart_cache: Optional[CartCacheBackend] = None
+            self._cart_flusher = None
+            self._guest_collector = None
+            self.__on_guests_collected = None
+            self.__guest_gc_lock = threading.Lock()
+            self.__guest_gc_metrics = self.__new_guest_gc_metrics()
+            self.__suspension_lock = threading.Lock()
+            # user id -> the end of the suspension (None - permanent) of the suspended users, loaded on the first
+            # check, and a min-heap of the ends of the temporary suspensions
+            self.__suspensions: Optional[Dict[int, Optional[datetime]]] = None
+            self.__suspension_ends: List[Tuple[datetime, int]] = []
+            self.__suspensions_loaded_at = 0.0
+            self.__username_lock = threading.Lock()
+            # username -> (member id, password hash) of the members that logged in or were nominated lately. A member
+            # is never removed and its password is only changed by a rehash of the same password, so an entry of
+            # another process still verifies the password
+            self.__usernames: 'OrderedDict[str, Tuple[int, str]]' = OrderedDict()
+
+    @property
+    def _carts(self) -> CartCacheBackend:
+        # the carts are served from the cache and written to the database by the flusher, at checkout and when a
+        # cart is replaced
+        if self.__cart_cache is None:
+            from flask import current_app
+            self.__cart_cache = create_cart_cache_backend(current_app.config)
+        return self.__cart_cache
 
     def clean_data(self):
         """
         For testing purposes only
         """
-        UserFacade.__id_serializer = 0
         db.session.query(User).delete()
         db.session.query(Member).delete()
         db.session.query(Notification).delete()
-        db.session.query(ShoppingBasket).delete()
-        db.session.commit()
+        db.session.query(BasketProduct).delete()
+        commit()
+        self._carts.clear()
+        with self.__guest_gc_lock:
+            self.__guest_gc_metrics = self.__new_guest_gc_metrics()
+        with self.__suspension_lock:
+            self.__suspensions = None
+        with self.__username_lock:
+            self.__usernames.clear()
+        IdAllocator().reset('users')
+        IdAllocator().reset('members')
+
+    def __load_suspensions(self) -> None:
+        # the caller holds the suspension lock
+        now = datetime.now()
+        self.__suspensions = {user_id: until for user_id, until in
+                              db.session.query(User.id, Member.suspended_until)
+                              .join(Member, User.member_id == Member.id)
+                              .filter(Member.is_suspended.is_(True),
+                                      or_(Member.suspended_until.is_(None), Member.suspended_until > now))}
+        self.__suspension_ends = [(until, user_id) for user_id, until in self.__suspensions.items()
+                                  if until is not None]
+        heapq.heapify(self.__suspension_ends)
+        self.__suspensions_loaded_at = time.time()
+
+    def __suspension_index(self) -> Dict[int, Optional[datetime]]:
+        # the caller holds the suspension lock, returns the users that are suspended now
+        from flask import current_app
+        refresh_interval = current_app.config.get('SUSPENSION_INDEX_REFRESH_INTERVAL',
+                                                  DEFAULT_SUSPENSION_INDEX_REFRESH_INTERVAL)
+        if self.__suspensions is None or time.time() - self.__suspensions_loaded_at >= refresh_interval:
+            self.__load_suspensions()
+        now = datetime.now()
+        while self.__suspension_ends and self.__suspension_ends[0][0] <= now:
+            until, user_id = heapq.heappop(self.__suspension_ends)
+            # a user that was suspended again or unsuspended meanwhile keeps its current suspension
+            if user_id in self.__suspensions and self.__suspensions[user_id] == until:
+                del self.__suspensions[user_id]
+        return self.__suspensions
+
+    def __index_suspension(self, user_id: int, suspended: bool, until: Optional[datetime] = None) -> None:
+        with self.__suspension_lock:
+            if self.__suspensions is None:
+                return
+            if not suspended:
+                self.__suspensions.pop(user_id, None)
+                return
+            self.__suspensions[user_id] = until
+            if until is not None:
+                heapq.heappush(self.__suspension_ends, (until, user_id))
 
     def get_suspended_users(self) -> Dict[int, Optional[datetime]]:
-        # suspended_users = SuspendedUser.query.all()
-        # return {su.user_id: su.suspension_end for su in suspended_users}
-        users = User.query.all()
-        out = {user.id: user.member.suspended_until for user in users if user.is_suspended()}
-        return out
+        with self.__suspension_lock:
+            return dict(self.__suspension_index())
 
     def suspended(self, user_id: int) -> bool:
         """
@@ -375,11 +487,8 @@ class UserFacade:
         otherwise we check if the user is registered and suspended
         * Return True if we can't continue
         """
-        user = User.query.filter_by(id=user_id).first()
-        if not user:
-            return False
-        ans = user.is_suspended()
-        return ans
+        with self.__suspension_lock:
+            return user_id in self.__suspension_index()
 
     def suspend_user_permanently(self, user_id: int):
         """
@@ -390,6 +499,7 @@ class UserFacade:
         if not user:
             raise UserError("User not found", UserErrorTypes.user_not_found)
         user.change_suspend(True, None)
+        self.__index_suspension(user.id, True)
 
     def suspend_user_temporarily(self, user_id: int, date_details: dict, time_details: dict):
         """
@@ -405,6 +515,7 @@ class UserFacade:
         if not user:
             raise UserError("User not found", UserErrorTypes.user_not_found)
         user.change_suspend(True, date)
+        self.__index_suspension(user.id, True, date)
 
     def unsuspend_user(self, user_id: int):
         """
@@ -415,7 +526,8 @@ class UserFacade:
         user = User.query.filter_by(id=user_id).first()
         if not user:
             raise UserError("User not found", UserErrorTypes.user_not_found)
-            user.change_suspend(False, None)
+        user.change_suspend(False, None)
+        self.__index_suspension(user.id, False)
 
     def get_user(self, user_id: int) -> User:
         user = User.query.filter_by(id=user_id).first()
@@ -430,13 +542,14 @@ class UserFacade:
         return user.get_user_dto(role)
 
     def create_user(self, currency: str = "USD") -> int:
-        with UserFacade.__create_lock:
-            id = db.session.query(User).count()
-            # UserFacade.__id_serializer += 1
+        from flask import current_app
+        id = IdAllocator().allocate('users', lambda: first_free_id(User.id), HOT_ID_BLOCK_SIZE)
         user = User(id, currency)
+        user.guest_expires_at = datetime.now() + timedelta(seconds=current_app.config.get('GUEST_TTL',
+                                                                                          DEFAULT_GUEST_TTL))
         logger.info(f"User {id} created")
         db.session.add(user)
-        db.session.commit()
+        commit()
         logger.info(f"User {id} added to database")
         return user.id
 
@@ -453,12 +566,66 @@ class UserFacade:
                 raise UserError("Username already exists", UserErrorTypes.username_already_exists)
 
             user.register(email, username, password, year, month, day, phone)
+        with self.__username_lock:
+            self.__usernames.pop(username, None)
+
+    def __lookup_usernames(self, usernames: List[str]) -> Dict[str, Tuple[int, str]]:
+        # the usernames that are not cached are read with one query on the unique index
+        from flask import current_app
+        found: Dict[str, Tuple[int, str]] = {}
+        with self.__username_lock:
+            for username in usernames:
+                if username in self.__usernames:
+                    self.__usernames.move_to_end(username)
+                    found[username] = self.__usernames[username]
+        missing = [username for username in usernames if username not in found]
+        if not missing:
+            return found
+        rows = db.session.query(Member.username, Member.id, Member.password).filter(Member.username.in_(missing)).all()
+        max_entries = current_app.config.get('USERNAME_CACHE_MAX_ENTRIES', DEFAULT_USERNAME_CACHE_MAX_ENTRIES)
+        with self.__username_lock:
+            for username, member_id, password in rows:
+                found[username] = self.__usernames[username] = (member_id, password)
+                self.__usernames.move_to_end(username)
+            while len(self.__usernames) > max_entries:
+                self.__usernames.popitem(last=False)
+        return found
+
+    def __lookup_username(self, username: str) -> Tuple[int, str]:
+        found = self.__lookup_usernames([username]).get(username)
+        if found is None:
+            raise UserError("Username not found", UserErrorTypes.username_not_found)
+        return found
 
     def get_user_id_from_username(self, username: str) -> int:
-        member = Member.query.filter_by(username=username).first()
+        return self.__lookup_username(username)[0]
+
+    def set_password(self, member_id: int, password: str) -> None:
+        """
+        * Parameters: member_id, password - the new password hash
+        * This function replaces the password hash of the member
+        * Returns: none
+        """
+        member = Member.query.filter_by(id=member_id).first()
         if not member:
-            raise UserError("Username not found", UserErrorTypes.username_not_found)
-        return member.id
+            raise UserError("User not found", UserErrorTypes.user_not_found)
+        member.password = password
+        commit()
+        with self.__username_lock:
+            self.__usernames.pop(member.username, None)
+
+    def get_user_ids_from_usernames(self, usernames: List[str]) -> Dict[str, int]:
+        """
+        * Parameters: usernames
+        * This function resolves many usernames at once, the ones that are not cached are read with one query
+        * Returns: username -> id, in the order of the usernames
+        """
+        usernames = list(dict.fromkeys(usernames))
+        found = self.__lookup_usernames(usernames)
+        missing = [username for username in usernames if username not in found]
+        if missing:
+            raise UserError(f"Username not found: {', '.join(missing)}", UserErrorTypes.username_not_found)
+        return {username: found[username][0] for username in usernames}
 
     def get_notifications(self, user_id: int) -> List[NotificationDTO]:
         with UserFacade.__notification_lock:
@@ -470,10 +637,7 @@ class UserFacade:
         return out
 
     def get_userid(self, username: str) -> int:
-        member = Member.query.filter_by(username=username).first()
-        if not member:
-            raise UserError("Username not found", UserErrorTypes.username_not_found)
-        return member.id
+        return self.__lookup_username(username)[0]
 
     def clear_notifications(self, user_id: int) -> None:
         with UserFacade.__notification_lock:
@@ -484,31 +648,149 @@ class UserFacade:
             self.get_user(user_id).add_notification(
                 Notification(notification.get_message(), notification.get_date()))
 
+    def __cached_cart(self, user_id: int) -> Tuple[int, Cart, int]:
+        # returns (the id the cart is cached by, the cart, its version), a cart that is not cached is read from the
+        # database
+        while True:
+            cached = self._carts.get(user_id)
+            if cached is not None:
+                return (user_id,) + cached
+            user = self.get_user(user_id)
+            if self._carts.put(user.id, user.get_shopping_cart(), None, False) or user.id != user_id:
+                cached = self._carts.get(user.id)
+                if cached is not None:
+                    return (user.id,) + cached
+
+    def __change_cart(self, user_id: int, change) -> int:
+        # applies the change to the cached cart, it is applied again if another request changed the cart meanwhile
+        while True:
+            cart_user_id, cart, version = self.__cached_cart(user_id)
+            change(cart)
+            if self._carts.put(cart_user_id, cart, version, True):
+                return cart_user_id
+
+    @staticmethod
+    def __write_cart(user_id: int, cart: Cart) -> None:
+        # only the products whose quantity differs from the rows are written, through the upserts of the baskets
+        changes: Dict[int, Dict[int, int]] = {}
+        for store_id, product_id, quantity in (db.session.query(BasketProduct.store_id, BasketProduct.product_id,
+                                                                BasketProduct.quantity)
+                                               .filter(BasketProduct.user_id == user_id)):
+            changes.setdefault(store_id, {})[product_id] = -quantity
+        for store_id, products in cart.items():
+            for product_id, quantity in products.items():
+                basket_changes = changes.setdefault(store_id, {})
+                basket_changes[product_id] = basket_changes.get(product_id, 0) + quantity
+        for store_id, basket_changes in changes.items():
+            basket_changes = {product_id: change for product_id, change in basket_changes.items() if change != 0}
+            if basket_changes:
+                ShoppingBasket(store_id, user_id).apply_changes(basket_changes)
+        commit()
+
+    def flush_cart(self, user_id: int) -> None:
+        """
+        * Parameters: user_id
+        * This function writes the cached cart of the user to the database
+        * Returns: none
+        """
+        # the flushers of all the processes take the row of the user first and only then read the cart, so the cart
+        # that is written last is also the newest one
+        db.session.query(User.id).filter(User.id == user_id).with_for_update().first()
+        cached = self._carts.get(user_id)
+        if cached is None:
+            return
+        cart, version = cached
+        self.__write_cart(user_id, cart)
+        # inside a unit of work the rows are only written when the request commits, the flusher writes them again
+        if not in_unit_of_work():
+            self._carts.mark_clean(user_id, version)
+
+    def flush_carts(self) -> int:
+        """
+        * Parameters: none
+        * This function writes the cached carts that changed to the database
+        * Returns: the number of carts that were written
+        """
+        flushed = 0
+        for user_id in self._carts.dirty_users():
+            try:
+                self.flush_cart(user_id)
+                flushed += 1
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"cart of user {user_id} could not be flushed: {e}")
+        return flushed
+
+    def start_cart_flusher(self, app, interval_seconds: float) -> None:
+        """
+        * Parameters: app, interval_seconds
+        * This function starts a background thread that writes the changed carts to the database every
+          interval_seconds, so at most interval_seconds of cart changes are lost if the process crashes
+        * Returns: none
+        """
+        if self._cart_flusher is not None:
+            return
+
+        def flush():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    with app.app_context():
+                        flushed = self.flush_carts()
+                    if flushed:
+                        logger.info(f"cart flusher wrote {flushed} carts")
+                except Exception as e:
+                    logger.error(f"cart flusher failed: {e}")
+
+        self._cart_flusher = threading.Thread(target=flush, name='cart-flusher', daemon=True)
+        self._cart_flusher.start()
+
     def add_product_to_basket(self, user_id: int, store_id: int, product_id: int, quantity: int) -> None:
         if self.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
-        self.get_user(user_id).add_product_to_basket(store_id, product_id, quantity)
+        if quantity < 0:
+            raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
+
+        def add(cart: Cart) -> None:
+            basket = cart.setdefault(store_id, {})
+            basket[product_id] = basket.get(product_id, 0) + quantity
+
+        self.__change_cart(user_id, add)
 
     def get_shopping_cart(self, user_id: int) -> Dict[int, Dict[int, int]]:
         if self.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
-        return self.get_user(user_id).get_shopping_cart()
+        return self.__cached_cart(user_id)[1]
 
     def remove_product_from_basket(self, user_id: int, store_id: int, product_id: int, quantity: int) -> None:
         if self.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
-        self.get_user(user_id).remove_product_from_basket(store_id, product_id, quantity)
+        if quantity < 0:
+            raise StoreError("Quantity can't be negative", StoreErrorTypes.invalid_amount)
+
+        def remove(cart: Cart) -> None:
+            if store_id not in cart:
+                raise StoreError("Store not found", StoreErrorTypes.store_not_found)
+            basket = cart[store_id]
+            if product_id not in basket:
+                raise StoreError("Product not found", StoreErrorTypes.product_not_found)
+            if basket[product_id] < quantity:
+                raise StoreError("Not enough quantity", StoreErrorTypes.product_not_available)
+            basket[product_id] -= quantity
+            if basket[product_id] == 0:
+                del basket[product_id]
+            if not basket:
+                del cart[store_id]
+
+        self.__change_cart(user_id, remove)
 
     def clear_basket(self, user_id: int) -> None:
         if self.suspended(user_id):
             raise UserError("User is suspended", UserErrorTypes.user_suspended)
-        self.get_user(user_id).clear_basket()
+        self.flush_cart(self.__change_cart(user_id, lambda cart: cart.clear()))
 
     def get_password(self, username: str) -> Tuple[int, str]:
-        member = Member.query.filter_by(username=username).first()
-        if not member:
-            raise UserError("Username not found", UserErrorTypes.username_not_found)
-        return member.id, member.get_password()
+        return self.__lookup_username(username)
 
     def remove_user(self, user_id: int):
 
@@ -523,11 +805,96 @@ class UserFacade:
         # cart = ShoppingCart.query.filter_by(user_id=user_id).first()
         # db.session.delete(cart)
 
-        for basket in ShoppingBasket.query.filter_by(user_id=user_id).all():
-            db.session.delete(basket)
+        db.session.query(BasketProduct).filter(BasketProduct.user_id == user_id).delete(synchronize_session=False)
 
         db.session.delete(user)
-        db.session.commit()
+        commit()
+        self._carts.delete(user_id)
+
+    @staticmethod
+    def __new_guest_gc_metrics() -> Dict:
+        return {'runs': 0, 'reclaimed_users': 0, 'reclaimed_basket_products': 0, 'last_run_at': None,
+                'last_run_seconds': None, 'last_reclaimed_users': 0}
+
+    def set_on_guests_collected(self, on_guests_collected) -> None:
+        """
+        * Parameters: on_guests_collected - called with the ids of every chunk of guests that were removed
+        * Returns: none
+        """
+        self.__on_guests_collected = on_guests_collected
+
+    def collect_expired_guests(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> int:
+        """
+        * Parameters: now(default=the current time), batch_size(default=GUEST_GC_BATCH_SIZE)
+        * This function removes the guests that expired and their baskets, a chunk of batch_size guests in every
+          transaction so the users table is never locked for long
+        * Returns: the number of guests that were removed
+        """
+        from flask import current_app
+        now = now or datetime.now()
+        batch_size = batch_size or current_app.config.get('GUEST_GC_BATCH_SIZE', DEFAULT_GUEST_GC_BATCH_SIZE)
+        started = time.time()
+        reclaimed_users = reclaimed_basket_products = 0
+        while True:
+            user_ids = [user_id for user_id, in db.session.query(User.id)
+                        .filter(User.member_id.is_(None), User.guest_expires_at <= now)
+                        .order_by(User.guest_expires_at).limit(batch_size)
+                        .with_for_update(skip_locked=True)]
+            if not user_ids:
+                break
+            reclaimed_basket_products += db.session.query(BasketProduct).filter(
+                BasketProduct.user_id.in_(user_ids)).delete(synchronize_session=False)
+            reclaimed_users += db.session.query(User).filter(User.id.in_(user_ids), User.member_id.is_(None)) \
+                .delete(synchronize_session=False)
+            commit()
+            for user_id in user_ids:
+                self._carts.delete(user_id)
+            if self.__on_guests_collected is not None:
+                self.__on_guests_collected(user_ids)
+            if len(user_ids) < batch_size:
+                break
+        with self.__guest_gc_lock:
+            metrics = self.__guest_gc_metrics
+            metrics['runs'] += 1
+            metrics['reclaimed_users'] += reclaimed_users
+            metrics['reclaimed_basket_products'] += reclaimed_basket_products
+            metrics['last_run_at'] = now.isoformat()
+            metrics['last_run_seconds'] = round(time.time() - started, 3)
+            metrics['last_reclaimed_users'] = reclaimed_users
+        if reclaimed_users:
+            logger.info(f"guest collector removed {reclaimed_users} guests and {reclaimed_basket_products} "
+                        f"basket products")
+        return reclaimed_users
+
+    def get_guest_gc_metrics(self) -> Dict:
+        """
+        * Parameters: none
+        * This function returns the totals of the guest collector since the process started and its last run
+        * Returns: a dict
+        """
+        with self.__guest_gc_lock:
+            return dict(self.__guest_gc_metrics)
+
+    def start_guest_collector(self, app, interval_seconds: float) -> None:
+        """
+        * Parameters: app, interval_seconds
+        * This function starts a background thread that removes the expired guests every interval_seconds
+        * Returns: none
+        """
+        if self._guest_collector is not None:
+            return
+
+        def collect():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    with app.app_context():
+                        self.collect_expired_guests()
+                except Exception as e:
+                    logger.error(f"guest collector failed: {e}")
+
+        self._guest_collector = threading.Thread(target=collect, name='guest-collector', daemon=True)
+        self._guest_collector.start()
 
     def logout_user(self, user_id: int):
         user = User.query.filter_by(id=user_id).first()
@@ -540,26 +907,92 @@ class UserFacade:
     def is_member(self, user_id: int) -> bool:
         return self.get_user(user_id).is_member()
 
+    def get_users_by_ids(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """
+        * Parameters: user_ids
+        * This function loads the users with their members in one joined query, an id is looked up as a user id and
+          then as a member id like in get_user
+        * Returns: id -> user of the ids that were found
+        """
+        ids = set(user_ids)
+        if not ids:
+            return {}
+        users = (User.query.options(joinedload(User.member))
+                 .filter(or_(User.id.in_(ids), User.member_id.in_(ids))).all())
+        out = {user.member_id: user for user in users if user.member_id in ids}
+        out.update({user.id: user for user in users if user.id in ids})
+        return out
+
     def get_users_dto(self, roles: Dict[int, str]) -> Dict[int, UserDTO]:  # user_id -> role
+        users = self.get_users_by_ids(roles)
         out = {}
         for user_id, role in roles.items():
-            out[user_id] = self.get_user(user_id).get_user_dto(role)
+            if user_id not in users:
+                raise UserError("User not found", UserErrorTypes.user_not_found)
+            out[user_id] = users[user_id].get_user_dto(role)
         return out
 
+    @staticmethod
+    def page_size(limit: Optional[int]) -> int:
+        """
+        * Parameters: limit - the requested page size, None for the default
+        * Returns: the page size of a member listing
+        """
+        from flask import current_app
+        if limit is None:
+            return current_app.config.get('MEMBER_LISTING_PAGE_SIZE', DEFAULT_MEMBER_LISTING_PAGE_SIZE)
+        if limit <= 0 or limit > current_app.config.get('MEMBER_LISTING_MAX_PAGE_SIZE',
+                                                        DEFAULT_MEMBER_LISTING_MAX_PAGE_SIZE):
+            raise UserError("Page size is invalid", UserErrorTypes.invalid_page_size)
+        return limit
+
+    def get_members_page(self, cursor: Optional[int] = None, limit: Optional[int] = None,
+                         username: Optional[str] = None, suspended: Optional[bool] = None,
+                         excluded_ids: Optional[Iterable[int]] = None) -> Tuple[List[UserDTO], Optional[int]]:
+        """
+        * Parameters: cursor - the next_cursor of the previous page, limit - page size, username - a prefix of the
+          usernames, suspended - only the suspended (True) or not suspended (False) members, excluded_ids - user ids
+        * This function returns a page of the members ordered by user id, read with one joined query
+        * Returns: (the members, the next_cursor - None on the last page)
+        """
+        limit = self.page_size(limit)
+        query = User.query.join(Member, User.member_id == Member.id).options(contains_eager(User.member))
+        if cursor is not None:
+            query = query.filter(User.id > cursor)
+        if username:
+            query = query.filter(Member.username.startswith(username, autoescape=True))
+        if suspended is not None:
+            now = datetime.now()
+            is_suspended = and_(Member.is_suspended.is_(True),
+                                or_(Member.suspended_until.is_(None), Member.suspended_until > now))
+            query = query.filter(is_suspended if suspended else not_(is_suspended))
+        if excluded_ids:
+            query = query.filter(User.id.notin_(list(excluded_ids)))
+        users = query.order_by(User.id).limit(limit + 1).all()
+        next_cursor = users[limit - 1].id if len(users) > limit else None
+        return [user.get_user_dto() for user in users[:limit]], next_cursor
+
     def restore_basket(self, user_id: int, cart: Dict[int, Dict[int, int]]):
-        self.get_user(user_id).clear_basket()
-        for store_id, products in cart.items():
-            for product_id, quantity in products.items():
-                self.add_product_to_basket(user_id, store_id, product_id, quantity)
+        # a failed checkout gives the products back to the user even if the user was suspended meanwhile, the
+        # compensation of an asynchronous checkout depends on it
+
+        def restore(cached_cart: Cart) -> None:
+            cached_cart.clear()
+            for store_id, products in cart.items():
+                cached_cart[store_id] = dict(products)
+
+        self.flush_cart(self.__change_cart(user_id, restore))
 
     def set_user_shopping_cart(self, user_id: int, cart: Dict[int, Dict[int, int]]):
-        user = self.get_user(user_id)
-        user.set_cart(cart)
+        def merge(cached_cart: Cart) -> None:
+            for store_id, products in cart.items():
+                basket = cached_cart.setdefault(store_id, {})
+                for product_id, quantity in products.items():
+                    basket[product_id] = basket.get(product_id, 0) + quantity
+
+        self.flush_cart(self.__change_cart(user_id, merge))
 
     def get_all_members(self) -> List[UserDTO]:
-        users = User.query.all()
-        out = []
-        for user in users:
-            if user.is_member():
-                out.append(user.get_user_dto())
-        return out
\ No newline at end of file
+        users = (User.query.join(Member, User.member_id == Member.id).options(contains_eager(User.member))
+                 .order_by(User.id).all())
+        return [user.get_user_dto() for user in users]
\ No newline at end of file
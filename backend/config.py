@@ -1,5 +1,6 @@
 import os
 import secrets
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -10,6 +11,56 @@ class Config:
     JWT_SECRET_KEY = SECRET_KEY
     JWT_TOKEN_LOCATION = ['headers']
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    CHECKOUT_WORKERS = int(os.getenv('CHECKOUT_WORKERS', 4))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+    OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', 2))
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))
+    # has to be longer than the slowest handler, a message in process past its lease is run again
+    OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', 5 * 60))
+    # encrypts the card details of the pending outbox messages, has to be shared by all the servers
+    OUTBOX_ENCRYPTION_KEY = os.getenv('OUTBOX_ENCRYPTION_KEY')
+    RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', 600))
+    RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', 30))
+    RESERVE_ON_ADD_TO_BASKET = os.getenv('RESERVE_ON_ADD_TO_BASKET', 'false').lower() == 'true'
+    BATCH_CHECKOUT_MAX_ENTRIES = int(os.getenv('BATCH_CHECKOUT_MAX_ENTRIES', 500))
+    IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 24 * 60 * 60))
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 30))
+    IDEMPOTENCY_IN_FLIGHT_TIMEOUT = float(os.getenv('IDEMPOTENCY_IN_FLIGHT_TIMEOUT', 120))
+    IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv('IDEMPOTENCY_CLEANUP_INTERVAL', 60 * 60))
+    UNIT_OF_WORK = os.getenv('UNIT_OF_WORK', 'false').lower() == 'true'
+    PRICE_QUOTE_TTL = int(os.getenv('PRICE_QUOTE_TTL', 5 * 60))
+    PRICE_QUOTE_SECRET_KEY = os.getenv('PRICE_QUOTE_SECRET_KEY')
+    PURCHASE_HISTORY_PAGE_SIZE = int(os.getenv('PURCHASE_HISTORY_PAGE_SIZE', 100))
+    PURCHASE_HISTORY_MAX_PAGE_SIZE = int(os.getenv('PURCHASE_HISTORY_MAX_PAGE_SIZE', 1000))
+    SALES_STATS_DEFAULT_DAYS = int(os.getenv('SALES_STATS_DEFAULT_DAYS', 30))
+    SALES_STATS_MAX_DAYS = int(os.getenv('SALES_STATS_MAX_DAYS', 366))
+    # an absolute path shared by all the servers, the purchases are not archived without it
+    PURCHASE_ARCHIVE_DIR = os.getenv('PURCHASE_ARCHIVE_DIR')
+    PURCHASE_ARCHIVE_HORIZON_DAYS = int(os.getenv('PURCHASE_ARCHIVE_HORIZON_DAYS', 365))
+    PURCHASE_ARCHIVE_BATCH_SIZE = int(os.getenv('PURCHASE_ARCHIVE_BATCH_SIZE', 1000))
+    PURCHASE_ARCHIVE_INTERVAL = float(os.getenv('PURCHASE_ARCHIVE_INTERVAL', 24 * 60 * 60))
+    PURCHASE_ARCHIVE_MANIFEST_TTL = float(os.getenv('PURCHASE_ARCHIVE_MANIFEST_TTL', 60))
+    DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', 100))
+    DELIVERY_POLL_INTERVAL = float(os.getenv('DELIVERY_POLL_INTERVAL', 60))
+    DELIVERY_RETRY_DELAY = float(os.getenv('DELIVERY_RETRY_DELAY', 30))
+    PURCHASE_COMPLETION_SWEEP_INTERVAL = float(os.getenv('PURCHASE_COMPLETION_SWEEP_INTERVAL', 60))
+    PURCHASE_COMPLETION_BATCH_SIZE = int(os.getenv('PURCHASE_COMPLETION_BATCH_SIZE', 1000))
+    # every worker serves the carts from the shared cache, the in-process one is for the tests
+    CART_CACHE_BACKEND = os.getenv('CART_CACHE_BACKEND', 'redis')
+    CART_CACHE_REDIS_URL = os.getenv('CART_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CART_CACHE_MAX_CARTS = int(os.getenv('CART_CACHE_MAX_CARTS', 10000))
+    CART_CACHE_FLUSH_INTERVAL = float(os.getenv('CART_CACHE_FLUSH_INTERVAL', 1))
+    GUEST_TTL = int(os.getenv('GUEST_TTL', 25 * 60 * 60))
+    GUEST_GC_INTERVAL = float(os.getenv('GUEST_GC_INTERVAL', 10 * 60))
+    GUEST_GC_BATCH_SIZE = int(os.getenv('GUEST_GC_BATCH_SIZE', 500))
+    SUSPENSION_INDEX_REFRESH_INTERVAL = float(os.getenv('SUSPENSION_INDEX_REFRESH_INTERVAL', 30))
+    MEMBER_LISTING_PAGE_SIZE = int(os.getenv('MEMBER_LISTING_PAGE_SIZE', 100))
+    MEMBER_LISTING_MAX_PAGE_SIZE = int(os.getenv('MEMBER_LISTING_MAX_PAGE_SIZE', 1000))
+    USERNAME_CACHE_MAX_ENTRIES = int(os.getenv('USERNAME_CACHE_MAX_ENTRIES', 10000))
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 64))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -21,6 +72,14 @@ class DockerDevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    PURCHASE_ARCHIVE_DIR = os.getenv('TEST_PURCHASE_ARCHIVE_DIR',
+                                     os.path.join(tempfile.gettempdir(), 'tradecenter_purchase_archive'))
+    CART_CACHE_BACKEND = os.getenv('TEST_CART_CACHE_BACKEND', 'memory')
+    # the tests flush the carts themselves
+    CART_CACHE_FLUSH_INTERVAL = float(os.getenv('TEST_CART_CACHE_FLUSH_INTERVAL', 60 * 60))
+    # the cheapest work factor bcrypt allows keeps the logins of the tests fast
+    BCRYPT_LOG_ROUNDS = int(os.getenv('TEST_BCRYPT_LOG_ROUNDS', 4))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('TEST_PASSWORD_HASH_QUEUE_SIZE', 8))
     if os.getenv('DOCKER_ENV') == 'true':
         SQLALCHEMY_DATABASE_URI = os.getenv('DOCKER_TEST_DATABASE_URL', 'postgresql://user:password@db:5432/test_database')
     else:
@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text
+from contextvars import ContextVar, Token
+from contextlib import contextmanager
+from typing import Optional
 
 class SingletonSQLAlchemy:
     _instance = None
@@ -31,4 +34,63 @@ def clear_database():
         print(f"Error occurred: {e}")
     finally:
         connection.close()
-        print('Database cleared!')
\ No newline at end of file
+        print('Database cleared!')
+
+
+# ---------------------unit of work---------------------#
+# when a unit of work is active the business layer only flushes its changes, they are committed once at the end of
+# the request (or at an explicit boundary) and a failure rolls back everything the request did
+_unit_of_work: ContextVar[Optional[object]] = ContextVar('unit_of_work', default=None)
+
+
+def begin_unit_of_work() -> Token:
+    return _unit_of_work.set(db.session())
+
+
+def end_unit_of_work(token: Token) -> None:
+    _unit_of_work.reset(token)
+
+
+def in_unit_of_work() -> bool:
+    # a nested app context has a session of its own, its changes are not part of the unit of work
+    session = _unit_of_work.get()
+    return session is not None and session is db.session()
+
+
+@contextmanager
+def ensure_app_context():
+    """
+    * Parameters: none
+    * This function reuses the active app context, and with it the session of the request, a new app context is
+      pushed only when there is none (e.g. in a background thread)
+    * Returns: a context manager
+    """
+    from flask import has_app_context
+    if has_app_context():
+        yield
+    else:
+        from backend.app_factory import get_app
+        with get_app().app_context():
+            yield
+
+
+def commit() -> None:
+    """
+    * Parameters: none
+    * This function commits the session, inside a unit of work the changes are only flushed
+    * Returns: none
+    """
+    if in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def commit_boundary() -> None:
+    """
+    * Parameters: none
+    * This function commits the session even inside a unit of work, for changes that have to persist whatever
+      happens to the rest of the request
+    * Returns: none
+    """
+    db.session.commit()
@@ -33,6 +33,7 @@ class StoreErrorTypes(Enum):
     unexpected_error = 29
     invalid_product_name = 30
     invalid_user_id = 31
+    reservation_expired = 32
 
 class UserErrorTypes(Enum):
     user_suspended = 1
@@ -53,6 +54,8 @@ class UserErrorTypes(Enum):
     user_not_a_member = 16
     user_not_a_manager_or_owner = 17
     empty_fields = 18
+    invalid_page_size = 19
+    too_many_logins = 20
 
 class RoleErrorTypes(Enum):
     actor_not_member_of_store = 1
@@ -99,6 +102,19 @@ class PurchaseErrorTypes(Enum):
     database_error = 17
     invalid_name = 18
     purchase_not_approved = 19
+    checkout_job_not_found = 20
+    checkout_job_not_of_user = 21
+    outbox_action_not_supported = 22
+    batch_checkout_too_large = 23
+    duplicate_user_in_batch = 24
+    idempotency_key_reused = 25
+    idempotency_request_in_progress = 26
+    invalid_history_cursor = 27
+    invalid_page_size = 28
+    invalid_purchase_status = 29
+    invalid_date_range = 30
+    archive_directory_invalid = 31
+    archive_file_missing = 32
 
 
 class ThirdPartyHandlerErrorTypes(Enum):
@@ -147,6 +163,11 @@ class ServiceLayerErrorTypes(Enum):
     tags_not_list = 3
     config_not_dict = 4
     additional_details_not_dict = 5
+    entries_not_list = 6
+    cart_not_dict = 7
+    invalid_idempotency_key = 8
+    quote_not_string = 9
+    invalid_export_format = 10
 
 
 # -------------------------------------- StoreErrors --------------------------------------
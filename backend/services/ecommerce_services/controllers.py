@@ -1,60 +1,203 @@
 # communication with business logic
-from typing import Optional
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+import csv
+import io
+import json
 
 from backend.business import MarketFacade
-from flask import jsonify
+from backend.business.checkout import IdempotencyManager
+from backend.business.purchase.purchase import PURCHASE_EXPORT_FIELDS
+from backend.error_types import *
+from flask import Response, jsonify, stream_with_context
 
 import logging
 
 logger = logging.getLogger('myapp')
 
+# failures that a retry of the same request can get past, their result is not replayed for the idempotency key
+TRANSIENT_THIRD_PARTY_ERRORS = {ThirdPartyHandlerErrorTypes.payment_failed, ThirdPartyHandlerErrorTypes.supply_failed,
+                                ThirdPartyHandlerErrorTypes.handshake_failed,
+                                ThirdPartyHandlerErrorTypes.external_payment_failed,
+                                ThirdPartyHandlerErrorTypes.external_supply_failed}
+TRANSIENT_STORE_ERRORS = {StoreErrorTypes.product_not_available}
+
 
 class PurchaseService:
     def __init__(self):
         self.__market_facade = MarketFacade()
+        self.__idempotency = IdempotencyManager()
+
+    @staticmethod
+    def __is_replayable(error: Exception) -> bool:
+        """
+            Whether a failed request fails the same way when it is retried (a validation error), only such failures
+            are stored for the idempotency key
+        """
+        if isinstance(error, ThirdPartyHandlerError):
+            return error.third_party_handler_error_type not in TRANSIENT_THIRD_PARTY_ERRORS
+        if isinstance(error, StoreError):
+            return error.store_error_type not in TRANSIENT_STORE_ERRORS
+        return isinstance(error, (UserError, PurchaseError, DiscountAndConstraintsError, RoleError))
+
+    def __idempotent(self, user_id: int, endpoint: str, idempotency_key: Optional[str], request_data: dict,
+                     operation: str, handler):
+        """
+            Run the handler once per idempotency key, a repeated key gets the stored response of the first request.
+            A transient failure releases the key, so the request can be retried with it
+        """
+        def run():
+            try:
+                info = handler()
+                logger.info(f'{operation} was successful')
+                return jsonify({'message': info}), 200, True
+            except Exception as e:
+                logger.error(f'{operation} was not successful')
+                return jsonify({'message': str(e)}), 400, self.__is_replayable(e)
+
+        if idempotency_key is None:
+            return run()[:2]
+        try:
+            replay = self.__idempotency.begin(user_id, endpoint, idempotency_key, request_data)
+        except Exception as e:
+            logger.error(f'{endpoint} idempotency key {idempotency_key} was rejected')
+            return jsonify({'message': str(e)}), 400
+        if replay is not None:
+            response, status_code = replay
+            return jsonify(response), status_code, {'Idempotent-Replayed': 'true'}
+        try:
+            response, status_code, replayable = run()
+        except Exception:
+            self.__idempotency.release(user_id, endpoint, idempotency_key)
+            raise
+        if replayable:
+            self.__idempotency.complete(user_id, endpoint, idempotency_key, response.get_json(), status_code)
+        else:
+            self.__idempotency.release(user_id, endpoint, idempotency_key)
+        return response, status_code
 
     def test(self,user_id):
         self.__market_facade.test(user_id)
 
-    def checkout(self, user_id: int, payment_details: dict, supply_method: str, address: dict):
+    def checkout(self, user_id: int, payment_details: dict, supply_method: str, address: dict,
+                 idempotency_key: Optional[str] = None, quote: Optional[str] = None):
         """
             Checkout the shopping cart
         """
+        def run():
+            return self.__market_facade.checkout(user_id, payment_details, supply_method, address, quote)
+
+        request_data = {'payment_details': payment_details, 'supply_method': supply_method, 'address': address}
+        return self.__idempotent(user_id, 'checkout', idempotency_key, request_data, 'checkout', run)
+
+    def checkout_async(self, user_id: int, payment_details: dict, supply_method: str, address: dict,
+                       idempotency_key: Optional[str] = None, quote: Optional[str] = None):
+        """
+            Checkout the shopping cart asynchronously, returns the id of the checkout job
+        """
+        def run():
+            return self.__market_facade.checkout_async(user_id, payment_details, supply_method, address, quote)
+
+        request_data = {'payment_details': payment_details, 'supply_method': supply_method, 'address': address,
+                        'async': True}
+        return self.__idempotent(user_id, 'checkout', idempotency_key, request_data, 'checkout_async', run)
+
+    def batch_checkout(self, user_id: int, entries: list):
+        """
+            Checkout a batch of shopping carts, returns the result of every entry
+        """
+        try:
+            info = self.__market_facade.batch_checkout(user_id, entries)
+            logger.info('batch_checkout was successful')
+            return jsonify({'message': info}), 200
+        except Exception as e:
+            logger.error('batch_checkout was not successful')
+            return jsonify({'message': str(e)}), 400
+
+    def checkout_status(self, user_id: int, job_id: int):
+        """
+            Get the status of an asynchronous checkout job
+        """
         try:
-            info = self.__market_facade.checkout(user_id, payment_details, supply_method, address)
-            logger.info('checkout was successful')
+            info = self.__market_facade.get_checkout_status(user_id, job_id)
+            logger.info('checkout_status was successful')
             return jsonify({'message': info}), 200
         except Exception as e:
-            logger.error('checkout was not successful')
+            logger.error('checkout_status was not successful')
             return jsonify({'message': str(e)}), 400
 
-    def show_purchase_history_in_store(self, user_id: int, store_id: int):
+    def show_purchase_history_in_store(self, user_id: int, store_id: int, start_date: Optional[datetime] = None,
+                                       end_date: Optional[datetime] = None, status: Optional[str] = None,
+                                       cursor: Optional[str] = None, limit: Optional[int] = None,
+                                       summary: bool = False):
         """
             Show the purchase history in a store
         """
         try:
-            info = self.__market_facade.view_purchases_of_store(user_id, store_id)
+            info = self.__market_facade.view_purchases_of_store(user_id, store_id, start_date, end_date, status,
+                                                                cursor, limit, summary)
             logger.info('show_purchase_history_in_store was successful')
-            info = [x.get() for x in info]
-            return jsonify({'message': info}), 200
+            if summary:
+                return jsonify({'message': info}), 200
+            return jsonify({'message': [x.get() for x in info['purchases']], 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('show_purchase_history_in_store was not successful')
             return jsonify({'message': str(e)}), 400
 
-    def show_purchase_history_of_user(self, user_id: int, requested_id: int, store_id: Optional[int] = None):
+    def show_purchase_history_of_user(self, user_id: int, requested_id: int, store_id: Optional[int] = None,
+                                      start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                                      status: Optional[str] = None, cursor: Optional[str] = None,
+                                      limit: Optional[int] = None, summary: bool = False):
         """
             Show the purchase history of a member
         """
         try:
-            info = self.__market_facade.view_purchases_of_user(user_id, requested_id, store_id)
+            info = self.__market_facade.view_purchases_of_user(user_id, requested_id, store_id, start_date, end_date,
+                                                               status, cursor, limit, summary)
             logger.info('show_purchase_history_of_user was successful')
-            info = [x.get() for x in info]
-
-            return jsonify({'message': info}), 200
+            if summary:
+                return jsonify({'message': info}), 200
+            return jsonify({'message': [x.get() for x in info['purchases']], 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('show_purchase_history_of_user was not successful')
             return jsonify({'message': str(e)}), 400
 
+    @staticmethod
+    def __csv_lines(lines: Iterator[Dict]) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(PURCHASE_EXPORT_FIELDS)
+        for line in lines:
+            writer.writerow([line[field] for field in PURCHASE_EXPORT_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    @staticmethod
+    def __ndjson_lines(lines: Iterator[Dict]) -> Iterator[str]:
+        for line in lines:
+            yield json.dumps(line) + '\n'
+
+    def export_purchase_history_of_store(self, user_id: int, store_id: int, export_format: str,
+                                         start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                                         status: Optional[str] = None):
+        """
+            Stream the purchase history of a store as CSV or NDJSON
+        """
+        try:
+            lines = self.__market_facade.export_purchases_of_store(user_id, store_id, start_date, end_date, status)
+        except Exception as e:
+            logger.error('export_purchase_history_of_store was not successful')
+            return jsonify({'message': str(e)}), 400
+        logger.info('export_purchase_history_of_store was successful')
+        if export_format == 'csv':
+            body, mimetype = self.__csv_lines(lines), 'text/csv'
+        else:
+            body, mimetype = self.__ndjson_lines(lines), 'application/x-ndjson'
+        headers = {'Content-Disposition': f'attachment; filename=store_{store_id}_purchases.{export_format}'}
+        return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
     def search_products_by_category(self, category_id: int, store_id: Optional[int]):
         """
             Search products in the stores
@@ -121,17 +264,17 @@ class PurchaseService:
         except Exception as e:
             logger.error('get_user_stores was not successful')
 
-    def bid_checkout(self, user_id: int, bid_id: int, payment_details: dict, supply_method: str, address: dict):
+    def bid_checkout(self, user_id: int, bid_id: int, payment_details: dict, supply_method: str, address: dict,
+                     idempotency_key: Optional[str] = None):
         """
             Checkout of a bid purchase
         """
-        try:
-            info = self.__market_facade.bid_checkout(user_id,bid_id, payment_details, supply_method, address)
-            logger.info('bid_checkout was successful')
-            return jsonify({'message': info}), 200
-        except Exception as e:
-            logger.error('bid_checkout was not successful')
-            return jsonify({'message': str(e)}), 400
+        def run():
+            return self.__market_facade.bid_checkout(user_id,bid_id, payment_details, supply_method, address)
+
+        request_data = {'bid_id': bid_id, 'payment_details': payment_details, 'supply_method': supply_method,
+                        'address': address}
+        return self.__idempotent(user_id, 'checkout_bid', idempotency_key, request_data, 'bid_checkout', run)
         
     def user_bid_offer(self, user_id: int, proposed_price: int, store_id: int, product_id: int):
         """
@@ -247,38 +390,41 @@ class PurchaseService:
             logger.error('show_user_bids was not successful')
             return jsonify({'message': str(e)}), 400
         
-    def view_user_bids(self, user_id: int):
+    def view_user_bids(self, user_id: int, status: Optional[str] = None, cursor: Optional[int] = None,
+                       limit: Optional[int] = None):
         """
             View user bids
         """
         try:
-            info = self.__market_facade.view_user_bids(user_id)
+            info = self.__market_facade.view_user_bids(user_id, status, cursor, limit)
             logger.info('view_user_bids was successful')
-            return jsonify({'message': info}), 200
+            return jsonify({'message': info['bids'], 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('view_user_bids was not successful')
             return jsonify({'message': str(e)}), 400
         
-    def show_store_bids(self, store_owner_id: int, store_id: int):
+    def show_store_bids(self, store_owner_id: int, store_id: int, status: Optional[str] = None,
+                        cursor: Optional[int] = None, limit: Optional[int] = None):
         """
             Show store bids
         """
         try:
-            info = self.__market_facade.show_store_bids(store_owner_id, store_id)
+            info = self.__market_facade.show_store_bids(store_owner_id, store_id, status, cursor, limit)
             logger.info('show_store_bids was successful')
-            return jsonify({'message': info}), 200
+            return jsonify({'message': info['bids'], 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('show_store_bids was not successful')
             return jsonify({'message': str(e)}), 400
         
-    def view_all_bids_of_system(self, system_manager_id: int):
+    def view_all_bids_of_system(self, system_manager_id: int, status: Optional[str] = None,
+                                cursor: Optional[int] = None, limit: Optional[int] = None):
         """
             View all bids of the system
         """
         try:
-            info = self.__market_facade.view_all_bids_of_system(system_manager_id)
+            info = self.__market_facade.view_all_bids_of_system(system_manager_id, status, cursor, limit)
             logger.info('view_all_bids_of_system was successful')
-            return jsonify({'message': info}), 200
+            return jsonify({'message': info['bids'], 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('view_all_bids_of_system was not successful')
             return jsonify({'message': str(e)}), 400
@@ -1,3 +1,4 @@
+from datetime import datetime
 from flask import Blueprint, request, jsonify
 from backend.services.ecommerce_services.controllers import PurchaseService
 from flask_jwt_extended import jwt_required, get_jwt_identity
@@ -14,6 +15,49 @@ market_bp = Blueprint('market', __name__)
 
 purchase_service = PurchaseService()
 
+MAX_IDEMPOTENCY_KEY_LENGTH = 200
+
+
+def get_idempotency_key():
+    # the optional Idempotency-Key header of the request
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ServiceLayerError(f'Idempotency-Key must have 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters',
+                                ServiceLayerErrorTypes.invalid_idempotency_key)
+    return key
+
+
+def get_history_filters(data: dict) -> dict:
+    # the optional filters and pagination of the purchase history routes
+    summary = data.get('summary', False)
+    if isinstance(summary, str):
+        summary = summary.lower() == 'true'
+    filters = {'start_date': None, 'end_date': None, 'status': None, 'cursor': None, 'limit': None,
+               'summary': bool(summary)}
+    for name in ('start_date', 'end_date'):
+        if data.get(name) is not None:
+            filters[name] = datetime.fromisoformat(str(data[name]))
+    for name in ('status', 'cursor'):
+        if data.get(name) is not None:
+            filters[name] = str(data[name])
+    if data.get('limit') is not None:
+        filters['limit'] = int(data['limit'])
+    return filters
+
+
+def get_bid_filters(data: dict) -> dict:
+    # the optional status filter and pagination of the bid listing routes
+    filters = {'status': None, 'cursor': None, 'limit': None}
+    if data.get('status') is not None:
+        filters['status'] = str(data['status'])
+    for name in ('cursor', 'limit'):
+        if data.get(name) is not None:
+            filters[name] = int(data[name])
+    return filters
+
 @market_bp.route('/test', methods=['GET'])
 @jwt_required()
 def test():
@@ -27,6 +71,15 @@ def checkout():
     """
         Use Case 2.2.5:
         Checkout the shopping cart
+
+        Data:
+            async (bool, optional): if true, returns a checkout job id right after the products are reserved,
+                                    the result is sent as a 'checkout_status' event and by /checkout_status
+            quote (str, optional): a quote from /store/get_total_price_after_discounts, its prices are used if the
+                                   cart, the address and the prices of the stores did not change since
+
+        Headers:
+            Idempotency-Key (str, optional): a retry with the same key returns the response of the first request
     """
     logger.info('recieved request to checkout the shopping cart')
     try:
@@ -57,11 +110,101 @@ def checkout():
         if not isinstance(address_helper, dict):
             raise ServiceLayerError('address must be a dictionary', ServiceLayerErrorTypes.address_not_dict)
         address = {str(key): str(value) for key, value in address_helper.items()}
+        run_async = bool(data.get('async', False))
+        quote = data.get('quote')
+        if quote is not None and not isinstance(quote, str):
+            raise ServiceLayerError('quote must be a string', ServiceLayerErrorTypes.quote_not_string)
+        idempotency_key = get_idempotency_key()
     except Exception as e:
         logger.error('checkout - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.checkout(user_id, payment_details, supply_details, address)
+    if run_async:
+        return purchase_service.checkout_async(user_id, payment_details, supply_details, address, idempotency_key,
+                                               quote)
+    return purchase_service.checkout(user_id, payment_details, supply_details, address, idempotency_key, quote)
+
+
+@market_bp.route('/batch_checkout', methods=['POST'])
+@jwt_required()
+def batch_checkout():
+    """
+        Use Case 2.2.5:
+        Checkout many shopping carts in one request
+
+        Data:
+            entries (list): every entry has user_id, payment_details, supply_method, address and optionally
+                            payment_additional_details, supply_additional_details and cart (store_id -> product_id -> amount),
+                            the basket of the user is used when cart is missing
+    """
+    logger.info('recieved request to checkout a batch of shopping carts')
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        entries_helper = data['entries']
+        if not isinstance(entries_helper, list):
+            raise ServiceLayerError('entries must be a list', ServiceLayerErrorTypes.entries_not_list)
+        entries = []
+        for entry in entries_helper:
+            payment_details_helper = entry['payment_details']
+            if not isinstance(payment_details_helper, dict):
+                raise ServiceLayerError('payment details must be a dictionary', ServiceLayerErrorTypes.payment_details_not_dict)
+            payment_details = {str(key): str(value) for key, value in payment_details_helper.items()}
+            if "payment_additional_details" in entry:
+                additional_details = entry['payment_additional_details']
+                if not isinstance(additional_details, dict):
+                    raise ServiceLayerError('additional details must be a dictionary', ServiceLayerErrorTypes.additional_details_not_dict)
+                payment_details["additional details"] = {str(key): str(value) for key, value in additional_details.items()}
+
+            supply_details = {"supply method": str(entry['supply_method'])}
+            if 'supply_additional_details' in entry:
+                additional_details = entry['supply_additional_details']
+                if not isinstance(additional_details, dict):
+                    raise ServiceLayerError('additional details must be a dictionary', ServiceLayerErrorTypes.additional_details_not_dict)
+                supply_details["additional details"] = {str(key): str(value) for key, value in additional_details.items()}
+
+            address_helper = entry['address']
+            if not isinstance(address_helper, dict):
+                raise ServiceLayerError('address must be a dictionary', ServiceLayerErrorTypes.address_not_dict)
+            address = {str(key): str(value) for key, value in address_helper.items()}
+
+            cart = None
+            if entry.get('cart') is not None:
+                cart_helper = entry['cart']
+                if not isinstance(cart_helper, dict) or not all(isinstance(products, dict) for products in cart_helper.values()):
+                    raise ServiceLayerError('cart must be a dictionary of store ids to products', ServiceLayerErrorTypes.cart_not_dict)
+                cart = {int(store_id): {int(product_id): int(amount) for product_id, amount in products.items()}
+                        for store_id, products in cart_helper.items()}
+
+            entries.append({'user_id': int(entry['user_id']), 'cart': cart, 'payment_details': payment_details,
+                            'supply_details': supply_details, 'address': address})
+    except Exception as e:
+        logger.error('batch_checkout - ', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return purchase_service.batch_checkout(user_id, entries)
+
+
+@market_bp.route('/checkout_status', methods=['GET', 'POST'])
+@jwt_required()
+def checkout_status():
+    """
+        Use Case 2.2.5:
+        Get the status of an asynchronous checkout job
+
+        Data:
+            job_id (int): id of the checkout job returned by an async checkout
+    """
+    logger.info('recieved request to get the status of a checkout job')
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        job_id = int(data['job_id'])
+    except Exception as e:
+        logger.error('checkout_status - ', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return purchase_service.checkout_status(user_id, job_id)
 
 
 @market_bp.route('/store_purchase_history', methods=['GET', 'POST'])
@@ -69,18 +212,58 @@ def checkout():
 def show_store_purchase_history():
     """
         Use Case 2.4.13:
-        Show the purchase history in a store
+        Show the purchase history in a store, newest first
+
+        Data:
+            store_id (int): id of the store
+            start_date (str, optional): ISO date, only purchases made at or after it
+            end_date (str, optional): ISO date, only purchases made before it
+            status (str, optional): onGoing, accepted, completed, offer_rejected or approved
+            limit (int, optional): page size, PURCHASE_HISTORY_PAGE_SIZE by default
+            cursor (str, optional): next_cursor of the previous page
+            summary (bool, optional): return only the number of purchases and their totals
     """
     logger.info('recieved request to show the purchase history of a store')
     try:
         user_id = get_jwt_identity()
         data = request.get_json()
         store_id = int(data['store_id'])
+        filters = get_history_filters(data)
     except Exception as e:
         logger.error('show_store_purchase_history - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.show_purchase_history_in_store(user_id, store_id)
+    return purchase_service.show_purchase_history_in_store(user_id, store_id, **filters)
+
+
+@market_bp.route('/export_store_purchase_history', methods=['GET', 'POST'])
+@jwt_required()
+def export_store_purchase_history():
+    """
+        Use Case 2.4.13:
+        Export the purchase history of a store, one line for each purchased product, oldest first. The response is
+        streamed so stores with a long history can be exported
+
+        Data:
+            store_id (int): id of the store
+            format (str, optional): csv (default) or ndjson
+            start_date, end_date, status (optional): as in store_purchase_history
+    """
+    logger.info('recieved request to export the purchase history of a store')
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or request.args.to_dict()
+        store_id = int(data['store_id'])
+        export_format = str(data.get('format', 'csv')).lower()
+        if export_format not in ('csv', 'ndjson'):
+            raise ServiceLayerError('format must be csv or ndjson', ServiceLayerErrorTypes.invalid_export_format)
+        filters = get_history_filters(data)
+    except Exception as e:
+        logger.error('export_store_purchase_history - %s', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return purchase_service.export_purchase_history_of_store(user_id, store_id, export_format, filters['start_date'],
+                                                             filters['end_date'], filters['status'])
 
 
 @market_bp.route('/user_purchase_history', methods=['POST', 'GET'])
@@ -88,7 +271,13 @@ def show_store_purchase_history():
 def show_user_purchase_history():
     """
         Use Case 2.2.4.13:
-        Show the purchase history of a user (if store id is provided, show the purchase history in the store)
+        Show the purchase history of a user (if store id is provided, show the purchase history in the store),
+        newest first
+
+        Data:
+            user_id (int): id of the user
+            store_id (int, optional): id of the store
+            start_date, end_date, status, limit, cursor, summary (optional): as in store_purchase_history
     """
     logger.info('recieved request to show the purchase history of a user')
     try:
@@ -99,12 +288,13 @@ def show_user_purchase_history():
             if data['store_id'] is not None:
                 store_id = int(data['store_id'])
         user_id = int(data['user_id'])
+        filters = get_history_filters(data)
 
     except Exception as e:
         logger.error(('show_user_purchase_history - ', str(e)))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.show_purchase_history_of_user(actor_id, user_id, store_id)
+    return purchase_service.show_purchase_history_of_user(actor_id, user_id, store_id, **filters)
 
 
 @market_bp.route('/show_purchase_history', methods=['GET'])
@@ -112,16 +302,20 @@ def show_user_purchase_history():
 def show_purchase_history():
     """
         Use Case
-        Show the purchase history of a user
+        Show the purchase history of a user, newest first
+
+        Data (optional):
+            start_date, end_date, status, limit, cursor, summary: as in store_purchase_history
     """
     logger.info('recieved request to show the purchase history of a user')
     try:
         user_id = get_jwt_identity()
+        filters = get_history_filters(request.get_json(silent=True) or request.args.to_dict())
     except Exception as e:
         logger.error(('show_purchase_history - ', str(e)))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.show_purchase_history_of_user(user_id, user_id)
+    return purchase_service.show_purchase_history_of_user(user_id, user_id, **filters)
 
 
 @market_bp.route('/search_products_by_category', methods=['POST'])
@@ -206,6 +400,9 @@ def bid_checkout():
     """
         Use Case
         Checkout the bid
+
+        Headers:
+            Idempotency-Key (str, optional): a retry with the same key returns the response of the first request
     """
     logger.info('recieved request to checkout the bid')
     try:
@@ -237,11 +434,12 @@ def bid_checkout():
         if not isinstance(address_helper, dict):
             raise Exception('address must be a dictionary')
         address = {str(key): str(value) for key, value in address_helper.items()}
+        idempotency_key = get_idempotency_key()
     except Exception as e:
         logger.error('bid_checkout - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.bid_checkout(user_id, bid_id, payment_details, supply_details, address)
+    return purchase_service.bid_checkout(user_id, bid_id, payment_details, supply_details, address, idempotency_key)
     
     
 @market_bp.route('/user_bid_offer', methods=['POST'])
@@ -464,19 +662,21 @@ def show_user_bids():
 def view_user_bids():
     """
         Use Case:
-        View bids of user
-        
-        Data:
-            user_id (int): id of the user
+        View bids of user, newest first
+
+        Data (optional):
+            status (str): onGoing, accepted, completed, offer_rejected or approved
+            limit (int): page size, PURCHASE_HISTORY_PAGE_SIZE by default
+            cursor (int): next_cursor of the previous page
     """
     logger.info('recieved request to view bids of user')
     try:
         user_id = get_jwt_identity()
-        data = request.get_json()
+        filters = get_bid_filters(request.get_json(silent=True) or request.args.to_dict())
     except Exception as e:
-        logger.error('view_bids_of_user - ', str(e))
+        logger.error('view_bids_of_user - %s', str(e))
         return jsonify({'message': str(e)}), 400
-    return purchase_service.view_user_bids(user_id)
+    return purchase_service.view_user_bids(user_id, **filters)
 
 
 @market_bp.route('/get_store_bids', methods=['GET', 'POST'])
@@ -484,42 +684,44 @@ def view_user_bids():
 def show_store_bids():
     """
         Use Case:
-        Show store bids
+        Show store bids, newest first
 
         Data:
             store_id (int): id of the store
+            status, limit, cursor (optional): as in view_bids_of_user
     """
     logger.info('recieved request to show store bids')
     try:
         store_owner_id = get_jwt_identity()
-        data = request.get_json()
+        data = request.get_json(silent=True) or request.args.to_dict()
         store_id = int(data['store_id'])
+        filters = get_bid_filters(data)
         logger.info(f'the store id we got to get their bids from is: {store_id}')
     except Exception as e:
-        logger.error('show_store_bids - ', str(e))
+        logger.error('show_store_bids - %s', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.show_store_bids(store_owner_id, store_id)
+    return purchase_service.show_store_bids(store_owner_id, store_id, **filters)
 
 @market_bp.route('/view_all_bids', methods=['GET', 'POST'])
 @jwt_required()
 def view_all_bids_of_system():
     """
         Use Case:
-        View all bids
+        View all bids, newest first
 
-        Data:
-            None
+        Data (optional):
+            status, limit, cursor: as in view_bids_of_user
     """
     logger.info('recieved request to view all bids')
     try:
         system_manager_id = get_jwt_identity()
-        data = request.get_json()
+        filters = get_bid_filters(request.get_json(silent=True) or request.args.to_dict())
     except Exception as e:
-        logger.error('view_all_bids - ', str(e))
+        logger.error('view_all_bids - %s', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return purchase_service.view_all_bids_of_system(system_manager_id)
+    return purchase_service.view_all_bids_of_system(system_manager_id, **filters)
 
 
 
@@ -1,5 +1,5 @@
 # communication with business logic
-from datetime import datetime
+from datetime import date, datetime
 from typing import Dict, List, Optional, Tuple
 from backend.business import MarketFacade
 from backend.business.store import StoreFacade
@@ -451,6 +451,18 @@ class StoreService:
             logger.error('store owner was not added')
             return jsonify({'message': str(e)}), 400
 
+    def add_store_owners(self, user_id: int, store_id: int, new_owner_usernames: List[str]):
+        """
+            Send promotions to many new owners of a store
+        """
+        try:
+            nominations = self.__market_facade.nominate_store_owners(store_id, user_id, new_owner_usernames)
+            logger.info('store owners were added successfully')
+            return jsonify({'message': 'store owners were added successfully', 'nominations': nominations}), 200
+        except Exception as e:
+            logger.error('store owners were not added')
+            return jsonify({'message': str(e)}), 400
+
     def add_store_manager(self, user_id: int, store_id: int, manager_username):
         """
             Add a store manager
@@ -463,6 +475,18 @@ class StoreService:
             logger.error('store manager was not added')
             return jsonify({'message': str(e)}), 400
 
+    def add_store_managers(self, user_id: int, store_id: int, manager_usernames: List[str]):
+        """
+            Send promotions to many new managers of a store
+        """
+        try:
+            nominations = self.__market_facade.nominate_store_managers(store_id, user_id, manager_usernames)
+            logger.info('store managers were added successfully')
+            return jsonify({'message': 'store managers were added successfully', 'nominations': nominations}), 200
+        except Exception as e:
+            logger.error('store managers were not added')
+            return jsonify({'message': str(e)}), 400
+
     def remove_store_role(self, user_id: int, store_id: int, username: str):
         """
             Remove a store role (owner/manager)
@@ -632,14 +656,40 @@ class StoreService:
             return jsonify({'message': str(e)}), 400
 
 
-    def get_total_price_after_discount(self, user_id: int):
+    def get_sales_stats(self, user_id: int, store_id: int, start_date: Optional[date] = None,
+                        end_date: Optional[date] = None):
+        """
+            Get the daily sales of a store from the sales rollups
+        """
+        try:
+            stats = self.__market_facade.get_sales_stats(user_id, store_id, start_date, end_date)
+            logger.info('sales stats were sent successfully')
+            return jsonify({'message': stats}), 200
+        except Exception as e:
+            logger.error('sales stats were not sent')
+            return jsonify({'message': str(e)}), 400
+
+    def rebuild_sales_stats(self, user_id: int, store_id: Optional[int] = None):
+        """
+            Rebuild the sales rollups from the purchase history
+        """
+        try:
+            counted = self.__market_facade.rebuild_sales_stats(user_id, store_id)
+            logger.info('sales stats were rebuilt successfully')
+            return jsonify({'message': counted}), 200
+        except Exception as e:
+            logger.error('sales stats were not rebuilt')
+            return jsonify({'message': str(e)}), 400
+
+    def get_total_price_after_discount(self, user_id: int, address: Optional[dict] = None):
         """
-            Get the total price after discount
+            Get the total price after discount and a quote of it
         """
         try:
-            total_price = self.__market_facade.get_total_price_after_discount(user_id)
+            quote = self.__market_facade.get_price_quote(user_id, address)
             logger.info('total price after discount was sent successfully')
-            return jsonify({'message': total_price}), 200
+            return jsonify({'message': quote['total_price_after_discounts'], 'total_price': quote['total_price'],
+                            'quote': quote['quote'], 'quote_expires_at': quote['expires_at']}), 200
         except Exception as e:
             logger.error('total price after discount was not sent')
             return jsonify({'message': str(e)}), 400
\ No newline at end of file
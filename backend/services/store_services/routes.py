@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, Tuple
 from flask import Blueprint, request, jsonify
 from .controllers import StoreService
@@ -837,17 +837,24 @@ def add_store_owner():
         Use Case 2.4.3.1:
         Send promototion to a new owner to a store.
         User still needs to accept the promotion!
+
+        Data:
+            store_id (int): id of the store
+            username (str) or usernames (list of str): the new owners
     """
     logger.info('received request to add store owner')
     try:
         user_id = get_jwt_identity()
         data = request.get_json()
         store_id = int(data['store_id'])
-        username = data['username']
+        usernames = [str(username) for username in data['usernames']] if 'usernames' in data else None
+        username = data['username'] if usernames is None else None
 
     except Exception as e:
         logger.error('add_store_owner - ', str(e))
         return jsonify({'message': str(e)}), 400
+    if usernames is not None:
+        return store_service.add_store_owners(user_id, store_id, usernames)
     return store_service.add_store_owner(user_id, store_id, username)
 
 @store_bp.route('/add_store_manager', methods=['POST'])
@@ -857,17 +864,24 @@ def add_store_manager():
         Use Case 2.4.3.1:
         Send promototion to a new manager to a store.
         User still needs to accept the promotion!
+
+        Data:
+            store_id (int): id of the store
+            username (str) or usernames (list of str): the new managers
     """
     logger.info('received request to add store manager')
     try:
         user_id = get_jwt_identity()
         data = request.get_json()
         store_id = int(data['store_id'])
-        new_manager_username = data['username']
+        usernames = [str(username) for username in data['usernames']] if 'usernames' in data else None
+        new_manager_username = data['username'] if usernames is None else None
     except Exception as e:
         logger.error('add_store_manager - ', str(e))
         return jsonify({'message': str(e)}), 400
 
+    if usernames is not None:
+        return store_service.add_store_managers(user_id, store_id, usernames)
     return store_service.add_store_manager(user_id, store_id, new_manager_username)
 
 
@@ -1200,13 +1214,76 @@ def get_product_categories():
 def get_total_price_after_discounts():
     """
         Use Case
-        Get total price after discounts
+        Get total price after discounts, with a quote that checkout can use instead of pricing the cart again
+
+        Data:
+            address (dict, optional): the checkout address, discounts that depend on the user are calculated and
+                                      the quote is usable at checkout only if it is given
     """
     logger.info('received request to get total price after discounts')
     try:
         user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        address = data.get('address')
+        if address is not None:
+            if not isinstance(address, dict):
+                raise ServiceLayerError('address must be a dictionary', ServiceLayerErrorTypes.address_not_dict)
+            address = {str(key): str(value) for key, value in address.items()}
     except Exception as e:
         logger.error('get_total_price_after_discounts - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return store_service.get_total_price_after_discount(user_id)
\ No newline at end of file
+    return store_service.get_total_price_after_discount(user_id, address)
+
+@store_bp.route('/sales_stats', methods=['GET', 'POST'])
+@jwt_required()
+def get_sales_stats():
+    """
+        Use Case
+        Get the revenue per day, the units sold of each product and the average basket value of a store
+
+        Data:
+            store_id (int): id of the store
+            start_date (str, optional): ISO date, first day of the range
+            end_date (str, optional): ISO date, last day of the range, today by default
+    """
+    logger.info('received request to get the sales stats of a store')
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or request.args.to_dict()
+        store_id = int(data['store_id'])
+        start_date = None
+        if data.get('start_date') is not None:
+            start_date = date.fromisoformat(str(data['start_date']))
+        end_date = None
+        if data.get('end_date') is not None:
+            end_date = date.fromisoformat(str(data['end_date']))
+    except Exception as e:
+        logger.error('get_sales_stats - %s', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return store_service.get_sales_stats(user_id, store_id, start_date, end_date)
+
+
+@store_bp.route('/rebuild_sales_stats', methods=['POST'])
+@jwt_required()
+def rebuild_sales_stats():
+    """
+        Use Case
+        Rebuild the sales stats from the purchase history (system manager only)
+
+        Data:
+            store_id (int, optional): id of the store, all the stores by default
+    """
+    logger.info('received request to rebuild the sales stats')
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        store_id = None
+        if data.get('store_id') is not None:
+            store_id = int(data['store_id'])
+    except Exception as e:
+        logger.error('rebuild_sales_stats - %s', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return store_service.rebuild_sales_stats(user_id, store_id)
@@ -441,65 +441,102 @@ class UserService:
             logger.error('get_user_nominations - ' + str(e))
             return jsonify({'message': str(e)}), 400
 
-    def get_user_employees(self, user_id: int, store_id: int):
+    def get_user_employees(self, user_id: int, store_id: int, **filters):
         """
-            Get user employees
+            Get a page of the user employees
 
             Args:
                 user_id (int): id of the user
                 store_id (int): id of the store
+                filters: cursor, limit, is_owner and username
 
             Returns:
                 response (str): response of the operation
         """
         try:
-            employees = self.market_facade.get_user_employees(user_id, store_id)
-            employees = [employee.get() for employee in employees]
-            return jsonify({'employees': employees}), 200
+            info = self.market_facade.get_user_employees(user_id, store_id, **filters)
+            employees = [employee.get() for employee in info['employees']]
+            return jsonify({'employees': employees, 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('get_user_employees - ' + str(e))
             return jsonify({'message': str(e)}), 400
 
-    def get_unemployed_users(self, store_id):
+    def get_unemployed_users(self, store_id, **filters):
         """
-            Get unemployed users
+            Get a page of the unemployed users
 
             Args:
-                user_id (int): id of the user
                 store_id (int): id of the store
+                filters: cursor, limit and username
 
             Returns:
                 response (str): response of the operation
         """
         try:
-            unemployed_users = self.market_facade.get_unemployed_users(store_id)
-            unemployed_users = [user.get() for user in unemployed_users]
-            return jsonify({'unemployed_users': unemployed_users}), 200
+            info = self.market_facade.get_unemployed_users(store_id, **filters)
+            unemployed_users = [user.get() for user in info['members']]
+            return jsonify({'unemployed_users': unemployed_users, 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('get_unemployed_users - ' + str(e))
             return jsonify({'message': str(e)}), 400
 
-    def get_all_members(self, user_id: int):
+    def get_all_members(self, user_id: int, **filters):
         """
-            Get all users
+            Get a page of the members
 
             Args:
                 user_id (int): id of the user
+                filters: cursor, limit, username and suspended
 
             Returns:
                 response (str): response of the operation
         """
         try:
-            users = self.market_facade.get_all_members(user_id)
-            users = [user.get() for user in users]
+            info = self.market_facade.get_all_members(user_id, **filters)
+            users = [user.get() for user in info['members']]
+            system_managers = set(self.roles_facade.get_system_managers())
             for user in users:
                 user['is_suspended'] = self.market_facade.is_suspended(user['user_id'])
-                user['is_system_manager'] = self.roles_facade.is_system_manager(user['user_id'])
-            return jsonify({'users': users}), 200
+                user['is_system_manager'] = user['user_id'] in system_managers
+            return jsonify({'users': users, 'next_cursor': info['next_cursor']}), 200
         except Exception as e:
             logger.error('get_all_users - ' + str(e))
             return jsonify({'message': str(e)}), 400
 
+    def get_guest_gc_metrics(self, user_id: int):
+        """
+            Get the metrics of the guest collector
+
+            Args:
+                user_id (int): id of the user
+
+            Returns:
+                response (str): response of the operation
+        """
+        try:
+            metrics = self.market_facade.get_guest_gc_metrics(user_id)
+            return jsonify({'metrics': metrics}), 200
+        except Exception as e:
+            logger.error('get_guest_gc_metrics - ' + str(e))
+            return jsonify({'message': str(e)}), 400
+
+    def get_password_hash_metrics(self, user_id: int):
+        """
+            Get the metrics of the password hasher of the logins
+
+            Args:
+                user_id (int): id of the user
+
+            Returns:
+                response (str): response of the operation
+        """
+        try:
+            metrics = self.market_facade.get_password_hash_metrics(user_id)
+            return jsonify({'metrics': metrics}), 200
+        except Exception as e:
+            logger.error('get_password_hash_metrics - ' + str(e))
+            return jsonify({'message': str(e)}), 400
+
 class AuthenticationService:
     # singleton
     instance = None
@@ -572,6 +609,8 @@ class AuthenticationService:
 
         except UserError as e:
             logger.error(f"login - {str(e.user_error_type)} , {str(e.message)}")
+            if e.user_error_type == UserErrorTypes.too_many_logins:
+                return jsonify({'message': str(e)}), 503
             return jsonify({'message': str(e)}), 401
 
         except Exception as e:
@@ -17,6 +17,21 @@ user_bp = Blueprint('user', __name__)
 user_service = UserService()
 
 
+def get_member_filters(data: dict, *names: str) -> dict:
+    # the optional filters and pagination of the member listing routes
+    filters = {}
+    for name in ('cursor', 'limit'):
+        if data.get(name) is not None:
+            filters[name] = int(data[name])
+    if data.get('username'):
+        filters['username'] = str(data['username'])
+    for name in names:
+        value = data.get(name)
+        if value is not None:
+            filters[name] = value.lower() == 'true' if isinstance(value, str) else bool(value)
+    return filters
+
+
 # ---------------------------------------------------------------authentication usecase
 # routes---------------------------------------------------------------
 
@@ -466,15 +481,24 @@ def get_user_nominations():
 @user_bp.route('/get_user_employees', methods=['GET', 'POST'])
 @jwt_required()
 def get_user_employees():
+    """
+        Data:
+            store_id (int): id of the store
+            limit (int, optional): page size, MEMBER_LISTING_PAGE_SIZE by default
+            cursor (int, optional): next_cursor of the previous page
+            is_owner (bool, optional): only the owners (true) or the managers (false)
+            username (str, optional): a prefix of the usernames
+    """
     try:
         user_id = get_jwt_identity()
-        data = request.get_json()
+        data = request.get_json(silent=True) or request.args.to_dict()
         store_id = int(data['store_id'])
+        filters = get_member_filters(data, 'is_owner')
     except Exception as e:
         logger.error('get_user_employees - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    res = user_service.get_user_employees(user_id, store_id)
+    res = user_service.get_user_employees(user_id, store_id, **filters)
     return res
 
 @user_bp.route('/get_unemployed_users', methods=['GET', 'POST'])
@@ -482,25 +506,56 @@ def get_user_employees():
 def get_unemployed_users():
     try:
         user_id = get_jwt_identity()
-        data = request.get_json()
+        data = request.get_json(silent=True) or request.args.to_dict()
         store_id = int(data['store_id'])
+        filters = get_member_filters(data)
     except Exception as e:
         logger.error('get_unemployed_users - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    res = user_service.get_unemployed_users(store_id)
+    res = user_service.get_unemployed_users(store_id, **filters)
     return res
 
-@user_bp.route('/get_all_members', methods=['GET'])
+@user_bp.route('/get_all_members', methods=['GET', 'POST'])
 @jwt_required()
 def get_all_users():
+    """
+        Data (optional):
+            limit (int): page size, MEMBER_LISTING_PAGE_SIZE by default
+            cursor (int): next_cursor of the previous page
+            username (str): a prefix of the usernames
+            suspended (bool): only the suspended (true) or not suspended (false) members
+    """
     try:
         user_id = get_jwt_identity()
+        filters = get_member_filters(request.get_json(silent=True) or request.args.to_dict(), 'suspended')
     except Exception as e:
         logger.error('get_all_users - ', str(e))
         return jsonify({'message': str(e)}), 400
 
-    return user_service.get_all_members(user_id)
+    return user_service.get_all_members(user_id, **filters)
+
+@user_bp.route('/guest_gc_metrics', methods=['GET'])
+@jwt_required()
+def get_guest_gc_metrics():
+    try:
+        user_id = get_jwt_identity()
+    except Exception as e:
+        logger.error('get_guest_gc_metrics - ', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return user_service.get_guest_gc_metrics(user_id)
+
+@user_bp.route('/password_hash_metrics', methods=['GET'])
+@jwt_required()
+def get_password_hash_metrics():
+    try:
+        user_id = get_jwt_identity()
+    except Exception as e:
+        logger.error('get_password_hash_metrics - ', str(e))
+        return jsonify({'message': str(e)}), 400
+
+    return user_service.get_password_hash_metrics(user_id)
 
 @user_bp.route('/check_system_manager', methods=['POST'])
 @jwt_required()
@@ -3,6 +3,7 @@ from backend import create_app, clean_data
 import json
 import threading
 import queue
+import time
 register_credentials = { 
         'username': 'test',
         'email': 'test@gmail.com',
@@ -337,3 +338,514 @@ def test_checkout_failed_address_invalid(app, clean,client2, user_token, init_st
     response = client2.post('market/checkout', headers=headers, json=data)
     assert response.status_code == 400
 
+
+def wait_for_checkout_job(client, headers, job_id):
+    for _ in range(50):
+        response = client.post('market/checkout_status', headers=headers, json={"job_id": job_id})
+        assert response.status_code == 200
+        job = json.loads(response.data)['message']
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.1)
+    return job
+
+def test_user_checkout_async_success(app, clean, client2, user_token, init_store):
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    headers = {'Authorization': 'Bearer ' + user_token}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout,
+            "async": True}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    job_id = json.loads(response.data)['message']
+
+    job = wait_for_checkout_job(client2, headers, job_id)
+    assert job['status'] == 'completed'
+
+def test_user_checkout_async_payment_failed(app, clean, client2, user_token, init_store):
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    headers = {'Authorization': 'Bearer ' + user_token}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": {'payment method': 'invalid'},
+            "supply_method": default_supply_method,
+            "address": default_address_checkout,
+            "async": True}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    job_id = json.loads(response.data)['message']
+
+    job = wait_for_checkout_job(client2, headers, job_id)
+    assert job['status'] == 'failed'
+
+def test_checkout_status_invalid_job(app, clean, client2, user_token):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    response = client2.post('market/checkout_status', headers=headers, json={"job_id": 1234})
+    assert response.status_code == 400
+
+def test_failed_checkout_releases_reserved_products(app, clean, client2, client3, init_store, user_token, guest_token):
+    user_headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 10}
+    response = client2.post('user/add_to_basket', headers=user_headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": {'payment method': 'invalid'},
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    response = client2.post('market/checkout', headers=user_headers, json=data)
+    assert response.status_code == 400
+
+    guest_headers = {'Authorization': 'Bearer ' + guest_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 10}
+    response = client3.post('user/add_to_basket', headers=guest_headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    response = client3.post('market/checkout', headers=guest_headers, json=data)
+    assert response.status_code == 200
+
+def batch_entry(user_id, cart=None):
+    entry = {"user_id": user_id,
+             "payment_details": default_payment_method,
+             "supply_method": default_supply_method,
+             "address": default_address_checkout}
+    if cart is not None:
+        entry["cart"] = cart
+    return entry
+
+def test_batch_checkout_own_basket(app, clean, client2, user_token, init_store):
+    from flask_jwt_extended import decode_token
+    user_id = int(decode_token(user_token)['sub'])
+    headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 2}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    response = client2.post('market/batch_checkout', headers=headers, json={"entries": [batch_entry(user_id)]})
+    assert response.status_code == 200
+    results = json.loads(response.data)['message']
+    assert results[0]['success']
+
+    response = client2.get('user/show_cart', headers=headers)
+    assert json.loads(response.data)['shopping_cart'] == {}
+
+def test_batch_checkout_failing_entry_does_not_abort_others(app, clean, client1, client2, client3, init_store, owner_token, user_token, guest_token):
+    from flask_jwt_extended import decode_token
+    user_id = int(decode_token(user_token)['sub'])
+    owner_id = int(decode_token(owner_token)['sub'])
+    from backend.business.market import MarketFacade
+    MarketFacade().create_admin()
+    response = client3.post('auth/login', headers={'Authorization': 'Bearer ' + guest_token},
+                            json={"username": "admin", "password": "admin"})
+    admin_headers = {'Authorization': 'Bearer ' + json.loads(response.data)['token']}
+
+    store_id = init_store['store_id']
+    entries = [batch_entry(user_id, {str(store_id): {str(init_store['product_id1']): 3}}),
+               batch_entry(owner_id, {str(store_id): {str(init_store['product_id2']): 11}})]
+    response = client3.post('market/batch_checkout', headers=admin_headers, json={"entries": entries})
+    assert response.status_code == 200
+    results = json.loads(response.data)['message']
+    assert results[0]['success']
+    assert 'purchase_id' in results[0]
+    assert not results[1]['success']
+    assert 'message' in results[1]
+
+    response = client1.post('store/store_products', headers={'Authorization': 'Bearer ' + owner_token},
+                            json={"store_id": store_id})
+    amounts = {product['product_id']: product['amount'] for product in json.loads(response.data)['message']}
+    assert amounts[init_store['product_id1']] == 7
+    assert amounts[init_store['product_id2']] == 10
+
+def test_batch_checkout_for_other_user_not_system_manager(app, clean, client2, init_store, owner_token, user_token):
+    from flask_jwt_extended import decode_token
+    owner_id = int(decode_token(owner_token)['sub'])
+    headers = {'Authorization': 'Bearer ' + user_token}
+    entries = [batch_entry(owner_id, {str(init_store['store_id']): {str(init_store['product_id1']): 1}})]
+    response = client2.post('market/batch_checkout', headers=headers, json={"entries": entries})
+    assert response.status_code == 200
+    assert not json.loads(response.data)['message'][0]['success']
+
+def test_checkout_with_idempotency_key_runs_once(app, clean, client1, client2, init_store, owner_token, user_token):
+    headers = {'Authorization': 'Bearer ' + user_token, 'Idempotency-Key': 'checkout-1'}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    first = client2.post('market/checkout', headers=headers, json=data)
+    assert first.status_code == 200
+
+    # the retry is answered from the stored result even though the cart is now empty
+    retry = client2.post('market/checkout', headers=headers, json=data)
+    assert retry.status_code == 200
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert json.loads(retry.data) == json.loads(first.data)
+
+    response = client1.post('store/store_products', headers={'Authorization': 'Bearer ' + owner_token},
+                            json={"store_id": init_store['store_id']})
+    amounts = {product['product_id']: product['amount'] for product in json.loads(response.data)['message']}
+    assert amounts[init_store['product_id1']] == 9
+
+def test_checkout_idempotency_key_reused_with_other_request(app, clean, client2, init_store, user_token):
+    headers = {'Authorization': 'Bearer ' + user_token, 'Idempotency-Key': 'checkout-1'}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+
+    data["address"] = dict(default_address_checkout, city='metropolis')
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 400
+
+def test_transient_checkout_failure_is_not_replayed(app, clean, client2, client3, init_store, user_token,
+                                                     guest_token):
+    user_headers = {'Authorization': 'Bearer ' + user_token, 'Idempotency-Key': 'checkout-1'}
+    guest_headers = {'Authorization': 'Bearer ' + guest_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 10}
+    assert client2.post('user/add_to_basket', headers=user_headers, json=data).status_code == 200
+    assert client3.post('user/add_to_basket', headers=guest_headers, json=data).status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    assert client3.post('market/checkout', headers=guest_headers, json=data).status_code == 200
+    # the products were sold out, the key is released so the checkout can be retried with it
+    first = client2.post('market/checkout', headers=user_headers, json=data)
+    assert first.status_code == 400
+    retry = client2.post('market/checkout', headers=user_headers, json=data)
+    assert retry.status_code == 400
+    assert retry.headers.get('Idempotent-Replayed') is None
+
+def test_concurrent_checkouts_with_same_idempotency_key(app, clean, client2, client3, init_store, user_token):
+    headers = {'Authorization': 'Bearer ' + user_token, 'Idempotency-Key': 'checkout-1'}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    responses = queue.Queue()
+
+    def send(client):
+        with app.app_context():
+            responses.put(client.post('market/checkout', headers=headers, json=data))
+
+    threads = [threading.Thread(target=send, args=(client,)) for client in (client2, client3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    first, second = responses.get(), responses.get()
+    assert first.status_code == 200 and second.status_code == 200
+    assert json.loads(first.data) == json.loads(second.data)
+
+def get_quote(client, headers, address=default_address_checkout):
+    response = client.get('store/get_total_price_after_discounts', headers=headers, json={'address': address})
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+def purchase_total(purchase_id):
+    from backend.business.purchase.purchase import Purchase
+    from backend.database import db
+    db.session.expire_all()
+    return db.session.query(Purchase).filter_by(id=purchase_id).first().total_price
+
+def test_checkout_with_quote_skips_repricing(app, clean, client2, user_token, init_store, monkeypatch):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 2}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+    quote = get_quote(client2, headers)
+    assert quote['message'] == 20.0 and quote['total_price'] == 20.0
+
+    from backend.business.store import StoreFacade
+    def priced_again(*args, **kwargs):
+        raise AssertionError('the cart was priced again')
+    monkeypatch.setattr(StoreFacade, 'get_purchase_shopping_cart', priced_again)
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout,
+            "quote": quote['quote']}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    assert purchase_total(json.loads(response.data)['message']) == 20.0
+
+def test_checkout_with_outdated_quote_prices_again(app, clean, client1, client2, owner_token, user_token, init_store):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 2}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+    quote = get_quote(client2, headers)
+
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "price": 15.0}
+    response = client1.post('store/change_price_of_product', headers=owner_headers, json=data)
+    assert response.status_code == 200
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout,
+            "quote": quote['quote']}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    assert purchase_total(json.loads(response.data)['message']) == 30.0
+
+def test_quote_expires_when_a_discount_starts(app, clean, client1, client2, owner_token, user_token, init_store):
+    from datetime import date, datetime, timedelta
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    starts = date.today() + timedelta(days=1)
+    data = {"description": 'tomorrow', "start_date": starts.strftime('%Y-%m-%d'),
+            "end_date": (starts + timedelta(days=7)).strftime('%Y-%m-%d'), "percentage": 0.1,
+            "store_id": init_store['store_id'], "product_id": None, "category_id": None, "applied_to_sub": None}
+    response = client1.post('store/add_discount', headers=owner_headers, json=data)
+    assert response.status_code == 200
+
+    headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+    ttl = app.config['PRICE_QUOTE_TTL']
+    app.config['PRICE_QUOTE_TTL'] = 3 * 24 * 60 * 60
+    try:
+        quote = get_quote(client2, headers)
+    finally:
+        app.config['PRICE_QUOTE_TTL'] = ttl
+    # the discount starts inside the time to live, the quote is only valid until then
+    assert datetime.fromisoformat(quote['quote_expires_at']) == datetime.combine(starts, datetime.min.time())
+
+def test_checkout_with_tampered_quote_prices_again(app, clean, client2, user_token, init_store):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 1}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+    payload, signature = get_quote(client2, headers)['quote'].split('.')
+    import base64
+    quote = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    quote['total_price'] = quote['total_price_after_discounts'] = 0.5
+    payload = base64.urlsafe_b64encode(json.dumps(quote, sort_keys=True).encode()).decode().rstrip('=')
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout,
+            "quote": f'{payload}.{signature}'}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    assert purchase_total(json.loads(response.data)['message']) == 10.0
+
+def checkout_product(client, headers, store_id, product_id, quantity):
+    data = {"store_id": store_id, "product_id": product_id, "quantity": quantity}
+    response = client.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout}
+    response = client.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    return json.loads(response.data)['message']
+
+def test_purchase_history_pages_and_summary(app, clean, client1, client2, owner_token, user_token, init_store):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    first = checkout_product(client2, headers, init_store['store_id'], init_store['product_id1'], 1)
+    second = checkout_product(client2, headers, init_store['store_id'], init_store['product_id2'], 2)
+
+    response = client2.get('market/show_purchase_history?limit=1', headers=headers)
+    assert response.status_code == 200
+    page = json.loads(response.data)
+    assert [purchase['purchase_id'] for purchase in page['message']] == [second]
+    response = client2.get(f'market/show_purchase_history?limit=1&cursor={page["next_cursor"]}', headers=headers)
+    page = json.loads(response.data)
+    assert [purchase['purchase_id'] for purchase in page['message']] == [first]
+    assert page['next_cursor'] is None
+
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    data = {'store_id': init_store['store_id'], 'summary': True}
+    response = client1.post('market/store_purchase_history', headers=owner_headers, json=data)
+    assert response.status_code == 200
+    assert json.loads(response.data)['message'] == {'purchases': 2, 'total_price': 30.0,
+                                                    'total_price_after_discounts': 30.0}
+    data = {'store_id': init_store['store_id'], 'status': 'completed'}
+    response = client1.post('market/store_purchase_history', headers=owner_headers, json=data)
+    assert response.status_code == 200
+    assert json.loads(response.data)['message'] == []
+    data = {'store_id': init_store['store_id'], 'status': 'delivered'}
+    response = client1.post('market/store_purchase_history', headers=owner_headers, json=data)
+    assert response.status_code == 400
+
+def test_sales_stats(app, clean, client1, client2, owner_token, user_token, init_store):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    checkout_product(client2, headers, init_store['store_id'], init_store['product_id1'], 1)
+    checkout_product(client2, headers, init_store['store_id'], init_store['product_id2'], 2)
+
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    response = client1.get(f'store/sales_stats?store_id={init_store["store_id"]}', headers=owner_headers)
+    assert response.status_code == 200
+    stats = json.loads(response.data)['message']
+    assert len(stats['days']) == app.config['SALES_STATS_DEFAULT_DAYS']
+    assert stats['totals']['purchases'] == 2 and stats['totals']['units'] == 3
+    assert stats['totals']['revenue'] == 30.0 and stats['totals']['average_basket_value'] == 15.0
+    assert [product['units'] for product in stats['products']] == [2, 1]
+
+    response = client2.get(f'store/sales_stats?store_id={init_store["store_id"]}', headers=headers)
+    assert response.status_code == 400
+    response = client1.post('store/rebuild_sales_stats', headers=owner_headers, json={})
+    assert response.status_code == 400
+
+def test_export_store_purchase_history(app, clean, client1, client2, owner_token, user_token, init_store):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    first = checkout_product(client2, headers, init_store['store_id'], init_store['product_id1'], 1)
+    second = checkout_product(client2, headers, init_store['store_id'], init_store['product_id2'], 2)
+
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    response = client1.get(f'market/export_store_purchase_history?store_id={init_store["store_id"]}',
+                           headers=owner_headers)
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    import csv
+    import io
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(int(row['purchase_id']), int(row['amount'])) for row in rows] == [(first, 1), (second, 2)]
+
+    response = client1.get(f'market/export_store_purchase_history?store_id={init_store["store_id"]}&format=ndjson',
+                           headers=owner_headers)
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['product_id'] for line in lines] == [init_store['product_id1'], init_store['product_id2']]
+
+    response = client1.get(f'market/export_store_purchase_history?store_id={init_store["store_id"]}&format=xml',
+                           headers=owner_headers)
+    assert response.status_code == 400
+    response = client2.get(f'market/export_store_purchase_history?store_id={init_store["store_id"]}',
+                           headers=headers)
+    assert response.status_code == 400
+
+def test_bid_listings_pages(app, clean, client1, client2, owner_token, user_token, init_store):
+    headers = {'Authorization': 'Bearer ' + user_token}
+    bid_ids = []
+    for price in (5.0, 6.0):
+        data = {'store_id': init_store['store_id'], 'product_id': init_store['product_id1'], 'proposed_price': price}
+        response = client2.post('market/user_bid_offer', headers=headers, json=data)
+        assert response.status_code == 200
+        bid_ids.append(json.loads(response.data)['message'])
+
+    response = client2.get('market/view_bids_of_user?limit=1', headers=headers)
+    assert response.status_code == 200
+    page = json.loads(response.data)
+    assert [bid['bid_id'] for bid in page['message']] == [bid_ids[1]]
+    response = client2.get(f'market/view_bids_of_user?limit=1&cursor={page["next_cursor"]}', headers=headers)
+    page = json.loads(response.data)
+    assert [bid['bid_id'] for bid in page['message']] == [bid_ids[0]] and page['next_cursor'] is None
+
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    data = {'store_id': init_store['store_id'], 'status': 'onGoing'}
+    response = client1.post('market/get_store_bids', headers=owner_headers, json=data)
+    assert response.status_code == 200
+    assert [bid['proposed_price'] for bid in json.loads(response.data)['message']] == [6.0, 5.0]
+    data = {'store_id': init_store['store_id'], 'status': 'approved'}
+    response = client1.post('market/get_store_bids', headers=owner_headers, json=data)
+    assert json.loads(response.data)['message'] == []
+
+def test_async_checkout_fails_when_its_reservations_expire(app, clean, client2, user_token, init_store, monkeypatch):
+    from backend.business.ThirdPartyHandlers import SupplyHandler
+    from backend.business.store import StoreFacade
+    from backend.business.store.reservation import StockReservation, ReservationStatus
+    from backend.database import db
+    from datetime import datetime, timedelta
+    headers = {'Authorization': 'Bearer ' + user_token}
+    data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 10}
+    response = client2.post('user/add_to_basket', headers=headers, json=data)
+    assert response.status_code == 200
+
+    process_supply = SupplyHandler.process_supply
+    def slow_supply(self, *args, **kwargs):
+        # the job runs past the reservation time to live and the sweeper returns the stock to the store
+        for reservation in db.session.query(StockReservation).filter(StockReservation._status == ReservationStatus.active):
+            reservation._expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        StoreFacade().release_expired_reservations()
+        return process_supply(self, *args, **kwargs)
+    monkeypatch.setattr(SupplyHandler, 'process_supply', slow_supply)
+
+    data = {"payment_details": default_payment_method,
+            "supply_method": default_supply_method,
+            "address": default_address_checkout,
+            "async": True}
+    response = client2.post('market/checkout', headers=headers, json=data)
+    assert response.status_code == 200
+    job = wait_for_checkout_job(client2, headers, json.loads(response.data)['message'])
+    assert job['status'] == 'failed'
+
+def test_batch_checkout_prices_like_single_checkout(app, clean, client1, client2, owner_token, user_token, init_store):
+    from datetime import date, timedelta
+    from flask_jwt_extended import decode_token
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    data = {"description": 'store wide', "start_date": date.today().strftime('%Y-%m-%d'),
+            "end_date": (date.today() + timedelta(days=7)).strftime('%Y-%m-%d'), "percentage": 0.1,
+            "store_id": init_store['store_id'], "product_id": None, "category_id": None, "applied_to_sub": None}
+    response = client1.post('store/add_discount', headers=owner_headers, json=data)
+    assert response.status_code == 200
+
+    user_id = int(decode_token(user_token)['sub'])
+    headers = {'Authorization': 'Bearer ' + user_token}
+    totals = []
+    for batch in (False, True):
+        data = {"store_id": init_store['store_id'], "product_id": init_store['product_id1'], "quantity": 2}
+        response = client2.post('user/add_to_basket', headers=headers, json=data)
+        assert response.status_code == 200
+        if batch:
+            response = client2.post('market/batch_checkout', headers=headers, json={"entries": [batch_entry(user_id)]})
+            assert response.status_code == 200
+            purchase_id = json.loads(response.data)['message'][0]['purchase_id']
+        else:
+            data = {"payment_details": default_payment_method,
+                    "supply_method": default_supply_method,
+                    "address": default_address_checkout}
+            response = client2.post('market/checkout', headers=headers, json=data)
+            assert response.status_code == 200
+            purchase_id = json.loads(response.data)['message']
+        from backend.business.purchase.purchase import Purchase
+        from backend.database import db
+        db.session.expire_all()
+        totals.append(db.session.query(Purchase).filter_by(id=purchase_id).first().total_price_after_discounts)
+    assert totals == [18.0, 18.0]
+
+def test_batch_pricing_loads_do_not_grow_with_carts(app, clean, client1, owner_token, init_store):
+    from datetime import date, timedelta
+    from backend.business.store import StoreFacade
+    from backend.database import db
+    from tests.load_harness import QueryCounter
+    owner_headers = {'Authorization': 'Bearer ' + owner_token}
+    data = {"description": 'store wide', "start_date": date.today().strftime('%Y-%m-%d'),
+            "end_date": (date.today() + timedelta(days=7)).strftime('%Y-%m-%d'), "percentage": 0.1,
+            "store_id": init_store['store_id'], "product_id": None, "category_id": None, "applied_to_sub": None}
+    response = client1.post('store/add_discount', headers=owner_headers, json=data)
+    assert response.status_code == 200
+
+    cart = {init_store['store_id']: {init_store['product_id1']: 1, init_store['product_id2']: 2}}
+    counter = QueryCounter(db.engine)
+    counter.install()
+    try:
+        counts = []
+        for carts in (1, 10):
+            db.session.expire_all()
+            counter.reset()
+            prices = StoreFacade().price_carts([(None, cart)] * carts)
+            counts.append(counter.count())
+            assert all(price[1] == 27.0 for price in prices)
+    finally:
+        counter.uninstall()
+    assert counts[0] == counts[1]
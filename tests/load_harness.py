@@ -0,0 +1,447 @@
+"""
+Load harness for the market API.
+
+Drives either the Flask test client (in process) or a live server with a configurable mix of browse, search,
+add-to-basket and checkout traffic over generated stores and users, and writes per endpoint throughput,
+p50/p95/p99 latency, error rate and DB query counts to a JSON file so runs of different commits can be compared.
+
+Usage:
+    python -m tests.load_harness --mix browse=5,search=3,add_to_basket=2,checkout=1 --requests 1000
+    python -m tests.load_harness --target http://localhost:5000 --workers 16 --output load_results.json
+
+DB query counts are only available for the test client target, a live server runs its queries in another process.
+"""
+# ----------------- imports -----------------#
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_MIX = {'browse': 5, 'search': 3, 'add_to_basket': 2, 'checkout': 1}
+DEFAULT_OUTPUT = 'load_results.json'
+PERCENTILES = (50, 95, 99)
+MAX_SAMPLE_ERRORS = 5
+
+default_payment_method = {'payment method': 'bogo'}
+
+default_supply_method = "bogo"
+
+default_address_checkout = {'address': 'randomstreet 34th',
+                            'city': 'arkham',
+                            'state': 'gotham',
+                            'country': 'Wakanda',
+                            'zip_code': '12345'}
+
+
+def register_credentials(username: str) -> dict:
+    return {'username': username,
+            'email': f'{username}@gmail.com',
+            'password': 'test',
+            'address': 'regular adddress',
+            'city': 'regular city',
+            'state': 'regular state',
+            'country': 'regular country',
+            'zip_code': '12345',
+            'year': 2003,
+            'month': 1,
+            'day': 1,
+            'phone': '054-1234567'}
+
+
+# ----------------- transports -----------------#
+class TestClientTransport:
+    # sends the requests through the flask test client, one client per worker thread
+    __test__ = False
+
+    def __init__(self, app):
+        self.app = app
+        self.__local = threading.local()
+
+    @property
+    def name(self) -> str:
+        return 'test_client'
+
+    def request(self, method: str, path: str, token: Optional[str] = None,
+                data: Optional[dict] = None) -> Tuple[int, dict]:
+        client = getattr(self.__local, 'client', None)
+        if client is None:
+            client = self.__local.client = self.app.test_client()
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        response = client.open(path, method=method, headers=headers, json=data)
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class HttpTransport:
+    # sends the requests to a live server
+    def __init__(self, base_url: str, timeout: float = 30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    @property
+    def name(self) -> str:
+        return self.base_url
+
+    def request(self, method: str, path: str, token: Optional[str] = None,
+                data: Optional[dict] = None) -> Tuple[int, dict]:
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(f'{self.base_url}/{path.lstrip("/")}', data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                status, raw = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, raw = e.code, e.read()
+        try:
+            return status, json.loads(raw or b'{}')
+        except ValueError:
+            return status, {}
+
+
+# ----------------- DB query counting -----------------#
+class QueryCounter:
+    # counts the statements the engine executes on behalf of each thread
+    def __init__(self, engine):
+        self.engine = engine
+        self.__local = threading.local()
+        self.__installed = False
+
+    def __on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.__local.count = getattr(self.__local, 'count', 0) + 1
+
+    def install(self) -> None:
+        from sqlalchemy import event
+        if not self.__installed:
+            event.listen(self.engine, 'before_cursor_execute', self.__on_execute)
+            self.__installed = True
+
+    def uninstall(self) -> None:
+        from sqlalchemy import event
+        if self.__installed:
+            event.remove(self.engine, 'before_cursor_execute', self.__on_execute)
+            self.__installed = False
+
+    def reset(self) -> None:
+        self.__local.count = 0
+
+    def count(self) -> int:
+        return getattr(self.__local, 'count', 0)
+
+
+# ----------------- statistics -----------------#
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    # nearest rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    queries: List[int] = field(default_factory=list)
+    statuses: Dict[int, int] = field(default_factory=dict)
+    sample_errors: List[str] = field(default_factory=list)
+
+    def record(self, latency: float, status: int, queries: Optional[int], error: Optional[str] = None) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status >= 400:
+            self.errors += 1
+            if error is not None and error not in self.sample_errors and len(self.sample_errors) < MAX_SAMPLE_ERRORS:
+                self.sample_errors.append(error)
+        if queries is not None:
+            self.queries.append(queries)
+
+    def summary(self, duration: float) -> dict:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        summary = {'requests': count,
+                   'errors': self.errors,
+                   'error_rate': self.errors / count if count else 0.0,
+                   'throughput_rps': count / duration if duration > 0 else 0.0,
+                   'latency_ms': {'mean': sum(latencies) / count * 1000 if count else None,
+                                  'max': latencies[-1] * 1000 if count else None},
+                   'statuses': {str(status): amount for status, amount in sorted(self.statuses.items())},
+                   'sample_errors': list(self.sample_errors)}
+        for pct in PERCENTILES:
+            value = percentile(latencies, pct)
+            summary['latency_ms'][f'p{pct}'] = value * 1000 if value is not None else None
+        if self.queries:
+            summary['db_queries'] = {'total': sum(self.queries),
+                                     'per_request': sum(self.queries) / len(self.queries),
+                                     'max': max(self.queries)}
+        return summary
+
+
+# ----------------- harness -----------------#
+@dataclass
+class LoadConfig:
+    mix: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_MIX))
+    requests: int = 1000
+    workers: int = 8
+    stores: int = 3
+    products_per_store: int = 5
+    users: int = 16
+    product_amount: int = 100000
+    seed: Optional[int] = None
+
+
+class LoadHarness:
+    def __init__(self, transport, config: LoadConfig, query_counter: Optional[QueryCounter] = None):
+        for action in config.mix:
+            if action not in self.actions():
+                raise ValueError(f'unknown action {action}, expected one of {sorted(self.actions())}')
+        self.transport = transport
+        self.config = config
+        self.query_counter = query_counter
+        self.random = random.Random(config.seed)
+        self.stats: Dict[str, EndpointStats] = {}
+        self.__stats_lock = threading.Lock()
+        self.stores: Dict[int, List[int]] = {}  # store_id -> product ids
+        self.product_names: List[str] = []
+        self.user_tokens: List[str] = []
+
+    @classmethod
+    def actions(cls) -> Dict[str, str]:
+        # action -> name of the method that performs it
+        return {'browse': 'browse', 'search': 'search', 'add_to_basket': 'add_to_basket', 'checkout': 'checkout'}
+
+    # ----------------- setup -----------------#
+    def __guest_token(self) -> str:
+        status, body = self.transport.request('GET', '/auth/')
+        if status >= 300:
+            raise RuntimeError(f'failed to enter as a guest: {body}')
+        return body['token']
+
+    def __member_token(self, username: str) -> str:
+        token = self.__guest_token()
+        status, body = self.transport.request('POST', '/auth/register', token,
+                                              {'register_credentials': register_credentials(username)})
+        if status >= 300:
+            raise RuntimeError(f'failed to register {username}: {body}')
+        status, body = self.transport.request('POST', '/auth/login', token, {'username': username, 'password': 'test'})
+        if status >= 300:
+            raise RuntimeError(f'failed to login {username}: {body}')
+        return body['token']
+
+    def setup(self) -> None:
+        """
+        * Parameters: none
+        * This function generates the stores, products and users the traffic runs over. Usernames are suffixed with
+          the run time so a live server can be loaded more than once
+        * Returns: none
+        """
+        run = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        owner_token = self.__member_token(f'load_owner_{run}')
+        for store_index in range(self.config.stores):
+            status, body = self.transport.request('POST', '/store/add_store', owner_token,
+                                                  {'store_name': f'load_store_{store_index}', 'address': 'load_address',
+                                                   'city': 'load_city', 'state': 'load_state',
+                                                   'country': 'load_country', 'zip_code': '12345'})
+            if status >= 300:
+                raise RuntimeError(f'failed to add store: {body}')
+            store_id = body['storeId']
+            self.stores[store_id] = []
+            for product_index in range(self.config.products_per_store):
+                product_name = f'load_product_{store_index}_{product_index}'
+                status, body = self.transport.request('POST', '/store/add_product', owner_token,
+                                                      {'store_id': store_id, 'product_name': product_name,
+                                                       'description': 'load product', 'price': 10.0, 'weight': 1.0,
+                                                       'tags': ['load', f'store_{store_index}'],
+                                                       'amount': self.config.product_amount})
+                if status >= 300:
+                    raise RuntimeError(f'failed to add product: {body}')
+                self.stores[store_id].append(body['product_id'])
+                self.product_names.append(product_name)
+        for user_index in range(self.config.users):
+            self.user_tokens.append(self.__member_token(f'load_user_{run}_{user_index}'))
+
+    # ----------------- actions -----------------#
+    def __call(self, endpoint: str, method: str, path: str, token: str, data: Optional[dict] = None) -> int:
+        if self.query_counter is not None:
+            self.query_counter.reset()
+        start = time.perf_counter()
+        error = None
+        try:
+            status, body = self.transport.request(method, path, token, data)
+            if status >= 400:
+                error = str(body.get('message', body))
+        except Exception as e:
+            status, error = 599, str(e)
+        latency = time.perf_counter() - start
+        queries = self.query_counter.count() if self.query_counter is not None else None
+        with self.__stats_lock:
+            self.stats.setdefault(endpoint, EndpointStats()).record(latency, status, queries, error)
+        return status
+
+    def __random_product(self, rnd: random.Random) -> Tuple[int, int]:
+        store_id = rnd.choice(list(self.stores))
+        return store_id, rnd.choice(self.stores[store_id])
+
+    def browse(self, token: str, rnd: random.Random) -> None:
+        self.__call('browse', 'POST', '/store/store_products', token, {'store_id': rnd.choice(list(self.stores))})
+
+    def search(self, token: str, rnd: random.Random) -> None:
+        self.__call('search', 'POST', '/market/search_products_by_name', token,
+                    {'name': rnd.choice(self.product_names)})
+
+    def add_to_basket(self, token: str, rnd: random.Random) -> None:
+        store_id, product_id = self.__random_product(rnd)
+        self.__call('add_to_basket', 'POST', '/user/add_to_basket', token,
+                    {'store_id': store_id, 'product_id': product_id, 'quantity': 1})
+
+    def checkout(self, token: str, rnd: random.Random) -> None:
+        # a checkout needs a non empty cart, the product is added first and recorded as add_to_basket
+        self.add_to_basket(token, rnd)
+        self.__call('checkout', 'POST', '/market/checkout', token,
+                    {'payment_details': default_payment_method, 'supply_method': default_supply_method,
+                     'address': default_address_checkout})
+
+    # ----------------- run -----------------#
+    def __plan(self) -> List[str]:
+        actions = list(self.config.mix)
+        weights = [self.config.mix[action] for action in actions]
+        return self.random.choices(actions, weights=weights, k=self.config.requests)
+
+    def __worker(self, worker_index: int, plan: List[str], tokens: List[str]) -> None:
+        rnd = random.Random(self.random.random() + worker_index)
+        for i, action in enumerate(plan):
+            getattr(self, self.actions()[action])(tokens[i % len(tokens)], rnd)
+
+    def run(self) -> dict:
+        """
+        * Parameters: none
+        * This function sends the configured mix of requests from the worker threads. Every worker gets its own
+          share of the users so the carts of a single user are not raced
+        * Returns: the report of the run
+        """
+        if not self.stores:
+            self.setup()
+        if self.query_counter is not None:
+            self.query_counter.install()
+        plan = self.__plan()
+        workers = max(1, min(self.config.workers, len(plan)))
+        threads = []
+        for worker_index in range(workers):
+            tokens = self.user_tokens[worker_index::workers] or [self.user_tokens[worker_index % len(self.user_tokens)]]
+            threads.append(threading.Thread(target=self.__worker,
+                                            args=(worker_index, plan[worker_index::workers], tokens)))
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if self.query_counter is not None:
+                self.query_counter.uninstall()
+        duration = time.perf_counter() - start
+        return self.report(duration, workers)
+
+    def report(self, duration: float, workers: int) -> dict:
+        total = EndpointStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.queries.extend(stats.queries)
+            total.errors += stats.errors
+            for status, amount in stats.statuses.items():
+                total.statuses[status] = total.statuses.get(status, 0) + amount
+        return {'meta': {'target': self.transport.name,
+                         'commit': current_commit(),
+                         'started_at': datetime.now().isoformat(),
+                         'duration_s': duration,
+                         'workers': workers,
+                         'mix': self.config.mix,
+                         'requests': self.config.requests,
+                         'stores': self.config.stores,
+                         'products_per_store': self.config.products_per_store,
+                         'users': self.config.users,
+                         'seed': self.config.seed},
+                'endpoints': {endpoint: stats.summary(duration) for endpoint, stats in sorted(self.stats.items())},
+                'total': total.summary(duration)}
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def write_report(report: dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(','):
+        action, _, weight = part.partition('=')
+        mix[action.strip()] = int(weight) if weight else 1
+    return mix
+
+
+def build_harness(target: str, config: LoadConfig, mode: str = 'testing') -> LoadHarness:
+    """
+    * Parameters: target, config, mode
+    * This function builds a harness for the given target, 'client' runs the app of the given mode in process
+      and counts its DB queries, anything else is treated as the url of a live server
+    * Returns: the load harness
+    """
+    if target == 'client':
+        from backend.app_factory import create_app_instance
+        from backend.database import db
+        app = create_app_instance(mode=mode)
+        app.app_context().push()
+        return LoadHarness(TestClientTransport(app), config, QueryCounter(db.engine))
+    return LoadHarness(HttpTransport(target), config)
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description='Load the market API with a mix of shopper traffic')
+    parser.add_argument('--target', default='client', help="'client' for the in process test client or a server url")
+    parser.add_argument('--mode', default='testing', help='app config mode for the client target')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='comma separated action=weight pairs, actions: ' + ', '.join(LoadHarness.actions()))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--stores', type=int, default=3)
+    parser.add_argument('--products-per-store', type=int, default=5)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+
+    config = LoadConfig(mix=args.mix, requests=args.requests, workers=args.workers, stores=args.stores,
+                        products_per_store=args.products_per_store, users=args.users, seed=args.seed)
+    harness = build_harness(args.target, config, args.mode)
+    report = harness.run()
+    write_report(report, args.output)
+    for endpoint, summary in report['endpoints'].items():
+        latency = summary['latency_ms']
+        queries = summary.get('db_queries', {}).get('per_request')
+        print(f"{endpoint:>14}: {summary['requests']:>6} req  {summary['throughput_rps']:8.1f} rps  "
+              f"p50 {latency['p50']:8.2f}ms  p95 {latency['p95']:8.2f}ms  p99 {latency['p99']:8.2f}ms  "
+              f"errors {summary['error_rate']:6.2%}" + (f"  queries/req {queries:.1f}" if queries is not None else ''))
+    print(f'results written to {args.output}')
+    return report
+
+
+if __name__ == '__main__':
+    main()
+    # supply deliveries are scheduled on non daemon threads that would keep the process alive
+    os._exit(0)
@@ -0,0 +1,49 @@
+import pytest
+import json
+from backend import clean_data
+from backend.database import db
+from tests.load_harness import LoadConfig, LoadHarness, TestClientTransport, QueryCounter, percentile, parse_mix, write_report
+
+
+@pytest.fixture
+def app():
+    from backend.app_factory import create_app_instance
+    app = create_app_instance(mode='testing')
+    app_context = app.app_context()
+    app_context.push()
+    yield app
+    clean_data()
+    app_context.pop()
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) is None
+
+
+def test_parse_mix():
+    assert parse_mix('browse=5,checkout=1,search') == {'browse': 5, 'checkout': 1, 'search': 1}
+
+
+def test_unknown_action_fails(app):
+    with pytest.raises(ValueError):
+        LoadHarness(TestClientTransport(app), LoadConfig(mix={'dance': 1}))
+
+
+def test_load_run_report(app, tmp_path):
+    config = LoadConfig(requests=40, workers=2, stores=2, products_per_store=2, users=2, seed=7)
+    harness = LoadHarness(TestClientTransport(app), config, QueryCounter(db.engine))
+    report = harness.run()
+    assert report['total']['requests'] >= 40
+    assert set(report['endpoints']) <= {'browse', 'search', 'add_to_basket', 'checkout'}
+    for summary in report['endpoints'].values():
+        assert summary['errors'] == 0, summary['sample_errors']
+        assert summary['latency_ms']['p50'] <= summary['latency_ms']['p99']
+        assert summary['db_queries']['per_request'] > 0
+
+    output = tmp_path / 'load_results.json'
+    write_report(report, str(output))
+    assert json.loads(output.read_text())['meta']['requests'] == 40
@@ -0,0 +1,56 @@
+import pytest
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from backend.business.purchase.purchase import ImmediateSubPurchase, Purchase, PurchaseFacade
+from backend.business.DTOs import PurchaseProductDTO
+from backend.database import db
+
+
+@pytest.fixture
+def app():
+    from backend.app_factory import create_app_instance
+    app = create_app_instance("testing")
+    context = app.app_context()
+    context.push()
+    yield app
+    db.session.rollback()
+    context.pop()
+
+
+@pytest.fixture
+def clean_purchases(app):
+    PurchaseFacade().clean_data()
+    yield
+    db.session.rollback()
+    PurchaseFacade().clean_data()
+
+
+@pytest.fixture
+def make_purchase(clean_purchases):
+    def make(cart: Union[List[int], Dict[int, List[Tuple[int, float, int]]]], user_id: int = 1, products: int = 2,
+             discount: float = 0.0, made_at: Optional[datetime] = None, accepted_at: Optional[datetime] = None,
+             complete: bool = False) -> int:
+        # cart: the store ids, each buys one of the products 0..products-1 for 10.0,
+        # or store_id -> [(product_id, price, amount)]. The discount is taken off every store
+        if not isinstance(cart, dict):
+            cart = {store_id: [(product_id, 10.0, 1) for product_id in range(products)] for store_id in cart}
+        shopping_cart = {}
+        for store_id, items in cart.items():
+            price = sum(product_price * amount for _, product_price, amount in items)
+            shopping_cart[store_id] = ([PurchaseProductDTO(product_id, f'product {product_id}', 'description',
+                                                           product_price, amount)
+                                        for product_id, product_price, amount in items], price, price - discount)
+        purchase_id = PurchaseFacade().create_immediate_purchase(
+            user_id, sum(price for _, price, _ in shopping_cart.values()),
+            sum(price for _, _, price in shopping_cart.values()), shopping_cart)
+        if made_at is not None:
+            db.session.query(Purchase).filter(Purchase.id == purchase_id).update({Purchase._date_of_purchase: made_at})
+            (db.session.query(ImmediateSubPurchase).filter(ImmediateSubPurchase.purchase_id == purchase_id)
+             .update({ImmediateSubPurchase._date_of_purchase: made_at}))
+            db.session.commit()
+        if accepted_at is not None:
+            PurchaseFacade().accept_purchase(purchase_id, accepted_at)
+        if complete:
+            PurchaseFacade().complete_purchase(purchase_id)
+        return purchase_id
+    return make
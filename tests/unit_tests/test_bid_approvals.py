@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import event
+from backend.business.purchase.purchase import BidApproval, BidPurchase, PurchaseFacade, PurchaseStatus
+from backend.database import db
+from backend.error_types import *
+
+
+pytestmark = pytest.mark.usefixtures('clean_purchases')
+
+
+def bid(required_approvals: int) -> int:
+    return PurchaseFacade().create_bid_purchase(1, 10.0, 1, 0, required_approvals)
+
+
+def get_bid(bid_id: int) -> BidPurchase:
+    db.session.expire_all()
+    return db.session.get(BidPurchase, bid_id)
+
+
+def test_approvals_are_rows_with_a_counter(app):
+    bid_id = bid(2)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 5)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 6)
+    assert db.session.query(BidApproval).filter_by(bid_id=bid_id).count() == 2
+    purchase = get_bid(bid_id)
+    assert purchase.approvals == 2
+    assert purchase.list_of_store_owners_managers_that_accepted_offer == [5, 6]
+    assert purchase.fully_approved
+    with pytest.raises(PurchaseError) as e:
+        PurchaseFacade().store_owner_manager_accept_offer(bid_id, 5)
+    assert e.value.purchase_error_type == PurchaseErrorTypes.store_owner_manager_already_accepted_offer
+
+
+def test_quorum_not_reached_does_not_read_the_approvals(app):
+    bid_id = bid(2)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 5)
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', on_execute)
+    try:
+        assert not PurchaseFacade().store_accept_offer(bid_id, [5, 6])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_execute)
+    assert statements
+    assert not any('bid_approvals' in statement for statement in statements)
+    assert get_bid(bid_id).status == PurchaseStatus.onGoing
+
+
+def test_quorum_reached(app):
+    bid_id = bid(2)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 5)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 6)
+    assert PurchaseFacade().store_accept_offer(bid_id, [5, 6])
+    assert get_bid(bid_id).status == PurchaseStatus.approved
+
+
+def test_approval_of_a_removed_worker_is_not_counted(app):
+    bid_id = bid(2)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 5)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 6)
+    assert not PurchaseFacade().store_accept_offer(bid_id, [5, 7])
+    assert get_bid(bid_id).required_approvals == 2
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 7)
+    assert PurchaseFacade().store_accept_offer(bid_id, [5, 7])
+
+
+def test_counter_offers_reset_the_approvals(app):
+    bid_id = bid(2)
+    PurchaseFacade().store_owner_manager_accept_offer(bid_id, 5)
+    PurchaseFacade().store_counter_offer(bid_id, 6, 12.0)
+    purchase = get_bid(bid_id)
+    assert purchase.list_of_store_owners_managers_that_accepted_offer == [6]
+    assert purchase.approvals == 1
+    PurchaseFacade().user_counter_offer(bid_id, 1, 11.0)
+    assert get_bid(bid_id).approvals == 0
+    assert db.session.query(BidApproval).filter_by(bid_id=bid_id).count() == 0
@@ -0,0 +1,60 @@
+import pytest
+from backend.business.purchase.purchase import BidPurchase, Purchase, PurchaseFacade, PurchaseStatus
+from backend.database import db
+from tests.load_harness import QueryCounter
+
+
+pytestmark = pytest.mark.usefixtures('clean_purchases')
+
+
+def bid(user_id: int, store_id: int, product_id: int = 0, price: float = 10.0) -> int:
+    return PurchaseFacade().create_bid_purchase(user_id, price, store_id, product_id)
+
+
+def set_status(bid_id: int, status: PurchaseStatus) -> None:
+    db.session.query(Purchase).filter(Purchase.id == bid_id).update({Purchase._status: status})
+    db.session.commit()
+
+
+def test_bids_are_filtered_by_user_and_store(app):
+    first = bid(1, 1)
+    second = bid(1, 2)
+    third = bid(2, 1)
+    assert [b['bid_id'] for b in PurchaseFacade().view_user_bids(1)] == [second, first]
+    assert [b['bid_id'] for b in PurchaseFacade().get_bid_purchases_of_store(1)] == [third, first]
+    assert [b['bid_id'] for b in PurchaseFacade().view_all_bids_of_system()] == [third, second, first]
+    assert [b.purchase_id for b in PurchaseFacade().get_bid_purchases_of_user(2)] == [third]
+    assert PurchaseFacade().view_user_bids(2)[0] == {'bid_id': third, 'user_id': 2, 'store_id': 1, 'product_id': 0,
+                                                     'proposed_price': 10.0, 'is_offer_to_store': True,
+                                                     'status': 'onGoing', 'user_who_rejected_id': -1}
+
+
+def test_bid_pages_and_status(app):
+    ids = [bid(1, 1, product_id) for product_id in range(5)]
+    set_status(ids[1], PurchaseStatus.offer_rejected)
+    set_status(ids[3], PurchaseStatus.offer_rejected)
+    bids, cursor = PurchaseFacade().list_bids(user_id=1, limit=2)
+    assert [b['bid_id'] for b in bids] == [ids[4], ids[3]]
+    bids, cursor = PurchaseFacade().list_bids(user_id=1, cursor=cursor, limit=2)
+    assert [b['bid_id'] for b in bids] == [ids[2], ids[1]]
+    bids, cursor = PurchaseFacade().list_bids(user_id=1, cursor=cursor, limit=2)
+    assert [b['bid_id'] for b in bids] == [ids[0]] and cursor is None
+    bids, cursor = PurchaseFacade().list_bids(store_id=1, status=PurchaseStatus.offer_rejected)
+    assert [b['bid_id'] for b in bids] == [ids[3], ids[1]] and cursor is None
+    assert PurchaseFacade().list_bids(store_id=2)[0] == []
+
+
+def test_bid_listing_reads_one_statement(app):
+    for product_id in range(5):
+        bid(1, 1, product_id)
+    db.session.expunge_all()
+    counter = QueryCounter(db.engine)
+    counter.install()
+    try:
+        counter.reset()
+        bids, _ = PurchaseFacade().list_bids(store_id=1, status=PurchaseStatus.onGoing)
+        assert len(bids) == 5
+        assert counter.count() == 1
+        assert len(db.session.identity_map) == 0
+    finally:
+        counter.uninstall()
@@ -0,0 +1,89 @@
+import threading
+import pytest
+from backend.business.user.user import BasketProduct, UserFacade
+from backend.business.user.cart_cache import MemoryCartCacheBackend
+from backend.database import db
+
+
+@pytest.fixture
+def user_id(app):
+    UserFacade().clean_data()
+    yield UserFacade().create_user()
+    UserFacade().clean_data()
+
+
+def rows(user_id: int):
+    db.session.commit()
+    return {(row.store_id, row.product_id): row.quantity
+            for row in db.session.query(BasketProduct).filter(BasketProduct.user_id == user_id)}
+
+
+def test_cart_changes_are_written_behind(user_id):
+    UserFacade().add_product_to_basket(user_id, 1, 100, 2)
+    UserFacade().add_product_to_basket(user_id, 2, 200, 1)
+    UserFacade().remove_product_from_basket(user_id, 2, 200, 1)
+    assert UserFacade().get_shopping_cart(user_id) == {1: {100: 2}}
+    assert rows(user_id) == {}
+    assert UserFacade().flush_carts() == 1
+    assert rows(user_id) == {(1, 100): 2}
+    assert UserFacade().flush_carts() == 0
+
+
+def test_clear_and_restore_write_through(user_id):
+    UserFacade().add_product_to_basket(user_id, 1, 100, 2)
+    UserFacade().clear_basket(user_id)
+    assert UserFacade().get_shopping_cart(user_id) == {}
+    UserFacade().restore_basket(user_id, {1: {100: 1}, 3: {300: 4}})
+    assert rows(user_id) == {(1, 100): 1, (3, 300): 4}
+    assert UserFacade().flush_carts() == 0
+
+
+def test_concurrent_adds_are_not_lost(user_id):
+    def add():
+        for _ in range(50):
+            UserFacade().add_product_to_basket(user_id, 1, 100, 1)
+
+    from backend.app_factory import get_app
+
+    def run():
+        with get_app().app_context():
+            add()
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert UserFacade().get_shopping_cart(user_id) == {1: {100: 200}}
+
+
+def test_stale_versions_are_rejected():
+    backend = MemoryCartCacheBackend(max_carts=1)
+    assert backend.put(1, {1: {100: 1}}, None, False)
+    cart, version = backend.get(1)
+    assert backend.put(1, {1: {100: 2}}, version, True)
+    assert not backend.put(1, {1: {100: 3}}, version, True)
+    assert backend.get(1) == ({1: {100: 2}}, version + 1)
+    # a dirty cart is not evicted
+    assert backend.put(2, {}, None, False)
+    assert backend.get(1) is not None
+    backend.mark_clean(1, version + 1)
+    assert backend.dirty_users() == []
+
+
+def test_flush_writes_the_changes_of_the_rows(user_id):
+    UserFacade().add_product_to_basket(user_id, 1, 100, 2)
+    UserFacade().add_product_to_basket(user_id, 1, 101, 1)
+    UserFacade().flush_carts()
+    UserFacade().add_product_to_basket(user_id, 1, 100, 3)
+    UserFacade().remove_product_from_basket(user_id, 1, 101, 1)
+    UserFacade().add_product_to_basket(user_id, 2, 200, 1)
+    assert UserFacade().flush_carts() == 1
+    assert rows(user_id) == {(1, 100): 5, (2, 200): 1}
+
+
+def test_suspended_user_basket_is_restored(user_id):
+    UserFacade().register_user(user_id, 'test@mail.com', 'testuser', 'password', 2000, 1, 1, '1234567890')
+    UserFacade().suspend_user_permanently(user_id)
+    UserFacade().restore_basket(user_id, {1: {100: 1}})
+    assert rows(user_id) == {(1, 100): 1}
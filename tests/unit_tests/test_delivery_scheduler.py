@@ -0,0 +1,73 @@
+import time
+import pytest
+from datetime import datetime, timedelta
+from backend.business.ThirdPartyHandlers import DeliveryScheduler, ScheduledDelivery
+from backend.database import db
+
+
+@pytest.fixture(autouse=True)
+def scheduler(app):
+    from backend.business.market import MarketFacade
+    config = {name: app.config[name] for name in ('DELIVERY_BATCH_SIZE', 'DELIVERY_RETRY_DELAY')}
+    DeliveryScheduler().clean_data()
+    yield
+    DeliveryScheduler().set_on_arrivals(MarketFacade().on_arrivals_lambda)
+    DeliveryScheduler().clean_data()
+    app.config.update(config)
+
+
+def pending():
+    db.session.commit()
+    return {purchase_id for purchase_id, in db.session.query(ScheduledDelivery._purchase_id)}
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        DeliveryScheduler().fire_due()
+        time.sleep(0.05)
+    return condition()
+
+
+def test_due_deliveries_arrive_in_batches(app):
+    app.config['DELIVERY_BATCH_SIZE'] = 2
+    batches = []
+    DeliveryScheduler().set_on_arrivals(lambda purchase_ids: batches.append(list(purchase_ids)))
+    now = datetime.now()
+    for purchase_id in range(1, 6):
+        DeliveryScheduler().schedule(purchase_id, now - timedelta(seconds=purchase_id))
+    DeliveryScheduler().schedule(6, now + timedelta(days=1))
+    assert wait_for(lambda: pending() == {6})
+    assert sorted(purchase_id for batch in batches for purchase_id in batch) == [1, 2, 3, 4, 5]
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+def test_pending_deliveries_are_reloaded(app):
+    arrived = []
+    DeliveryScheduler().set_on_arrivals(arrived.extend)
+    # deliveries that were scheduled before a restart are only in the table
+    db.session.add_all([ScheduledDelivery(1, datetime.now() - timedelta(minutes=5)),
+                        ScheduledDelivery(2, datetime.now() - timedelta(minutes=1))])
+    db.session.commit()
+    # due after the cancel, so the running worker cannot fire it first
+    DeliveryScheduler().schedule(3, datetime.now() + timedelta(seconds=1))
+    DeliveryScheduler().cancel(3)
+    DeliveryScheduler().load_due()
+    assert wait_for(lambda: not pending())
+    assert sorted(arrived) == [1, 2]
+
+
+def test_failed_arrivals_are_retried(app):
+    app.config['DELIVERY_RETRY_DELAY'] = 0
+    arrived = []
+
+    def on_arrivals(purchase_ids):
+        if not arrived:
+            arrived.append(None)
+            raise Exception('the purchases could not be completed')
+        arrived.extend(purchase_ids)
+
+    DeliveryScheduler().set_on_arrivals(on_arrivals)
+    DeliveryScheduler().schedule(1, datetime.now())
+    assert wait_for(lambda: not pending())
+    assert arrived == [None, 1]
@@ -0,0 +1,43 @@
+import threading
+import pytest
+from backend.business.id_allocator import IdAllocator, first_free_id
+from backend.business.user.user import User
+from backend.database import db
+
+
+@pytest.fixture(autouse=True)
+def test_ids(app):
+    IdAllocator().reset('test:', prefix=True)
+    yield
+    db.session.rollback()
+    IdAllocator().reset('test:', prefix=True)
+
+
+def test_ids_are_allocated_in_order(app):
+    assert [IdAllocator().allocate('test:counter') for _ in range(3)] == [0, 1, 2]
+    assert [IdAllocator().allocate('test:other', lambda: 7, 5) for _ in range(3)] == [7, 8, 9]
+    IdAllocator().reset('test:counter')
+    assert IdAllocator().allocate('test:counter', lambda: 10) == 10
+
+
+def test_initial_id_follows_existing_rows(app):
+    assert first_free_id(User.id, User.id < 0) == 0
+    last = db.session.query(db.func.max(User.id)).scalar()
+    assert first_free_id(User.id) == (0 if last is None else last + 1)
+
+
+def test_concurrent_ids_are_unique(app):
+    from backend.app_factory import get_app
+    ids = []
+
+    def run():
+        with get_app().app_context():
+            for _ in range(25):
+                ids.append(IdAllocator().allocate('test:concurrent', block_size=10))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ids) == list(range(100))
@@ -0,0 +1,86 @@
+import pytest
+import threading
+import time
+from datetime import datetime, timedelta
+from backend.business.checkout import IdempotencyManager, IdempotencyStatus
+from backend.business.checkout.idempotency import IdempotencyRecord
+from backend.database import db
+from backend.error_types import *
+
+
+@pytest.fixture
+def manager(app):
+    idempotency = IdempotencyManager()
+    idempotency.clean_data()
+    yield idempotency
+    app.config['IDEMPOTENCY_WAIT_TIMEOUT'] = 30
+    idempotency.clean_data()
+
+
+def test_first_request_owns_the_key(manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    record = db.session.query(IdempotencyRecord).first()
+    assert record.status == IdempotencyStatus.in_progress
+
+
+def test_completed_request_is_replayed(manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    manager.complete(1, 'checkout', 'key-1', {'message': 5}, 200)
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) == ({'message': 5}, 200)
+
+
+def test_key_is_scoped_to_user_and_endpoint(manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    assert manager.begin(2, 'checkout', 'key-1', {'value': 1}) is None
+    assert manager.begin(1, 'checkout_bid', 'key-1', {'value': 1}) is None
+
+
+def test_key_reused_for_different_request_fails(manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    manager.complete(1, 'checkout', 'key-1', {'message': 5}, 200)
+    with pytest.raises(PurchaseError) as e:
+        manager.begin(1, 'checkout', 'key-1', {'value': 2})
+    assert e.value.purchase_error_type == PurchaseErrorTypes.idempotency_key_reused
+
+
+def test_duplicate_waits_for_in_flight_request(app, manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    replayed = []
+
+    def duplicate():
+        with app.app_context():
+            replayed.append(manager.begin(1, 'checkout', 'key-1', {'value': 1}))
+
+    thread = threading.Thread(target=duplicate)
+    thread.start()
+    time.sleep(0.3)
+    assert replayed == []
+    manager.complete(1, 'checkout', 'key-1', {'message': 5}, 200)
+    thread.join(5)
+    assert replayed == [({'message': 5}, 200)]
+
+
+def test_duplicate_times_out_while_in_flight(app, manager):
+    app.config['IDEMPOTENCY_WAIT_TIMEOUT'] = 0.2
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    with pytest.raises(PurchaseError) as e:
+        manager.begin(1, 'checkout', 'key-1', {'value': 1})
+    assert e.value.purchase_error_type == PurchaseErrorTypes.idempotency_request_in_progress
+
+
+def test_released_key_can_be_retried(manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    manager.release(1, 'checkout', 'key-1')
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+
+
+def test_clean_expired(manager):
+    assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+    manager.complete(1, 'checkout', 'key-1', {'message': 5}, 200)
+    assert manager.begin(1, 'checkout', 'key-2', {'value': 1}) is None
+    manager.complete(1, 'checkout', 'key-2', {'message': 6}, 200)
+    record = db.session.query(IdempotencyRecord).filter_by(_key='key-1').first()
+    record._expires_at = datetime.now() - timedelta(seconds=1)
+    db.session.commit()
+    assert manager.clean_expired() == 1
+    assert db.session.query(IdempotencyRecord).count() == 1
@@ -0,0 +1,166 @@
+import pytest
+import time
+from datetime import datetime, timedelta
+from backend.business.checkout import CheckoutJobManager, OutboxDispatcher, OutboxStatus
+from backend.business.checkout.outbox import OutboxMessage
+from backend.database import db
+from backend.error_types import *
+
+
+handled_payloads = []
+failures_left = {'count': 0}
+
+
+def record_handler(payload: dict):
+    if failures_left['count'] > 0:
+        failures_left['count'] -= 1
+        raise ThirdPartyHandlerError("Failed to connect", ThirdPartyHandlerErrorTypes.handshake_failed)
+    handled_payloads.append(payload)
+    if payload.get('follow_up'):
+        return [('test_record', {'value': payload['value'] + 1}, f"test_record:{payload['value'] + 1}")]
+    return []
+
+
+@pytest.fixture
+def outbox(app):
+    dispatcher = OutboxDispatcher()
+    dispatcher.register_handler('test_record', record_handler)
+    dispatcher.clean_data()
+    handled_payloads.clear()
+    failures_left['count'] = 0
+    yield dispatcher
+    dispatcher.clean_data()
+
+
+def wait_for_messages(dispatcher: OutboxDispatcher, amount: int, timeout: float = 10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        db.session.expire_all()
+        if len(dispatcher.get_messages(OutboxStatus.done)) >= amount:
+            return
+        time.sleep(0.1)
+
+
+def test_enqueue_and_dispatch(outbox):
+    outbox.enqueue('test_record', {'value': 1}, 'test_record:1')
+    db.session.commit()
+    outbox.wake()
+    wait_for_messages(outbox, 1)
+    assert handled_payloads == [{'value': 1}]
+    assert len(outbox.get_messages(OutboxStatus.done)) == 1
+
+
+def test_enqueue_same_key_is_ignored(outbox):
+    outbox.enqueue('test_record', {'value': 1}, 'test_record:1')
+    db.session.commit()
+    outbox.enqueue('test_record', {'value': 1}, 'test_record:1')
+    db.session.commit()
+    assert db.session.query(OutboxMessage).count() == 1
+
+
+def test_enqueue_unknown_action_fails(outbox):
+    with pytest.raises(PurchaseError) as e:
+        outbox.enqueue('unknown_action', {})
+    assert e.value.purchase_error_type == PurchaseErrorTypes.outbox_action_not_supported
+
+
+def test_follow_up_messages_are_dispatched(outbox):
+    outbox.enqueue('test_record', {'value': 1, 'follow_up': True}, 'test_record:1')
+    db.session.commit()
+    outbox.wake()
+    wait_for_messages(outbox, 2)
+    assert {'value': 2} in handled_payloads
+
+
+def test_failed_message_is_retried(outbox):
+    failures_left['count'] = 1
+    outbox.enqueue('test_record', {'value': 1}, 'test_record:1')
+    db.session.commit()
+    outbox.wake()
+    wait_for_messages(outbox, 1)
+    message = outbox.get_messages()[0]
+    assert message.status == OutboxStatus.done
+    assert message.attempts == 1
+    assert handled_payloads == [{'value': 1}]
+
+
+def failing_give_up(payload: dict, error: str):
+    raise ValueError('give up failed')
+
+
+def test_failing_give_up_handler_still_fails_message(outbox):
+    outbox.register_handler('test_give_up', lambda payload: record_handler(payload), failing_give_up)
+    failures_left['count'] = 100
+    message = OutboxMessage('test_give_up:1', 'test_give_up', {'value': 1})
+    message._attempts = 4
+    db.session.add(message)
+    db.session.commit()
+    outbox.wake()
+    deadline = time.time() + 10
+    while time.time() < deadline and not outbox.get_messages(OutboxStatus.failed):
+        db.session.expire_all()
+        time.sleep(0.1)
+    message = outbox.get_messages()[0]
+    assert message.status == OutboxStatus.failed
+    assert 'give up handler failed' in message.last_error
+
+
+def test_sensitive_fields_are_removed_when_done(outbox):
+    outbox.register_handler('test_sensitive', record_handler, sensitive_fields=('card',))
+    outbox.enqueue('test_sensitive', {'value': 1, 'card': '1111222233334444'}, 'test_sensitive:1')
+    db.session.commit()
+    # the card is encrypted while the message is pending
+    stored = outbox.get_messages()[0].payload
+    assert stored['value'] == 1 and '1111222233334444' not in stored['card']
+    outbox.wake()
+    wait_for_messages(outbox, 1)
+    assert handled_payloads == [{'value': 1, 'card': '1111222233334444'}]
+    assert outbox.get_messages()[0].payload == {'value': 1}
+
+
+def test_undecryptable_message_gives_up(outbox):
+    given_up = []
+    outbox.register_handler('test_sensitive', record_handler,
+                            lambda payload, error: given_up.append(payload), sensitive_fields=('card',))
+    # a message that another key encrypted
+    db.session.add(OutboxMessage('test_sensitive:1', 'test_sensitive', {'value': 1, 'card': 'gAAAA-not-a-token'}))
+    db.session.commit()
+    outbox.wake()
+    deadline = time.time() + 10
+    while time.time() < deadline and not outbox.get_messages(OutboxStatus.failed):
+        db.session.expire_all()
+        time.sleep(0.1)
+    message = outbox.get_messages()[0]
+    assert message.status == OutboxStatus.failed and message.attempts == 1
+    assert message.payload == {'value': 1}
+    assert handled_payloads == [] and given_up == [{'value': 1}]
+
+
+def test_only_expired_leases_are_reclaimed(outbox):
+    now = datetime.now()
+    for key, claimed_at in (('test_record:1', now), ('test_record:2', now - timedelta(hours=1))):
+        message = OutboxMessage(key, 'test_record', {'value': 1})
+        message._status = OutboxStatus.processing
+        message._claimed_at = claimed_at
+        message._next_attempt_at = now + timedelta(hours=1)
+        db.session.add(message)
+    db.session.commit()
+    assert outbox.reclaim_expired() == 1
+    db.session.commit()
+    statuses = {message.key: message.status for message in outbox.get_messages()}
+    assert statuses == {'test_record:1': OutboxStatus.processing, 'test_record:2': OutboxStatus.pending}
+
+
+def test_checkout_job_pays_once(outbox):
+    jobs = CheckoutJobManager()
+    jobs.clean_data()
+    job_id = jobs.create_job(1, 1)
+    db.session.commit()
+    assert jobs.begin_payment(job_id)
+    # the attempt was interrupted, its outcome is unknown
+    assert not jobs.begin_payment(job_id)
+    jobs.record_payment(job_id, None)
+    assert jobs.begin_payment(job_id)
+    jobs.record_payment(job_id, 12345)
+    assert jobs.get_payment_id(job_id) == 12345
+    jobs.clean_data()
@@ -0,0 +1,82 @@
+import threading
+import time
+import pytest
+from backend.business.authentication import Authentication, PasswordHasher
+from backend.business.user.user import Member, UserFacade
+from backend.error_types import UserError, UserErrorTypes
+
+
+@pytest.fixture(autouse=True)
+def hasher(app):
+    from backend import bcrypt
+    rounds = app.config['BCRYPT_LOG_ROUNDS']
+    UserFacade().clean_data()
+    PasswordHasher().clean_data()
+    yield
+    app.config['BCRYPT_LOG_ROUNDS'] = rounds
+    PasswordHasher().start(app, bcrypt)
+    Authentication().clean_data()
+    UserFacade().clean_data()
+
+
+class BlockingBcrypt:
+    # holds the workers of the hasher until it is released
+    def __init__(self):
+        self.release = threading.Event()
+
+    def check_password_hash(self, hashed_password, password):
+        self.release.wait(10)
+        return True
+
+
+def test_passwords_are_hashed_by_the_workers(app):
+    hashed = PasswordHasher().hash('password')
+    assert hashed.split('$')[2] == '%02d' % app.config['BCRYPT_LOG_ROUNDS']
+    assert PasswordHasher().verify('password', hashed)
+    assert not PasswordHasher().verify('wrong', hashed)
+    metrics = PasswordHasher().get_metrics()
+    assert metrics['operations']['verify']['count'] == 2
+    assert metrics['operations']['hash']['count'] == 1
+    assert metrics['queue_depth'] == 0
+
+
+def test_password_is_rehashed_on_login(app):
+    from backend import bcrypt
+    user_id = UserFacade().create_user()
+    Authentication().register_user(user_id, {'email': 'test@mail.com', 'username': 'testuser', 'password': 'password',
+                                             'year': 2000, 'month': 1, 'day': 1, 'phone': '1234567890'})
+    assert not PasswordHasher().needs_rehash(Member.query.filter_by(username='testuser').one().password)
+    # the work factor of the environment changed
+    app.config['BCRYPT_LOG_ROUNDS'] = app.config['BCRYPT_LOG_ROUNDS'] + 1
+    PasswordHasher().start(app, bcrypt)
+    Authentication().login_user('testuser', 'password')
+    password = Member.query.filter_by(username='testuser').one().password
+    assert password.split('$')[2] == '%02d' % app.config['BCRYPT_LOG_ROUNDS']
+    assert UserFacade().get_password('testuser')[1] == password
+
+
+def test_saturated_hasher_rejects_logins(app):
+    blocking = BlockingBcrypt()
+    PasswordHasher().start(app, blocking)
+    capacity = PasswordHasher().get_metrics()['workers'] + app.config['PASSWORD_HASH_QUEUE_SIZE']
+    threads = [threading.Thread(target=PasswordHasher().verify, args=('password', 'hash')) for _ in range(capacity)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while PasswordHasher().get_metrics()['queue_depth'] < app.config['PASSWORD_HASH_QUEUE_SIZE'] \
+            and time.time() < deadline:
+        time.sleep(0.01)
+    try:
+        started = time.time()
+        with pytest.raises(UserError) as e:
+            PasswordHasher().verify('password', 'hash')
+        assert e.value.user_error_type == UserErrorTypes.too_many_logins
+        assert time.time() - started < 1
+    finally:
+        blocking.release.set()
+        for thread in threads:
+            thread.join()
+    metrics = PasswordHasher().get_metrics()
+    assert metrics['rejected'] == 1
+    assert metrics['max_queue_depth'] == app.config['PASSWORD_HASH_QUEUE_SIZE']
+    assert metrics['operations']['verify']['count'] == capacity
@@ -0,0 +1,55 @@
+import pytest
+from datetime import date, datetime, timedelta
+from backend.business.checkout import PriceQuoteManager
+from backend.business.DTOs import AddressDTO, PurchaseProductDTO, UserInformationForConstraintDTO
+
+
+@pytest.fixture
+def quotes(app):
+    return PriceQuoteManager()
+
+
+user_info = UserInformationForConstraintDTO(1, date(2000, 1, 1), AddressDTO('address', 'city', 'state', 'country', '1'))
+cart = {1: {0: 2, 1: 1}}
+versions = {1: (3, 1, 0)}
+purchase_shopping_cart = {1: ([PurchaseProductDTO(0, 'milk', 'fresh', 5.0, 2), PurchaseProductDTO(1, 'bread', 'white', 8.0, 1)],
+                              18.0, 16.2)}
+
+
+def issue(quotes, valid_until=None) -> str:
+    quote, _ = quotes.issue(1, user_info, cart, versions, 0, 18.0, 16.2, purchase_shopping_cart, valid_until)
+    return quote
+
+
+def test_redeem_quote(quotes):
+    total_price, total_price_after_discounts, purchase_cart = quotes.redeem(issue(quotes), 1, user_info, cart,
+                                                                            versions, 0)
+    assert (total_price, total_price_after_discounts) == (18.0, 16.2)
+    products, price, price_after_discounts = purchase_cart[1]
+    assert [product.get() for product in products] == [product.get() for product in purchase_shopping_cart[1][0]]
+    assert (price, price_after_discounts) == (18.0, 16.2)
+
+
+def test_quote_is_bound_to_cart_user_and_versions(quotes):
+    quote = issue(quotes)
+    assert quotes.redeem(quote, 1, user_info, {1: {0: 3, 1: 1}}, versions, 0) is None
+    assert quotes.redeem(quote, 2, user_info, cart, versions, 0) is None
+    assert quotes.redeem(quote, 1, None, cart, versions, 0) is None
+    assert quotes.redeem(quote, 1, user_info, cart, {1: (3, 2, 0)}, 0) is None
+    assert quotes.redeem(quote, 1, user_info, cart, versions, 1) is None
+
+
+def test_tampered_quote_is_rejected(quotes):
+    payload, signature = issue(quotes).split('.')
+    other_payload, _ = quotes.issue(1, user_info, cart, versions, 0, 1.0, 1.0, purchase_shopping_cart)[0].split('.')
+    assert quotes.redeem(f'{other_payload}.{signature}', 1, user_info, cart, versions, 0) is None
+    assert quotes.redeem('not a quote', 1, user_info, cart, versions, 0) is None
+
+
+def test_quote_expires(app, quotes):
+    assert quotes.redeem(issue(quotes, datetime.now() - timedelta(seconds=1)), 1, user_info, cart, versions, 0) is None
+    app.config['PRICE_QUOTE_TTL'] = -1
+    try:
+        assert quotes.redeem(issue(quotes), 1, user_info, cart, versions, 0) is None
+    finally:
+        app.config['PRICE_QUOTE_TTL'] = 300
@@ -0,0 +1,101 @@
+import os
+import pytest
+from datetime import date, datetime, timedelta
+from backend.business.purchase import PurchaseArchive, SalesStats
+from backend.business.purchase.purchase import Purchase, PurchaseFacade, PurchaseProduct, PurchaseStatus
+from backend.database import db
+from backend.error_types import PurchaseError, PurchaseErrorTypes
+
+
+pytestmark = pytest.mark.usefixtures('clean_purchases')
+
+
+@pytest.fixture
+def purchase(make_purchase):
+    # made, delivered and completed at made_at, with a discount of 2.0 on every store
+    def make(user_id: int, store_ids, made_at: datetime, complete: bool = True) -> int:
+        return make_purchase(store_ids, user_id, discount=2.0, made_at=made_at, accepted_at=made_at, complete=complete)
+    return make
+
+
+def history(user_id: int, limit: int):
+    pages = []
+    cursor = None
+    while True:
+        purchases, cursor = PurchaseFacade().get_purchase_history_of_user(user_id, cursor=cursor, limit=limit)
+        pages.append([(p.purchase_id, p.store_id) for p in purchases])
+        if cursor is None:
+            return pages
+
+
+def test_old_completed_purchases_are_archived(app, purchase):
+    old = purchase(1, [1, 2], datetime(2023, 1, 10))
+    older = purchase(1, [1], datetime(2022, 12, 5))
+    not_completed = purchase(1, [1], datetime(2023, 1, 11), complete=False)
+    recent = purchase(1, [2], datetime.now() - timedelta(days=1))
+    assert PurchaseArchive().archive() == 2
+    hot = {purchase_id for purchase_id, in db.session.query(Purchase.id)}
+    assert hot == {not_completed, recent}
+    assert db.session.query(PurchaseProduct).filter(PurchaseProduct.purchase_id.in_([old, older])).count() == 0
+    files = sorted(os.listdir(app.config['PURCHASE_ARCHIVE_DIR']))
+    assert files == ['purchases-2022-12.json.gz', 'purchases-2023-01.json.gz']
+    assert PurchaseArchive().archive() == 0
+
+
+def test_history_reads_the_archive(app, purchase):
+    old = purchase(1, [1, 2], datetime(2023, 1, 10))
+    older = purchase(1, [1], datetime(2022, 12, 5))
+    not_completed = purchase(1, [1], datetime(2023, 1, 11), complete=False)
+    recent = purchase(1, [2], datetime.now() - timedelta(days=1))
+    purchase(2, [1], datetime(2023, 1, 10))
+    expected = [(recent, 2), (not_completed, 1), (old, 1), (old, 2), (older, 1)]
+    assert history(1, 2) == [expected[:2], expected[2:4], expected[4:]]
+    PurchaseArchive().archive()
+    assert history(1, 2) == [expected[:2], expected[2:4], expected[4:]]
+    assert history(1, 10) == [expected]
+
+    purchases = PurchaseFacade().get_purchases_of_store(1)
+    assert [(p.purchase_id, p.user_id) for p in purchases][-2:] == [(old, 1), (older, 1)]
+    assert [product.product_id for product in purchases[-1].products] == [0, 1]
+    assert purchases[-1].status == PurchaseStatus.completed.value
+
+    summary = PurchaseFacade().get_purchase_summary_of_user(1, start_date=datetime(2023, 1, 1))
+    assert summary == {'purchases': 4, 'total_price': 80.0, 'total_price_after_discounts': 72.0}
+    page, _ = PurchaseFacade().get_purchase_history_of_store(1, start_date=datetime(2022, 12, 1),
+                                                             end_date=datetime(2023, 1, 1))
+    assert [p.purchase_id for p in page] == [older]
+
+
+def test_export_and_rollups_include_the_archive(app, purchase):
+    old = purchase(1, [1], datetime(2023, 1, 10))
+    recent = purchase(1, [1], datetime.now() - timedelta(days=1))
+    PurchaseArchive().archive()
+    lines = list(PurchaseFacade().iter_purchase_lines_of_store(1))
+    assert [(line['purchase_id'], line['product_id']) for line in lines] == [(old, 0), (old, 1), (recent, 0),
+                                                                          (recent, 1)]
+    assert SalesStats().rebuild(1) == 2
+    stats = SalesStats().get_store_stats(1, date(2023, 1, 10), date(2023, 1, 10))
+    assert stats['totals']['purchases'] == 1
+    assert stats['totals']['completed_purchases'] == 1
+
+
+def test_missing_archive_file_fails_the_read(app, purchase):
+    purchase(1, [1], datetime(2023, 1, 10))
+    PurchaseArchive().archive()
+    os.remove(os.path.join(app.config['PURCHASE_ARCHIVE_DIR'], 'purchases-2023-01.json.gz'))
+    with pytest.raises(PurchaseError) as e:
+        history(1, 10)
+    assert e.value.purchase_error_type == PurchaseErrorTypes.archive_file_missing
+
+
+def test_archive_directory_has_to_be_absolute(app, purchase):
+    old = purchase(1, [1], datetime(2023, 1, 10))
+    directory = app.config['PURCHASE_ARCHIVE_DIR']
+    app.config['PURCHASE_ARCHIVE_DIR'] = 'purchase_archive'
+    try:
+        with pytest.raises(PurchaseError) as e:
+            PurchaseArchive().archive()
+        assert e.value.purchase_error_type == PurchaseErrorTypes.archive_directory_invalid
+    finally:
+        app.config['PURCHASE_ARCHIVE_DIR'] = directory
+    assert db.session.get(Purchase, old) is not None
@@ -0,0 +1,36 @@
+import pytest
+from datetime import date, datetime, timedelta
+from backend.business.purchase import SalesStats
+from backend.business.purchase.purchase import ImmediateSubPurchase, Purchase, PurchaseFacade, PurchaseStatus
+from backend.database import db
+
+
+pytestmark = pytest.mark.usefixtures('clean_purchases')
+
+
+def test_delivered_purchases_are_completed(app, make_purchase):
+    past = datetime.now() - timedelta(minutes=1)
+    delivered = make_purchase([1, 2], products=1, accepted_at=past)
+    not_delivered = make_purchase([1], products=1, accepted_at=datetime.now() + timedelta(days=1))
+    not_accepted = make_purchase([2], products=1)
+    assert PurchaseFacade().complete_delivered_purchases() == {1: [delivered], 2: [delivered]}
+    db.session.commit()
+    assert dict(db.session.query(Purchase.id, Purchase._status)) == {delivered: PurchaseStatus.completed,
+                                                                      not_delivered: PurchaseStatus.accepted,
+                                                                      not_accepted: PurchaseStatus.onGoing}
+    assert {status for status, in db.session.query(ImmediateSubPurchase._status)
+            .filter(ImmediateSubPurchase.purchase_id == delivered)} == {PurchaseStatus.completed}
+    stats = SalesStats().get_store_stats(2, date.today(), date.today())
+    assert stats['totals']['completed_purchases'] == 1
+    assert PurchaseFacade().complete_delivered_purchases() == {}
+
+
+def test_delivered_purchases_are_completed_in_batches(app, make_purchase):
+    past = datetime.now() - timedelta(minutes=1)
+    purchase_ids = [make_purchase([1], products=1, accepted_at=past - timedelta(seconds=i)) for i in range(5)]
+    first = PurchaseFacade().complete_delivered_purchases(batch_size=2)
+    # the purchases that were delivered first are completed first
+    assert sorted(first[1]) == sorted(purchase_ids[-2:])
+    second = PurchaseFacade().complete_delivered_purchases(batch_size=10)
+    assert sorted(first[1] + second[1]) == sorted(purchase_ids)
+    assert SalesStats().get_store_stats(1, date.today(), date.today())['totals']['completed_purchases'] == 5
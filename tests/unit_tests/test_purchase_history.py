@@ -0,0 +1,143 @@
+import pytest
+from datetime import datetime, timedelta
+from backend.business.purchase.purchase import Purchase, ImmediateSubPurchase, PurchaseFacade, PurchaseStatus
+from backend.database import db
+from backend.error_types import *
+from tests.load_harness import QueryCounter
+
+
+pytestmark = pytest.mark.usefixtures('clean_purchases')
+
+
+@pytest.fixture
+def queries(app):
+    counter = QueryCounter(db.engine)
+    counter.install()
+    yield counter
+    counter.uninstall()
+
+
+def test_purchases_of_user_are_filtered(app, make_purchase):
+    first = make_purchase([1, 2], user_id=1)
+    second = make_purchase([2], user_id=1)
+    make_purchase([1, 2], user_id=2)
+    purchases = PurchaseFacade().get_purchases_of_user(1)
+    assert [(p.purchase_id, p.store_id) for p in purchases] == [(second, 2), (first, 1), (first, 2)]
+    assert [p.purchase_id for p in PurchaseFacade().get_purchases_of_user(1, 2)] == [second, first]
+    assert [product.product_id for product in purchases[0].products] == [0, 1]
+    assert PurchaseFacade().get_purchases_of_user(3) == []
+
+
+def test_purchases_of_store_are_filtered(app, make_purchase):
+    first = make_purchase([1, 2], user_id=1)
+    second = make_purchase([1], user_id=2)
+    make_purchase([2], user_id=3)
+    purchases = PurchaseFacade().get_purchases_of_store(1)
+    assert [(p.purchase_id, p.user_id) for p in purchases] == [(second, 2), (first, 1)]
+    assert all(len(p.products) == 2 for p in purchases)
+
+
+def test_history_query_count_does_not_grow_with_purchases(app, queries, make_purchase):
+    for _ in range(5):
+        make_purchase([1, 2], user_id=1, products=3)
+    db.session.expunge_all()
+    queries.reset()
+    assert len(PurchaseFacade().get_purchases_of_user(1)) == 10
+    assert queries.count() == 2
+    queries.reset()
+    assert len(PurchaseFacade().get_purchases_of_store(2)) == 5
+    assert queries.count() == 2
+
+
+def set_date(purchase_id: int, date: datetime) -> None:
+    db.session.query(Purchase).filter(Purchase.id == purchase_id).update({Purchase._date_of_purchase: date})
+    (db.session.query(ImmediateSubPurchase).filter(ImmediateSubPurchase.purchase_id == purchase_id)
+     .update({ImmediateSubPurchase._date_of_purchase: date}))
+    db.session.commit()
+
+
+def read_all_pages(read_page, limit: int):
+    pages = []
+    cursor = None
+    while True:
+        purchases, cursor = read_page(cursor, limit)
+        pages.append([(p.purchase_id, p.store_id) for p in purchases])
+        if cursor is None:
+            return pages
+
+
+def test_user_history_pages(app, make_purchase):
+    date = datetime(2024, 1, 1)
+    ids = [make_purchase([1, 2], user_id=1) for _ in range(3)]
+    # the first two purchases were made at the same time
+    set_date(ids[0], date)
+    set_date(ids[1], date)
+    set_date(ids[2], date + timedelta(days=1))
+    pages = read_all_pages(lambda cursor, limit: PurchaseFacade().get_purchase_history_of_user(1, cursor=cursor,
+                                                                                                limit=limit), 4)
+    assert pages == [[(ids[2], 1), (ids[2], 2), (ids[1], 1), (ids[1], 2)], [(ids[0], 1), (ids[0], 2)]]
+    pages = read_all_pages(lambda cursor, limit: PurchaseFacade().get_purchase_history_of_user(1, cursor=cursor,
+                                                                                                limit=limit), 3)
+    assert pages == [[(ids[2], 1), (ids[2], 2), (ids[1], 1)], [(ids[1], 2), (ids[0], 1), (ids[0], 2)]]
+
+
+def test_store_history_filters(app, make_purchase):
+    ids = [make_purchase([1], user_id=user_id) for user_id in range(4)]
+    for days, purchase_id in enumerate(ids):
+        set_date(purchase_id, datetime(2024, 1, 1) + timedelta(days=days))
+    PurchaseFacade().accept_purchase(ids[1], datetime.now())
+    purchases, cursor = PurchaseFacade().get_purchase_history_of_store(1, start_date=datetime(2024, 1, 2),
+                                                                       end_date=datetime(2024, 1, 4))
+    assert [p.purchase_id for p in purchases] == [ids[2], ids[1]] and cursor is None
+    purchases, _ = PurchaseFacade().get_purchase_history_of_store(1, status=PurchaseStatus.accepted)
+    assert [(p.purchase_id, p.user_id) for p in purchases] == [(ids[1], 1)]
+    pages = read_all_pages(lambda cursor, limit: PurchaseFacade().get_purchase_history_of_store(1, cursor=cursor,
+                                                                                                 limit=limit), 3)
+    assert pages == [[(ids[3], 1), (ids[2], 1), (ids[1], 1)], [(ids[0], 1)]]
+
+
+def test_history_summary(app, make_purchase):
+    make_purchase([1, 2], user_id=1, products=1)
+    make_purchase([2], user_id=1, products=3)
+    make_purchase([2], user_id=2, products=2)
+    assert PurchaseFacade().get_purchase_summary_of_user(1) == {'purchases': 3, 'total_price': 50.0,
+                                                                'total_price_after_discounts': 50.0}
+    assert PurchaseFacade().get_purchase_summary_of_store(2) == {'purchases': 3, 'total_price': 60.0,
+                                                                 'total_price_after_discounts': 60.0}
+    assert PurchaseFacade().get_purchase_summary_of_user(3)['purchases'] == 0
+
+
+def test_invalid_history_arguments(app):
+    with pytest.raises(PurchaseError) as e:
+        PurchaseFacade().get_purchase_history_of_user(1, cursor='not a cursor')
+    assert e.value.purchase_error_type == PurchaseErrorTypes.invalid_history_cursor
+    with pytest.raises(PurchaseError) as e:
+        PurchaseFacade().get_purchase_history_of_store(1, limit=0)
+    assert e.value.purchase_error_type == PurchaseErrorTypes.invalid_page_size
+    with pytest.raises(PurchaseError) as e:
+        PurchaseFacade().get_purchase_summary_of_store(1, start_date=datetime(2024, 1, 2),
+                                                       end_date=datetime(2024, 1, 1))
+    assert e.value.purchase_error_type == PurchaseErrorTypes.invalid_date_range
+
+
+def test_store_export_lines(app, make_purchase):
+    first = make_purchase([1, 2], user_id=1, products=2)
+    second = make_purchase([1], user_id=2, products=1)
+    set_date(first, datetime(2024, 1, 1))
+    set_date(second, datetime(2024, 1, 2))
+    db.session.expunge_all()
+    lines = PurchaseFacade().iter_purchase_lines_of_store(1)
+    assert len(db.session.identity_map) == 0
+    lines = list(lines)
+    assert [(line['purchase_id'], line['user_id'], line['product_id']) for line in lines] == \
+           [(first, 1, 0), (first, 1, 1), (second, 2, 0)]
+    assert lines[0] == {'purchase_id': first, 'user_id': 1, 'date': '2024-01-01T00:00:00', 'status': 'onGoing',
+                        'total_price': 20.0, 'total_price_after_discounts': 20.0, 'product_id': 0,
+                        'name': 'product 0', 'description': 'description', 'price': 10.0, 'amount': 1}
+    # the exported rows are not kept in the session
+    assert len(db.session.identity_map) == 0
+    assert [line['purchase_id'] for line in
+            PurchaseFacade().iter_purchase_lines_of_store(1, start_date=datetime(2024, 1, 2))] == [second]
+    with pytest.raises(PurchaseError):
+        PurchaseFacade().iter_purchase_lines_of_store(1, start_date=datetime(2024, 1, 2),
+                                                      end_date=datetime(2024, 1, 1))
@@ -76,6 +76,19 @@ def test_set_manager_permissions(roles_facade):
     permissions = roles_facade.get_permissions(1, 3)
     assert permissions.add_product is True
 
+def test_get_bid_owners_managers(roles_facade):
+    roles_facade.add_store(1, 2)
+    for manager_id in (3, 4):
+        nomination_id = roles_facade.nominate_manager(1, 2, manager_id)
+        roles_facade.accept_nomination(nomination_id, manager_id)
+    roles_facade.set_manager_permissions(1, 2, 4, False, False, False, False, False, False, True)
+    assert sorted(roles_facade.get_bid_owners_managers(1)) == [2, 4]
+
+def test_get_bid_owners_managers_nonexistent_store(roles_facade):
+    with pytest.raises(StoreError) as e:
+        roles_facade.get_bid_owners_managers(1)
+    assert e.value.store_error_type == StoreErrorTypes.store_not_found
+
 def test_remove_role(roles_facade):
     with patch.object(roles_facade, '_RolesFacade__notifier', new=MagicMock()) as mock_notifier:
         # Mock the notifier methods
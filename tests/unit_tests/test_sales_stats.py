@@ -0,0 +1,53 @@
+import pytest
+from datetime import date, datetime, timedelta
+from backend.business.purchase import PurchaseFacade, SalesStats
+
+
+pytestmark = pytest.mark.usefixtures('clean_purchases')
+
+
+today = date.today()
+
+
+def test_accepted_purchases_are_counted(app, make_purchase):
+    first = make_purchase({1: [(0, 10.0, 2), (1, 5.0, 1)], 2: [(0, 3.0, 1)]}, discount=5.0)
+    second = make_purchase({1: [(0, 10.0, 1)]})
+    make_purchase({1: [(1, 5.0, 4)]})
+    PurchaseFacade().accept_purchase(first, datetime.now())
+    PurchaseFacade().accept_purchase(second, datetime.now())
+    stats = SalesStats().get_store_stats(1, today - timedelta(days=1), today)
+    assert [day['purchases'] for day in stats['days']] == [0, 2]
+    assert stats['days'][1] == {'date': today.isoformat(), 'purchases': 2, 'completed_purchases': 0, 'units': 4,
+                                'revenue': 30.0, 'revenue_before_discounts': 35.0, 'average_basket_value': 15.0}
+    assert stats['products'] == [{'product_id': 0, 'units': 3, 'revenue': 30.0},
+                                 {'product_id': 1, 'units': 1, 'revenue': 5.0}]
+    assert stats['totals']['revenue'] == 30.0
+    assert SalesStats().get_store_stats(2, today, today)['totals']['units'] == 1
+
+
+def test_completed_and_cancelled_purchases(app, make_purchase):
+    first = make_purchase({1: [(0, 10.0, 1)]})
+    second = make_purchase({1: [(0, 10.0, 3)]})
+    PurchaseFacade().accept_purchase(first, datetime.now())
+    PurchaseFacade().accept_purchase(second, datetime.now())
+    PurchaseFacade().complete_purchase(first)
+    PurchaseFacade().cancel_accepted_purchase(second)
+    totals = SalesStats().get_store_stats(1, today, today)['totals']
+    assert (totals['purchases'], totals['completed_purchases'], totals['units']) == (1, 1, 1)
+
+
+def test_rebuild_matches_incremental_rollups(app, make_purchase):
+    for cart in ({1: [(0, 10.0, 2)], 2: [(1, 4.0, 1)]}, {1: [(1, 5.0, 3)]}, {2: [(1, 4.0, 2)]}):
+        PurchaseFacade().accept_purchase(make_purchase(cart), datetime.now())
+    completed = make_purchase({1: [(0, 10.0, 1)]})
+    PurchaseFacade().accept_purchase(completed, datetime.now())
+    PurchaseFacade().complete_purchase(completed)
+    make_purchase({1: [(0, 10.0, 9)]})
+    before = {store_id: SalesStats().get_store_stats(store_id, today, today) for store_id in (1, 2)}
+    SalesStats().clean_data()
+    assert SalesStats().get_store_stats(1, today, today)['totals']['purchases'] == 0
+    assert SalesStats().rebuild() == 5
+    assert {store_id: SalesStats().get_store_stats(store_id, today, today) for store_id in (1, 2)} == before
+    assert SalesStats().rebuild(2) == 2
+    assert SalesStats().get_store_stats(2, today, today) == before[2]
+    assert SalesStats().get_store_stats(1, today, today) == before[1]
@@ -0,0 +1,101 @@
+import pytest
+from backend.business.user.user import UserFacade, User
+from backend.database import db, begin_unit_of_work, end_unit_of_work, in_unit_of_work, commit, commit_boundary
+
+
+@pytest.fixture(autouse=True)
+def users(app):
+    yield
+    app.config['UNIT_OF_WORK'] = False
+    db.session.rollback()
+    UserFacade().clean_data()
+
+
+def user_exists(user_id: int) -> bool:
+    return db.session.query(User).filter_by(id=user_id).first() is not None
+
+
+def run_request(app, status_code: int, exception: Exception = None) -> int:
+    with app.test_request_context():
+        app.preprocess_request()
+        user_id = UserFacade().create_user()
+        assert in_unit_of_work()
+        if exception is None:
+            app.process_response(app.make_response(({'message': user_id}, status_code)))
+        app.do_teardown_request(exception)
+    assert not in_unit_of_work()
+    return user_id
+
+
+def test_commit_outside_unit_of_work(app):
+    user_id = UserFacade().create_user()
+    db.session.rollback()
+    assert user_exists(user_id)
+
+
+def test_commit_inside_unit_of_work_only_flushes(app):
+    token = begin_unit_of_work()
+    try:
+        user_id = UserFacade().create_user()
+        assert user_exists(user_id)
+        db.session.rollback()
+        assert not user_exists(user_id)
+    finally:
+        end_unit_of_work(token)
+
+
+def test_commit_boundary_inside_unit_of_work(app):
+    token = begin_unit_of_work()
+    try:
+        user_id = UserFacade().create_user()
+        commit_boundary()
+        db.session.rollback()
+        assert user_exists(user_id)
+    finally:
+        end_unit_of_work(token)
+
+
+def test_request_is_committed_once_on_success(app):
+    app.config['UNIT_OF_WORK'] = True
+    user_id = run_request(app, 200)
+    db.session.rollback()
+    assert user_exists(user_id)
+
+
+def test_request_is_rolled_back_on_error_response(app):
+    app.config['UNIT_OF_WORK'] = True
+    user_id = run_request(app, 400)
+    assert not user_exists(user_id)
+
+
+def test_request_is_rolled_back_on_exception(app):
+    app.config['UNIT_OF_WORK'] = True
+    user_id = run_request(app, 200, ValueError('request failed'))
+    assert not user_exists(user_id)
+
+
+def test_unit_of_work_is_disabled_by_default(app):
+    with app.test_request_context():
+        app.preprocess_request()
+        assert not in_unit_of_work()
+        commit()
+        app.do_teardown_request()
+
+
+def test_replayable_failure_does_not_commit_the_request(app):
+    from backend.business.checkout import IdempotencyManager
+    app.config['UNIT_OF_WORK'] = True
+    manager = IdempotencyManager()
+    manager.clean_data()
+    try:
+        with app.test_request_context():
+            app.preprocess_request()
+            assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) is None
+            user_id = UserFacade().create_user()
+            manager.complete(1, 'checkout', 'key-1', {'message': 'Cart is empty'}, 400)
+            app.process_response(app.make_response(({'message': 'Cart is empty'}, 400)))
+            app.do_teardown_request()
+        assert not user_exists(user_id)
+        assert manager.begin(1, 'checkout', 'key-1', {'value': 1}) == ({'message': 'Cart is empty'}, 400)
+    finally:
+        manager.clean_data()
@@ -9,8 +9,9 @@ from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
 from backend import create_app
-from backend.business.user.user import UserFacade, User, ShoppingCart, ShoppingBasket, Notification
+from backend.business.user.user import UserFacade, User, ShoppingCart, ShoppingBasket, BasketProduct, Notification
 from backend.error_types import UserError, UserErrorTypes, StoreError, StoreErrorTypes
+from tests.load_harness import QueryCounter
 
 class TestShoppingBasket(unittest.TestCase):
 
@@ -31,6 +32,8 @@ class TestShoppingBasket(unittest.TestCase):
 
     def setUp(self):
         self.facade = UserFacade()
+        # the products of a basket are rows of its user and store, every test starts with an empty basket
+        self.facade.clean_data()
         self.connection = db.engine.connect()
         self.transaction = self.connection.begin()
 
@@ -58,6 +61,24 @@ class TestShoppingBasket(unittest.TestCase):
             basket.remove_product(100, 1)
         assert e.exception.store_error_type == StoreErrorTypes.product_not_found
 
+    def test_remove_product_not_enough_quantity(self):
+        basket = ShoppingBasket(store_id=1, user_id=1)
+        basket.add_product(100, 1)
+        with self.assertRaises(StoreError) as e:
+            basket.remove_product(100, 2)
+        assert e.exception.store_error_type == StoreErrorTypes.product_not_available
+        self.assertEqual(basket.get_dto(), {100: 1})
+
+    def test_add_product_from_two_sessions(self):
+        # adds of other requests to the same basket are not lost
+        basket = ShoppingBasket(store_id=1, user_id=1)
+        basket.add_product(100, 1)
+        with app.app_context():
+            ShoppingBasket(store_id=1, user_id=1).add_product(100, 2)
+        basket.add_product(100, 3)
+        self.assertEqual(BasketProduct.query.filter_by(user_id=1, store_id=1, product_id=100).count(), 1)
+        self.assertEqual(basket.get_dto(), {100: 6})
+
 # class TestShoppingCart(unittest.TestCase):
 
 #     @classmethod
@@ -138,6 +159,8 @@ class TestUser(unittest.TestCase):
 
     def setUp(self):
         self.facade = UserFacade()
+        # usernames are unique, every test registers its member from scratch
+        self.facade.clean_data()
         self.connection = db.engine.connect()
         self.transaction = self.connection.begin()
 
@@ -296,3 +319,143 @@ class TestUserFacade(unittest.TestCase):
         self.assertEqual(self.facade.get_notifications(user_id=user), [])
         # self.facade.notify_user(user_id=user, notification=NotificationDTO(0, "Test Message", datetime.datetime.now()))
         # self.assertEqual(len(self.facade.get_notifications(user_id=user)), 1)
+
+    def test_collect_expired_guests(self):
+        self.clear()
+        guest = self.facade.create_user()
+        member = self.facade.create_user()
+        self.facade.register_user(member, email="test@mail.com", username="testuser", password="password", year=2000, month=1, day=1, phone="1234567890")
+        self.facade.add_product_to_basket(guest, 1, 1, 2)
+        self.facade.flush_carts()
+        collected = []
+        self.facade.set_on_guests_collected(collected.extend)
+        try:
+            # the guest did not expire yet
+            assert self.facade.collect_expired_guests() == 0
+            later = datetime.datetime.now() + datetime.timedelta(days=2)
+            assert self.facade.collect_expired_guests(now=later, batch_size=1) == 1
+        finally:
+            from backend.business.authentication.authentication import Authentication
+            self.facade.set_on_guests_collected(Authentication().forget_guests)
+        assert collected == [guest]
+        assert User.query.filter_by(id=guest).first() is None
+        assert self.facade.is_member(member)
+        assert db.session.query(BasketProduct).filter(BasketProduct.user_id == guest).count() == 0
+        metrics = self.facade.get_guest_gc_metrics()
+        assert metrics['runs'] == 2
+        assert metrics['reclaimed_users'] == 1
+        assert metrics['reclaimed_basket_products'] == 1
+
+    def test_temporary_suspension_is_lifted(self):
+        self.clear()
+        user = self.facade.create_user()
+        self.facade.register_user(user, email="test@mail.com", username="testuser", password="password", year=2000, month=1, day=1, phone="1234567890")
+        until = datetime.datetime.now() - datetime.timedelta(minutes=1)
+        self.facade.suspend_user_temporarily(user, {"year": until.year, "month": until.month, "day": until.day},
+                                             {"hour": until.hour, "minute": until.minute})
+        # a suspension that already ended is not listed
+        assert not self.facade.suspended(user)
+        assert self.facade.get_suspended_users() == {}
+        later = until + datetime.timedelta(minutes=2)
+        self.facade.suspend_user_temporarily(user, {"year": later.year, "month": later.month, "day": later.day},
+                                             {"hour": later.hour, "minute": later.minute})
+        assert self.facade.suspended(user)
+        assert self.facade.get_suspended_users() == {user: later.replace(second=0, microsecond=0)}
+
+    def test_unsuspend_user(self):
+        self.clear()
+        user = self.facade.create_user()
+        self.facade.register_user(user, email="test@mail.com", username="testuser", password="password", year=2000, month=1, day=1, phone="1234567890")
+        self.facade.suspend_user_permanently(user)
+        assert self.facade.get_suspended_users() == {user: None}
+        self.facade.unsuspend_user(user)
+        assert not self.facade.suspended(user)
+        assert not self.facade.get_user(user).is_suspended()
+
+    def test_get_users_by_ids(self):
+        self.clear()
+        guest = self.facade.create_user()
+        member = self.facade.create_user()
+        self.facade.register_user(member, email="test@mail.com", username="testuser", password="password", year=2000, month=1, day=1, phone="1234567890")
+        member_id = self.facade.get_user(member).member_id
+        users = self.facade.get_users_by_ids([guest, member, 1000])
+        assert set(users) == {guest, member}
+        assert users[member].get_username() == "testuser"
+        # an id is looked up like in get_user
+        assert self.facade.get_users_by_ids([member_id])[member_id].id == self.facade.get_user(member_id).id
+        assert self.facade.get_users_dto({member: "StoreOwner"})[member].username == "testuser"
+
+    def test_get_members_page(self):
+        self.clear()
+        self.facade.create_user()
+        members = []
+        for name in ["alice", "bob", "albert"]:
+            user = self.facade.create_user()
+            self.facade.register_user(user, email=f"{name}@mail.com", username=name, password="password", year=2000, month=1, day=1, phone="1234567890")
+            members.append(user)
+        page, cursor = self.facade.get_members_page(limit=2)
+        assert [user.user_id for user in page] == members[:2]
+        page, cursor = self.facade.get_members_page(cursor=cursor, limit=2)
+        assert [user.user_id for user in page] == members[2:] and cursor is None
+        page, _ = self.facade.get_members_page(username="al")
+        assert [user.username for user in page] == ["alice", "albert"]
+        self.facade.suspend_user_permanently(members[1])
+        assert [user.user_id for user in self.facade.get_members_page(suspended=True)[0]] == [members[1]]
+        assert [user.user_id for user in self.facade.get_members_page(suspended=False, excluded_ids=[members[0]])[0]] == [members[2]]
+        with self.assertRaises(UserError) as e:
+            self.facade.get_members_page(limit=0)
+        assert e.exception.user_error_type == UserErrorTypes.invalid_page_size
+
+    def test_username_lookups(self):
+        self.clear()
+        users = {}
+        for name in ["alice", "bob"]:
+            user = self.facade.create_user()
+            self.facade.register_user(user, email=f"{name}@mail.com", username=name, password=f"{name}-hash", year=2000, month=1, day=1, phone="1234567890")
+            users[name] = self.facade.get_user(user).member_id
+        assert self.facade.get_password("alice") == (users["alice"], "alice-hash")
+        assert self.facade.get_userid("alice") == users["alice"]
+        # the second lookup is served from the cache
+        counter = QueryCounter(db.engine)
+        counter.install()
+        try:
+            assert self.facade.get_user_id_from_username("alice") == users["alice"]
+            assert counter.count() == 0
+        finally:
+            counter.uninstall()
+        assert self.facade.get_user_ids_from_usernames(["bob", "alice", "bob"]) == {"bob": users["bob"], "alice": users["alice"]}
+        with self.assertRaises(UserError) as e:
+            self.facade.get_user_ids_from_usernames(["alice", "carol"])
+        assert e.exception.user_error_type == UserErrorTypes.username_not_found
+
+    def test_username_cache_is_invalidated(self):
+        self.clear()
+        user = self.facade.create_user()
+        self.facade.register_user(user, email="alice@mail.com", username="alice", password="old-hash", year=2000, month=1, day=1, phone="1234567890")
+        member_id = self.facade.get_user(user).member_id
+        assert self.facade.get_password("alice") == (member_id, "old-hash")
+        # a changed password drops the cached entry, the next lookup reads the new hash
+        self.facade.set_password(member_id, "new-hash")
+        counter = QueryCounter(db.engine)
+        counter.install()
+        try:
+            assert self.facade.get_password("alice") == (member_id, "new-hash")
+            assert counter.count() == 1
+        finally:
+            counter.uninstall()
+        # a removed member is not served from the cache
+        self.facade.clean_data()
+        with self.assertRaises(UserError) as e:
+            self.facade.get_password("alice")
+        assert e.exception.user_error_type == UserErrorTypes.username_not_found
+
+    def test_username_is_unique(self):
+        self.clear()
+        first = self.facade.create_user()
+        second = self.facade.create_user()
+        self.facade.register_user(first, email="test@mail.com", username="testuser", password="password", year=2000, month=1, day=1, phone="1234567890")
+        # a registration that skipped the check of the facade, like a concurrent one, is rejected by the index
+        with self.assertRaises(UserError) as e:
+            self.facade.get_user(second).register("other@mail.com", "testuser", "password", 2000, 1, 1, "1234567890")
+        assert e.exception.user_error_type == UserErrorTypes.username_already_exists
+        assert not self.facade.is_member(second)